@@ -1,25 +1,159 @@
+import asyncio
 import json
 import logging
-from fastapi import WebSocket
+from fastapi import WebSocket, WebSocketDisconnect
+from app.config import settings
+from app.core.security import verify_access_token
 from app.services.https.UserManagement import UserManagement
+from .OutboundQueue import OutboundQueue
+from .FanoutBroker import FanoutBroker, InProcessBroker
+from .PresenceService import PresenceService
+from .WireCodec import WireCodec
+from .RateLimiter import ConnectionRateLimiter
+
+# 空闲连接被回收时使用的关闭码（1001: Going Away）
+IDLE_CLOSE_CODE = 1001
+# 持续超出限流被断开时使用的关闭码（1008: Policy Violation）
+FLOOD_CLOSE_CODE = 1008
 
 
 class ConnectionHandler:
     """
     连接管理器，管理所有WebSocket连接
     """
-    sessions = {}  # 类级别，存储所有已认证的客户端 {user_id: websocket}
+    sessions = {}  # 类级别，存储所有已认证的客户端 {user_id: set(ConnectionHandler)}，每个设备一个连接
+    presence = PresenceService()  # 类级别，心跳和空闲连接回收
+    subscriptions = {}  # 类级别，主题订阅表 {topic: set(ConnectionHandler)}
+    # 跨进程扇出：定义了自己sessions的子类使用独立的命名空间
+    fanout_namespace = "default"
+    namespaces = {}  # {fanout_namespace: handler class}
+    broker: FanoutBroker = InProcessBroker()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "fanout_namespace" in cls.__dict__:
+            ConnectionHandler.namespaces[cls.fanout_namespace] = cls
+
+    @classmethod
+    def start_presence_tasks(cls) -> list:
+        """
+        为每个命名空间启动心跳/空闲回收任务（服务启动时调用）
+        """
+        return [asyncio.create_task(handler_cls.presence.run()) for handler_cls in ConnectionHandler.namespaces.values()]
+
+    @classmethod
+    async def start_fanout_broker(cls, broker: FanoutBroker):
+        """
+        启动扇出broker（服务启动时调用）
+        """
+        ConnectionHandler.broker = broker
+        await broker.start(ConnectionHandler.deliver_from_broker)
+
+    @staticmethod
+    async def deliver_from_broker(payload: dict):
+        """
+        其他进程转发来的事件，只在本进程投递
+        """
+        handler_cls = ConnectionHandler.namespaces.get(payload.get("namespace"))
+        if handler_cls is None:
+            return
+        op = payload.get("op")
+        if op == "broadcast":
+            handler_cls._broadcast_local(payload["message"], payload.get("exclude_id"), payload.get("coalesce_key"))
+        elif op == "publish":
+            handler_cls._publish_local(payload["topic"], payload["message"], payload.get("exclude_id"), payload.get("coalesce_key"))
+        elif op == "send_to_user":
+            handler_cls._send_to_user_local(payload["user_id"], payload["message"], payload.get("coalesce_key"))
 
     def __init__(self, websocket: WebSocket):
         self.websocket = websocket
         self.user_id = None
+        # 认证成功后创建，所有发往该连接的消息都经过这个队列
+        self.outbound = None
+        # 认证时协商的帧编码，默认JSON文本帧
+        self.codec = WireCodec()
+        self.rate_limiter = ConnectionRateLimiter()
+        self.topics = set()  # 当前连接订阅的主题
+        self.detached = False
+
+    @staticmethod
+    def topic(kind: str, object_id) -> str:
+        """
+        主题名称，例如 user:12、chatroom:3、match:5
+        """
+        return f"{kind}:{object_id}"
+
+    def subscribe(self, topic: str):
+        """
+        订阅主题
+        """
+        self.subscriptions.setdefault(topic, set()).add(self)
+        self.topics.add(topic)
+
+    def unsubscribe(self, topic: str):
+        """
+        取消订阅主题
+        """
+        subscribers = self.subscriptions.get(topic)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.subscriptions[topic]
+        self.topics.discard(topic)
+
+    def unsubscribe_all(self):
+        """
+        取消当前连接的全部订阅（断开连接时调用）
+        """
+        for topic in list(self.topics):
+            self.unsubscribe(topic)
+
+    @classmethod
+    async def publish(cls, topic: str, message: str, exclude_id: str = None, coalesce_key: str = None) -> int:
+        """
+        将消息发布给主题的订阅者，开销只与订阅者数量有关
+        返回本进程中放入发送队列的连接数
+        """
+        delivered = cls._publish_local(topic, message, exclude_id, coalesce_key)
+        await cls.broker.forward({
+            "op": "publish",
+            "namespace": cls.fanout_namespace,
+            "topic": topic,
+            "message": message,
+            "exclude_id": exclude_id,
+            "coalesce_key": coalesce_key
+        })
+        return delivered
+
+    @classmethod
+    def _publish_local(cls, topic: str, message: str, exclude_id: str = None, coalesce_key: str = None) -> int:
+        subscribers = cls.subscriptions.get(topic)
+        if not subscribers:
+            return 0
+
+        delivered = 0
+        for handler in list(subscribers):
+            if exclude_id and handler.user_id == exclude_id:
+                continue
+            if handler.outbound.enqueue(message, coalesce_key):
+                delivered += 1
+        return delivered
+
+    async def send_text(self, message: str, coalesce_key: str = None) -> bool:
+        """
+        向当前连接发送消息：认证后放入发送队列，认证前直接发送
+        """
+        if self.outbound is None:
+            await self.websocket.send_text(message)
+            return True
+        return self.outbound.enqueue(message, coalesce_key)
 
     async def handle_connection(self):
         """
         处理连接的生命周期：认证 -> 连接 -> 消息循环 -> 断开
         """
         try:
-            # 等待认证消息
+            # 等待认证消息（始终为JSON文本帧，可带protocol/compression字段协商后续帧的编码）
             auth_message = await self.websocket.receive_text()
             try:
                 auth_data = json.loads(auth_message)
@@ -34,125 +168,205 @@ class ConnectionHandler:
                 await self.websocket.close()
                 return
 
-            # 认证成功，注册会话
-            self.sessions[self.user_id] = self.websocket
-            await self.websocket.send_text(json.dumps({"status": "authenticated", "user_id": self.user_id}))
+            # 认证成功，创建发送队列并注册会话（同一用户可以有多个设备同时在线）
+            self.codec = WireCodec.negotiate(auth_data)
+            self.outbound = OutboundQueue(
+                self.websocket,
+                maxsize=settings.WS_SEND_QUEUE_SIZE,
+                overflow_policy=settings.WS_SEND_OVERFLOW_POLICY,
+                codec=self.codec
+            )
+            self.outbound.start()
+            devices = self.sessions.setdefault(self.user_id, set())
+            devices.add(self)
+            if len(devices) == 1:
+                self.broker.user_online(self.fanout_namespace, self.user_id)
+            self.subscribe(self.topic("user", self.user_id))
+            self.presence.track(self)
+            # 认证响应已按协商的编码发送
+            await self.send_text(json.dumps({"status": "authenticated", "user_id": self.user_id, **self.codec.describe()}))
             
             # 调用连接钩子
             await self.on_connect()
 
             # 消息循环
             while True:
-                message = await self.websocket.receive_text()
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                self.presence.touch(self)
+                # 先检查总限额再解码，垃圾帧洪泛也只消耗一次字典查找
+                retry_after = self.rate_limiter.check("*")
+                if retry_after:
+                    if not await self._throttle("*", retry_after):
+                        break
+                    continue
                 try:
-                    message_data = json.loads(message)
-                    await self.on_message(message_data)
-                except json.JSONDecodeError:
-                    await self.websocket.send_text(json.dumps({"error": "Invalid JSON format"}))
+                    frame = message.get("text")
+                    message_data = self.codec.decode(frame if frame is not None else message.get("bytes"))
+                except ValueError:  # json.JSONDecodeError也是ValueError
+                    await self.send_text(json.dumps({"error": "Invalid message format"}))
+                    continue
+                
+                # 心跳消息由基类处理，不交给子类
+                message_type = message_data.get("type", "broadcast") if isinstance(message_data, dict) else None
+                if message_type == "pong":
+                    continue
+                if message_type == "ping":
+                    await self.send_text(json.dumps({"type": "pong", "ts": message_data.get("ts")}))
+                    continue
+                retry_after = self.rate_limiter.check(str(message_type))
+                if retry_after:
+                    if not await self._throttle(message_type, retry_after):
+                        break
+                    continue
+                self.rate_limiter.strikes = 0
+                await self.on_message(message_data)
 
         except Exception as e:
             logging.error(f"Connection error for user {self.user_id}: {e}")
         finally:
-            # 清理会话
-            if self.user_id and self.user_id in self.sessions:
+            await self._detach()
+
+    async def _throttle(self, message_type: str, retry_after: float) -> bool:
+        """
+        帧被限流：回复rate_limited（可合并，洪泛时不会占满发送队列）
+        连续被限流的帧数达到WS_RATE_LIMIT_MAX_STRIKES时断开连接，返回False
+        """
+        self.rate_limiter.strikes += 1
+        if settings.WS_RATE_LIMIT_MAX_STRIKES and self.rate_limiter.strikes >= settings.WS_RATE_LIMIT_MAX_STRIKES:
+            logging.warning(f"Disconnecting user {self.user_id}: {self.rate_limiter.strikes} consecutive rate-limited frames")
+            await self.websocket.close(code=FLOOD_CLOSE_CODE)
+            return False
+        await self.send_text(json.dumps({
+            "type": "rate_limited",
+            "message_type": message_type,
+            "retry_after": round(retry_after, 3)
+        }), coalesce_key=f"rate_limited:{message_type}")
+        return True
+
+    async def _detach(self):
+        """
+        清理会话、订阅和发送队列（正常断开和空闲回收都会调用，只执行一次）
+        """
+        if self.detached:
+            return
+        self.detached = True
+        
+        self.presence.untrack(self)
+        devices = self.sessions.get(self.user_id) if self.user_id else None
+        if devices is not None:
+            devices.discard(self)
+            if not devices:
                 del self.sessions[self.user_id]
-            await self.on_disconnect()
+                self.broker.user_offline(self.fanout_namespace, self.user_id)
+        self.unsubscribe_all()
+        if self.outbound is not None:
+            await self.outbound.close()
+        await self.on_disconnect()
+
+    async def reap(self):
+        """
+        回收空闲连接：立即清理会话，再关闭底层socket
+        半开连接上的接收循环可能很久才报错，不能依赖它来清理
+        """
+        logging.info(f"Reaping idle connection for user {self.user_id}")
+        await self._detach()
+        try:
+            await self.websocket.close(code=IDLE_CLOSE_CODE)
+        except Exception:
+            pass
 
     @classmethod
-    async def broadcast(cls, message: str, exclude_id: str = None):
+    def is_online(cls, user_id: str) -> bool:
         """
-        广播消息给所有连接的客户端
+        用户是否在线（本进程或其他worker），O(1)
         """
-        if not cls.sessions:
-            return
+        return user_id in cls.sessions or cls.broker.is_user_online(cls.fanout_namespace, user_id)
 
-        disconnected = []
-        for user_id, websocket in cls.sessions.items():
+    @classmethod
+    def get_last_seen(cls, user_id: str):
+        """
+        用户在本进程中最后活跃的Unix时间戳
+        """
+        return cls.presence.get_last_seen(user_id)
+
+    @classmethod
+    async def broadcast(cls, message: str, exclude_id: str = None, coalesce_key: str = None):
+        """
+        广播消息给所有连接的客户端（包括其他进程中的连接）
+        只放入各连接的发送队列，不等待任何连接的网络写入
+        """
+        cls._broadcast_local(message, exclude_id, coalesce_key)
+        await cls.broker.forward({
+            "op": "broadcast",
+            "namespace": cls.fanout_namespace,
+            "message": message,
+            "exclude_id": exclude_id,
+            "coalesce_key": coalesce_key
+        })
+
+    @classmethod
+    def _broadcast_local(cls, message: str, exclude_id: str = None, coalesce_key: str = None):
+        for user_id, devices in list(cls.sessions.items()):
             if exclude_id and user_id == exclude_id:
                 continue
-            try:
-                await websocket.send_text(message)
-            except Exception:
-                disconnected.append(user_id)
-        
-        # 清理断开的连接
-        for user_id in disconnected:
-            cls.sessions.pop(user_id, None)
+            for handler in list(devices):
+                handler.outbound.enqueue(message, coalesce_key)
 
     @classmethod
-    async def send_to_user(cls, user_id: str, message: str) -> bool:
+    async def send_to_user(cls, user_id: str, message: str, coalesce_key: str = None) -> bool:
         """
-        发送消息给指定用户
+        发送消息给指定用户的所有设备，返回是否至少放入了一个发送队列
+        用户在其他worker上也有设备时同时路由过去
         """
-        if user_id not in cls.sessions:
-            return False
-        
-        try:
-            await cls.sessions[user_id].send_text(message)
-            return True
-        except Exception:
-            cls.sessions.pop(user_id, None)
-            return False
+        delivered = cls._send_to_user_local(user_id, message, coalesce_key)
+        if await cls.broker.send_to_user(cls.fanout_namespace, user_id, message, coalesce_key):
+            delivered = True
+        return delivered
+
+    @classmethod
+    def _send_to_user_local(cls, user_id: str, message: str, coalesce_key: str = None) -> bool:
+        delivered = False
+        for handler in list(cls.sessions.get(user_id, ())):
+            if handler.outbound.enqueue(message, coalesce_key):
+                delivered = True
+        return delivered
 
     async def _authenticate(self, auth_data: dict) -> bool:
         """
-        认证逻辑，检查用户是否在UserManagement缓存中存在
+        认证逻辑：验证签名token（auth_data["token"]），并检查用户是否在UserManagement缓存中存在
+        AUTH_ALLOW_LEGACY_USER_ID开启时兼容只带user_id的旧客户端
+        token验证有LRU缓存，用户查找是字典查找，开销与用户数量无关
         """
-        print(f"🔍 [DEBUG] Starting authentication process...")
-        print(f"🔍 [DEBUG] Received auth_data: {auth_data}")
-        
-        if "user_id" not in auth_data:
-            print(f"❌ [DEBUG] No user_id found in auth_data")
-            logging.warning("Authentication failed: no user_id provided")
+        token = auth_data.get("token")
+        if token:
+            user_id_input = verify_access_token(token)
+            if user_id_input is None:
+                logging.warning("Authentication failed: invalid or expired token")
+                return False
+        elif settings.AUTH_ALLOW_LEGACY_USER_ID and "user_id" in auth_data:
+            user_id_input = auth_data["user_id"]
+        else:
+            logging.warning("Authentication failed: no token provided")
             return False
-        
-        user_id_input = auth_data["user_id"]
-        print(f"🔍 [DEBUG] Extracted user_id_input: '{user_id_input}' (type: {type(user_id_input)})")
-        
-        # 获取UserManagement实例并检查用户是否存在
+
+        # 缓存中的键是int
         try:
-            print(f"🔍 [DEBUG] Getting UserManagement instance...")
-            user_manager = UserManagement()
-            print(f"🔍 [DEBUG] UserManagement instance created: {user_manager}")
-            
-            # 检查UserManagement是否已初始化
-            print(f"🔍 [DEBUG] UserManagement._initialized: {UserManagement._initialized}")
-            print(f"🔍 [DEBUG] UserManagement user_list length: {len(user_manager.user_list)}")
-            print(f"🔍 [DEBUG] UserManagement user_list keys (first 5): {list(user_manager.user_list.keys())[:5]}")
-            
-            # 转换用户ID为int类型进行查找（因为缓存中的键是int）
-            try:
-                user_id_for_lookup = int(user_id_input)
-                print(f"🔍 [DEBUG] Successfully converted '{user_id_input}' to int: {user_id_for_lookup}")
-            except (ValueError, TypeError) as e:
-                print(f"❌ [DEBUG] Failed to convert '{user_id_input}' to int: {e}")
-                logging.warning(f"Authentication failed: user_id '{user_id_input}' cannot be converted to int")
-                return False
-            
-            print(f"🔍 [DEBUG] Looking up user with ID: {user_id_for_lookup} (type: {type(user_id_for_lookup)})")
-            user_instance = user_manager.get_user_instance(user_id_for_lookup)
-            print(f"🔍 [DEBUG] get_user_instance returned: {user_instance}")
-            
-            if user_instance is None:
-                print(f"❌ [DEBUG] User not found in cache")
-                print(f"🔍 [DEBUG] Available user IDs in cache: {sorted(list(user_manager.user_list.keys()))}")
-                logging.warning(f"Authentication failed: user_id '{user_id_input}' not found in UserManagement cache")
-                return False
-            
-            # 保存用户ID为字符串格式（用于WebSocket会话管理）
-            self.user_id = str(user_id_input)
-            print(f"✅ [DEBUG] Authentication successful! User: {user_instance.telegram_user_name}")
-            logging.info(f"Authentication successful for user_id: {user_id_input} (looked up as {user_id_for_lookup})")
-            return True
-            
-        except Exception as e:
-            print(f"❌ [DEBUG] Exception during authentication: {e}")
-            print(f"❌ [DEBUG] Exception type: {type(e)}")
-            import traceback
-            print(f"❌ [DEBUG] Traceback: {traceback.format_exc()}")
-            logging.error(f"Authentication error for user_id '{user_id_input}': {e}")
+            user_id_for_lookup = int(user_id_input)
+        except (ValueError, TypeError):
+            logging.warning(f"Authentication failed: user_id '{user_id_input}' cannot be converted to int")
             return False
 
+        if UserManagement().get_user_instance(user_id_for_lookup) is None:
+            logging.warning(f"Authentication failed: user_id {user_id_for_lookup} not found in UserManagement cache")
+            return False
+
+        # 保存用户ID为字符串格式（用于WebSocket会话管理）
+        self.user_id = str(user_id_for_lookup)
+        logging.info(f"Authentication successful for user_id: {self.user_id}")
+        return True
+
     async def on_connect(self):
         """
         连接成功后的钩子，子类可以重写
@@ -174,4 +388,7 @@ class ConnectionHandler:
         """
         断开连接时的钩子，子类可以重写
         """
-        logging.info(f"User {self.user_id} disconnected")
\ No newline at end of file
+        logging.info(f"User {self.user_id} disconnected")
+
+
+ConnectionHandler.namespaces[ConnectionHandler.fanout_namespace] = ConnectionHandler
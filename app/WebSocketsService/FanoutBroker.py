@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+
+class FanoutBroker:
+    """
+    WebSocket跨进程扇出的接口，同时也是单进程实现（InProcessBroker）
+    ConnectionHandler先在本进程投递，再通过forward把同一事件交给其他进程；
+    其他进程收到后调用deliver回调，只在本地投递，不再转发
+    """
+
+    def __init__(self):
+        self.deliver = None  # async def deliver(payload: dict)
+
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def close(self):
+        pass
+
+    def user_online(self, namespace: str, user_id: str):
+        """本进程有用户连接"""
+
+    def user_offline(self, namespace: str, user_id: str):
+        """本进程的用户断开"""
+
+    async def forward(self, payload: dict):
+        """把事件交给其他进程"""
+
+    def is_user_online(self, namespace: str, user_id: str) -> bool:
+        """用户是否在其他进程中在线"""
+        return False
+
+    async def send_to_user(self, namespace: str, user_id: str, message: str, coalesce_key: str = None) -> bool:
+        """
+        把消息路由到持有该用户连接的其他进程，返回是否找到了该用户
+        """
+        return False
+
+
+class InProcessBroker(FanoutBroker):
+    """
+    单进程：所有连接都在本进程中，不需要转发
+    """
+
+
+class UnixSocketBroker(FanoutBroker):
+    """
+    基于Unix域套接字的跨进程扇出，适用于同一台机器上的多个uvicorn worker
+
+    每个worker在socket_dir下监听 worker-<pid>.sock，启动时连接目录中已有的其他worker，
+    被新worker连接时反向连接它。worker之间交换各自在线用户列表，
+    send_to_user直接发给持有该用户连接的worker，broadcast/publish发给所有worker。
+    帧格式为一行一个JSON。
+    """
+
+    def __init__(self, socket_dir: str, worker_id: str = None):
+        super().__init__()
+        self.socket_dir = Path(socket_dir)
+        self.worker_id = worker_id or str(os.getpid())
+        self.socket_path = self.socket_dir / f"worker-{self.worker_id}.sock"
+        self.server = None
+        self.peers = {}  # {worker_id: StreamWriter} 发往其他worker的连接
+        self.local_users = set()  # {(namespace, user_id)}
+        self.remote_users = {}  # {(namespace, user_id): set(worker_id)} 同一用户的设备可能分布在多个worker
+        self.reader_tasks = set()
+
+    async def start(self, deliver):
+        await super().start(deliver)
+        self.socket_dir.mkdir(parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        self.server = await asyncio.start_unix_server(self._handle_peer, path=str(self.socket_path))
+
+        for path in self.socket_dir.glob("worker-*.sock"):
+            worker_id = path.stem[len("worker-"):]
+            if worker_id != self.worker_id:
+                await self._connect_peer(worker_id)
+        logging.info(f"UnixSocketBroker worker {self.worker_id} started with {len(self.peers)} peers")
+
+    async def close(self):
+        for writer in self.peers.values():
+            writer.close()
+        self.peers.clear()
+        for task in list(self.reader_tasks):
+            task.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+    async def _connect_peer(self, worker_id: str):
+        """
+        连接其他worker并发送本进程的在线用户列表，连接失败的socket文件视为已退出的worker
+        """
+        if worker_id in self.peers:
+            return
+        path = self.socket_dir / f"worker-{worker_id}.sock"
+        try:
+            _, writer = await asyncio.open_unix_connection(str(path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            logging.info(f"Removing stale broker socket {path}")
+            path.unlink(missing_ok=True)
+            return
+        self.peers[worker_id] = writer
+        await self._send(worker_id, {
+            "op": "sessions",
+            "worker_id": self.worker_id,
+            "online": [list(user) for user in self.local_users],
+            "offline": []
+        })
+
+    async def _handle_peer(self, reader, writer):
+        """
+        读取其他worker发来的事件
+        """
+        task = asyncio.current_task()
+        self.reader_tasks.add(task)
+        peer_worker_id = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                payload = json.loads(line)
+                if payload.get("op") == "sessions":
+                    peer_worker_id = payload["worker_id"]
+                    for namespace, user_id in payload["online"]:
+                        self.remote_users.setdefault((namespace, user_id), set()).add(peer_worker_id)
+                    for namespace, user_id in payload["offline"]:
+                        self._remove_remote_user((namespace, user_id), peer_worker_id)
+                    # 新启动的worker连接过来时反向连接它
+                    await self._connect_peer(peer_worker_id)
+                else:
+                    await self.deliver(payload)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.warning(f"Broker peer connection error: {e}")
+        finally:
+            self.reader_tasks.discard(task)
+            writer.close()
+            if peer_worker_id is not None:
+                self._forget_peer(peer_worker_id)
+
+    def _forget_peer(self, worker_id: str):
+        """
+        其他worker退出：清理它的连接和在线用户
+        """
+        peer_writer = self.peers.pop(worker_id, None)
+        if peer_writer is not None:
+            peer_writer.close()
+        for user in list(self.remote_users):
+            self._remove_remote_user(user, worker_id)
+
+    def _remove_remote_user(self, user: tuple, worker_id: str):
+        workers = self.remote_users.get(user)
+        if workers is not None:
+            workers.discard(worker_id)
+            if not workers:
+                del self.remote_users[user]
+
+    async def _send(self, worker_id: str, payload: dict):
+        writer = self.peers.get(worker_id)
+        if writer is None:
+            return
+        try:
+            writer.write(json.dumps(payload).encode() + b"\n")
+            await writer.drain()
+        except Exception as e:
+            logging.warning(f"Failed to send to broker peer {worker_id}: {e}")
+            self._forget_peer(worker_id)
+
+    def _announce(self, online: list, offline: list):
+        if self.peers:
+            asyncio.ensure_future(self.forward({
+                "op": "sessions",
+                "worker_id": self.worker_id,
+                "online": online,
+                "offline": offline
+            }))
+
+    def user_online(self, namespace: str, user_id: str):
+        self.local_users.add((namespace, user_id))
+        self._announce([[namespace, user_id]], [])
+
+    def user_offline(self, namespace: str, user_id: str):
+        self.local_users.discard((namespace, user_id))
+        self._announce([], [[namespace, user_id]])
+
+    async def forward(self, payload: dict):
+        for worker_id in list(self.peers):
+            await self._send(worker_id, payload)
+
+    def is_user_online(self, namespace: str, user_id: str) -> bool:
+        return (namespace, user_id) in self.remote_users
+
+    async def send_to_user(self, namespace: str, user_id: str, message: str, coalesce_key: str = None) -> bool:
+        workers = self.remote_users.get((namespace, user_id))
+        if not workers:
+            return False
+        payload = {
+            "op": "send_to_user",
+            "namespace": namespace,
+            "user_id": user_id,
+            "message": message,
+            "coalesce_key": coalesce_key
+        }
+        for worker_id in list(workers):
+            await self._send(worker_id, payload)
+        return True
+
+
+def create_fanout_broker(kind: str, socket_dir: str = None) -> FanoutBroker:
+    """
+    根据配置创建扇出broker："inprocess" 或 "unix"
+    """
+    if kind == "inprocess":
+        return InProcessBroker()
+    if kind == "unix":
+        return UnixSocketBroker(socket_dir)
+    raise ValueError(f"Unknown WebSocket fan-out broker: {kind}")
@@ -2,6 +2,8 @@ import json
 import logging
 from fastapi import WebSocket
 from .ConnectionHandler import ConnectionHandler
+from .PresenceService import PresenceService
+from .MessageConnectionHandler import MessageConnectionHandler
 from app.services.https.N8nWebhookManager import N8nWebhookManager
 from app.services.https.MatchManager import MatchManager
 
@@ -11,6 +13,9 @@ class MatchSessionHandler(ConnectionHandler):
     匹配会话处理器，使用N8nWebhookManager和MatchManager实现匹配功能
     """
     sessions = {}  # 类级别的字典，作为"会话管理器"，用于存储所有已认证的客户端
+    subscriptions = {}  # 类级别的主题订阅表，与/ws/message的订阅互不影响
+    fanout_namespace = "match"
+    presence = PresenceService()
 
     def __init__(self, websocket: WebSocket):
         """
@@ -34,7 +39,7 @@ class MatchSessionHandler(ConnectionHandler):
             matches = await webhook_manager.request_matches(user_id_int, num_of_matches=1)
             
             if not matches:
-                await self.websocket.send_text(json.dumps({
+                await self.send_text(json.dumps({
                     "type": "match_error",
                     "message": "No matches found"
                 }))
@@ -48,22 +53,21 @@ class MatchSessionHandler(ConnectionHandler):
             # 获取MatchManager实例
             match_manager = MatchManager()
             
-            # 检查是否已存在该用户对的匹配（确保唯一性）
-            existing_matches = match_manager.get_user_matches(user_id_1)
-            for existing_match in existing_matches:
-                if (existing_match.user_id_1 == user_id_2 or existing_match.user_id_2 == user_id_2):
-                    await self.websocket.send_text(json.dumps({
-                        "type": "match_info",
-                        "match_id": existing_match.match_id,
-                        "self_user_id": user_id_1,
-                        "matched_user_id": user_id_2,
-                        "match_score": existing_match.match_score,
-                        "reason_of_match_given_to_self_user": existing_match.description_to_user_1 if existing_match.user_id_1 == user_id_1 else existing_match.description_to_user_2,
-                        "reason_of_match_given_to_matched_user": existing_match.description_to_user_2 if existing_match.user_id_1 == user_id_1 else existing_match.description_to_user_1,
-                        "message": "Existing match found"
-                    }))
-                    logging.info(f"Existing match found for users {user_id_1} and {user_id_2}: match_id={existing_match.match_id}")
-                    return
+            # 检查是否已存在该用户对的匹配（包括已归档的匹配，确保唯一性）
+            existing_match = await match_manager.find_match_between(user_id_1, user_id_2)
+            if existing_match:
+                await self.send_text(json.dumps({
+                    "type": "match_info",
+                    "match_id": existing_match.match_id,
+                    "self_user_id": user_id_1,
+                    "matched_user_id": user_id_2,
+                    "match_score": existing_match.match_score,
+                    "reason_of_match_given_to_self_user": existing_match.description_to_user_1 if existing_match.user_id_1 == user_id_1 else existing_match.description_to_user_2,
+                    "reason_of_match_given_to_matched_user": existing_match.description_to_user_2 if existing_match.user_id_1 == user_id_1 else existing_match.description_to_user_1,
+                    "message": "Existing match found"
+                }))
+                logging.info(f"Existing match found for users {user_id_1} and {user_id_2}: match_id={existing_match.match_id}")
+                return
             
             # 创建匹配
             match = await match_manager.create_match(
@@ -99,12 +103,21 @@ class MatchSessionHandler(ConnectionHandler):
                 "reason_of_match_given_to_matched_user": match_data.get('reason_of_match_given_to_matched_user')
             }
             
-            await self.websocket.send_text(json.dumps(match_info))
+            await self.send_text(json.dumps(match_info))
             logging.info(f"Match created and sent to user {self.user_id}: match_id={match.match_id}")
             
+            # 通知被匹配的用户，不在线时下次连接/ws/message时收到
+            await MessageConnectionHandler.deliver_event(user_id_2, {
+                "type": "new_match",
+                "match_id": match.match_id,
+                "user_id_1": user_id_1,
+                "user_id_2": user_id_2,
+                "match_score": match_data.get('match_score')
+            })
+            
         except Exception as e:
             logging.error(f"Error in on_connect for user {self.user_id}: {e}")
-            await self.websocket.send_text(json.dumps({
+            await self.send_text(json.dumps({
                 "type": "match_error",
                 "message": f"Failed to create match: {str(e)}"
             }))
@@ -116,42 +129,6 @@ class MatchSessionHandler(ConnectionHandler):
         await super().on_disconnect()
         logging.info(f"User {self.user_id} disconnected from match system")
 
-    @classmethod
-    async def broadcast(cls, message: str, exclude_id: str = None):
-        """
-        广播消息给所有连接的客户端（可被子类复写）
-        """
-        if not cls.sessions:
-            return
-
-        disconnected = []
-        for user_id, websocket in cls.sessions.items():
-            if exclude_id and user_id == exclude_id:
-                continue
-            try:
-                await websocket.send_text(message)
-            except Exception:
-                disconnected.append(user_id)
-        
-        # 清理断开的连接
-        for user_id in disconnected:
-            cls.sessions.pop(user_id, None)
-
-    @classmethod
-    async def send_to_user(cls, user_id: str, message: str) -> bool:
-        """
-        向指定用户ID发送私聊消息（可被子类复写）
-        """
-        if user_id not in cls.sessions:
-            return False
-        
-        try:
-            await cls.sessions[user_id].send_text(message)
-            return True
-        except Exception:
-            cls.sessions.pop(user_id, None)
-            return False
-
     async def _authenticate(self, auth_data: dict) -> bool:
         """
         认证逻辑，检查用户是否在UserManagement的user_list中
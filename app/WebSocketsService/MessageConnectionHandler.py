@@ -1,8 +1,14 @@
+import asyncio
 import json
 import logging
+from contextlib import aclosing
 from fastapi import WebSocket
 from .ConnectionHandler import ConnectionHandler
 from app.services.https.ChatroomManager import ChatroomManager
+from app.services.https.MatchManager import MatchManager
+from app.services.https.UserManagement import UserManagement
+from app.services.https.PendingEventQueue import PendingEventQueue
+from app.services.https.AIResponseProcessor import AIResponseProcessor
 from app.utils.my_logger import MyLogger
 
 logger = MyLogger("MessageConnectionHandler")
@@ -13,6 +19,46 @@ class MessageConnectionHandler(ConnectionHandler):
     消息连接处理器，专门处理私聊消息
     """
 
+    def __init__(self, websocket: WebSocket):
+        super().__init__(websocket)
+        self.ai_chat_task = None  # 正在进行的流式AI聊天，每个连接同时最多一个
+
+    @classmethod
+    async def deliver_event(cls, user_id, event: dict, coalesce_key: str = None) -> bool:
+        """
+        向用户投递事件：在线时直接发送，不在线时放入离线事件队列，下次连接时批量补发
+        返回是否已实时投递
+        """
+        if await cls.send_to_user(str(user_id), json.dumps(event), coalesce_key):
+            return True
+        await PendingEventQueue().push(user_id, event, coalesce_key)
+        return False
+
+    async def _flush_pending_events(self):
+        """
+        认证后把离线期间的事件作为一个批次发给新连接，批次写入socket后才从队列中确认删除
+        （连接在发送前断开时事件保留到下次连接）
+        truncated为True时表示有事件因队列已满被丢弃，客户端需要按since_seq补齐聊天记录
+        """
+        pending_queue = PendingEventQueue()
+        try:
+            batch = await pending_queue.peek(self.user_id)
+        except Exception as e:
+            logger.error(f"用户 {self.user_id} 读取离线事件失败: {e}")
+            return
+        if batch is None:
+            return
+
+        events = batch["events"]
+        user_id = self.user_id
+        self.outbound.enqueue(json.dumps({
+            "type": "offline_events",
+            "count": len(events),
+            "truncated": batch["truncated"],
+            "events": events
+        }), on_sent=lambda: pending_queue.ack_later(user_id, events))
+        logger.info(f"用户 {self.user_id} 补发离线事件 {len(events)} 条")
+
     async def on_message(self, message: dict):
         """
         处理消息，支持私聊、广播和私信流程
@@ -31,8 +77,12 @@ class MessageConnectionHandler(ConnectionHandler):
             # 广播消息
             await self.handle_broadcast_message(message)
             
+        elif message_type == "ai_chat":
+            # 流式AI聊天
+            await self.handle_ai_chat(message)
+            
         else:
-            await self.websocket.send_text(json.dumps({
+            await self.send_text(json.dumps({
                 "error": f"Unknown message type: {message_type}"
             }))
 
@@ -40,15 +90,16 @@ class MessageConnectionHandler(ConnectionHandler):
         """
         处理私信流程初始化
         步骤1: 获取或创建聊天室
-        步骤2: 获取聊天历史记录
+        步骤2: 获取聊天历史记录（提供since_seq时只返回客户端缺失的消息）
         """
         try:
             # 获取参数并统一转换为int类型
             target_user_id = message.get("target_user_id")
             match_id = message.get("match_id")
+            since_seq = message.get("since_seq")
             
             if not target_user_id or not match_id:
-                await self.websocket.send_text(json.dumps({
+                await self.send_text(json.dumps({
                     "type": "private_chat_error",
                     "error": "target_user_id and match_id are required"
                 }))
@@ -59,8 +110,9 @@ class MessageConnectionHandler(ConnectionHandler):
                 current_user_id = int(self.user_id)
                 target_user_id = int(target_user_id)
                 match_id = int(match_id)
+                since_seq = int(since_seq) if since_seq is not None else None
             except (ValueError, TypeError) as e:
-                await self.websocket.send_text(json.dumps({
+                await self.send_text(json.dumps({
                     "type": "private_chat_error",
                     "error": f"Invalid ID format: {str(e)}"
                 }))
@@ -68,8 +120,18 @@ class MessageConnectionHandler(ConnectionHandler):
             
             logger.info(f"私信流程开始 - 用户 {current_user_id} 发起与用户 {target_user_id} 的私信 (match_id: {match_id})")
             
+            # 只有匹配双方才能打开聊天室并订阅其事件
+            match = await MatchManager().get_match(match_id)
+            if not match or {current_user_id, target_user_id} != {int(match.user_id_1), int(match.user_id_2)}:
+                logger.warning(f"私信流程拒绝 - 用户 {current_user_id} 不属于匹配 {match_id}")
+                await self.send_text(json.dumps({
+                    "type": "private_chat_error",
+                    "error": "Match not found or user is not a participant"
+                }))
+                return
+            
             # 步骤1: 获取或创建聊天室
-            await self.websocket.send_text(json.dumps({
+            await self.send_text(json.dumps({
                 "type": "private_chat_progress",
                 "step": 1,
                 "message": f"正在获取或创建聊天室... (match_id: {match_id})"
@@ -81,15 +143,19 @@ class MessageConnectionHandler(ConnectionHandler):
             )
             
             if not chatroom_id:
-                await self.websocket.send_text(json.dumps({
+                await self.send_text(json.dumps({
                     "type": "private_chat_error",
                     "step": 1,
                     "error": "Failed to get or create chatroom"
                 }))
                 return
             
+            # 订阅该聊天室和匹配的事件（新建的聊天室在连接时还没有订阅）
+            self.subscribe(self.topic("chatroom", chatroom_id))
+            self.subscribe(self.topic("match", match_id))
+            
             # 步骤1完成通知
-            await self.websocket.send_text(json.dumps({
+            await self.send_text(json.dumps({
                 "type": "private_chat_progress",
                 "step": 1,
                 "status": "completed",
@@ -98,30 +164,34 @@ class MessageConnectionHandler(ConnectionHandler):
             }))
             
             # 步骤2: 获取聊天历史记录
-            await self.websocket.send_text(json.dumps({
+            await self.send_text(json.dumps({
                 "type": "private_chat_progress",
                 "step": 2,
                 "message": f"正在获取聊天历史记录... (chatroom_id: {chatroom_id})"
             }))
             
-            chat_history = await chatroom_manager.get_chatroom_history(chatroom_id, current_user_id)
+            chat_history = await chatroom_manager.get_chatroom_history(chatroom_id, current_user_id, since_seq)
+            chatroom = chatroom_manager.chatrooms.get(chatroom_id)
+            last_seq = (chatroom.last_seq or 0) if chatroom else 0
             
-            # 步骤2完成通知
-            await self.websocket.send_text(json.dumps({
+            # 步骤2完成通知（只带条数，历史记录只在private_chat_init_complete中发送一次）
+            await self.send_text(json.dumps({
                 "type": "private_chat_progress",
                 "step": 2,
                 "status": "completed",
-                "chat_history": chat_history,
+                "message_count": len(chat_history),
                 "message": f"获取到 {len(chat_history)} 条聊天记录"
             }))
             
             # 私信流程完成
-            await self.websocket.send_text(json.dumps({
+            await self.send_text(json.dumps({
                 "type": "private_chat_init_complete",
                 "chatroom_id": chatroom_id,
                 "target_user_id": target_user_id,
                 "match_id": match_id,
                 "chat_history": chat_history,
+                "since_seq": since_seq,
+                "last_seq": last_seq,
                 "message": "私信流程初始化完成，可以开始聊天"
             }))
             
@@ -129,7 +199,7 @@ class MessageConnectionHandler(ConnectionHandler):
             
         except Exception as e:
             logger.error(f"私信流程失败: {e}")
-            await self.websocket.send_text(json.dumps({
+            await self.send_text(json.dumps({
                 "type": "private_chat_error",
                 "error": f"Private chat initialization failed: {str(e)}"
             }))
@@ -143,15 +213,16 @@ class MessageConnectionHandler(ConnectionHandler):
             target_user_id = message.get("target_user_id")
             chatroom_id = message.get("chatroom_id")
             content = message.get("content", "")
+            client_message_id = message.get("client_message_id")  # 可选，客户端重发时保持不变
             
             if not target_user_id:
-                await self.websocket.send_text(json.dumps({
+                await self.send_text(json.dumps({
                     "error": "target_user_id is required for private messages"
                 }))
                 return
             
             if not chatroom_id:
-                await self.websocket.send_text(json.dumps({
+                await self.send_text(json.dumps({
                     "error": "chatroom_id is required for private messages"
                 }))
                 return
@@ -162,41 +233,75 @@ class MessageConnectionHandler(ConnectionHandler):
                 target_user_id = int(target_user_id)
                 chatroom_id = int(chatroom_id)
             except (ValueError, TypeError) as e:
-                await self.websocket.send_text(json.dumps({
+                await self.send_text(json.dumps({
                     "error": f"Invalid ID format: {str(e)}"
                 }))
                 return
             
+            # 接收者只能是聊天室中的另一方，不能信任客户端传来的target_user_id（否则可以往任意用户的离线队列写事件）
+            chatroom_manager = ChatroomManager()
+            chatroom = chatroom_manager.chatrooms.get(chatroom_id)
+            recipient_id = chatroom.get_other_user_id(current_user_id) if chatroom else None
+            if recipient_id is None or int(recipient_id) != target_user_id:
+                logger.warning(f"私聊消息被拒绝 - 用户 {current_user_id} 不能在聊天室 {chatroom_id} 中向用户 {target_user_id} 发送消息")
+                await self.send_text(json.dumps({
+                    "error": "target_user_id is not the other member of this chatroom"
+                }))
+                return
+            
             logger.info(f"私聊消息 - 用户 {current_user_id} 向用户 {target_user_id} 在聊天室 {chatroom_id} 中发送消息")
             
             # 使用ChatroomManager发送消息，创建Message实例并保存到chatroom和数据库
-            chatroom_manager = ChatroomManager()
             send_result = await chatroom_manager.send_message(
-                chatroom_id, current_user_id, content
+                chatroom_id, current_user_id, content, client_message_id
             )
             
             success = send_result.get("success", False)
             match_id = send_result.get("match_id")
+            seq = send_result.get("seq")
             
-            if success:
-                # 通过WebSocket发送消息给目标用户，包含match_id
-                websocket_success = await self.send_to_user(str(target_user_id), json.dumps({
+            if success and send_result.get("duplicate"):
+                # 重发的消息：只回复原消息的确认，不再投递和广播
+                await self.send_text(json.dumps({
+                    "type": "message_status",
+                    "target_user_id": target_user_id,
+                    "chatroom_id": chatroom_id,
+                    "match_id": match_id,
+                    "seq": seq,
+                    "client_message_id": client_message_id,
+                    "duplicate": True,
+                    "delivered": None,
+                    "saved_to_database": send_result.get("ack") == "durable",
+                    "ack": send_result.get("ack"),
+                    "content": content
+                }))
+                logger.info(f"私聊消息重发已去重 - client_message_id: {client_message_id}, seq: {seq}")
+            
+            elif success:
+                # 通过WebSocket发送消息给目标用户，包含match_id；不在线时进入离线事件队列
+                websocket_success = await self.deliver_event(target_user_id, {
                     "type": "private_message",
                     "from": current_user_id,
                     "content": content,
                     "chatroom_id": chatroom_id,
                     "match_id": match_id,  # 添加match_id字段
+                    "seq": seq,
+                    "client_message_id": client_message_id,
                     "timestamp": message.get("timestamp")
-                }))
+                })
                 
                 # 给发送者确认，包含match_id
-                await self.websocket.send_text(json.dumps({
+                await self.send_text(json.dumps({
                     "type": "message_status",
                     "target_user_id": target_user_id,
                     "chatroom_id": chatroom_id,
                     "match_id": match_id,  # 添加match_id字段
+                    "seq": seq,
+                    "client_message_id": client_message_id,
+                    "duplicate": False,
                     "delivered": websocket_success,
-                    "saved_to_database": success,
+                    "saved_to_database": send_result.get("ack") == "durable",
+                    "ack": send_result.get("ack"),
                     "content": content
                 }))
                 
@@ -204,18 +309,19 @@ class MessageConnectionHandler(ConnectionHandler):
 
                 # 新增：广播内部消息，通知有用户收到私信
                 # 中文注释：广播一个内部消息，type为'user_message_update'，内容为“User xxxxxx (user_id) receives a message from user xxxxxx(user_id)”
-                await self.broadcast(json.dumps({
+                await self.publish(self.topic("chatroom", chatroom_id), json.dumps({
                     "type": "user_message_update",
                     "message": f"User {target_user_id} ({target_user_id}) receives a message from user {current_user_id} ({current_user_id})"
-                }), exclude_id=None)  # 不排除任何人，所有人都能收到
+                }), coalesce_key=f"user_message_update:{target_user_id}:{current_user_id}")  # 只发给该聊天室的订阅者
 
             else:
                 # 发送失败
-                await self.websocket.send_text(json.dumps({
+                await self.send_text(json.dumps({
                     "type": "message_status",
                     "target_user_id": target_user_id,
                     "chatroom_id": chatroom_id,
                     "match_id": match_id,  # 添加match_id字段，即使失败也要包含
+                    "client_message_id": client_message_id,
                     "delivered": False,
                     "saved_to_database": False,
                     "content": content,
@@ -225,7 +331,7 @@ class MessageConnectionHandler(ConnectionHandler):
             
         except Exception as e:
             logger.error(f"处理私聊消息失败: {e}")
-            await self.websocket.send_text(json.dumps({
+            await self.send_text(json.dumps({
                 "type": "message_status",
                 "error": f"Private message handling failed: {str(e)}"
             }))
@@ -238,7 +344,7 @@ class MessageConnectionHandler(ConnectionHandler):
             content = message.get("content", "")
             
             if not content.strip():
-                await self.websocket.send_text(json.dumps({
+                await self.send_text(json.dumps({
                     "error": "message content cannot be empty"
                 }))
                 return
@@ -254,7 +360,7 @@ class MessageConnectionHandler(ConnectionHandler):
             }), exclude_id=self.user_id)
             
             # 给发送者确认
-            await self.websocket.send_text(json.dumps({
+            await self.send_text(json.dumps({
                 "type": "broadcast_status",
                 "content": content,
                 "delivered": True,
@@ -265,29 +371,114 @@ class MessageConnectionHandler(ConnectionHandler):
             
         except Exception as e:
             logger.error(f"处理广播消息失败: {e}")
-            await self.websocket.send_text(json.dumps({
+            await self.send_text(json.dumps({
                 "type": "broadcast_status",
                 "error": f"Broadcast message handling failed: {str(e)}"
             }))
 
+    async def handle_ai_chat(self, message: dict):
+        """
+        处理AI聊天：在后台任务中流式转发AI输出，不阻塞该连接上的其他消息
+        客户端依次收到 ai_chat_delta（每段内容）和 ai_chat_complete（完整结果，包括最终总结的分割）
+        """
+        request_id = message.get("request_id")  # 可选，原样带回，方便客户端对应请求
+        content = message.get("message", "")
+        if not isinstance(content, str) or not content.strip():
+            await self.send_text(json.dumps({
+                "type": "ai_chat_error",
+                "request_id": request_id,
+                "error": "message content cannot be empty"
+            }))
+            return
+        if self.ai_chat_task is not None and not self.ai_chat_task.done():
+            await self.send_text(json.dumps({
+                "type": "ai_chat_error",
+                "request_id": request_id,
+                "error": "An AI reply is still being generated"
+            }))
+            return
+        self.ai_chat_task = asyncio.ensure_future(self._stream_ai_chat(content, request_id))
+
+    async def _stream_ai_chat(self, content: str, request_id):
+        try:
+            # aclosing：任务被取消时立即关闭生成器，释放该用户的对话轮次和AI并发名额
+            async with aclosing(AIResponseProcessor().stream_chat(int(self.user_id), content)) as events:
+                async for event in events:
+                    if event["type"] == "delta":
+                        await self.send_text(json.dumps({
+                            "type": "ai_chat_delta",
+                            "request_id": request_id,
+                            "content": event["content"]
+                        }))
+                    elif event["type"] == "done":
+                        await self.send_text(json.dumps({
+                            "type": "ai_chat_complete",
+                            "request_id": request_id,
+                            "status": "success" if event.get("success") else "error",
+                            "response": event.get("message", ""),
+                            "summary": event.get("summary", ""),
+                            "is_final": event.get("is_final", False),
+                            "prompt_version": event.get("prompt_version")
+                        }))
+                    else:
+                        await self.send_text(json.dumps({
+                            "type": "ai_chat_error",
+                            "request_id": request_id,
+                            "error": event.get("error"),
+                            "retry_after": event.get("retry_after")
+                        }))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"流式AI聊天失败 - 用户 {self.user_id}: {e}")
+            await self.send_text(json.dumps({
+                "type": "ai_chat_error",
+                "request_id": request_id,
+                "error": f"AI chat failed: {str(e)}"
+            }))
+
+    def _match_topics(self) -> list:
+        """
+        当前用户所有匹配的主题
+        """
+        user = UserManagement().get_user_instance(int(self.user_id))
+        if not user:
+            return []
+        return [self.topic("match", match_id) for match_id in user.match_ids]
+
+    async def _publish_presence(self, event_type: str):
+        """
+        只向与当前用户有匹配的用户发布上线/下线事件
+        """
+        message = json.dumps({
+            "type": event_type,
+            "user_id": self.user_id
+        })
+        for topic in self._match_topics():
+            await self.publish(topic, message, exclude_id=self.user_id, coalesce_key=f"presence:{self.user_id}")
+
     async def on_connect(self):
         """
-        用户连接时通知
+        用户连接时补发离线事件，订阅自己的聊天室和匹配，并通知匹配对象
         """
         await super().on_connect()
-        # 通知其他用户有新用户加入
-        await self.broadcast(json.dumps({
-            "type": "user_joined",
-            "user_id": self.user_id
-        }), exclude_id=self.user_id)
+        await self._flush_pending_events()
+        chatroom_ids = ChatroomManager().user_chatrooms.get(int(self.user_id), set())
+        for chatroom_id in list(chatroom_ids):
+            self.subscribe(self.topic("chatroom", chatroom_id))
+        for topic in self._match_topics():
+            self.subscribe(topic)
+        # 同一用户的其他设备已在线时不重复通知
+        if len(self.sessions.get(self.user_id, ())) == 1:
+            await self._publish_presence("user_joined")
 
     async def on_disconnect(self):
         """
-        用户断开连接时通知
+        用户断开连接时停止流式AI聊天并通知匹配对象
         """
         await super().on_disconnect()
-        # 通知其他用户有用户离开
-        await self.broadcast(json.dumps({
-            "type": "user_left", 
-            "user_id": self.user_id
-        }), exclude_id=self.user_id)
\ No newline at end of file
+        if self.ai_chat_task is not None and not self.ai_chat_task.done():
+            self.ai_chat_task.cancel()
+        # 用户的最后一个设备断开时才通知
+        if self.user_id and self.user_id not in self.sessions:
+            await self._publish_presence("user_left")
\ No newline at end of file
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+from collections import deque
+from fastapi import WebSocket
+
+# 慢消费者被断开时使用的关闭码（1013: Try Again Later）
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+
+class OutboundQueue:
+    """
+    单个WebSocket连接的有界发送队列，由独立的写任务逐条发送
+    入队是同步操作，广播时不会等待任何慢连接
+
+    溢出策略：
+    - drop_oldest: 队列满时丢弃最早的消息
+    - coalesce: 带coalesce_key的消息替换队列中相同key的旧消息（只保留最新状态），
+                队列满时优先丢弃最早的可合并消息，没有则丢弃最早的消息
+    - disconnect: 队列满时断开该连接，由客户端重连后增量同步
+    """
+
+    def __init__(self, websocket: WebSocket, maxsize: int, overflow_policy: str = "drop_oldest", codec=None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+        self.codec = codec  # WireCodec，为None时按JSON文本帧发送
+        self.entries = deque()  # [coalesce_key, message, on_sent]
+        self.coalesce_index = {}  # {coalesce_key: entry}
+        self.dropped_count = 0
+        self.closed = False
+        self.overflowed = False  # disconnect策略下因溢出而关闭
+        self._wakeup = asyncio.Event()
+        self._writer_task = None
+
+    def start(self):
+        """
+        启动写任务
+        """
+        if self._writer_task is None:
+            self._writer_task = asyncio.ensure_future(self._writer())
+
+    def enqueue(self, message: str, coalesce_key: str = None, on_sent=None) -> bool:
+        """
+        将消息放入队列，返回是否被接受（连接已关闭或因溢出被断开时返回False）
+        on_sent为可选的同步回调，消息成功写入socket后调用（消息被丢弃或发送失败时不调用）
+        """
+        if self.closed:
+            return False
+
+        if self.overflow_policy == "coalesce" and coalesce_key is not None:
+            queued_entry = self.coalesce_index.get(coalesce_key)
+            if queued_entry is not None:
+                queued_entry[1] = message
+                return True
+
+        if len(self.entries) >= self.maxsize:
+            if self.overflow_policy == "disconnect":
+                logging.warning(f"Outbound queue full ({self.maxsize}), disconnecting slow consumer")
+                self.overflowed = True
+                self.closed = True
+                self._wakeup.set()
+                return False
+            self._drop_one()
+
+        entry = [coalesce_key, message, on_sent]
+        self.entries.append(entry)
+        if coalesce_key is not None:
+            self.coalesce_index[coalesce_key] = entry
+        self._wakeup.set()
+        return True
+
+    def _drop_one(self):
+        """
+        溢出时丢弃一条消息
+        """
+        victim = None
+        if self.overflow_policy == "coalesce":
+            for entry in self.entries:
+                if entry[0] is not None:
+                    victim = entry
+                    break
+        if victim is None:
+            victim = self.entries[0]
+        self.entries.remove(victim)
+        self._forget(victim)
+        self.dropped_count += 1
+
+    def _forget(self, entry):
+        if entry[0] is not None and self.coalesce_index.get(entry[0]) is entry:
+            del self.coalesce_index[entry[0]]
+
+    async def _writer(self):
+        """
+        写任务：逐条发送队列中的消息，发送失败或被标记关闭时退出
+        """
+        try:
+            while True:
+                while not self.entries and not self.closed:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+
+                if self.closed:
+                    if self.overflowed:
+                        await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+                    return
+
+                entry = self.entries.popleft()
+                self._forget(entry)
+                frame = entry[1] if self.codec is None else self.codec.encode(entry[1])
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                if entry[2] is not None:
+                    entry[2]()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.warning(f"Outbound writer stopped: {e}")
+        finally:
+            self.closed = True
+            self.entries.clear()
+            self.coalesce_index.clear()
+
+    async def close(self):
+        """
+        停止写任务，丢弃未发送的消息
+        """
+        self.closed = True
+        self.entries.clear()
+        self.coalesce_index.clear()
+        if self._writer_task is not None and not self._writer_task.done():
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
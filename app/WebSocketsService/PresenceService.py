@@ -0,0 +1,117 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from app.config import settings
+
+
+class PresenceService:
+    """
+    在线状态服务：记录每个连接的最后活跃时间，发送服务端心跳并回收空闲连接
+
+    使用时间轮调度：每个连接只挂在一个槽位上，收到消息时只更新last_seen（O(1)），
+    槽位到期时再根据last_seen决定：仍活跃则重新挂到 last_seen + ping_interval，
+    空闲超过ping_interval则发送ping并挂到 last_seen + idle_timeout，
+    空闲超过idle_timeout则回收该连接
+    """
+
+    def __init__(self, ping_interval: float = None, idle_timeout: float = None, tick_seconds: float = None):
+        self.ping_interval = ping_interval if ping_interval is not None else settings.WS_PING_INTERVAL_SECONDS
+        self.idle_timeout = idle_timeout if idle_timeout is not None else settings.WS_IDLE_TIMEOUT_SECONDS
+        self.tick_seconds = tick_seconds if tick_seconds is not None else settings.WS_PRESENCE_TICK_SECONDS
+        # 调度距离最多为idle_timeout，多留两个槽位保证不会绕回同一槽位
+        self.slots = [set() for _ in range(int(math.ceil(self.idle_timeout / self.tick_seconds)) + 2)]
+        self.current_tick = None
+        self.last_seen = {}  # {handler: time.monotonic()}
+        self.user_last_seen = {}  # {user_id: time.time()} 用户最后活跃的时间（断开后保留）
+
+    def _tick_of(self, timestamp: float) -> int:
+        return int(timestamp // self.tick_seconds)
+
+    def _schedule(self, handler, deadline: float):
+        tick = max(int(math.ceil(deadline / self.tick_seconds)), (self.current_tick or 0) + 1)
+        self.slots[tick % len(self.slots)].add(handler)
+
+    def track(self, handler, now: float = None):
+        """
+        开始跟踪一个已认证的连接
+        """
+        now = time.monotonic() if now is None else now
+        if self.current_tick is None:
+            self.current_tick = self._tick_of(now)
+        self.last_seen[handler] = now
+        self.user_last_seen[handler.user_id] = time.time()
+        self._schedule(handler, now + self.ping_interval)
+
+    def touch(self, handler, now: float = None):
+        """
+        连接上有活动（收到任何消息，包括pong）
+        """
+        if handler in self.last_seen:
+            self.last_seen[handler] = time.monotonic() if now is None else now
+            self.user_last_seen[handler.user_id] = time.time()
+
+    def untrack(self, handler):
+        """
+        停止跟踪（槽位中的残留引用在到期时被跳过）
+        """
+        if self.last_seen.pop(handler, None) is not None:
+            self.user_last_seen[handler.user_id] = time.time()
+
+    def get_last_seen(self, user_id: str):
+        """
+        用户最后活跃的Unix时间戳，没有记录返回None
+        """
+        return self.user_last_seen.get(user_id)
+
+    async def tick(self, now: float = None) -> int:
+        """
+        处理到期的槽位，返回回收的连接数
+        """
+        now = time.monotonic() if now is None else now
+        target_tick = self._tick_of(now)
+        if self.current_tick is None:
+            self.current_tick = target_tick
+            return 0
+
+        reaped = 0
+        # 事件循环延迟导致落后很多时，每个槽位最多处理一次
+        steps = min(target_tick - self.current_tick, len(self.slots))
+        for _ in range(steps):
+            self.current_tick += 1
+            slot_index = self.current_tick % len(self.slots)
+            due = self.slots[slot_index]
+            self.slots[slot_index] = set()
+
+            for handler in due:
+                last_seen = self.last_seen.get(handler)
+                if last_seen is None:
+                    continue
+                idle = now - last_seen
+                if idle >= self.idle_timeout:
+                    self.untrack(handler)
+                    reaped += 1
+                    await handler.reap()
+                elif idle >= self.ping_interval:
+                    handler.outbound.enqueue(json.dumps({"type": "ping", "ts": time.time()}), coalesce_key="ping")
+                    self._schedule(handler, last_seen + self.idle_timeout)
+                else:
+                    self._schedule(handler, last_seen + self.ping_interval)
+        self.current_tick = max(self.current_tick, target_tick)
+        return reaped
+
+    async def run(self):
+        """
+        时间轮后台任务
+        """
+        while True:
+            try:
+                await asyncio.sleep(self.tick_seconds)
+                reaped = await self.tick()
+                if reaped:
+                    logging.info(f"Presence reaped {reaped} idle WebSocket connections, {len(self.last_seen)} tracked")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.error(f"Presence tick error: {e}")
@@ -0,0 +1,81 @@
+import time
+from app.config import settings
+
+
+def parse_rate_limits(spec: str) -> dict:
+    """
+    解析限流配置，格式为逗号分隔的 消息类型=每秒速率/突发容量，例如：
+        "*=20/40,private=5/10,broadcast=0.2/2"
+    "*" 表示该连接上所有帧的总限额
+    返回 {message_type: (rate, capacity)}
+    """
+    limits = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        message_type, _, value = item.partition("=")
+        rate, _, capacity = value.partition("/")
+        rate = float(rate)
+        capacity = float(capacity) if capacity else max(rate, 1.0)
+        if rate <= 0 or capacity < 1:
+            raise ValueError(f"Invalid rate limit: {item}")
+        limits[message_type.strip()] = (rate, capacity)
+    return limits
+
+
+class TokenBucket:
+    """
+    令牌桶：按rate每秒补充令牌，最多capacity个，每条消息消耗一个
+    补充在检查时按经过的时间计算，不需要定时任务
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def consume(self, now: float) -> float:
+        """
+        尝试消耗一个令牌，成功返回0，否则返回需要等待的秒数
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ConnectionRateLimiter:
+    """
+    单个WebSocket连接的限流器，每种消息类型一个令牌桶，另有"*"总限额
+    桶在第一次用到时创建，每次检查O(1)
+    """
+    _default_limits = None  # 解析后的WS_RATE_LIMITS，所有连接共享
+
+    def __init__(self, limits: dict = None):
+        if limits is None:
+            if ConnectionRateLimiter._default_limits is None:
+                ConnectionRateLimiter._default_limits = parse_rate_limits(settings.WS_RATE_LIMITS)
+            limits = ConnectionRateLimiter._default_limits
+        self.limits = limits
+        self.buckets = {}  # {message_type: TokenBucket}
+        self.strikes = 0  # 连续被限流的帧数，由调用方维护
+
+    def check(self, message_type: str, now: float = None) -> float:
+        """
+        检查一帧是否允许处理，允许返回0，否则返回建议的重试等待秒数
+        没有配置限额的消息类型总是允许
+        """
+        bucket = self.buckets.get(message_type)
+        if bucket is None:
+            limit = self.limits.get(message_type)
+            if limit is None:
+                return 0.0
+            now = time.monotonic() if now is None else now
+            bucket = self.buckets[message_type] = TokenBucket(limit[0], limit[1], now)
+
+        return bucket.consume(time.monotonic() if now is None else now)
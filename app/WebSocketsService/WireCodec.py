@@ -0,0 +1,97 @@
+import json
+import zlib
+from app.config import settings
+
+try:
+    import msgpack
+except ImportError:  # msgpack是可选依赖，未安装时只支持JSON
+    msgpack = None
+
+# 二进制帧的第一个字节
+FRAME_PLAIN = 0x00
+FRAME_DEFLATE = 0x01
+
+SUPPORTED_PROTOCOLS = ("json", "msgpack")
+
+
+class WireCodec:
+    """
+    WebSocket帧编解码，在认证消息中协商：
+        {"user_id": ..., "protocol": "json" | "msgpack", "compression": "deflate"}
+
+    - 默认（json且不压缩）：与原来一样发送JSON文本帧
+    - 其他组合：发送二进制帧，第一个字节为标志位（0x00原文，0x01 raw deflate），
+      后面是JSON UTF-8或MessagePack编码的内容；只有不小于WS_COMPRESSION_MIN_BYTES的帧才压缩
+    客户端发来的消息可以是JSON文本帧，也可以是相同格式的二进制帧
+    """
+
+    def __init__(self, protocol: str = "json", compression: str = None, min_compress_bytes: int = None):
+        self.protocol = protocol
+        self.compression = compression
+        self.min_compress_bytes = min_compress_bytes if min_compress_bytes is not None else settings.WS_COMPRESSION_MIN_BYTES
+
+    @classmethod
+    def negotiate(cls, auth_data: dict) -> "WireCodec":
+        """
+        根据客户端在认证消息中的请求选择编码，不支持的选项回退到JSON/不压缩
+        """
+        protocol = auth_data.get("protocol", "json")
+        if protocol not in SUPPORTED_PROTOCOLS or (protocol == "msgpack" and msgpack is None):
+            protocol = "json"
+        compression = "deflate" if auth_data.get("compression") == "deflate" else None
+        return cls(protocol, compression)
+
+    @property
+    def is_text(self) -> bool:
+        return self.protocol == "json" and self.compression is None
+
+    def describe(self) -> dict:
+        return {"protocol": self.protocol, "compression": self.compression}
+
+    def encode(self, message: str):
+        """
+        将JSON字符串编码为要发送的帧（str为文本帧，bytes为二进制帧）
+        """
+        if self.is_text:
+            return message
+
+        if self.protocol == "msgpack":
+            payload = msgpack.packb(json.loads(message), use_bin_type=True)
+        else:
+            payload = message.encode("utf-8")
+
+        if self.compression == "deflate" and len(payload) >= self.min_compress_bytes:
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            return bytes([FRAME_DEFLATE]) + compressor.compress(payload) + compressor.flush()
+        return bytes([FRAME_PLAIN]) + payload
+
+    def decode(self, frame) -> dict:
+        """
+        解码客户端发来的帧，格式错误时抛出ValueError
+        """
+        if isinstance(frame, str):
+            return json.loads(frame)
+
+        if not frame:
+            raise ValueError("Empty frame")
+        flag, payload = frame[0], frame[1:]
+        if flag == FRAME_DEFLATE:
+            # 限制解压后的大小，避免小帧解压出巨大内容
+            decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+            try:
+                payload = decompressor.decompress(payload, settings.WS_MAX_DECOMPRESSED_BYTES)
+            except zlib.error as e:
+                raise ValueError(f"Invalid deflate payload: {e}")
+            if decompressor.unconsumed_tail:
+                raise ValueError(f"Deflate payload exceeds {settings.WS_MAX_DECOMPRESSED_BYTES} bytes")
+            if not decompressor.eof:
+                raise ValueError("Invalid deflate payload: incomplete or truncated stream")
+        elif flag != FRAME_PLAIN:
+            raise ValueError(f"Unknown frame flag: {flag}")
+
+        if self.protocol == "msgpack":
+            try:
+                return msgpack.unpackb(payload, raw=False)
+            except Exception as e:
+                raise ValueError(f"Invalid MessagePack payload: {e}")
+        return json.loads(payload.decode("utf-8"))
@@ -1,8 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from app.schemas.AIResponseProcessor import GetAIHistoryRequest, GetAIHistoryResponse, ChatRequest, ChatResponse
 from app.services.https.AIResponseProcessor import AIResponseProcessor
+from app.services.https.AIAdmissionController import AIAdmissionController, AIOverloadedError
+from app.services.https.AIProviderRouter import AIProviderRouter
 from app.services.https.KimiInteractionAPI import KimiInteractionAPI
+from app.utils.idempotency import chat_idempotency
 from app.utils.my_logger import MyLogger
+from typing import Optional
+import json
 import time
 
 logger = MyLogger(__name__)
@@ -60,44 +66,69 @@ async def get_ai_chat_history(
 @router.post("/chat")
 async def handle_ai_chat(
     request: ChatRequest,
+    http_response: Response,
+    idempotency_key_header: Optional[str] = Header(None, alias="Idempotency-Key"),
     ai_interaction: KimiInteractionAPI = Depends(get_ai_interaction),
     ai_processor: AIResponseProcessor = Depends(get_ai_processor)
 ) -> ChatResponse:
     """
     统一的AI聊天处理入口
+    带幂等键（请求体的idempotency_key或Idempotency-Key请求头）时，
+    重复的请求合并到正在处理的同一次AI调用，已完成的结果直接重放，不会重复调用AI或重复保存对话
     """
     user_id = request.user_id
     logger.info(f"[{user_id}] 收到新的AI聊天请求: message='{request.message}'")
-    try:
-        # 1. 获取历史记录
-        logger.info(f"[{user_id}] 步骤 1/4: 开始获取对话历史...")
-        history = await ai_processor.get_conversation_history(user_id)
-        logger.info(f"[{user_id}] 步骤 1/4: 获取到 {len(history)} 条历史记录")
-        
-        # 2. 发送到AI并获取响应
-        logger.info(f"[{user_id}] 步骤 2/4: 开始调用KimiInteractionAPI.send_message_to_ai...")
-        start_time = time.time()
-        response = await ai_interaction.send_message_to_ai(
-            user_id=user_id,
-            message=request.message,
-            history=history,
-            gender="neutral"  # 添加gender参数
-        )
-        end_time = time.time()
-        logger.info(f"[{user_id}] 步骤 2/4: AI响应成功，耗时: {end_time - start_time:.2f}秒, 成功: {response.get('success')}")
+
+    async def generate_and_save() -> dict:
+        # 同一用户的对话轮次串行执行（读取历史、调用AI、保存），避免两次调用基于同一份历史
+        async with AIAdmissionController().user_turn(user_id):
+            # 1. 获取历史记录
+            logger.info(f"[{user_id}] 步骤 1/4: 开始获取对话历史...")
+            history = await ai_processor.get_conversation_history(user_id)
+            logger.info(f"[{user_id}] 步骤 1/4: 获取到 {len(history)} 条历史记录")
         
-        # 3. 保存对话记录（如果成功）
-        logger.info(f"[{user_id}] 步骤 3/4: 检查是否需要保存对话记录...")
-        if response.get("success"):
-            logger.info(f"[{user_id}] 步骤 3/4: 开始保存对话记录...")
-            await ai_processor.save_conversation_history(
+            # 2. 发送到AI并获取响应
+            logger.info(f"[{user_id}] 步骤 2/4: 开始调用KimiInteractionAPI.send_message_to_ai...")
+            start_time = time.time()
+            response = await ai_interaction.send_message_to_ai(
                 user_id=user_id,
                 message=request.message,
-                response=response.get("message", "")  # 使用message字段
+                history=history,
+                gender="neutral"  # 添加gender参数
             )
-            logger.info(f"[{user_id}] 步骤 3/4: 对话记录保存成功")
+            end_time = time.time()
+            logger.info(f"[{user_id}] 步骤 2/4: AI响应成功，耗时: {end_time - start_time:.2f}秒, 成功: {response.get('success')}")
+        
+            # 3. 保存对话记录（如果成功）
+            logger.info(f"[{user_id}] 步骤 3/4: 检查是否需要保存对话记录...")
+            if response.get("success"):
+                logger.info(f"[{user_id}] 步骤 3/4: 开始保存对话记录...")
+                await ai_processor.save_conversation_history(
+                    user_id=user_id,
+                    message=request.message,
+                    response=response.get("message", ""),  # 使用message字段
+                    prompt_version=response.get("prompt_version")
+                )
+                logger.info(f"[{user_id}] 步骤 3/4: 对话记录保存成功")
+            else:
+                logger.warning(f"[{user_id}] 步骤 3/4: AI响应失败，跳过保存")
+            return response
+
+    try:
+        idempotency_key = request.idempotency_key or idempotency_key_header
+        if idempotency_key:
+            response, replayed = await chat_idempotency.run(
+                user_id,
+                idempotency_key,
+                lambda: ai_processor.get_history_version(user_id),
+                generate_and_save,
+                cacheable=lambda result: bool(result.get("success"))
+            )
+            if replayed:
+                logger.info(f"[{user_id}] 幂等键 {idempotency_key} 的请求已处理或正在处理，重放结果")
+                http_response.headers["Idempotent-Replayed"] = "true"
         else:
-            logger.warning(f"[{user_id}] 步骤 3/4: AI响应失败，跳过保存")
+            response = await generate_and_save()
         
         # 4. 返回响应
         logger.info(f"[{user_id}] 步骤 4/4: 准备向客户端返回最终响应...")
@@ -107,7 +138,8 @@ async def handle_ai_chat(
                 status="success",
                 response=response.get("message", ""),
                 summary=response.get("summary", ""),
-                error=None
+                error=None,
+                prompt_version=response.get("prompt_version")
             )
         else:
             chat_response = ChatResponse(
@@ -119,6 +151,16 @@ async def handle_ai_chat(
         logger.info(f"[{user_id}] 步骤 4/4: 聊天请求处理完成")
         return chat_response
         
+    except AIOverloadedError as e:
+        logger.warning(f"[{user_id}] AI聊天请求未被接纳: {e.reason}")
+        http_response.status_code = 429
+        http_response.headers["Retry-After"] = str(int(e.retry_after))
+        return ChatResponse(
+            status="error",
+            response="",
+            summary="",
+            error=str(e)
+        )
     except Exception as e:
         logger.error(f"[{user_id}] 处理AI聊天请求时发生未捕获异常: {str(e)}", exc_info=True)
         return ChatResponse(
@@ -126,4 +168,46 @@ async def handle_ai_chat(
             response="",
             summary="",
             error=f"处理聊天请求失败: {str(e)}"
-        ) 
\ No newline at end of file
+        )
+
+@router.post("/chat/stream")
+async def handle_ai_chat_stream(
+    request: ChatRequest,
+    ai_processor: AIResponseProcessor = Depends(get_ai_processor)
+):
+    """
+    流式AI聊天（Server-Sent Events）
+    每收到一段AI输出发送一个delta事件，结束时发送done事件（与/chat的结果相同，包括最终总结的分割），
+    对话记录在done事件之前保存
+    """
+    user_id = request.user_id
+    logger.info(f"[{user_id}] 收到新的流式AI聊天请求: message='{request.message}'")
+
+    async def event_stream():
+        try:
+            async for event in ai_processor.stream_chat(user_id, request.message):
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.error(f"[{user_id}] 流式AI聊天失败: {str(e)}", exc_info=True)
+            error_event = {"type": "error", "error": f"处理聊天请求失败: {str(e)}"}
+            yield f"event: error\ndata: {json.dumps(error_event, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/admission_stats")
+async def get_ai_admission_stats() -> dict:
+    """
+    AI服务准入控制的状态：并发数、队列深度、等待时间和拒绝次数
+    """
+    return AIAdmissionController().get_stats()
+
+@router.get("/provider_stats")
+async def get_ai_provider_stats() -> dict:
+    """
+    各AI服务商最近的p50/p95延迟、错误率和对冲次数（按当前优先顺序）
+    """
+    return AIProviderRouter().get_stats()
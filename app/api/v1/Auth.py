@@ -0,0 +1,22 @@
+import hmac
+from datetime import timedelta
+from fastapi import APIRouter, HTTPException
+from app.config import settings
+from app.core.security import create_access_token
+from app.schemas.Auth import IssueTokenRequest, IssueTokenResponse
+from app.services.https.UserManagement import UserManagement
+
+router = APIRouter()
+
+@router.post("/token", response_model=IssueTokenResponse)
+# 为用户签发短期访问令牌（只允许持有AUTH_ISSUER_KEY的可信后端调用）
+# compare_digest比较bytes，非ASCII的密钥返回403而不是抛出TypeError
+async def issue_token(request: IssueTokenRequest):
+    if not settings.AUTH_ISSUER_KEY or not hmac.compare_digest(request.issuer_key.encode(), settings.AUTH_ISSUER_KEY.encode()):
+        raise HTTPException(status_code=403, detail="Invalid issuer key")
+    if UserManagement().get_user_instance(request.user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    expires_in = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    access_token = create_access_token({"sub": str(request.user_id)}, timedelta(seconds=expires_in))
+    return IssueTokenResponse(access_token=access_token, expires_in=expires_in)
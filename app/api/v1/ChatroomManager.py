@@ -3,7 +3,8 @@ from app.schemas.ChatroomManager import (
     GetOrCreateChatroomRequest, GetOrCreateChatroomResponse,
     GetChatHistoryRequest, GetChatHistoryResponse,
     SaveChatroomHistoryRequest, SaveChatroomHistoryResponse,
-    SendMessageRequest, SendMessageResponse
+    SendMessageRequest, SendMessageResponse,
+    GetInboxRequest, GetInboxResponse
 )
 from app.services.https.ChatroomManager import ChatroomManager
 
@@ -33,19 +34,23 @@ async def get_chat_history(request: GetChatHistoryRequest):
     try:
         chat_history = await chatroom_manager.get_chatroom_history(
             chatroom_id=request.chatroom_id,
-            user_id=request.user_id
+            user_id=request.user_id,
+            since_seq=request.since_seq
         )
         
         # 转换格式以匹配响应模型
         messages = []
-        for message_content, datetime_str, sender_id, sender_name in chat_history:
+        for message_content, datetime_str, sender_id, sender_name, seq in chat_history:
             messages.append({
                 "sender_name": sender_name,
                 "message": message_content,
-                "datetime": datetime_str
+                "datetime": datetime_str,
+                "seq": seq
             })
         
-        return GetChatHistoryResponse(success=True, messages=messages)
+        chatroom = chatroom_manager.chatrooms.get(request.chatroom_id)
+        last_seq = (chatroom.last_seq or 0) if chatroom else 0
+        return GetChatHistoryResponse(success=True, messages=messages, last_seq=last_seq)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -69,11 +74,28 @@ async def send_message(request: SendMessageRequest):
         result = await chatroom_manager.send_message(
             chatroom_id=request.chatroom_id,
             sender_user_id=request.sender_user_id,
-            message_content=request.message_content
+            message_content=request.message_content,
+            client_message_id=request.client_message_id
         )
         return SendMessageResponse(
             success=result["success"],
-            match_id=result["match_id"]
+            match_id=result["match_id"],
+            seq=result.get("seq"),
+            duplicate=result.get("duplicate", False)
         )
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/get_inbox", response_model=GetInboxResponse)
+# 获取用户的会话列表（最后一条消息预览和未读数）
+async def get_inbox(request: GetInboxRequest):
+    chatroom_manager = ChatroomManager()
+    try:
+        inbox = chatroom_manager.get_inbox(
+            user_id=request.user_id,
+            offset=request.offset,
+            limit=request.limit
+        )
+        return GetInboxResponse(success=True, total=inbox["total"], conversations=inbox["conversations"])
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -7,6 +7,7 @@ from app.schemas.MatchManager import (
     GetNewMatchesForEveryoneRequest, GetNewMatchesForEveryoneResponse  # 🔧 MODIFIED: 新增导入
 )
 from app.services.https.MatchManager import MatchManager
+from app.WebSocketsService.MessageConnectionHandler import MessageConnectionHandler
 
 router = APIRouter()
 
@@ -21,6 +22,15 @@ async def create_match(request: CreateMatchRequest):
             reason_2=request.reason_2,
             match_score=request.match_score
         )
+        # 通知双方有新匹配，不在线的用户下次连接时收到
+        for user_id in (new_match.user_id_1, new_match.user_id_2):
+            await MessageConnectionHandler.deliver_event(user_id, {
+                "type": "new_match",
+                "match_id": new_match.match_id,
+                "user_id_1": new_match.user_id_1,
+                "user_id_2": new_match.user_id_2,
+                "match_score": new_match.match_score
+            })
         return CreateMatchResponse(success=True, match_id=new_match.match_id)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -29,7 +39,7 @@ async def create_match(request: CreateMatchRequest):
 async def get_match_info(request: GetMatchInfoRequest):
     match_manager = MatchManager()
     try:
-        match_info = match_manager.get_match_info(
+        match_info = await match_manager.get_match_info(
             user_id=request.user_id,
             match_id=request.match_id
         )
@@ -44,7 +54,16 @@ async def get_match_info(request: GetMatchInfoRequest):
 async def toggle_like(request: ToggleLikeRequest):
     match_manager = MatchManager()
     try:
-        success = match_manager.toggle_like(match_id=request.match_id)
+        success = await match_manager.toggle_like(match_id=request.match_id)
+        if success:
+            # 通知双方点赞状态变化，离线期间多次切换只保留最新状态
+            match = await match_manager.get_match(request.match_id)
+            for user_id in (match.user_id_1, match.user_id_2):
+                await MessageConnectionHandler.deliver_event(user_id, {
+                    "type": "match_like_update",
+                    "match_id": match.match_id,
+                    "is_liked": match.is_liked
+                }, coalesce_key=f"like:{match.match_id}")
         return ToggleLikeResponse(success=success)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1,17 +1,25 @@
-from fastapi import APIRouter
-from app.api.v1 import UserManagement, MatchManager, ChatroomManager
+from fastapi import APIRouter, Depends
+from app.api.v1 import Auth, UserManagement, MatchManager, ChatroomManager
 from app.api.v1.AIResponseProcessor import router as AIResponseProcessor_router
+from app.core.security import require_token_user
 
 api_router = APIRouter()
 
+# 注册认证路由（签发token，不需要token）
+api_router.include_router(Auth.router, prefix="/auth", tags=["auth"])
+
+# 以下路由都需要有效的Bearer token，且只能操作token中用户自己的数据
+# （可信后端携带X-Issuer-Key；AUTH_ALLOW_LEGACY_USER_ID开启时允许不带token）
+authenticated = [Depends(require_token_user)]
+
 # 注册用户相关路由
-api_router.include_router(UserManagement.router, prefix="/UserManagement", tags=["users"])
+api_router.include_router(UserManagement.router, prefix="/UserManagement", tags=["users"], dependencies=authenticated)
 
 # 注册匹配相关路由
-api_router.include_router(MatchManager.router, prefix="/MatchManager", tags=["matches"])
+api_router.include_router(MatchManager.router, prefix="/MatchManager", tags=["matches"], dependencies=authenticated)
 
 # 注册聊天室相关路由
-api_router.include_router(ChatroomManager.router, prefix="/ChatroomManager", tags=["chatrooms"]) 
+api_router.include_router(ChatroomManager.router, prefix="/ChatroomManager", tags=["chatrooms"], dependencies=authenticated) 
 
 # 注册AI聊天相关路由
-api_router.include_router(AIResponseProcessor_router) 
\ No newline at end of file
+api_router.include_router(AIResponseProcessor_router, dependencies=authenticated) 
\ No newline at end of file
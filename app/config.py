@@ -28,10 +28,61 @@ class Settings:
     # MONGODB_PASSWORD: str = ""
     # MONGODB_AUTH_SOURCE: str = ""
 
-    # JWT配置 (为了保持结构完整性，即使当前未使用)
+    # JWT配置：WebSocket认证和HTTP接口使用的短期签名token
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30  # 默认30分钟
+    # 已验证token的LRU缓存大小
+    TOKEN_VERIFY_CACHE_SIZE: int = int(os.getenv("TOKEN_VERIFY_CACHE_SIZE", "10000"))
+    # 签发token的服务端密钥（Telegram bot等可信后端调用/auth/token时携带），为空时不允许签发
+    AUTH_ISSUER_KEY: str = os.getenv("AUTH_ISSUER_KEY", "")
+    # 兼容旧客户端：允许WebSocket只带user_id认证、HTTP请求不带token（默认关闭，迁移期间可临时设为true）
+    AUTH_ALLOW_LEGACY_USER_ID: bool = os.getenv("AUTH_ALLOW_LEGACY_USER_ID", "false").lower() == "true"
+
+    # 匹配归档配置：超过N天没有点赞变化或聊天活动的匹配移入matches_archive集合（0表示不归档）
+    MATCH_ARCHIVE_AFTER_DAYS: int = int(os.getenv("MATCH_ARCHIVE_AFTER_DAYS", "30"))
+    MATCH_ARCHIVE_INTERVAL_SECONDS: int = int(os.getenv("MATCH_ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+    # 收件箱配置：最后一条消息预览的最大字符数
+    INBOX_PREVIEW_LENGTH: int = int(os.getenv("INBOX_PREVIEW_LENGTH", "100"))
+
+    # 私信写入确认级别：
+    # "durable"  单次插入messages成功后立即投递，聊天室更新在后台完成
+    # "accepted" 写入内存消息日志后立即投递，由后台任务批量写入数据库（进程崩溃可能丢失未落库的消息）
+    MESSAGE_ACK_LEVEL: str = os.getenv("MESSAGE_ACK_LEVEL", "durable")
+    MESSAGE_JOURNAL_FLUSH_INTERVAL_MS: int = int(os.getenv("MESSAGE_JOURNAL_FLUSH_INTERVAL_MS", "50"))
+    MESSAGE_JOURNAL_MAX_BATCH: int = int(os.getenv("MESSAGE_JOURNAL_MAX_BATCH", "500"))
+    # 单条消息因非重复键错误写入失败的最大尝试次数，超过后转入死信集合messages_dead_letter并移出日志
+    MESSAGE_JOURNAL_MAX_ATTEMPTS: int = int(os.getenv("MESSAGE_JOURNAL_MAX_ATTEMPTS", "5"))
+    # 每个聊天室记住最近多少个client_message_id用于重发去重
+    CLIENT_MESSAGE_ID_WINDOW: int = int(os.getenv("CLIENT_MESSAGE_ID_WINDOW", "256"))
+
+    # WebSocket发送队列：每个连接最多缓存的待发送消息数，以及队列满时的策略
+    # "drop_oldest" 丢弃最早的消息 / "coalesce" 合并同类状态消息 / "disconnect" 断开慢连接
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+    WS_SEND_OVERFLOW_POLICY: str = os.getenv("WS_SEND_OVERFLOW_POLICY", "coalesce")
+
+    # WebSocket跨进程扇出："inprocess"（单worker）或 "unix"（同机多worker，通过Unix域套接字转发）
+    WS_FANOUT_BROKER: str = os.getenv("WS_FANOUT_BROKER", "inprocess")
+    WS_BROKER_SOCKET_DIR: str = os.getenv("WS_BROKER_SOCKET_DIR", "/tmp/newlovelush-ws-broker")
+    # WebSocket心跳：空闲超过PING间隔时服务端发送ping，超过IDLE_TIMEOUT仍无任何消息则回收连接
+    WS_PING_INTERVAL_SECONDS: float = float(os.getenv("WS_PING_INTERVAL_SECONDS", "25"))
+    WS_IDLE_TIMEOUT_SECONDS: float = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+    WS_PRESENCE_TICK_SECONDS: float = float(os.getenv("WS_PRESENCE_TICK_SECONDS", "1"))
+    # 离线事件队列：用户不在线时每人最多暂存的事件数（私信/新匹配/点赞），超出时丢弃最早的
+    OFFLINE_QUEUE_MAX_EVENTS: int = int(os.getenv("OFFLINE_QUEUE_MAX_EVENTS", "200"))
+    # WebSocket限流：每个连接按消息类型的令牌桶，格式 "类型=每秒速率/突发容量"，"*"为所有帧的总限额
+    WS_RATE_LIMITS: str = os.getenv("WS_RATE_LIMITS", "*=20/40,private=5/10,private_chat_init=1/5,broadcast=0.2/2,ai_chat=0.2/3")
+    # 连续被限流的帧数达到该值时断开连接（0表示不断开）
+    WS_RATE_LIMIT_MAX_STRIKES: int = int(os.getenv("WS_RATE_LIMIT_MAX_STRIKES", "50"))
+    # WebSocket二进制协议：客户端协商deflate后，不小于该字节数的帧在应用层压缩
+    # （传输层的permessage-deflate由uvicorn与浏览器协商，对所有帧生效）
+    WS_COMPRESSION_MIN_BYTES: int = int(os.getenv("WS_COMPRESSION_MIN_BYTES", "1024"))
+    # 客户端deflate帧解压后的最大字节数，超过则拒绝该帧（防止压缩炸弹）
+    WS_MAX_DECOMPRESSED_BYTES: int = int(os.getenv("WS_MAX_DECOMPRESSED_BYTES", "1048576"))
+    # uvicorn worker数量。注意：用户/匹配/聊天室仍由各进程的内存单例持有，
+    # 多worker只解决WebSocket投递，在共享状态之前请保持为1
+    SERVER_WORKERS: int = int(os.getenv("SERVER_WORKERS", "1"))
 
     # AI API配置
     # 豆包API配置（保留，但暂时不使用）
@@ -49,8 +100,52 @@ class Settings:
     KIMI_API_URL: str = os.getenv("KIMI_API_URL", "https://api.moonshot.cn/v1/chat/completions")
     KIMI_MODEL_NAME: str = os.getenv("KIMI_MODEL_NAME", "moonshot-v1-8k")
     
+    # AI请求：每次尝试的超时、最大尝试次数、重试退避（带随机抖动）和共享连接池大小
+    AI_REQUEST_TIMEOUT_SECONDS: float = float(os.getenv("AI_REQUEST_TIMEOUT_SECONDS", "60"))
+    AI_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("AI_CONNECT_TIMEOUT_SECONDS", "5"))
+    AI_MAX_RETRIES: int = int(os.getenv("AI_MAX_RETRIES", "3"))
+    AI_RETRY_BASE_DELAY_SECONDS: float = float(os.getenv("AI_RETRY_BASE_DELAY_SECONDS", "1"))
+    AI_RETRY_MAX_DELAY_SECONDS: float = float(os.getenv("AI_RETRY_MAX_DELAY_SECONDS", "8"))
+    AI_HTTP_MAX_CONNECTIONS: int = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "20"))
+    
+    # AI上下文预算（估算token）：moonshot-v1-8k的上下文减去max_tokens=1024的回复和余量，
+    # 超出时较早的轮次压缩为滚动摘要，摘要最多占AI_SUMMARY_TOKEN_BUDGET，每轮最多保留AI_SUMMARY_LINE_CHARS个字符
+    AI_CONTEXT_TOKEN_BUDGET: int = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "6000"))
+    AI_SUMMARY_TOKEN_BUDGET: int = int(os.getenv("AI_SUMMARY_TOKEN_BUDGET", "800"))
+    AI_SUMMARY_LINE_CHARS: int = int(os.getenv("AI_SUMMARY_LINE_CHARS", "80"))
+    
+    # AI服务准入控制：全局并发上限、每分钟token预算（按估算值预留）、排队上限和最长排队时间（秒）
+    AI_MAX_CONCURRENT_REQUESTS: int = int(os.getenv("AI_MAX_CONCURRENT_REQUESTS", "8"))
+    AI_TOKENS_PER_MINUTE: int = int(os.getenv("AI_TOKENS_PER_MINUTE", "128000"))
+    AI_MAX_QUEUE_DEPTH: int = int(os.getenv("AI_MAX_QUEUE_DEPTH", "100"))
+    AI_QUEUE_TIMEOUT_SECONDS: float = float(os.getenv("AI_QUEUE_TIMEOUT_SECONDS", "15"))
+    
+    # /ai/chat幂等键：重试的请求在此时间（秒）内重放已完成的结果，最多缓存AI_IDEMPOTENCY_MAX_ENTRIES个结果
+    AI_IDEMPOTENCY_TTL_SECONDS: float = float(os.getenv("AI_IDEMPOTENCY_TTL_SECONDS", "600"))
+    AI_IDEMPOTENCY_MAX_ENTRIES: int = int(os.getenv("AI_IDEMPOTENCY_MAX_ENTRIES", "10000"))
+    
+    # AI对话历史：每个用户在内存中最多保留最近AI_HISTORY_MAX_MESSAGES条消息（更早的只在数据库中），
+    # 最多AI_HISTORY_MAX_ACTIVE_USERS个用户的历史常驻内存，超出时换出最久未使用的用户，需要时再从数据库加载
+    AI_HISTORY_MAX_MESSAGES: int = int(os.getenv("AI_HISTORY_MAX_MESSAGES", "200"))
+    AI_HISTORY_MAX_ACTIVE_USERS: int = int(os.getenv("AI_HISTORY_MAX_ACTIVE_USERS", "10000"))
+    # AI对话分桶存储：每个桶文档最多保存的消息条数（不小于AI_HISTORY_MAX_MESSAGES时加载历史最多读取两个桶）
+    AI_HISTORY_BUCKET_SIZE: int = int(os.getenv("AI_HISTORY_BUCKET_SIZE", "200"))
+    
+    # prompt文件修改检查的最小间隔（秒），文件变化时重新组合系统提示词，无需重启
+    PROMPT_RELOAD_CHECK_SECONDS: float = float(os.getenv("PROMPT_RELOAD_CHECK_SECONDS", "2"))
+    
     # 当前使用的AI服务（可以切换）
     CURRENT_AI_SERVICE: str = os.getenv("CURRENT_AI_SERVICE", "kimi")  # "kimi", "gemini" 或 "doubao"
+    
+    # AI服务商路由：AI_PROVIDERS为逗号分隔的服务商列表（按优先顺序，支持kimi、doubao、gemini、stub），为空时只使用CURRENT_AI_SERVICE
+    # 按最近AI_PROVIDER_STATS_WINDOW次调用的p50延迟和错误率排序，样本少于AI_PROVIDER_MIN_SAMPLES时不参与判断
+    AI_PROVIDERS: str = os.getenv("AI_PROVIDERS", "")
+    AI_PROVIDER_STATS_WINDOW: int = int(os.getenv("AI_PROVIDER_STATS_WINDOW", "100"))
+    AI_PROVIDER_MIN_SAMPLES: int = int(os.getenv("AI_PROVIDER_MIN_SAMPLES", "10"))
+    AI_PROVIDER_MAX_ERROR_RATE: float = float(os.getenv("AI_PROVIDER_MAX_ERROR_RATE", "0.5"))
+    # 对冲请求：首选服务商超过其AI_HEDGE_PERCENTILE分位延迟仍未返回时，向下一个服务商再发一次（会增加token消耗）
+    AI_HEDGE_ENABLED: bool = os.getenv("AI_HEDGE_ENABLED", "false").lower() == "true"
+    AI_HEDGE_PERCENTILE: float = float(os.getenv("AI_HEDGE_PERCENTILE", "95"))
 
     class Config:
         case_sensitive = True
@@ -89,10 +89,10 @@ class Database:
             raise
 
     @classmethod
-    async def insert_many(cls, collection_name: str, documents: list):
+    async def insert_many(cls, collection_name: str, documents: list, ordered: bool = True):
         """插入多个文档"""
         try:
-            result = await cls.get_collection(collection_name).insert_many(documents)
+            result = await cls.get_collection(collection_name).insert_many(documents, ordered=ordered)
             logger.info(f"Inserted {len(result.inserted_ids)} documents")
             return [str(id) for id in result.inserted_ids]
         except Exception as e:
@@ -132,16 +132,26 @@ class Database:
             raise
 
     @classmethod
-    async def update_one(cls, collection_name: str, query: dict, update: dict):
-        """更新单个文档"""
+    async def update_one(cls, collection_name: str, query: dict, update: dict, upsert: bool = False):
+        """更新单个文档，upsert为True时不存在则插入"""
         try:
-            result = await cls.get_collection(collection_name).update_one(query, update)
+            result = await cls.get_collection(collection_name).update_one(query, update, upsert=upsert)
             # logger.info(f"Modified {result.modified_count} document")
             return result.modified_count
         except Exception as e:
             logger.error(f"Error updating document: {e}")
             raise
 
+    @classmethod
+    async def bulk_write(cls, collection_name: str, operations: list, ordered: bool = True):
+        """批量执行写操作（UpdateOne等），一次往返"""
+        try:
+            result = await cls.get_collection(collection_name).bulk_write(operations, ordered=ordered)
+            return result.modified_count
+        except Exception as e:
+            logger.error(f"Error bulk writing documents: {e}")
+            raise
+
     @classmethod
     async def update_many(cls, collection_name: str, query: dict, update: dict):
         """更新多个文档"""
@@ -155,6 +165,15 @@ class Database:
             logger.error(f"Error updating documents: {e}")
             raise
 
+    @classmethod
+    async def create_index(cls, collection_name: str, keys: list, **kwargs):
+        """创建索引（已存在时MongoDB直接返回）"""
+        try:
+            return await cls.get_collection(collection_name).create_index(keys, **kwargs)
+        except Exception as e:
+            logger.error(f"Error creating index: {e}")
+            raise
+
     @classmethod
     async def delete_one(cls, collection_name: str, query: dict):
         """删除单个文档"""
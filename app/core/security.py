@@ -1,8 +1,11 @@
+import hmac
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, UTC
 from typing import Optional, Dict, Any
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordBearer, APIKeyHeader
 from app.config import settings
 import logging
 
@@ -10,9 +13,16 @@ logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/auth/token", # 修改为适合此项目的token URL
-    scheme_name="OAuth2PasswordBearer"
+    scheme_name="OAuth2PasswordBearer",
+    auto_error=False  # 缺少token时由依赖自行决定是否放行（兼容旧客户端）
 )
 
+# 可信后端（Telegram bot、n8n等）以AUTH_ISSUER_KEY直接调用接口，例如创建用户时还没有用户token
+issuer_key_scheme = APIKeyHeader(name="X-Issuer-Key", auto_error=False)
+
+# token验证缓存 {token: (user_id, exp_timestamp)}，按最近使用顺序淘汰
+_verified_tokens: "OrderedDict[str, tuple]" = OrderedDict()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """创建访问令牌"""
     to_encode = data.copy()
@@ -24,29 +34,113 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict[str, Any]:
-    """获取当前用户"""
+def verify_access_token(token: str) -> Optional[str]:
+    """
+    验证访问令牌，返回其中的用户ID（sub），无效或过期返回None
+    验证过的token放入LRU缓存，重复连接/请求只需一次字典查找和过期时间比较
+    """
+    cached = _verified_tokens.get(token)
+    if cached is not None:
+        user_id, expire_at = cached
+        if expire_at > time.time():
+            _verified_tokens.move_to_end(token)
+            return user_id
+        del _verified_tokens[token]
+        return None
+
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+    user_id = payload.get("sub")
+    expire_at = payload.get("exp")
+    if user_id is None or expire_at is None:
+        return None
+
+    _verified_tokens[token] = (str(user_id), float(expire_at))
+    if len(_verified_tokens) > settings.TOKEN_VERIFY_CACHE_SIZE:
+        _verified_tokens.popitem(last=False)
+    return str(user_id)
+
+async def get_current_user(
+    token: Optional[str] = Depends(oauth2_scheme),
+    issuer_key: Optional[str] = Depends(issuer_key_scheme)
+) -> Dict[str, Any]:
+    """
+    获取当前用户
+    携带正确X-Issuer-Key的可信后端请求返回{"_id": None, "issuer": True}
+    AUTH_ALLOW_LEGACY_USER_ID开启时，没有携带token的请求按旧方式放行（返回空字典）
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
-        user_id: str = payload.get("sub")
+    if issuer_key and settings.AUTH_ISSUER_KEY and hmac.compare_digest(issuer_key.encode(), settings.AUTH_ISSUER_KEY.encode()):
+        return {"_id": None, "issuer": True}
+    if token is None:
+        if settings.AUTH_ALLOW_LEGACY_USER_ID:
+            return {}
+        raise credentials_exception
 
-        if user_id is None:
-            raise credentials_exception
+    user_id = verify_access_token(token)
+    if user_id is None:
+        raise credentials_exception
+    return {"_id": user_id}
 
-        return {"_id": user_id}
+# 请求中表示“当前用户”的字段，携带用户token时必须与token中的用户一致
+USER_ID_FIELDS = ("user_id", "sender_user_id")
+# 涉及两个用户的请求，token中的用户必须是其中之一
+USER_PAIR_FIELDS = ("user_id_1", "user_id_2")
 
-    except JWTError:
-        raise credentials_exception
-    except Exception as e:
-        logger.error(f"获取用户信息失败: {str(e)}")
-        raise credentials_exception
+async def require_token_user(
+    request: Request,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """
+    受保护路由的依赖：用户token只能操作自己的数据
+    路径、查询参数或JSON请求体中的user_id/sender_user_id必须等于token中的用户，
+    带user_id_1/user_id_2的请求token用户必须是其中之一，带match_id/chatroom_id的请求token用户必须是匹配或聊天室双方之一
+    可信后端（X-Issuer-Key）和兼容模式下不带token的请求不做检查
+    """
+    token_user_id = current_user.get("_id")
+    if token_user_id is None:
+        return current_user
+
+    claimed = {**request.query_params, **request.path_params}
+    if request.method in ("POST", "PUT", "PATCH"):
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            claimed.update(body)
+
+    forbidden = HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Token does not match the requested user"
+    )
+    for field in USER_ID_FIELDS:
+        if claimed.get(field) is not None and str(claimed[field]) != token_user_id:
+            raise forbidden
+    pair = {str(claimed[field]) for field in USER_PAIR_FIELDS if claimed.get(field) is not None}
+    if pair and token_user_id not in pair:
+        raise forbidden
+    if claimed.get("match_id") is not None:
+        # 导入放在函数内部避免循环导入
+        from app.services.https.MatchManager import MatchManager
+        match = await MatchManager().get_match(claimed["match_id"])
+        if match is not None and token_user_id not in (str(match.user_id_1), str(match.user_id_2)):
+            raise forbidden
+    if claimed.get("chatroom_id") is not None:
+        from app.services.https.ChatroomManager import ChatroomManager
+        try:
+            chatroom = ChatroomManager().chatrooms.get(int(claimed["chatroom_id"]))
+        except (TypeError, ValueError):
+            chatroom = None  # 格式错误由路由的请求校验处理
+        if chatroom is not None and token_user_id not in (str(chatroom.user1_id), str(chatroom.user2_id)):
+            raise forbidden
+    return current_user
 
 async def get_current_active_user(
     current_user: Dict[str, Any] = Depends(get_current_user)
@@ -1,3 +1,7 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from app.config import settings
 from app.core.database import Database
 from app.utils.my_logger import MyLogger
 
@@ -36,7 +40,6 @@ class Chatroom:
         except Exception as e:
             logger.error(f"Failed to initialize chatroom counter: {e}")
             # 如果初始化失败，使用时间戳作为起始点以避免冲突
-            import time
             cls._chatroom_counter = int(time.time() * 1000)  # 毫秒时间戳
             cls._initialized = True
             logger.warning(f"Using timestamp as chatroom counter starting point: {cls._chatroom_counter}")
@@ -49,6 +52,7 @@ class Chatroom:
         Chatroom._chatroom_counter += 1
         self.chatroom_id = Chatroom._chatroom_counter
         self.message_ids = []
+        self.last_seq = 0  # 最后分配的消息序号
         self.user1_id = user1.user_id
         self.user2_id = user2.user_id
         self.match_id = match_id  # 添加match_id属性
@@ -56,8 +60,130 @@ class Chatroom:
         self.user1 = user1
         self.user2 = user2
         
+        # 收件箱摘要：最后一条消息预览、最近活动时间和各用户未读数
+        self.last_message = None
+        self.last_message_time = None  # ISO时间字符串
+        self.last_sender_id = None
+        self.last_activity_time = time.time()
+        self.unread_counts = {self.user1_id: 0, self.user2_id: 0}
+        # 最近的客户端消息ID：{(sender_id, client_message_id): asyncio.Future(发送结果)}，只保存在内存
+        self.recent_client_messages = OrderedDict()
+        
         logger.info(f"Created chatroom {self.chatroom_id} for users {self.user1_id} and {self.user2_id} with match_id {self.match_id}")
 
+    @classmethod
+    def from_document(cls, chatroom_data: dict, user1, user2) -> "Chatroom":
+        """
+        从数据库文档直接构建Chatroom实例（启动加载使用）
+        不推进计数器、不逐条输出日志，用户实例由调用方批量解析后传入
+        """
+        match_id = chatroom_data.get("match_id")
+        
+        chatroom = cls.__new__(cls)
+        chatroom.chatroom_id = int(chatroom_data["_id"])  # chatroom_id存储在_id字段中
+        chatroom.message_ids = chatroom_data.get("message_ids", [])
+        # 旧文档没有last_seq字段，为None时由ChatroomManager在启动时回填
+        chatroom.last_seq = chatroom_data.get("last_seq")
+        chatroom.user1_id = user1.user_id
+        chatroom.user2_id = user2.user_id
+        chatroom.match_id = int(match_id) if match_id is not None else None
+        chatroom.user1 = user1
+        chatroom.user2 = user2
+        
+        chatroom.last_message = chatroom_data.get("last_message")
+        chatroom.last_message_time = chatroom_data.get("last_message_time")
+        chatroom.last_sender_id = chatroom_data.get("last_sender_id")
+        chatroom.last_activity_time = chatroom_data.get("last_activity_time", 0)
+        # MongoDB文档的键只能是字符串，加载时转换回int
+        unread_counts = chatroom_data.get("unread_counts", {})
+        chatroom.unread_counts = {
+            chatroom.user1_id: int(unread_counts.get(str(chatroom.user1_id), 0)),
+            chatroom.user2_id: int(unread_counts.get(str(chatroom.user2_id), 0))
+        }
+        chatroom.recent_client_messages = OrderedDict()
+        return chatroom
+
+    def next_seq(self) -> int:
+        """
+        分配下一个消息序号（同步方法，中间没有await，并发发送不会拿到相同序号）
+        发送失败时序号不回收，客户端应只依赖单调递增而不是连续
+        """
+        self.last_seq += 1
+        return self.last_seq
+
+    def record_message(self, sender_id: int, content: str, send_time: datetime):
+        """
+        更新收件箱摘要：最后一条消息、最近活动时间，并增加接收方的未读数
+        """
+        preview_length = settings.INBOX_PREVIEW_LENGTH
+        self.last_message = content if len(content) <= preview_length else content[:preview_length] + "…"
+        self.last_message_time = send_time.isoformat()
+        self.last_sender_id = sender_id
+        if send_time.tzinfo is None:
+            send_time = send_time.replace(tzinfo=timezone.utc)  # 数据库中读出的时间不带时区，按UTC处理
+        self.last_activity_time = send_time.timestamp()
+        
+        for user_id in self.unread_counts:
+            if user_id != sender_id:
+                self.unread_counts[user_id] += 1
+
+    def remember_client_message(self, key, send_result):
+        """
+        记录客户端消息ID对应的发送结果，超过窗口大小时淘汰最早的记录
+        """
+        self.recent_client_messages[key] = send_result
+        while len(self.recent_client_messages) > settings.CLIENT_MESSAGE_ID_WINDOW:
+            self.recent_client_messages.popitem(last=False)
+
+    def mark_read(self, user_id: int):
+        """
+        将指定用户在该聊天室的未读数清零
+        """
+        if user_id in self.unread_counts:
+            self.unread_counts[user_id] = 0
+
+    def get_other_user_id(self, user_id: int):
+        """
+        获取聊天室中另一个用户的ID
+        """
+        if user_id == self.user1_id:
+            return self.user2_id
+        if user_id == self.user2_id:
+            return self.user1_id
+        return None
+
+    def _summary_fields(self) -> dict:
+        """
+        收件箱摘要和序号字段（MongoDB文档的键只能是字符串）
+        """
+        return {
+            "last_seq": self.last_seq,
+            "last_message": self.last_message,
+            "last_message_time": self.last_message_time,
+            "last_sender_id": self.last_sender_id,
+            "last_activity_time": self.last_activity_time,
+            "unread_counts": {str(user_id): count for user_id, count in self.unread_counts.items()}
+        }
+
+    async def append_messages_to_database(self, message_ids: list) -> bool:
+        """
+        发送消息后的增量更新：一次update把新消息ID加入message_ids并刷新摘要
+        使用$addToSet，与定时全量保存交错执行时不会产生重复ID
+        """
+        try:
+            await Database.update_one(
+                "chatrooms",
+                {"_id": self.chatroom_id},
+                {
+                    "$addToSet": {"message_ids": {"$each": list(message_ids)}},
+                    "$set": self._summary_fields()
+                }
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error appending messages {message_ids} to chatroom {self.chatroom_id} in database: {e}")
+            return False
+
     async def save_to_database(self) -> bool:
         """
         保存聊天室到数据库，使用chatroom_id作为_id主键
@@ -68,7 +194,8 @@ class Chatroom:
                 "user1_id": self.user1_id,
                 "user2_id": self.user2_id,
                 "message_ids": self.message_ids,
-                "match_id": self.match_id  # 添加match_id到数据库字段
+                "match_id": self.match_id,  # 添加match_id到数据库字段
+                **self._summary_fields()
             }
             
             # 检查聊天室是否已存在（基于_id查询，O(log n)复杂度）
@@ -23,10 +23,12 @@ class Match:
             
         try:
             # 查找数据库中最大的_id（match_id存储在_id字段中）
+            # 归档集合中的match_id同样不可复用，因此两个集合都要查询
             matches = await Database.find("matches", sort=[("_id", -1)], limit=1)
+            archived_matches = await Database.find("matches_archive", sort=[("_id", -1)], limit=1)
             
-            if matches:
-                max_id = matches[0]["_id"]
+            if matches or archived_matches:
+                max_id = max(m[0]["_id"] for m in (matches, archived_matches) if m)
                 cls._match_counter = max_id
                 logger.info(f"Match counter initialized from database: starting from {max_id}")
             else:
@@ -58,6 +60,7 @@ class Match:
         self.mutual_game_scores = {}  # {session_id: {score: int, description: str, game_session_id: int}}
         self.chatroom_id = None
         self.match_time = match_time
+        self.last_activity_time = time.time()  # 最近一次活动时间（点赞/聊天），用于归档判断
         
         self.chatroom = None
         self.user_1 = None
@@ -68,6 +71,32 @@ class Match:
         
         logger.info(f"Created new match with ID: {self.match_id} between users {self.user_id_1} and {self.user_id_2}")
 
+    @classmethod
+    def from_document(cls, match_data: dict, user_1=None, user_2=None) -> "Match":
+        """
+        从数据库文档直接构建Match实例（启动加载和归档恢复使用）
+        不推进计数器、不逐条输出日志，用户实例由调用方批量解析后传入
+        """
+        match = cls.__new__(cls)
+        match.match_id = match_data["_id"]  # match_id存储在_id字段中
+        match.user_id_1 = match_data["user_id_1"]
+        match.user_id_2 = match_data["user_id_2"]
+        match.description_to_user_1 = match_data.get("description_to_user_1", "")
+        match.description_to_user_2 = match_data.get("description_to_user_2", "")
+        match.is_liked = match_data.get("is_liked", False)
+        match.match_score = match_data.get("match_score", 0)
+        match.mutual_game_scores = match_data.get("mutual_game_scores", {})
+        match.chatroom_id = match_data.get("chatroom_id")
+        match.match_time = match_data.get("match_time", "Unknown")
+        # 旧数据没有活动时间，以加载时间为准，避免上线后立即被归档
+        last_activity_time = match_data.get("last_activity_time")
+        match.last_activity_time = last_activity_time if last_activity_time is not None else time.time()
+        
+        match.chatroom = None
+        match.user_1 = user_1
+        match.user_2 = user_2
+        return match
+
     def _populate_user_instances(self):
         """
         从UserManagement单例获取用户实例
@@ -119,12 +148,19 @@ class Match:
         """
         return self.match_id
 
+    def touch(self):
+        """
+        记录一次活动（点赞变化、聊天室消息），刷新最近活动时间
+        """
+        self.last_activity_time = time.time()
+
     def toggle_like(self) -> bool:
         """
         切换喜欢状态
         """
         try:
             self.is_liked = not self.is_liked
+            self.touch()
             logger.info(f"Match {self.match_id} like status toggled to: {self.is_liked}")
             return True
         except Exception as e:
@@ -146,7 +182,8 @@ class Match:
                 "match_score": self.match_score,
                 "mutual_game_scores": self.mutual_game_scores,
                 "chatroom_id": self.chatroom_id,
-                "match_time": self.match_time
+                "match_time": self.match_time,
+                "last_activity_time": self.last_activity_time
             }
             
             # 检查匹配是否已存在（基于_id查询，O(log n)复杂度）
@@ -195,5 +232,6 @@ class Match:
             "match_score": self.match_score,
             "mutual_game_scores": self.mutual_game_scores,
             "chatroom_id": self.chatroom_id,
-            "match_time": self.match_time
+            "match_time": self.match_time,
+            "last_activity_time": self.last_activity_time
         }
\ No newline at end of file
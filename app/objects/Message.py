@@ -1,4 +1,5 @@
 from datetime import datetime, timezone
+from pymongo.errors import DuplicateKeyError
 from app.core.database import Database
 from app.utils.my_logger import MyLogger
 
@@ -42,7 +43,7 @@ class Message:
             cls._initialized = True
             logger.warning(f"Using timestamp as message counter starting point: {cls._message_counter}")
     
-    def __init__(self, sender_user, receiver_user, send_content, chatroom_id):
+    def __init__(self, sender_user, receiver_user, send_content, chatroom_id, seq=None, client_message_id=None):
         # 确保计数器已初始化
         if not Message._initialized:
             raise RuntimeError("Message counter not initialized. Call Message.initialize_counter() first.")
@@ -54,6 +55,8 @@ class Message:
         self.message_sender_id = sender_user.user_id
         self.message_receiver_id = receiver_user.user_id
         self.chatroom_id = chatroom_id  # 消息归属的聊天室ID
+        self.seq = seq  # 聊天室内单调递增的序号，用于客户端增量同步
+        self.client_message_id = client_message_id  # 客户端生成的消息ID，用于重发去重
         
         self.message_sender = sender_user
         self.message_receiver = receiver_user
@@ -63,34 +66,34 @@ class Message:
         
         logger.info(f"Created message {self.message_id} from {self.message_sender_id} to {self.message_receiver_id} in chatroom {self.chatroom_id}")
     
+    def to_document(self) -> dict:
+        """
+        转换为数据库文档，使用message_id作为_id主键
+        """
+        return {
+            "_id": self.message_id,  # 使用message_id作为MongoDB的_id主键
+            "message_content": self.message_content,
+            "message_send_time_in_utc": self.message_send_time_in_utc,
+            "message_sender_id": self.message_sender_id,
+            "message_receiver_id": self.message_receiver_id,
+            "chatroom_id": self.chatroom_id,  # 保存消息所属的聊天室ID
+            "seq": self.seq,
+            "client_message_id": self.client_message_id
+        }
+
     async def save_to_database(self) -> bool:
         """
-        保存消息到数据库，使用message_id作为_id主键
-        消息一旦创建不可更新，确保数据完整性
+        保存消息到数据库，只有一次插入往返
+        消息一旦创建不可更新：_id已存在时插入失败，视为已保存
         """
         try:
-            message_dict = {
-                "_id": self.message_id,  # 使用message_id作为MongoDB的_id主键
-                "message_content": self.message_content,
-                "message_send_time_in_utc": self.message_send_time_in_utc,
-                "message_sender_id": self.message_sender_id,
-                "message_receiver_id": self.message_receiver_id,
-                "chatroom_id": self.chatroom_id  # 保存消息所属的聊天室ID
-            }
-            
-            # 检查消息是否已存在（基于_id查询，O(log n)复杂度）
-            existing_message = await Database.find_one("messages", {"_id": self.message_id})
-            
-            if existing_message:
-                # 消息已存在，不允许更新
-                logger.warning(f"Message {self.message_id} already exists in database - skipping save (messages are immutable)")
-                return True  # 返回True因为消息已经存在于数据库中
-            else:
-                # 插入新消息
-                await Database.insert_one("messages", message_dict)
-                logger.info(f"Saved new message {self.message_id} to database")
-                return True
+            await Database.insert_one("messages", self.to_document())
+            logger.info(f"Saved new message {self.message_id} to database")
+            return True
             
+        except DuplicateKeyError:
+            logger.warning(f"Message {self.message_id} already exists in database - skipping save (messages are immutable)")
+            return True  # 返回True因为消息已经存在于数据库中
         except Exception as e:
             logger.error(f"Error saving message {self.message_id} to database: {e}")
             return False
@@ -23,10 +23,12 @@ class ChatRequest(BaseModel):
     """AI聊天请求模型"""
     user_id: int = Field(..., description="用户ID", ge=1)
     message: str = Field(..., description="用户消息")
+    idempotency_key: Optional[str] = Field(None, description="幂等键（也可以通过Idempotency-Key请求头提供），重试时使用同一个值", max_length=128)
 
 class ChatResponse(BaseModel):
     """AI聊天响应模型"""
     status: str = Field(..., description="响应状态")
     response: Optional[str] = Field(None, description="AI回复内容")
     summary: Optional[str] = Field(None, description="总结信息")
-    error: Optional[str] = Field(None, description="错误信息") 
\ No newline at end of file
+    error: Optional[str] = Field(None, description="错误信息")
+    prompt_version: Optional[str] = Field(None, description="生成回复时使用的系统提示词版本")
\ No newline at end of file
@@ -0,0 +1,11 @@
+from pydantic import BaseModel, Field
+
+# 签发访问令牌
+class IssueTokenRequest(BaseModel):
+    user_id: int = Field(..., description="用户ID")
+    issuer_key: str = Field(..., description="签发方密钥（AUTH_ISSUER_KEY）")
+
+class IssueTokenResponse(BaseModel):
+    access_token: str = Field(..., description="签名的访问令牌，用于WebSocket认证和HTTP Authorization头")
+    token_type: str = Field("bearer", description="令牌类型")
+    expires_in: int = Field(..., description="有效期（秒）")
@@ -15,15 +15,18 @@ class GetOrCreateChatroomResponse(BaseModel):
 class GetChatHistoryRequest(BaseModel):
     chatroom_id: int = Field(..., description="聊天室ID")
     user_id: int = Field(..., description="请求用户的ID")
+    since_seq: Optional[int] = Field(None, description="只返回序号大于该值的消息（增量同步），不提供则返回全部")
 
 class ChatMessage(BaseModel):
     sender_name: str = Field(..., description="发送者名称或'I'")
     message: str = Field(..., description="消息内容")
     datetime: str = Field(..., description="消息时间")
+    seq: Optional[int] = Field(None, description="消息在聊天室内的序号")
 
 class GetChatHistoryResponse(BaseModel):
     success: bool = Field(..., description="是否获取成功")
     messages: List[ChatMessage] = Field(default=[], description="聊天记录")
+    last_seq: int = Field(0, description="聊天室当前最大消息序号，客户端下次增量同步时作为since_seq")
 
 # Save chatroom history
 class SaveChatroomHistoryRequest(BaseModel):
@@ -37,7 +40,31 @@ class SendMessageRequest(BaseModel):
     chatroom_id: int = Field(..., description="聊天室ID")
     sender_user_id: int = Field(..., description="发送者用户ID")
     message_content: str = Field(..., description="消息内容")
+    client_message_id: Optional[str] = Field(None, description="客户端生成的消息ID，重发时保持不变以避免重复消息")
 
 class SendMessageResponse(BaseModel):
     success: bool = Field(..., description="是否发送成功")
-    match_id: Optional[int] = Field(None, description="关联的匹配ID")
\ No newline at end of file
+    match_id: Optional[int] = Field(None, description="关联的匹配ID")
+    seq: Optional[int] = Field(None, description="分配给该消息的序号")
+    duplicate: bool = Field(False, description="是否为已发送消息的重发（未重复存储）")
+
+# Get inbox
+class GetInboxRequest(BaseModel):
+    user_id: int = Field(..., description="用户ID")
+    offset: int = Field(0, ge=0, description="分页偏移量")
+    limit: int = Field(20, ge=1, le=100, description="每页会话数量")
+
+class InboxConversation(BaseModel):
+    chatroom_id: int = Field(..., description="聊天室ID")
+    match_id: Optional[int] = Field(None, description="关联的匹配ID")
+    target_user_id: int = Field(..., description="对方用户ID")
+    target_user_name: Optional[str] = Field(None, description="对方用户名")
+    last_message: Optional[str] = Field(None, description="最后一条消息预览")
+    last_message_time: Optional[str] = Field(None, description="最后一条消息时间")
+    last_sender_id: Optional[int] = Field(None, description="最后一条消息的发送者ID")
+    unread_count: int = Field(0, description="未读消息数")
+
+class GetInboxResponse(BaseModel):
+    success: bool = Field(..., description="是否获取成功")
+    total: int = Field(0, description="会话总数")
+    conversations: List[InboxConversation] = Field(default=[], description="按最近活动时间倒序的会话列表")
@@ -26,11 +26,23 @@ from app.services.https.ChatroomManager import ChatroomManager
 from app.services.https.N8nWebhookManager import N8nWebhookManager
 from app.services.https.DataIntegrity import DataIntegrity
 from app.services.https.AIResponseProcessor import AIResponseProcessor
+from app.services.https.MessageJournal import MessageJournal
+from app.services.https.PendingEventQueue import PendingEventQueue
+from app.services.https.KimiInteractionAPI import KimiInteractionAPI
+from app.services.https.AIProviderRouter import AIProviderRouter
+from app.WebSocketsService.ConnectionHandler import ConnectionHandler
+from app.WebSocketsService.FanoutBroker import create_fanout_broker
 
 logger = MyLogger("server")
 
 # 全局变量用于控制自动保存任务
 auto_save_task = None
+# 全局变量用于控制匹配归档任务
+auto_archive_task = None
+# 全局变量用于控制消息日志落库任务
+message_journal_task = None
+# 全局变量用于控制WebSocket心跳/空闲回收任务
+presence_tasks = []
 
 async def auto_save_to_database():
     """
@@ -117,9 +129,34 @@ async def auto_save_to_database():
             # 发生错误时等待一段时间再继续
             await asyncio.sleep(5)
 
+async def auto_archive_matches():
+    """
+    定期将长时间没有活动的匹配移入matches_archive的后台任务
+    """
+    logger.info(f"启动匹配归档任务，每{settings.MATCH_ARCHIVE_INTERVAL_SECONDS}秒归档一次超过{settings.MATCH_ARCHIVE_AFTER_DAYS}天未活动的匹配")
+    
+    while True:
+        try:
+            await asyncio.sleep(settings.MATCH_ARCHIVE_INTERVAL_SECONDS)
+            
+            match_manager = MatchManager()
+            archived_count = await match_manager.archive_inactive_matches()
+            logger.info(f"📦 匹配归档完成: 归档 {archived_count} 个, 内存中剩余 {len(match_manager.match_list)} 个")
+            
+        except asyncio.CancelledError:
+            logger.info("匹配归档任务被取消")
+            break
+        except Exception as e:
+            logger.error(f"匹配归档任务发生错误: {e}")
+            await asyncio.sleep(5)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global auto_save_task
+    global auto_save_task, auto_archive_task, message_journal_task, presence_tasks
+    
+    # 校验私信写入确认级别，未知取值直接拒绝启动
+    if settings.MESSAGE_ACK_LEVEL not in ("durable", "accepted"):
+        raise ValueError(f"Invalid MESSAGE_ACK_LEVEL: {settings.MESSAGE_ACK_LEVEL!r}, expected 'durable' or 'accepted'")
     
     # 启动时连接数据库
     logger.info("正在连接数据库...")
@@ -147,7 +184,6 @@ async def lifespan(app: FastAPI):
         # 检查初始化状态
         if construct_success:
             logger.info(f"ChatroomManager缓存初始化完成 - 加载了 {len(chatroom_manager.chatrooms)} 个聊天室")
-            logger.info(f"ChatroomManager可用的聊天室ID: {list(chatroom_manager.chatrooms.keys())}")
         else:
             logger.error("ChatroomManager缓存初始化失败")
             
@@ -164,11 +200,31 @@ async def lifespan(app: FastAPI):
         await ai_processor.initialize_from_database()  # 从数据库加载数据到内存
         logger.info("AIResponseProcessor初始化完成")
         
+        # 启动WebSocket扇出broker
+        await ConnectionHandler.start_fanout_broker(
+            create_fanout_broker(settings.WS_FANOUT_BROKER, settings.WS_BROKER_SOCKET_DIR)
+        )
+        logger.info(f"WebSocket扇出broker已启动: {settings.WS_FANOUT_BROKER}")
+        
+        # 启动WebSocket心跳和空闲连接回收任务
+        presence_tasks = ConnectionHandler.start_presence_tasks()
+        logger.info(f"WebSocket心跳任务已启动: ping间隔{settings.WS_PING_INTERVAL_SECONDS}秒, 空闲超时{settings.WS_IDLE_TIMEOUT_SECONDS}秒")
+        
         # 启动自动保存任务
         logger.info("正在启动自动保存后台任务...")
         auto_save_task = asyncio.create_task(auto_save_to_database())
         logger.info("自动保存后台任务已启动")
         
+        # 启动匹配归档任务
+        if settings.MATCH_ARCHIVE_AFTER_DAYS > 0:
+            auto_archive_task = asyncio.create_task(auto_archive_matches())
+            logger.info("匹配归档后台任务已启动")
+        
+        # 启动消息日志落库任务
+        if settings.MESSAGE_ACK_LEVEL == "accepted":
+            message_journal_task = asyncio.create_task(MessageJournal().run())
+            logger.info("消息日志落库后台任务已启动")
+        
     except Exception as e:
         logger.error(f"数据库连接或初始化失败: {str(e)}")
         raise
@@ -187,6 +243,31 @@ async def lifespan(app: FastAPI):
         except asyncio.CancelledError:
             logger.info("自动保存任务已停止")
     
+    # 取消匹配归档任务
+    if auto_archive_task and not auto_archive_task.done():
+        logger.info("正在停止匹配归档任务...")
+        auto_archive_task.cancel()
+        try:
+            await auto_archive_task
+        except asyncio.CancelledError:
+            logger.info("匹配归档任务已停止")
+    
+    # 停止WebSocket心跳任务并关闭扇出broker
+    for task in presence_tasks:
+        task.cancel()
+    await asyncio.gather(*presence_tasks, return_exceptions=True)
+    await ConnectionHandler.broker.close()
+    
+    # 停止消息日志落库任务，并写入全部未落库的消息
+    if message_journal_task and not message_journal_task.done():
+        logger.info("正在停止消息日志落库任务...")
+        message_journal_task.cancel()
+        try:
+            await message_journal_task
+        except asyncio.CancelledError:
+            logger.info("消息日志落库任务已停止")
+    await MessageJournal().drain()
+    
     # 执行最后一次保存
     logger.info("执行最后一次数据保存...")
     try:
@@ -205,9 +286,17 @@ async def lifespan(app: FastAPI):
         ai_processor = AIResponseProcessor()
         await ai_processor.save_to_database()
         logger.info("最终AI聊天数据保存完成")
+        
+        # 等待进行中的离线事件确认写入（离线事件本身已实时写入pending_events）
+        await asyncio.gather(*PendingEventQueue().background_tasks, return_exceptions=True)
+        logger.info("离线事件确认已完成")
     except Exception as e:
         logger.error(f"最终数据保存失败: {e}")
     
+    # 关闭AI请求连接池
+    await KimiInteractionAPI().close()
+    await AIProviderRouter().close()
+    
     # 断开数据库连接
     logger.info("正在关闭数据库连接...")
     await Database.close()  # 恢复数据库关闭
@@ -239,6 +328,22 @@ app = FastAPI(
     ]
 )
 
+# 日志中需要脱敏的请求头和JSON字段（token、签发密钥）
+SENSITIVE_HEADERS = {"authorization", "x-issuer-key", "cookie"}
+SENSITIVE_FIELDS = {"issuer_key", "access_token", "token"}
+
+
+def redact(data):
+    """
+    递归替换JSON数据中的敏感字段，用于日志输出
+    """
+    if isinstance(data, dict):
+        return {key: "***" if key in SENSITIVE_FIELDS else redact(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [redact(item) for item in data]
+    return data
+
+
 # 全局请求和响应日志中间件
 @app.middleware("http")
 async def log_requests_and_responses(request: Request, call_next):
@@ -264,6 +369,8 @@ async def log_requests_and_responses(request: Request, call_next):
     # 记录请求头
     logger.info(f"🔵 [{request_id}] ====== 请求头 ======")
     for header_name, header_value in request.headers.items():
+        if header_name.lower() in SENSITIVE_HEADERS:
+            header_value = "***"
         logger.info(f"🔵 [{request_id}] {header_name}: {header_value}")
     
     # 记录请求体（如果是POST/PUT/PATCH请求）
@@ -272,13 +379,15 @@ async def log_requests_and_responses(request: Request, call_next):
             body = await request.body()
             if body:
                 logger.info(f"🔵 [{request_id}] ====== 请求体 ======")
-                logger.info(f"🔵 [{request_id}] 原始数据: {body}")
                 try:
-                    # 尝试解析JSON
+                    # 尝试解析JSON（不记录原始数据，敏感字段脱敏后再输出）
                     json_body = json.loads(body)
-                    logger.info(f"🔵 [{request_id}] JSON数据: {json.dumps(json_body, indent=2, ensure_ascii=False)}")
+                    logger.info(f"🔵 [{request_id}] JSON数据: {json.dumps(redact(json_body), indent=2, ensure_ascii=False)}")
                 except json.JSONDecodeError:
-                    logger.info(f"🔵 [{request_id}] 非JSON数据: {body.decode('utf-8', errors='ignore')}")
+                    if request.url.path.endswith("/auth/token"):
+                        logger.info(f"🔵 [{request_id}] 非JSON数据: *** ({len(body)} bytes)")
+                    else:
+                        logger.info(f"🔵 [{request_id}] 非JSON数据: {body.decode('utf-8', errors='ignore')}")
             else:
                 logger.info(f"🔵 [{request_id}] ====== 请求体: 空 ======")
         except Exception as e:
@@ -304,6 +413,12 @@ async def log_requests_and_responses(request: Request, call_next):
         for header_name, header_value in response.headers.items():
             logger.info(f"🟢 [{request_id}] {header_name}: {header_value}")
         
+        # 流式响应（SSE）不读取响应体，否则要等生成结束才能发出第一个事件
+        if response.headers.get("content-type", "").startswith("text/event-stream"):
+            logger.info(f"🟢 [{request_id}] ====== 响应体: 流式响应，不记录 ======")
+            logger.info(f"🟢 [{request_id}] ====== 请求完成 ======")
+            return response
+        
         # 尝试记录响应体（如果是JSON响应）
         try:
             # 获取响应体
@@ -325,7 +440,7 @@ async def log_requests_and_responses(request: Request, call_next):
                 try:
                     # 尝试解析JSON
                     json_response = json.loads(response_body)
-                    logger.info(f"🟢 [{request_id}] JSON响应: {json.dumps(json_response, indent=2, ensure_ascii=False)}")
+                    logger.info(f"🟢 [{request_id}] JSON响应: {json.dumps(redact(json_response), indent=2, ensure_ascii=False)}")
                 except json.JSONDecodeError:
                     logger.info(f"🟢 [{request_id}] 非JSON响应: {response_body.decode('utf-8', errors='ignore')}")
             else:
@@ -406,8 +521,12 @@ if __name__ == "__main__":
         "host": "0.0.0.0",
         "port": 8000,
         "reload": False,
-        "workers": 1
+        "workers": settings.SERVER_WORKERS,
+        # 与客户端协商WebSocket permessage-deflate压缩
+        "ws_per_message_deflate": True
     }
+    if settings.SERVER_WORKERS > 1 and settings.WS_FANOUT_BROKER == "inprocess":
+        logger.warning("SERVER_WORKERS > 1 但 WS_FANOUT_BROKER 为 inprocess，跨worker的WebSocket消息将无法送达")
 
     # 本地测试配置
     # uvicorn_config = {
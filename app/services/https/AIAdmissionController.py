@@ -0,0 +1,183 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from app.config import settings
+from app.utils.my_logger import MyLogger
+
+logger = MyLogger("AIAdmissionController")
+
+
+class AIOverloadedError(Exception):
+    """
+    AI请求未被接纳（排队已满、等待超时或超出token预算）
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"AI服务繁忙（{reason}），请{retry_after:.0f}秒后重试")
+
+
+class AIAdmissionController:
+    """
+    AI服务调用的准入控制：
+    - 按用户串行：同一用户的对话轮次（读取历史、调用AI、保存）依次执行，不会基于同一份历史并发生成
+    - 全局并发上限AI_MAX_CONCURRENT_REQUESTS，以及每分钟token预算AI_TOKENS_PER_MINUTE（按请求的估算token数预留）
+    - 先到先得的有界队列：最多AI_MAX_QUEUE_DEPTH个请求排队，最多等待AI_QUEUE_TIMEOUT_SECONDS秒，
+      超出时抛出AIOverloadedError，而不是让请求堆积后在服务商处触发限流和重试风暴
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.in_flight = 0
+            cls._instance.waiters = deque()  # 排队中的请求，队首优先
+            cls._instance.condition = None  # asyncio.Condition，第一次使用时在当前事件循环中创建
+            cls._instance.condition_loop = None
+            cls._instance.tokens = float(settings.AI_TOKENS_PER_MINUTE)
+            cls._instance.tokens_updated_at = None
+            cls._instance.user_locks = {}  # {user_id: [asyncio.Lock, 引用数]}
+            cls._instance.stats = cls._empty_stats()
+        return cls._instance
+
+    @staticmethod
+    def _empty_stats() -> dict:
+        return {
+            "admitted": 0,
+            "rejected": {"queue_full": 0, "timeout": 0, "token_budget": 0, "user_busy": 0},
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0
+        }
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self.condition is None or self.condition_loop is not loop:
+            self.condition = asyncio.Condition()
+            self.condition_loop = loop
+        return self.condition
+
+    def _refill_tokens(self, now: float):
+        capacity = float(settings.AI_TOKENS_PER_MINUTE)
+        if self.tokens_updated_at is not None:
+            self.tokens = min(capacity, self.tokens + (now - self.tokens_updated_at) * capacity / 60)
+        self.tokens_updated_at = now
+
+    def _token_delay(self, tokens: float, now: float) -> float:
+        """
+        预留tokens个token还需要等待的秒数，0表示现在就可以
+        """
+        self._refill_tokens(now)
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) * 60 / settings.AI_TOKENS_PER_MINUTE
+
+    def _reject(self, reason: str, retry_after: float):
+        self.stats["rejected"][reason] += 1
+        logger.warning(f"拒绝AI请求: {reason}, 并发 {self.in_flight}, 排队 {len(self.waiters)}")
+        raise AIOverloadedError(reason, max(1.0, retry_after))
+
+    def _record_wait(self, waited: float):
+        self.stats["admitted"] += 1
+        self.stats["total_wait_seconds"] += waited
+        self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+
+    @asynccontextmanager
+    async def admit(self, estimated_tokens: int):
+        """
+        获取一次AI服务调用的许可（async with），退出时释放并发名额
+
+        Args:
+            estimated_tokens: 请求的估算token数（提示词 + 最大回复长度），超过每分钟预算时按预算计
+        """
+        condition = self._get_condition()
+        loop = asyncio.get_running_loop()
+        tokens = min(float(estimated_tokens), float(settings.AI_TOKENS_PER_MINUTE))
+        if len(self.waiters) >= settings.AI_MAX_QUEUE_DEPTH:
+            self._reject("queue_full", settings.AI_QUEUE_TIMEOUT_SECONDS)
+
+        start = loop.time()
+        deadline = start + settings.AI_QUEUE_TIMEOUT_SECONDS
+        waiter = object()
+        self.waiters.append(waiter)
+        try:
+            async with condition:
+                while True:
+                    now = loop.time()
+                    timeout = deadline - now
+                    if self.waiters[0] is waiter and self.in_flight < settings.AI_MAX_CONCURRENT_REQUESTS:
+                        delay = self._token_delay(tokens, now)
+                        if delay == 0:
+                            break
+                        # 等到预算补足也会超时的请求直接拒绝
+                        if delay > timeout:
+                            self._reject("token_budget", delay)
+                        timeout = delay
+                    elif timeout <= 0:
+                        self._reject("timeout", settings.AI_QUEUE_TIMEOUT_SECONDS)
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                self.tokens -= tokens
+                self.in_flight += 1
+        finally:
+            self.waiters.remove(waiter)
+            # 队首变化，唤醒其他等待者重新检查
+            async with condition:
+                condition.notify_all()
+        self._record_wait(loop.time() - start)
+
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            async with condition:
+                condition.notify_all()
+
+    @asynccontextmanager
+    async def user_turn(self, user_id: int):
+        """
+        串行执行同一用户的对话轮次（async with），最多等待AI_QUEUE_TIMEOUT_SECONDS秒
+        """
+        entry = self.user_locks.get(user_id)
+        if entry is None:
+            entry = self.user_locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            try:
+                await asyncio.wait_for(entry[0].acquire(), settings.AI_QUEUE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                self._reject("user_busy", settings.AI_QUEUE_TIMEOUT_SECONDS)
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self.user_locks.pop(user_id, None)
+
+    def get_stats(self) -> dict:
+        """
+        当前并发数、队列深度、等待时间和拒绝次数
+        """
+        admitted = self.stats["admitted"]
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": settings.AI_MAX_CONCURRENT_REQUESTS,
+            "queue_depth": len(self.waiters),
+            "users_waiting": sum(1 for _, count in self.user_locks.values() if count > 1),
+            "tokens_available": int(self.tokens),
+            "tokens_per_minute": settings.AI_TOKENS_PER_MINUTE,
+            "admitted": admitted,
+            "rejected": dict(self.stats["rejected"]),
+            "avg_wait_seconds": round(self.stats["total_wait_seconds"] / admitted, 3) if admitted else 0.0,
+            "max_wait_seconds": round(self.stats["max_wait_seconds"], 3)
+        }
+
+    def reset_stats(self):
+        """
+        清零累计的统计数据
+        """
+        self.stats = self._empty_stats()
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from collections import deque
+from typing import List, Optional
+from app.config import settings
+from app.services.https.AIProviders import AIProvider, AIProviderError, backoff_delay, build_provider
+from app.utils.my_logger import MyLogger
+
+logger = MyLogger("AIProviderRouter")
+
+
+class ProviderStats:
+    """
+    单个服务商最近AI_PROVIDER_STATS_WINDOW次调用的延迟和成功率
+    """
+    __slots__ = ("samples", "hedges", "wins")
+
+    def __init__(self):
+        self.samples = deque(maxlen=settings.AI_PROVIDER_STATS_WINDOW)  # (延迟秒数, 是否成功)
+        self.hedges = 0  # 作为对冲请求被发出的次数
+        self.wins = 0  # 对冲时先返回结果的次数
+
+    def record(self, latency: float, ok: bool):
+        self.samples.append((latency, ok))
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        成功调用延迟的百分位数（最近邻），样本不足AI_PROVIDER_MIN_SAMPLES时返回None
+        """
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if len(latencies) < settings.AI_PROVIDER_MIN_SAMPLES:
+            return None
+        index = min(len(latencies) - 1, max(0, int(len(latencies) * percent / 100 + 0.5) - 1))
+        return latencies[index]
+
+    def error_rate(self) -> float:
+        if len(self.samples) < settings.AI_PROVIDER_MIN_SAMPLES:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def describe(self) -> dict:
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "samples": len(self.samples),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(self.error_rate(), 3),
+            "hedges": self.hedges,
+            "hedge_wins": self.wins
+        }
+
+
+class AIProviderRouter:
+    """
+    AI服务商路由：
+    - 按最近的错误率和p50延迟排序服务商（错误率超过AI_PROVIDER_MAX_ERROR_RATE的排在最后），优先使用最快的健康服务商
+    - 调用失败时自动切换到下一个服务商；只配置了一个服务商时没有切换目标，
+      改为在同一个服务商上最多尝试AI_MAX_RETRIES次（带随机抖动的指数退避，429以外的4xx不重试）
+    - 开启AI_HEDGE_ENABLED时，首选服务商超过其AI_HEDGE_PERCENTILE分位延迟仍未返回，
+      向下一个服务商发出一次对冲请求，采用先返回的结果并取消另一个
+    服务商列表来自AI_PROVIDERS（逗号分隔），为空时只使用CURRENT_AI_SERVICE
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            names = settings.AI_PROVIDERS or settings.CURRENT_AI_SERVICE
+            providers = [build_provider(name) for name in names.split(",") if name.strip()]
+            cls._instance.set_providers([provider for provider in providers if provider is not None])
+        return cls._instance
+
+    def set_providers(self, providers: List[AIProvider]):
+        """
+        替换服务商列表（按优先顺序），并清空统计数据
+        """
+        self.providers = list(providers)
+        self.stats = {provider.name: ProviderStats() for provider in self.providers}
+
+    def ranked_providers(self) -> List[AIProvider]:
+        """
+        按(是否不健康, p50延迟)排序；没有足够样本的服务商延迟按0计，保持配置顺序
+        """
+        def sort_key(item):
+            index, provider = item
+            stats = self.stats[provider.name]
+            unhealthy = stats.error_rate() > settings.AI_PROVIDER_MAX_ERROR_RATE
+            return (unhealthy, stats.percentile(50) or 0.0, index)
+        return [provider for _, provider in sorted(enumerate(self.providers), key=sort_key)]
+
+    async def _timed_call(self, provider: AIProvider, request_data: dict, user_id: int) -> dict:
+        start = time.monotonic()
+        try:
+            result = await provider.complete(request_data, user_id)
+        except asyncio.CancelledError:
+            raise
+        except AIProviderError:
+            self.stats[provider.name].record(time.monotonic() - start, False)
+            raise
+        except Exception as e:
+            self.stats[provider.name].record(time.monotonic() - start, False)
+            raise AIProviderError(str(e)) from e
+        self.stats[provider.name].record(time.monotonic() - start, True)
+        return result
+
+    async def complete(self, request_data: dict, user_id: int) -> dict:
+        """
+        通过最合适的服务商发送请求，失败时切换服务商，必要时发出对冲请求
+
+        Raises:
+            AIProviderError: 所有服务商都失败
+        """
+        ranked = self.ranked_providers()
+        if not ranked:
+            raise AIProviderError("没有可用的AI服务商")
+        if len(ranked) == 1:
+            return await self._complete_with_retries(ranked[0], request_data, user_id)
+
+        pending = {}  # {task: provider}
+        next_index = 0
+        hedged = False
+        last_error = None
+
+        def launch():
+            nonlocal next_index
+            provider = ranked[next_index]
+            next_index += 1
+            task = asyncio.ensure_future(self._timed_call(provider, request_data, user_id))
+            pending[task] = provider
+            return provider
+
+        launch()
+        try:
+            while pending:
+                hedge_delay = None
+                if settings.AI_HEDGE_ENABLED and not hedged and len(pending) == 1 and next_index < len(ranked):
+                    primary = next(iter(pending.values()))
+                    hedge_delay = self.stats[primary.name].percentile(settings.AI_HEDGE_PERCENTILE)
+
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    provider = launch()
+                    self.stats[provider.name].hedges += 1
+                    logger.info(f"[{user_id}] 首选服务商超过p{settings.AI_HEDGE_PERCENTILE}延迟 {hedge_delay:.2f}秒，对冲请求发往 {provider.name}")
+                    continue
+
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except AIProviderError as e:
+                        last_error = e
+                        logger.warning(f"[{user_id}] AI服务商 {provider.name} 调用失败: {e}")
+                        continue
+                    if hedged:
+                        self.stats[provider.name].wins += 1
+                    return result
+
+                # 全部失败时切换到下一个服务商
+                if not pending and next_index < len(ranked):
+                    provider = launch()
+                    logger.warning(f"[{user_id}] 切换到AI服务商 {provider.name}")
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise AIProviderError(f"所有AI服务商调用失败: {last_error}")
+
+    async def _complete_with_retries(self, provider: AIProvider, request_data: dict, user_id: int) -> dict:
+        """
+        唯一的服务商：失败后退避重试，短暂的429/503不会直接变成备用回复
+        """
+        for attempt in range(1, settings.AI_MAX_RETRIES + 1):
+            try:
+                return await self._timed_call(provider, request_data, user_id)
+            except AIProviderError as e:
+                if not e.retryable or attempt >= settings.AI_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt, e.retry_after)
+                logger.warning(f"[{user_id}] AI服务商 {provider.name} 调用失败 (尝试 {attempt}/{settings.AI_MAX_RETRIES}): {e}，{delay:.2f}秒后重试")
+                await asyncio.sleep(delay)
+
+    def get_stats(self) -> dict:
+        """
+        各服务商的延迟分位数、错误率和对冲次数（按当前优先顺序）
+        """
+        return {provider.name: self.stats[provider.name].describe() for provider in self.ranked_providers()}
+
+    async def close(self):
+        """
+        关闭所有服务商的连接池（服务关闭时调用）
+        """
+        for provider in self.providers:
+            await provider.close()
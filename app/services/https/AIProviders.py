@@ -0,0 +1,257 @@
+"""
+AI服务商的统一封装
+所有服务商接收OpenAI兼容格式的请求数据（model、messages、temperature等），
+返回OpenAI兼容格式的响应（choices[0].message.content），由AIProviderRouter选择和切换
+"""
+
+import asyncio
+import random
+from abc import ABC, abstractmethod
+import httpx
+from typing import Optional
+from app.config import settings
+from app.utils.my_logger import MyLogger
+
+logger = MyLogger("AIProviders")
+
+
+class AIProviderError(Exception):
+    """
+    服务商调用失败（网络错误、超时、非200响应或响应格式错误）
+    retryable为False表示请求本身有问题（429以外的4xx），重试没有意义；retry_after为服务端给出的Retry-After
+    """
+
+    def __init__(self, message: str, retryable: bool = True, retry_after: Optional[str] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    第attempt次失败后的等待时间：服务端给出Retry-After时遵循它，
+    否则在[0, min(上限, 基数 * 2^(attempt-1))]中随机取值（full jitter），避免大量请求同时重试
+    """
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), settings.AI_RETRY_MAX_DELAY_SECONDS)
+        except ValueError:
+            pass
+    ceiling = min(settings.AI_RETRY_MAX_DELAY_SECONDS, settings.AI_RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+def completion_response(content: str) -> dict:
+    """
+    构建OpenAI兼容格式的响应
+    """
+    return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+class AIProvider(ABC):
+    """
+    AI服务商基类
+    """
+    name = "base"
+
+    @abstractmethod
+    async def complete(self, request_data: dict, user_id: int) -> dict:
+        """
+        发送一次非流式请求
+
+        Args:
+            request_data: OpenAI兼容格式的请求数据
+            user_id: 用户ID（用于日志）
+
+        Returns:
+            dict: OpenAI兼容格式的响应
+
+        Raises:
+            AIProviderError: 调用失败
+        """
+
+    async def close(self):
+        """
+        释放连接池
+        """
+
+
+class HTTPProvider(AIProvider):
+    """
+    通过HTTP调用的服务商基类：每个服务商一个httpx.AsyncClient连接池，每次调用只尝试一次
+    （失败后由路由器切换到其他服务商；只配置了一个服务商时由路由器退避重试）
+    """
+
+    def __init__(self, api_url: str, api_key: str, model_name: str):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model_name = model_name
+        self.client = None  # 第一次请求时创建
+        self.transport = None  # 可替换的httpx传输层（测试时使用httpx.MockTransport）
+
+    def _headers(self) -> dict:
+        return {"Content-Type": "application/json"}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                headers=self._headers(),
+                timeout=httpx.Timeout(settings.AI_REQUEST_TIMEOUT_SECONDS, connect=settings.AI_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(
+                    max_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.AI_HTTP_MAX_CONNECTIONS
+                ),
+                transport=self.transport
+            )
+        return self.client
+
+    async def _post(self, payload: dict, user_id: int) -> dict:
+        try:
+            response = await asyncio.wait_for(
+                self._get_client().post(self.api_url, json=payload),
+                timeout=settings.AI_REQUEST_TIMEOUT_SECONDS
+            )
+        except (httpx.TransportError, asyncio.TimeoutError) as e:
+            raise AIProviderError(f"{self.name} {type(e).__name__}: {e}") from e
+        if response.status_code != 200:
+            raise AIProviderError(
+                f"{self.name} 状态码 {response.status_code}: {response.text[:200]}",
+                retryable=response.status_code == 429 or response.status_code >= 500,
+                retry_after=response.headers.get("Retry-After")
+            )
+        return response.json()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+class KimiProvider(HTTPProvider):
+    """
+    Kimi（moonshot），复用KimiInteractionAPI的连接池（流式请求也使用它），
+    与其他服务商一样每次调用只尝试一次（重试由路由器决定，KimiInteractionAPI自己的重试只用于不经过路由器的流式请求）
+    """
+    name = "kimi"
+
+    def __init__(self):
+        super().__init__(settings.KIMI_API_URL, settings.KIMI_API_KEY, settings.KIMI_MODEL_NAME)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        from app.services.https.KimiInteractionAPI import KimiInteractionAPI
+        return KimiInteractionAPI()._get_client()
+
+    async def complete(self, request_data: dict, user_id: int) -> dict:
+        response_json = await self._post(request_data, user_id)
+        if not response_json.get("choices"):
+            raise AIProviderError("kimi 响应格式错误：缺少choices")
+        return response_json
+
+    async def close(self):
+        """
+        连接池由KimiInteractionAPI关闭
+        """
+
+
+class OpenAICompatibleProvider(HTTPProvider):
+    """
+    OpenAI兼容接口的服务商（豆包等），只替换请求中的模型名称
+    """
+
+    def __init__(self, name: str, api_url: str, api_key: str, model_name: str):
+        super().__init__(api_url, api_key, model_name)
+        self.name = name
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    async def complete(self, request_data: dict, user_id: int) -> dict:
+        response_json = await self._post({**request_data, "model": self.model_name}, user_id)
+        if not response_json.get("choices"):
+            raise AIProviderError(f"{self.name} 响应格式错误：缺少choices")
+        return response_json
+
+
+class GeminiProvider(HTTPProvider):
+    """
+    Gemini generateContent接口：请求和响应在OpenAI兼容格式之间转换
+    """
+    name = "gemini"
+
+    def _headers(self) -> dict:
+        return {"x-goog-api-key": self.api_key, "Content-Type": "application/json"}
+
+    @staticmethod
+    def _to_gemini(request_data: dict) -> dict:
+        system_parts = []
+        contents = []
+        for message in request_data["messages"]:
+            if message["role"] == "system":
+                system_parts.append({"text": message["content"]})
+            else:
+                role = "model" if message["role"] == "assistant" else "user"
+                contents.append({"role": role, "parts": [{"text": message["content"]}]})
+        payload = {
+            "contents": contents,
+            "generationConfig": {
+                key: request_data[source]
+                for key, source in (("temperature", "temperature"), ("topP", "top_p"), ("maxOutputTokens", "max_tokens"))
+                if request_data.get(source) is not None
+            }
+        }
+        if system_parts:
+            payload["systemInstruction"] = {"parts": system_parts}
+        return payload
+
+    async def complete(self, request_data: dict, user_id: int) -> dict:
+        response_json = await self._post(self._to_gemini(request_data), user_id)
+        try:
+            parts = response_json["candidates"][0]["content"]["parts"]
+        except (KeyError, IndexError, TypeError) as e:
+            raise AIProviderError("gemini 响应格式错误：缺少candidates") from e
+        return completion_response("".join(part.get("text", "") for part in parts))
+
+
+class StubProvider(AIProvider):
+    """
+    本地模拟服务商（测试和本地开发使用，不访问网络）
+
+    Args:
+        name: 服务商名称
+        reply: 固定回复内容
+        latency: 每次调用的延迟（秒），也可以是返回延迟的函数
+        failure_rate: 调用失败的概率
+    """
+
+    def __init__(self, name: str = "stub", reply: str = "这是本地模拟服务商的回复。", latency=0.0, failure_rate: float = 0.0):
+        self.name = name
+        self.reply = reply
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+
+    async def complete(self, request_data: dict, user_id: int) -> dict:
+        self.calls += 1
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise AIProviderError(f"{self.name} 模拟失败")
+        return completion_response(self.reply)
+
+
+def build_provider(name: str) -> Optional[AIProvider]:
+    """
+    根据名称和配置创建服务商，未知名称返回None
+    """
+    name = name.strip().lower()
+    if name == "kimi":
+        return KimiProvider()
+    if name == "doubao":
+        return OpenAICompatibleProvider("doubao", settings.DOUBAO_API_URL, settings.DOUBAO_API_KEY, settings.DOUBAO_MODEL_NAME)
+    if name == "gemini":
+        return GeminiProvider(settings.GEMINI_API_URL, settings.GEMINI_API_KEY, settings.GEMINI_MODEL_NAME)
+    if name == "stub":
+        return StubProvider()
+    logger.error(f"未知的AI服务商: {name}")
+    return None
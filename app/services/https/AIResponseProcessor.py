@@ -1,11 +1,24 @@
 from typing import List, Tuple, Optional, Dict
+from collections import OrderedDict, deque
+from contextlib import aclosing
 from datetime import datetime
+import asyncio
 import logging
+from app.config import settings
 from app.core.database import Database
+from app.services.https.KimiInteractionAPI import KimiInteractionAPI
+from app.services.https.AIAdmissionController import AIAdmissionController, AIOverloadedError
+from app.utils.context_builder import context_builder
 from app.utils.my_logger import MyLogger
+from app.utils.summary_detector import is_conversation_end, split_profile_summary
 
 logger = MyLogger("AIResponseProcessor")
 
+# 分桶存储：每个用户的对话按顺序存放在若干个桶文档中，每个桶最多AI_HISTORY_BUCKET_SIZE条消息
+# {"_id": "<user_id>:<bucket>", "user_id": int, "bucket": int, "messages": [消息详情], "last_message_id": int,
+#  "message_count": int}  message_count是截至本桶末尾已保存的消息总条数，不依赖桶大小设置
+BUCKET_COLLECTION = "AI_message_bucket"
+
 class AIResponseProcessor:
     """AI响应处理器类 - 单例模式"""
     
@@ -15,8 +28,14 @@ class AIResponseProcessor:
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance.ai_chatrooms = {}  # user_id -> ai_message_id列表
-            cls._instance.ai_messages = {}  # ai_message_id -> 消息详情
+            # user_id -> 最近的消息详情（按时间顺序追加，最多AI_HISTORY_MAX_MESSAGES条），按最近使用排序，
+            # 只保留最多AI_HISTORY_MAX_ACTIVE_USERS个用户，其余用户需要时从数据库加载
+            cls._instance.ai_histories = OrderedDict()
+            cls._instance.history_loads = {}  # user_id -> 正在从数据库加载历史的task（同一用户只加载一次）
+            # user_id -> 数据库分桶的写入位置（内存中的用户）：{"bucket": 最后一个桶, "filled": 桶内条数, "total": 已保存的总条数}
+            cls._instance.history_counts = {}
+            cls._instance.unsaved_messages = {}  # user_id -> 尚未写入数据库的消息（按顺序），有未保存消息的用户不会被换出
+            cls._instance.append_locks = {}  # user_id -> asyncio.Lock，同一用户的分桶写入串行执行
             cls._instance.ai_user_id = 999  # AI固定用户ID
             cls._instance.message_counter = 0  # 消息ID计数器
         return cls._instance
@@ -29,11 +48,16 @@ class AIResponseProcessor:
             return
             
         try:
-            # 查找数据库中最大的_id（ai_message_id存储在_id字段中）
+            # 查找分桶中最大的消息ID，以及旧格式AI_message中最大的_id（ai_message_id存储在_id字段中）
+            buckets = await Database.find(BUCKET_COLLECTION, sort=[("last_message_id", -1)], limit=1)
             messages = await Database.find("AI_message", sort=[("_id", -1)], limit=1)
             
+            max_ids = [buckets[0]["last_message_id"]] if buckets else []
             if messages:
-                max_id = messages[0]["_id"]
+                max_ids.append(messages[0]["_id"])
+            
+            if max_ids:
+                max_id = max(max_ids)
                 self.message_counter = max_id
                 logger.info(f"AI消息计数器从数据库初始化: 从 {max_id} 开始")
             else:
@@ -51,48 +75,226 @@ class AIResponseProcessor:
             logger.warning(f"使用时间戳作为AI消息计数器起始点: {self.message_counter}")
     
     async def initialize_from_database(self):
-        """从数据库初始化AI聊天缓存 [内部方法，非API调用]"""
+        """
+        初始化AI聊天缓存 [内部方法，非API调用]
+        启动时创建分桶索引、把旧格式的对话迁移为分桶文档并初始化消息计数器，
+        用户的对话历史在第一次使用时从数据库加载
+        """
         if AIResponseProcessor._initialized:
             return
         
         try:
-            # 首先初始化计数器
-            await self.initialize_counter()
-            
-            logger.info("AIResponseProcessor: 开始从数据库加载AI聊天数据到内存")
-            
-            # 加载AI_chatroom数据
-            chatrooms_data = await Database.find("AI_chatroom", {})
-            loaded_chatrooms = 0
-            
-            for chatroom_data in chatrooms_data:
-                user_id = chatroom_data.get("user_id")
-                ai_message_ids = chatroom_data.get("ai_message_ids", [])
-                if user_id:
-                    self.ai_chatrooms[user_id] = ai_message_ids
-                    loaded_chatrooms += 1
-            
-            # 加载AI_message数据
-            messages_data = await Database.find("AI_message", {})
-            loaded_messages = 0
-            
-            for message_data in messages_data:
-                message_id = message_data.get("ai_message_id")
-                if message_id:
-                    self.ai_messages[message_id] = message_data
-                    loaded_messages += 1
-            
-            AIResponseProcessor._initialized = True
+            # 按(user_id, bucket)读取最近的桶，按last_message_id初始化计数器
+            await Database.create_index(BUCKET_COLLECTION, [("user_id", 1), ("bucket", -1)])
+            await Database.create_index(BUCKET_COLLECTION, [("last_message_id", -1)])
+            await self.migrate_legacy_history()
+        except Exception as e:
+            logger.error(f"AIResponseProcessor: 初始化AI对话分桶失败: {e}")
+        
+        await self.initialize_counter()
+        logger.info("AIResponseProcessor: AI对话历史将在用户第一次使用时从数据库加载")
+    
+    async def get_history_version(self, user_id: int) -> int:
+        """
+        用户AI对话历史的版本（最后一条消息的ID，ID递增），每次保存对话后变化，用于幂等结果缓存
+        历史已被换出时从数据库重新加载，版本与换出前一致（否则换出后的重试会错过缓存并重复调用AI）
+        """
+        history = await self._get_history_buffer(user_id)
+        return history[-1]["ai_message_id"] if history else 0
+    
+    async def _get_history_buffer(self, user_id: int) -> deque:
+        """
+        获取用户的历史缓冲区并标记为最近使用，不在内存中时从数据库加载（并发的加载合并为一次）
+        """
+        history = self.ai_histories.get(user_id)
+        if history is not None:
+            self.ai_histories.move_to_end(user_id)
+            return history
+        
+        task = self.history_loads.get(user_id)
+        if task is None:
+            task = self.history_loads[user_id] = asyncio.ensure_future(self._load_history(user_id))
+        return await asyncio.shield(task)
+    
+    async def _load_history(self, user_id: int) -> deque:
+        """
+        从数据库加载用户最近的AI_HISTORY_MAX_MESSAGES条消息放入内存，并换出最久未使用的用户
+        数据库读取失败时从空历史开始（已保存的消息仍在数据库中，换出后重新加载时恢复）
+        """
+        try:
+            messages = await self._fetch_history(user_id)
+            logger.info(f"[{user_id}] 从数据库加载了 {len(messages)} 条AI对话历史")
+        except Exception as e:
+            logger.error(f"[{user_id}] 从数据库加载AI对话历史失败: {e}")
+            messages = []
+        finally:
+            self.history_loads.pop(user_id, None)
+        
+        history = self.ai_histories[user_id] = deque(messages, maxlen=settings.AI_HISTORY_MAX_MESSAGES)
+        context_builder.forget(user_id)  # 历史重新加载，旧的滚动摘要不再可靠
+        self._evict_inactive_users()
+        return history
+    
+    async def _fetch_history(self, user_id: int) -> List[dict]:
+        """
+        从数据库读取用户最近的AI_HISTORY_MAX_MESSAGES条消息（按时间顺序）
+        只读取最后几个桶（桶大小不小于AI_HISTORY_MAX_MESSAGES时一次查询最多两个桶）；
+        用户还没有分桶文档时先迁移旧格式的对话
+        """
+        buckets = await self._find_recent_buckets(user_id)
+        if not buckets and await self._migrate_user_history(await Database.find_one("AI_chatroom", {"user_id": user_id})):
+            buckets = await self._find_recent_buckets(user_id)
+        
+        buckets.reverse()
+        self.history_counts[user_id] = self._bucket_position(buckets[-1] if buckets else None)
+        # 桶和桶内的消息都按追加顺序排列，不需要再按时间排序
+        messages = [message for bucket in buckets for message in bucket["messages"]]
+        return messages[-settings.AI_HISTORY_MAX_MESSAGES:]
+    
+    async def _find_recent_buckets(self, user_id: int) -> List[dict]:
+        """
+        读取用户最近的桶（按bucket倒序），数量足够覆盖AI_HISTORY_MAX_MESSAGES条消息
+        """
+        limit = -(-settings.AI_HISTORY_MAX_MESSAGES // settings.AI_HISTORY_BUCKET_SIZE) + 1
+        return await Database.find(BUCKET_COLLECTION, {"user_id": user_id}, sort=[("bucket", -1)], limit=limit)
+    
+    @staticmethod
+    def _bucket_position(last_bucket: Optional[dict]) -> dict:
+        """
+        根据用户最后一个桶文档得到写入位置
+        旧的桶文档没有message_count，按之前的桶都已写满估算总条数
+        """
+        if last_bucket is None:
+            return {"bucket": 0, "filled": 0, "total": 0}
+        filled = len(last_bucket["messages"])
+        total = last_bucket.get("message_count", last_bucket["bucket"] * settings.AI_HISTORY_BUCKET_SIZE + filled)
+        return {"bucket": last_bucket["bucket"], "filled": filled, "total": total}
+    
+    async def _append_to_buckets(self, user_id: int, messages: List[dict]):
+        """
+        按顺序把消息追加到用户的分桶文档（每个桶一次$push），写满后写入下一个桶，并更新桶中的message_count
+        消息先放入未保存列表，写入成功的部分从列表中移除；写入失败时抛出异常，未保存的消息由下一次追加或save_to_database补写
+        """
+        self.unsaved_messages.setdefault(user_id, []).extend(messages)
+        # 读取条数、写入和移除已保存消息之间会等待数据库，同一用户的并发追加必须串行，否则会写入同一个桶的同一位置
+        async with self.append_locks.setdefault(user_id, asyncio.Lock()):
+            # 等待期间前一次追加可能已经写入了这些消息
+            pending = self.unsaved_messages.get(user_id)
+            if not pending:
+                return
+            if user_id not in self.history_counts:
+                # 历史加载失败时还不知道已保存的条数，先读取最后一个桶
+                last_buckets = await Database.find(BUCKET_COLLECTION, {"user_id": user_id}, sort=[("bucket", -1)], limit=1)
+                self.history_counts[user_id] = self._bucket_position(last_buckets[0] if last_buckets else None)
             
-            logger.info(f"AIResponseProcessor: 成功从数据库加载 {loaded_chatrooms} 个AI聊天室，{loaded_messages} 条消息到内存")
-            logger.info(f"AIResponseProcessor: 当前内存中有 {len(self.ai_chatrooms)} 个聊天室，{len(self.ai_messages)} 条消息")
+            position = self.history_counts[user_id]
+            while pending:
+                bucket, filled = position["bucket"], position["filled"]
+                if filled >= settings.AI_HISTORY_BUCKET_SIZE:
+                    bucket, filled = bucket + 1, 0
+                chunk = pending[:settings.AI_HISTORY_BUCKET_SIZE - filled]
+                total = position["total"] + len(chunk)
+                await Database.update_one(
+                    BUCKET_COLLECTION,
+                    {"_id": f"{user_id}:{bucket}"},
+                    {
+                        "$push": {"messages": {"$each": chunk}},
+                        "$max": {"last_message_id": chunk[-1]["ai_message_id"], "message_count": total},
+                        "$setOnInsert": {"user_id": user_id, "bucket": bucket}
+                    },
+                    upsert=True
+                )
+                position.update(bucket=bucket, filled=filled + len(chunk), total=total)
+                del pending[:len(chunk)]
+            self.unsaved_messages.pop(user_id, None)
+    
+    async def migrate_legacy_history(self, batch_size: int = 100) -> int:
+        """
+        把旧格式的对话（AI_chatroom的ai_message_ids + 每条消息一个AI_message文档）迁移为分桶文档
+        按批处理：每批读取batch_size个未迁移的聊天室和它们的消息，内存占用与总数据量无关；
+        迁移完成的聊天室标记为bucketed，可以重复执行（已写入的桶不会重复写入）
+        
+        Returns:
+            int: 本次迁移的聊天室数量
+        """
+        migrated_count = 0
+        failed_user_ids = []
+        while True:
+            chatrooms = await Database.find(
+                "AI_chatroom", {"bucketed": {"$ne": True}, "user_id": {"$nin": failed_user_ids}}, limit=batch_size
+            )
+            if not chatrooms:
+                break
             
-        except Exception as e:
-            logger.error(f"AIResponseProcessor: 从数据库加载AI聊天数据失败: {str(e)}")
+            message_ids = [message_id for chatroom in chatrooms for message_id in chatroom.get("ai_message_ids", [])]
+            messages = await Database.find("AI_message", {"_id": {"$in": message_ids}}) if message_ids else []
+            messages_by_id = {message["ai_message_id"]: message for message in messages}
+            for chatroom in chatrooms:
+                try:
+                    await self._migrate_user_history(chatroom, messages_by_id)
+                    migrated_count += 1
+                except Exception as e:
+                    failed_user_ids.append(chatroom.get("user_id"))
+                    logger.error(f"迁移用户 {chatroom.get('user_id')} 的AI对话失败: {e}")
+        
+        if migrated_count or failed_user_ids:
+            logger.info(f"AI对话迁移为分桶文档: 成功 {migrated_count} 个聊天室, 失败 {len(failed_user_ids)} 个")
+        return migrated_count
+    
+    async def _migrate_user_history(self, chatroom: Optional[dict], messages_by_id: Optional[Dict[int, dict]] = None) -> bool:
+        """
+        把一个旧格式聊天室的消息按ai_message_ids的顺序写入分桶文档，并标记聊天室已迁移
+        messages_by_id为None时从AI_message读取该聊天室的消息
+        
+        Returns:
+            bool: 是否写入了消息
+        """
+        if chatroom is None or chatroom.get("bucketed"):
+            return False
+        user_id = chatroom["user_id"]
+        message_ids = chatroom.get("ai_message_ids", [])
+        if messages_by_id is None:
+            messages = await Database.find("AI_message", {"_id": {"$in": message_ids}}) if message_ids else []
+            messages_by_id = {message["ai_message_id"]: message for message in messages}
+        
+        messages = [
+            {key: value for key, value in messages_by_id[message_id].items() if key != "_id"}
+            for message_id in message_ids if message_id in messages_by_id
+        ]
+        size = settings.AI_HISTORY_BUCKET_SIZE
+        for bucket, start in enumerate(range(0, len(messages), size)):
+            chunk = messages[start:start + size]
+            # 桶已存在（之前的迁移中断后重新执行）时不做修改
+            await Database.update_one(
+                BUCKET_COLLECTION,
+                {"_id": f"{user_id}:{bucket}"},
+                {"$setOnInsert": {
+                    "user_id": user_id, "bucket": bucket, "messages": chunk,
+                    "last_message_id": chunk[-1]["ai_message_id"], "message_count": start + len(chunk)
+                }},
+                upsert=True
+            )
+        await Database.update_one("AI_chatroom", {"user_id": user_id}, {"$set": {"bucketed": True}})
+        return bool(messages)
+    
+    def _evict_inactive_users(self):
+        """
+        内存中的用户超过AI_HISTORY_MAX_ACTIVE_USERS时，换出最久未使用且没有未保存消息的用户
+        """
+        while len(self.ai_histories) > settings.AI_HISTORY_MAX_ACTIVE_USERS:
+            victim = next((user_id for user_id in self.ai_histories if user_id not in self.unsaved_messages), None)
+            if victim is None:
+                break
+            del self.ai_histories[victim]
+            self.history_counts.pop(victim, None)
+            if victim in self.append_locks and not self.append_locks[victim].locked():
+                del self.append_locks[victim]
+            context_builder.forget(victim)
+            logger.debug(f"[{victim}] AI对话历史已换出内存")
     
     async def get_conversation_history(self, user_id: int) -> List[Tuple[str, str, int, str]]:
         """
-        获取对话历史记录 - 从内存中获取
+        获取对话历史记录 - 从内存中获取（最近AI_HISTORY_MAX_MESSAGES条）
         
         Args:
             user_id: 用户ID
@@ -103,26 +305,13 @@ class AIResponseProcessor:
         """
         logger.info(f"[{user_id}] 开始从内存中获取对话历史")
         try:
-            # 1. 从内存中获取用户的AI聊天室数据
-            if user_id not in self.ai_chatrooms:
-                logger.info(f"[{user_id}] 用户 {user_id} 在内存中没有AI聊天记录")
-                return []
-            
-            ai_message_ids = self.ai_chatrooms[user_id]
-            if not ai_message_ids:
-                logger.info(f"[{user_id}] 用户 {user_id} 在内存中的AI聊天记录为空")
+            # 1. 获取用户的历史缓冲区（不在内存中时从数据库加载）
+            messages = await self._get_history_buffer(user_id)
+            if not messages:
+                logger.info(f"[{user_id}] 用户 {user_id} 没有AI聊天记录")
                 return []
             
-            # 2. 从内存中获取消息详情
-            messages = []
-            for message_id in ai_message_ids:
-                if message_id in self.ai_messages:
-                    messages.append(self.ai_messages[message_id])
-            
-            # 3. 按时间排序
-            messages.sort(key=lambda x: x.get("ai_message_send_time_in_utc", datetime.min))
-            
-            # 4. 格式化为前端需要的格式
+            # 2. 格式化为前端需要的格式（缓冲区按时间顺序追加，不需要排序）
             history = []
             for message in messages:
                 content = message.get("ai_message_content", "")
@@ -152,7 +341,24 @@ class AIResponseProcessor:
             logger.error(f"从内存获取用户 {user_id} 的AI聊天历史失败: {str(e)}")
             return []
     
-    async def save_conversation_history(self, user_id: int, message: str, response: str) -> bool:
+    async def stream_chat(self, user_id: int, message: str, gender: str = "neutral"):
+        """
+        流式AI聊天（HTTP的SSE接口和WebSocket共用）
+        转发KimiInteractionAPI.stream_message_to_ai的事件，流结束且成功时先保存对话记录再产出done事件
+        同一用户的对话轮次串行执行，等待超时时产出error事件
+        """
+        try:
+            async with AIAdmissionController().user_turn(user_id):
+                history = await self.get_conversation_history(user_id)
+                async with aclosing(KimiInteractionAPI().stream_message_to_ai(user_id, message, history, gender)) as events:
+                    async for event in events:
+                        if event["type"] == "done" and event.get("success"):
+                            await self.save_conversation_history(user_id, message, event.get("message", ""), event.get("prompt_version"))
+                        yield event
+        except AIOverloadedError as e:
+            yield {"type": "error", "error": str(e), "retry_after": e.retry_after}
+    
+    async def save_conversation_history(self, user_id: int, message: str, response: str, prompt_version: Optional[str] = None) -> bool:
         """
         保存用户和AI的对话历史 - 先写内存，后异步写数据库
         
@@ -160,6 +366,7 @@ class AIResponseProcessor:
             user_id: 用户ID
             message: 用户消息
             response: AI响应
+            prompt_version: 生成该回复时使用的系统提示词版本（记录在AI消息上）
             
         Returns:
             bool: 是否成功
@@ -172,7 +379,6 @@ class AIResponseProcessor:
             self.message_counter += 1
             user_message_id = self.message_counter
             user_message_data = {
-                "_id": user_message_id,
                 "ai_message_id": user_message_id,
                 "ai_message_content": message,
                 "ai_message_send_time_in_utc": now_utc.isoformat(),
@@ -184,33 +390,25 @@ class AIResponseProcessor:
             self.message_counter += 1
             ai_message_id = self.message_counter
             ai_message_data = {
-                "_id": ai_message_id,
                 "ai_message_id": ai_message_id,
                 "ai_message_content": response,
                 "ai_message_send_time_in_utc": now_utc.isoformat(),
                 "role": 1  # 1表示AI
             }
+            if prompt_version:
+                ai_message_data["prompt_version"] = prompt_version
             logger.debug(f"[{user_id}] 创建AI消息, ID: {ai_message_id}")
 
-            # 3. 更新内存缓存
-            # 使用 self.add_message_to_memory 方法来原子性地更新内存
+            # 3. 更新内存缓存（先确保用户历史已加载，再追加到缓冲区末尾）
+            await self._get_history_buffer(user_id)
             self.add_message_to_memory(user_id, user_message_id, user_message_data)
             self.add_message_to_memory(user_id, ai_message_id, ai_message_data)
             logger.info(f"[{user_id}] 成功更新内存缓存，新增消息IDs: {user_message_id}, {ai_message_id}")
 
-            # 4. 异步写入数据库 (不阻塞主流程)
+            # 4. 异步写入数据库 (不阻塞主流程)：追加到用户最后一个桶，写入完成前不换出该用户
             try:
                 logger.info(f"[{user_id}] 开始异步写入数据库...")
-                await Database.insert_one("AI_message", user_message_data)
-                await Database.insert_one("AI_message", ai_message_data)
-                
-                # 更新AI_chatroom表
-                await Database.update_one(
-                    "AI_chatroom",
-                    {"user_id": user_id},
-                    {"$push": {"ai_message_ids": {"$each": [user_message_id, ai_message_id]}}},
-                    upsert=True
-                )
+                await self._append_to_buckets(user_id, [user_message_data, ai_message_data])
                 logger.info(f"[{user_id}] 异步写入数据库成功")
             except Exception as db_e:
                 logger.error(f"[{user_id}] 异步写入数据库失败: {db_e}", exc_info=True)
@@ -231,32 +429,7 @@ class AIResponseProcessor:
         Returns:
             bool: 是否结束
         """
-        # 这里先预留，后续实现结束检测功能
-        return False
-    
-    async def check_conversation_end(self, response: str) -> bool:
-        """
-        检查对话是否结束
-        
-        Args:
-            response: AI响应内容
-            
-        Returns:
-            bool: 是否结束
-        """
-        # 检查是否包含总结关键词
-        summary_keywords = [
-            "总结",
-            "总结报告", 
-            "建议总结",
-            "对话总结",
-            "最终建议",
-            "结束语",
-            "#end",
-            "Your Ideal Partner Profile",
-            "理想伴侣画像"
-        ]
-        return any(keyword in response for keyword in summary_keywords)
+        return is_conversation_end(response)
     
     async def process_final_summary(self, response: str) -> dict:
         """
@@ -287,142 +460,42 @@ class AIResponseProcessor:
         Returns:
             list[str]: 分割后的两部分
         """
-        import re
-        
-        # 1. 优先用 *** 分割
-        split_match = re.search(r"\n?\s*\*\*\*\s*\n?", response_text, re.IGNORECASE)
-        if split_match:
-            split_pos = split_match.start()
-            profile_part = response_text[:split_pos].strip()
-            questions_part = response_text[split_match.end():].strip()
-            return [profile_part, questions_part]
-        
-        # 2. 用关键词分割
-        pattern = re.compile(
-            r"(filter questions:?|筛选问题:?|问题工具包:?|提问建议:?|约会提问:?|推荐提问:?|建议提问:?|实用提问:?|情景提问:?|初期提问:?)",
-            re.IGNORECASE
-        )
-        match = pattern.search(response_text)
-        if match:
-            split_pos = match.start()
-            profile_part = response_text[:split_pos].strip()
-            questions_part = response_text[split_pos:].strip()
-            return [profile_part, questions_part]
-        
-        # 3. 兜底：返回原文
-        logger.warning(f"总结分割失败，返回原文: {response_text[:100]}...")
-        return [response_text]
+        parts = split_profile_summary(response_text)
+        if len(parts) < 2:
+            logger.warning(f"总结分割失败，返回原文: {response_text[:100]}...")
+        return parts
     
     async def save_to_database(self, user_id: Optional[int] = None):
         """
         保存AI聊天数据到数据库
         如果指定了user_id，则保存该用户的聊天数据；如果没有指定，则保存所有内存中的聊天数据。
+        对话在保存时已追加到分桶文档，这里只补写之前写入失败的消息
         [API调用]
         """
         try:
             if user_id is None:
-                # 保存所有内存中的聊天数据
+                # 保存所有有未保存消息的用户
                 success_count = 0
-                total_chatrooms = len(self.ai_chatrooms)
+                pending_user_ids = list(self.unsaved_messages)
                 
-                for user_id, message_ids in self.ai_chatrooms.items():
+                for pending_user_id in pending_user_ids:
                     try:
-                        # 保存聊天室数据
-                        chatroom_data = {
-                            "user_id": user_id,
-                            "ai_message_ids": message_ids
-                        }
-                        
-                        # 检查聊天室是否已在数据库中
-                        existing_chatroom = await Database.find_one("AI_chatroom", {"user_id": user_id})
-                        
-                        if existing_chatroom:
-                            # 如果存在，则更新
-                            await Database.update_one(
-                                "AI_chatroom",
-                                {"user_id": user_id},
-                                {"$set": {"ai_message_ids": message_ids}}
-                            )
-                        else:
-                            # 如果不存在，则插入
-                            await Database.insert_one("AI_chatroom", chatroom_data)
-                        
+                        await self._append_to_buckets(pending_user_id, [])
                         success_count += 1
-                        
                     except Exception as e:
-                        logger.error(f"保存用户 {user_id} 的AI聊天室失败: {e}")
-                        continue
+                        logger.error(f"保存用户 {pending_user_id} 的AI聊天数据失败: {e}")
                 
-                # 保存所有消息数据
-                message_success_count = 0
-                total_messages = len(self.ai_messages)
-                
-                for message_id, message_data in self.ai_messages.items():
-                    try:
-                        # 检查消息是否已在数据库中
-                        existing_message = await Database.find_one("AI_message", {"ai_message_id": message_id})
-                        
-                        if existing_message:
-                            # 如果存在，则更新
-                            update_data = message_data.copy()
-                            await Database.update_one(
-                                "AI_message",
-                                {"ai_message_id": message_id},
-                                {"$set": update_data}
-                            )
-                        else:
-                            # 如果不存在，则插入
-                            await Database.insert_one("AI_message", message_data)
-                        
-                        message_success_count += 1
-                        
-                    except Exception as e:
-                        logger.error(f"保存消息 {message_id} 失败: {e}")
-                        continue
-                
-                logger.info(f"AI聊天数据保存完成: {success_count}/{total_chatrooms} 个聊天室, {message_success_count}/{total_messages} 条消息")
-                return success_count == total_chatrooms and message_success_count == total_messages
+                logger.info(f"AI聊天数据保存完成: {success_count}/{len(pending_user_ids)} 个用户的未保存消息")
+                return success_count == len(pending_user_ids)
                 
             else:
                 # 保存指定用户的聊天数据
-                if user_id not in self.ai_chatrooms:
+                if user_id not in self.ai_histories:
                     logger.warning(f"用户 {user_id} 在内存中没有AI聊天数据")
                     return False
                 
-                message_ids = self.ai_chatrooms[user_id]
-                
-                # 保存聊天室数据
-                chatroom_data = {
-                    "user_id": user_id,
-                    "ai_message_ids": message_ids
-                }
-                
-                existing_chatroom = await Database.find_one("AI_chatroom", {"user_id": user_id})
-                
-                if existing_chatroom:
-                    await Database.update_one(
-                        "AI_chatroom",
-                        {"user_id": user_id},
-                        {"$set": {"ai_message_ids": message_ids}}
-                    )
-                else:
-                    await Database.insert_one("AI_chatroom", chatroom_data)
-                
-                # 保存该用户的所有消息
-                for message_id in message_ids:
-                    if message_id in self.ai_messages:
-                        message_data = self.ai_messages[message_id]
-                        existing_message = await Database.find_one("AI_message", {"ai_message_id": message_id})
-                        
-                        if existing_message:
-                            await Database.update_one(
-                                "AI_message",
-                                {"ai_message_id": message_id},
-                                {"$set": message_data}
-                            )
-                        else:
-                            await Database.insert_one("AI_message", message_data)
-                
+                if user_id in self.unsaved_messages:
+                    await self._append_to_buckets(user_id, [])
                 logger.info(f"用户 {user_id} 的AI聊天数据保存完成")
                 return True
                 
@@ -438,22 +511,14 @@ class AIResponseProcessor:
     
     def add_message_to_memory(self, user_id: int, message_id: int, message_data: dict):
         """
-        添加消息到内存 [内部方法]
+        添加消息到用户历史缓冲区的末尾，缓冲区已满时丢弃最早的消息 [内部方法]
+        调用前用户的历史须已加载（_get_history_buffer）
         
         Args:
             user_id: 用户ID
             message_id: 消息ID
             message_data: 消息数据
         """
-        # 确保用户聊天室存在
-        if user_id not in self.ai_chatrooms:
-            self.ai_chatrooms[user_id] = []
-        
-        # 添加消息ID到聊天室
-        if message_id not in self.ai_chatrooms[user_id]:
-            self.ai_chatrooms[user_id].append(message_id)
-        
-        # 添加消息详情到内存
-        self.ai_messages[message_id] = message_data
+        self.ai_histories[user_id].append(message_data)
         
         logger.info(f"消息 {message_id} 已添加到用户 {user_id} 的内存中") 
\ No newline at end of file
@@ -1,7 +1,11 @@
+import asyncio
+import gc
 from app.config import settings
 from app.objects.Chatroom import Chatroom
+from pymongo import UpdateOne
 from app.objects.Message import Message
 from app.services.https.MatchManager import MatchManager
+from app.services.https.MessageJournal import MessageJournal
 from app.services.https.UserManagement import UserManagement
 from app.core.database import Database
 from app.utils.my_logger import MyLogger
@@ -21,6 +25,9 @@ class ChatroomManager:
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance.chatrooms = {}  # {chatroom_id: Chatroom}
+            cls._instance.pending_chatroom_creations = {}  # {match_id: asyncio.Task} 进行中的聊天室创建
+            cls._instance.user_chatrooms = {}  # {user_id: set(chatroom_id)} 收件箱索引
+            cls._instance.background_tasks = set()  # 发送消息后不阻塞投递的后台写入任务
             logger.info("ChatroomManager singleton instance created")
         return cls._instance
 
@@ -40,53 +47,187 @@ class ChatroomManager:
             logger.info("ChatroomManager construct: Querying chatrooms from database...")
             chatrooms_data = await Database.find("chatrooms")
             logger.info(f"ChatroomManager construct: Found {len(chatrooms_data)} chatrooms in database")
-            loaded_count = 0
-            
-            for chatroom_data in chatrooms_data:
-                try:
-                    chatroom_id = chatroom_data["_id"]  # chatroom_id现在存储在_id字段中
-                    user1_id = chatroom_data["user1_id"]
-                    user2_id = chatroom_data["user2_id"]
-                    match_id = chatroom_data.get("match_id")  # 获取match_id，如果不存在则为None
-                    
-                    logger.info(f"ChatroomManager construct: Processing chatroom {chatroom_id} (users: {user1_id}, {user2_id}, match_id: {match_id})")
-                    
-                    # 统一转换为int类型
-                    chatroom_id = int(chatroom_id)
-                    user1_id = int(user1_id)
-                    user2_id = int(user2_id)
-                    if match_id is not None:
-                        match_id = int(match_id)
-                    
-                    # Get user instances
-                    user_manager = UserManagement()
-                    user1 = user_manager.get_user_instance(user1_id)
-                    user2 = user_manager.get_user_instance(user2_id)
-                    
-                    if user1 and user2:
-                        # Create chatroom instance with existing ID
-                        chatroom = Chatroom(user1, user2, match_id)
-                        chatroom.chatroom_id = chatroom_id
-                        chatroom.message_ids = chatroom_data.get("message_ids", [])
-                        
-                        self.chatrooms[chatroom_id] = chatroom
-                        loaded_count += 1
-                        logger.info(f"ChatroomManager construct: Successfully loaded chatroom {chatroom_id} with {len(chatroom.message_ids)} message_ids and match_id {match_id}")
-                    else:
-                        logger.warning(f"ChatroomManager construct: Cannot load chatroom {chatroom_id}: users {user1_id} (found: {user1 is not None}) or {user2_id} (found: {user2 is not None}) not found")
-                        
-                except Exception as e:
-                    logger.error(f"ChatroomManager construct: Error loading chatroom from database: {e}")
-                    continue
+            loaded_count = self.load_chatroom_documents(chatrooms_data)
             
             logger.info(f"ChatroomManager construct: Loaded {loaded_count} chatrooms from database")
-            logger.info(f"ChatroomManager construct: Final chatrooms in memory: {list(self.chatrooms.keys())}")
+            await self._backfill_inbox_previews()
+            await self._backfill_message_seqs()
+            # 增量同步按(chatroom_id, seq)查询消息
+            await Database.create_index("messages", [("chatroom_id", 1), ("seq", 1)])
             return True
             
         except Exception as e:
             logger.error(f"ChatroomManager construct: Error constructing ChatroomManager: {e}")
             return False
 
+    def load_chatroom_documents(self, chatrooms_data) -> int:
+        """
+        批量将数据库文档水合为Chatroom实例并放入内存
+        用户实例通过一次取得的user_list批量解析，不逐条输出日志
+        返回成功加载的聊天室数量
+        """
+        users = UserManagement().user_list
+        from_document = Chatroom.from_document
+        chatrooms = self.chatrooms
+        
+        loaded_count = 0
+        failed_count = 0
+        missing_user_ids = []
+        # 大量创建长期存活的对象时暂停循环垃圾回收，避免反复的全代扫描
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for chatroom_data in chatrooms_data:
+                try:
+                    user1 = users.get(int(chatroom_data["user1_id"]))
+                    user2 = users.get(int(chatroom_data["user2_id"]))
+                    if user1 is None or user2 is None:
+                        missing_user_ids.append(chatroom_data["_id"])
+                        continue
+                
+                    chatroom = from_document(chatroom_data, user1, user2)
+                    chatrooms[chatroom.chatroom_id] = chatroom
+                    self._index_chatroom(chatroom)
+                    loaded_count += 1
+                except Exception as e:
+                    failed_count += 1
+                    logger.error(f"ChatroomManager construct: Error loading chatroom {chatroom_data.get('_id')} from database: {e}")
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        
+        if missing_user_ids:
+            logger.warning(f"ChatroomManager construct: Skipped {len(missing_user_ids)} chatrooms whose users were not found (first 10: {missing_user_ids[:10]})")
+        if failed_count:
+            logger.warning(f"ChatroomManager construct: Failed to load {failed_count} chatrooms")
+        return loaded_count
+
+    def _index_chatroom(self, chatroom):
+        """
+        将聊天室加入两个用户的收件箱索引
+        """
+        self.user_chatrooms.setdefault(chatroom.user1_id, set()).add(chatroom.chatroom_id)
+        self.user_chatrooms.setdefault(chatroom.user2_id, set()).add(chatroom.chatroom_id)
+
+    async def _backfill_inbox_previews(self, batch_size: int = 1000):
+        """
+        为没有收件箱摘要的旧聊天室补全最后一条消息（按批查询，仅启动时执行）
+        """
+        pending = {}  # {last_message_id: chatroom}
+        for chatroom in self.chatrooms.values():
+            if chatroom.last_message is None and chatroom.message_ids:
+                pending[chatroom.message_ids[-1]] = chatroom
+        if not pending:
+            return
+        
+        message_ids = list(pending.keys())
+        for start in range(0, len(message_ids), batch_size):
+            batch = message_ids[start:start + batch_size]
+            messages_data = await Database.find("messages", {"_id": {"$in": batch}})
+            for message_data in messages_data:
+                chatroom = pending[message_data["_id"]]
+                chatroom.record_message(
+                    message_data["message_sender_id"],
+                    message_data["message_content"],
+                    message_data["message_send_time_in_utc"]
+                )
+                # 历史消息的已读状态未知，不计入未读数
+                chatroom.unread_counts = {user_id: 0 for user_id in chatroom.unread_counts}
+        
+        logger.info(f"ChatroomManager construct: Backfilled inbox previews for {len(pending)} chatrooms")
+
+    async def _backfill_message_seqs(self):
+        """
+        为没有last_seq的旧聊天室按message_ids顺序回填消息序号（仅启动时执行一次）
+        回填失败的聊天室保持last_seq为None，发送消息前会再次回填
+        """
+        legacy_chatrooms = [room for room in self.chatrooms.values() if room.last_seq is None]
+        if not legacy_chatrooms:
+            return
+        
+        backfilled_chatrooms = 0
+        for chatroom in legacy_chatrooms:
+            if await self._backfill_chatroom_seqs(chatroom):
+                backfilled_chatrooms += 1
+        
+        logger.info(f"ChatroomManager construct: Backfilled message seqs for {backfilled_chatrooms}/{len(legacy_chatrooms)} chatrooms")
+
+    async def _backfill_chatroom_seqs(self, chatroom) -> bool:
+        """
+        用一次bulk_write为旧聊天室的消息写入序号，成功后才设置last_seq
+        """
+        message_ids = list(chatroom.message_ids)
+        try:
+            if message_ids:
+                await Database.bulk_write(
+                    "messages",
+                    [UpdateOne({"_id": message_id}, {"$set": {"seq": seq}}) for seq, message_id in enumerate(message_ids, start=1)],
+                    ordered=False
+                )
+        except Exception as e:
+            logger.error(f"Failed to backfill message seqs for chatroom {chatroom.chatroom_id}: {e}")
+            return False
+        
+        # 回填期间可能已由另一次回填完成
+        if chatroom.last_seq is None:
+            chatroom.last_seq = len(message_ids)
+            await chatroom.save_to_database()
+        return True
+
+    def _run_in_background(self, coro, description: str):
+        """
+        在后台执行不影响投递的写入，保留任务引用直到完成，失败只记录日志
+        """
+        task = asyncio.ensure_future(coro)
+        self.background_tasks.add(task)
+
+        def _on_done(done_task):
+            self.background_tasks.discard(done_task)
+            if not done_task.cancelled() and done_task.exception() is not None:
+                logger.error(f"Background task failed ({description}): {done_task.exception()}")
+
+        task.add_done_callback(_on_done)
+        return task
+
+    def get_inbox(self, user_id, offset: int = 0, limit: int = 20) -> dict:
+        """
+        获取用户的会话列表（按最近活动时间倒序分页），完全从内存读取
+        Returns dict with total and conversations
+        """
+        user_id = int(user_id)
+        chatroom_ids = self.user_chatrooms.get(user_id, set())
+        
+        chatrooms = []
+        stale_ids = []
+        for chatroom_id in chatroom_ids:
+            chatroom = self.chatrooms.get(chatroom_id)
+            if chatroom is None:
+                # 聊天室已被删除（注销或完备性清理），顺便清理索引
+                stale_ids.append(chatroom_id)
+            else:
+                chatrooms.append(chatroom)
+        chatroom_ids.difference_update(stale_ids)
+        
+        chatrooms.sort(key=lambda room: room.last_activity_time, reverse=True)
+        
+        user_manager = UserManagement()
+        conversations = []
+        for chatroom in chatrooms[offset:offset + limit]:
+            target_user_id = chatroom.get_other_user_id(user_id)
+            target_user = user_manager.get_user_instance(target_user_id)
+            conversations.append({
+                "chatroom_id": chatroom.chatroom_id,
+                "match_id": chatroom.match_id,
+                "target_user_id": target_user_id,
+                "target_user_name": target_user.telegram_user_name if target_user else None,
+                "last_message": chatroom.last_message,
+                "last_message_time": chatroom.last_message_time,
+                "last_sender_id": chatroom.last_sender_id,
+                "unread_count": chatroom.unread_counts.get(user_id, 0)
+            })
+        
+        return {"total": len(chatrooms), "conversations": conversations}
+
     async def get_or_create_chatroom(self, user_id_1, user_id_2, match_id) -> int:
         """
         Get existing chatroom or create new one for the match
@@ -98,14 +239,10 @@ class ChatroomManager:
             user_id_2 = int(user_id_2)
             match_id = int(match_id)
             
-            # Debug: 打印ChatroomManager初始状态
-            logger.info(f"STEP 0: ChatroomManager current state - {len(self.chatrooms)} chatrooms in memory")
-            logger.info(f"STEP 0: Available chatroom IDs: {list(self.chatrooms.keys())}")
-            
             logger.info(f"STEP 1.1: Getting match {match_id} from MatchManager")
             # Get match from MatchManager
             match_manager = MatchManager()
-            match = match_manager.get_match(match_id)
+            match = await match_manager.get_match(match_id)
             
             if not match:
                 logger.error(f"STEP 1.1 FAILED: Match {match_id} not found")
@@ -115,69 +252,90 @@ class ChatroomManager:
             # Check if match already has a chatroom_id
             if match.chatroom_id:
                 logger.info(f"STEP 1.2 SUCCESS: Match {match_id} already has chatroom {match.chatroom_id}")
-                logger.info(f"STEP 1.2 DEBUG: match.chatroom_id = {match.chatroom_id} (type: {type(match.chatroom_id)})")
                 return match.chatroom_id
             
-            logger.info(f"STEP 1.3: Getting user instances for users {user_id_1} and {user_id_2}")
-            # Get user instances
-            user_manager = UserManagement()
-            
-            user1 = user_manager.get_user_instance(user_id_1)
-            user2 = user_manager.get_user_instance(user_id_2)
-            
-            logger.info(f"STEP 1.3.2: user1 result: {user1 is not None}, user2 result: {user2 is not None}")
-            if user1:
-                logger.info(f"STEP 1.3.2: user1 found: {user1.telegram_user_name} (ID: {user1.user_id})")
-            if user2:
-                logger.info(f"STEP 1.3.2: user2 found: {user2.telegram_user_name} (ID: {user2.user_id})")
-            
-            # 如果用户不存在，打印可用的用户ID列表进行调试
-            if not user1 or not user2:
-                available_ids = sorted(list(user_manager.user_list.keys()))[:10]  # 显示前10个ID
-                logger.error(f"STEP 1.3.2: Available user IDs in cache (first 10): {available_ids}")
-                logger.error(f"STEP 1.3 FAILED: Users {user_id_1} or {user_id_2} not found")
-                return None
-            
-            logger.info(f"STEP 1.4: Creating new chatroom for users {user_id_1} and {user_id_2}")
-            # Create new chatroom
-            chatroom = Chatroom(user1, user2, match_id)
-            
-            logger.info(f"STEP 1.5: Storing chatroom {chatroom.chatroom_id} in memory")
-            # Store in memory
-            self.chatrooms[chatroom.chatroom_id] = chatroom
-            
-            logger.info(f"STEP 1.6: Updating match {match_id} with chatroom_id {chatroom.chatroom_id}")
-            # Update match with chatroom_id
-            match.chatroom_id = chatroom.chatroom_id
-            
-            logger.info(f"STEP 1.7: Saving chatroom {chatroom.chatroom_id} to database")
-            # Save chatroom to database
-            chatroom_save_success = await chatroom.save_to_database()
-            if not chatroom_save_success:
-                logger.error(f"STEP 1.7 FAILED: Could not save chatroom {chatroom.chatroom_id} to database")
-                # 从内存中移除失败的chatroom
-                self.chatrooms.pop(chatroom.chatroom_id, None)
-                return None
-            
-            logger.info(f"STEP 1.8: Saving updated match {match_id} to database")
-            # Save match to database with updated chatroom_id
-            match_save_success = await match.save_to_database()
-            if not match_save_success:
-                logger.error(f"STEP 1.8 FAILED: Could not save match {match_id} to database")
-                # 注意：这里不移除chatroom，因为chatroom已经成功创建并保存
-                logger.warning(f"STEP 1.8: Chatroom {chatroom.chatroom_id} was created but match update failed")
+            # 同一个match的并发请求共享同一个创建任务，不同match之间互不阻塞
+            creation = self.pending_chatroom_creations.get(match_id)
+            if creation is None:
+                creation = asyncio.ensure_future(self._create_chatroom_for_match(match, user_id_1, user_id_2))
+                self.pending_chatroom_creations[match_id] = creation
+                creation.add_done_callback(lambda _: self.pending_chatroom_creations.pop(match_id, None))
+            else:
+                logger.info(f"STEP 1.2: Joining in-flight chatroom creation for match {match_id}")
             
-            logger.info(f"STEP 1 SUCCESS: Created chatroom {chatroom.chatroom_id} for match {match_id}")
-            return chatroom.chatroom_id
+            # shield保证某个调用方被取消时不会取消其他调用方共享的创建任务
+            return await asyncio.shield(creation)
             
         except Exception as e:
             logger.error(f"STEP 1 FAILED: Error getting or creating chatroom for match {match_id}: {e}")
             return None
 
-    async def get_chatroom_history(self, chatroom_id, user_id) -> List[Tuple[str, str, int, str]]:
+    async def _create_chatroom_for_match(self, match, user_id_1: int, user_id_2: int) -> Optional[int]:
+        """
+        Create and persist a chatroom for the match
+        Only one creation per match runs at a time, see get_or_create_chatroom
+        """
+        match_id = match.match_id
+        
+        logger.info(f"STEP 1.3: Getting user instances for users {user_id_1} and {user_id_2}")
+        # Get user instances
+        user_manager = UserManagement()
+        
+        user1 = user_manager.get_user_instance(user_id_1)
+        user2 = user_manager.get_user_instance(user_id_2)
+        
+        logger.info(f"STEP 1.3.2: user1 result: {user1 is not None}, user2 result: {user2 is not None}")
+        if user1:
+            logger.info(f"STEP 1.3.2: user1 found: {user1.telegram_user_name} (ID: {user1.user_id})")
+        if user2:
+            logger.info(f"STEP 1.3.2: user2 found: {user2.telegram_user_name} (ID: {user2.user_id})")
+        
+        # 如果用户不存在，打印可用的用户ID列表进行调试
+        if not user1 or not user2:
+            available_ids = sorted(list(user_manager.user_list.keys()))[:10]  # 显示前10个ID
+            logger.error(f"STEP 1.3.2: Available user IDs in cache (first 10): {available_ids}")
+            logger.error(f"STEP 1.3 FAILED: Users {user_id_1} or {user_id_2} not found")
+            return None
+        
+        logger.info(f"STEP 1.4: Creating new chatroom for users {user_id_1} and {user_id_2}")
+        # Create new chatroom
+        chatroom = Chatroom(user1, user2, match_id)
+        
+        logger.info(f"STEP 1.5: Storing chatroom {chatroom.chatroom_id} in memory")
+        # Store in memory
+        self.chatrooms[chatroom.chatroom_id] = chatroom
+        self._index_chatroom(chatroom)
+        
+        logger.info(f"STEP 1.6: Saving chatroom {chatroom.chatroom_id} to database")
+        # Save chatroom to database
+        chatroom_save_success = await chatroom.save_to_database()
+        if not chatroom_save_success:
+            logger.error(f"STEP 1.6 FAILED: Could not save chatroom {chatroom.chatroom_id} to database")
+            # 从内存中移除失败的chatroom
+            self.chatrooms.pop(chatroom.chatroom_id, None)
+            return None
+        
+        logger.info(f"STEP 1.7: Updating match {match_id} with chatroom_id {chatroom.chatroom_id}")
+        # 聊天室持久化成功后再写回match，创建期间的并发请求通过共享任务等待结果
+        match.chatroom_id = chatroom.chatroom_id
+        match.touch()
+        
+        logger.info(f"STEP 1.8: Saving updated match {match_id} to database")
+        # Save match to database with updated chatroom_id
+        match_save_success = await match.save_to_database()
+        if not match_save_success:
+            logger.error(f"STEP 1.8 FAILED: Could not save match {match_id} to database")
+            # 注意：这里不移除chatroom，因为chatroom已经成功创建并保存
+            logger.warning(f"STEP 1.8: Chatroom {chatroom.chatroom_id} was created but match update failed")
+        
+        logger.info(f"STEP 1 SUCCESS: Created chatroom {chatroom.chatroom_id} for match {match_id}")
+        return chatroom.chatroom_id
+
+    async def get_chatroom_history(self, chatroom_id, user_id, since_seq: Optional[int] = None) -> List[Tuple[str, str, int, str, int]]:
         """
         Get chat history for a chatroom, replacing user's own name with "I"
-        Returns list of (message, datetime, sender_id, sender_name)
+        since_seq不为空时只返回序号大于since_seq的消息（客户端重连后的增量同步）
+        Returns list of (message, datetime, sender_id, sender_name, seq)
         """
         try:
             # 统一转换为int类型
@@ -186,19 +344,18 @@ class ChatroomManager:
             
             logger.info(f"STEP 2.1: Getting chatroom {chatroom_id} from memory")
             
-            # Debug: 打印ChatroomManager的当前状态
-            logger.info(f"STEP 2.1 DEBUG: ChatroomManager has {len(self.chatrooms)} chatrooms in memory")
-            logger.info(f"STEP 2.1 DEBUG: Available chatroom IDs: {list(self.chatrooms.keys())}")
-            logger.info(f"STEP 2.1 DEBUG: Looking for chatroom_id: {chatroom_id} (type: {type(chatroom_id)})")
-            
             chatroom = self.chatrooms.get(chatroom_id)
             if not chatroom:
                 logger.error(f"STEP 2.1 FAILED: Chatroom {chatroom_id} not found in memory")
-                logger.error(f"STEP 2.1 DEBUG: Chatroom details:")
-                for cid, room in self.chatrooms.items():
-                    logger.error(f"  - ID: {cid} (type: {type(cid)}), Users: {room.user1.user_id if room.user1 else 'None'}, {room.user2.user_id if room.user2 else 'None'}")
                 return []
             
+            if chatroom.get_other_user_id(user_id) is None:
+                logger.warning(f"User {user_id} is not a member of chatroom {chatroom_id}, history not returned")
+                return []
+            
+            # 打开聊天记录即视为已读
+            chatroom.mark_read(user_id)
+            
             logger.info(f"STEP 2.2: Loading messages from database for chatroom {chatroom_id}")
             
             # Load messages on-demand from database using message_ids
@@ -209,12 +366,46 @@ class ChatroomManager:
             
             logger.info(f"STEP 2.2: Found {len(message_ids)} message_ids for chatroom {chatroom_id}")
             
-            # Load messages from database by ID (using _id for O(log n) lookup)
+            journal = MessageJournal()
             messages = []
+            # 序号尚未回填的旧聊天室无法增量同步，返回完整历史
+            if since_seq is not None and chatroom.last_seq is not None:
+                since_seq = int(since_seq)
+                if since_seq >= chatroom.last_seq:
+                    logger.info(f"STEP 2.2: Client is up to date for chatroom {chatroom_id} (seq {since_seq})")
+                    return []
+                # 增量同步：一次按(chatroom_id, seq)索引查询，只取客户端缺失的消息
+                messages_data = await Database.find(
+                    "messages",
+                    {"chatroom_id": chatroom_id, "seq": {"$gt": since_seq}},
+                    sort=[("seq", 1)]
+                )
+                # 合并尚未从消息日志落库的消息（按_id去重）
+                stored_ids = {message_data["_id"] for message_data in messages_data}
+                messages_data.extend(
+                    document for document in journal.get_pending_for_chatroom(chatroom_id, since_seq)
+                    if document["_id"] not in stored_ids
+                )
+                messages_data.sort(key=lambda message_data: message_data.get("seq") or 0)
+                user_manager = UserManagement()
+                for message_data in messages_data:
+                    sender_user = user_manager.get_user_instance(message_data["message_sender_id"])
+                    sender_name = sender_user.telegram_user_name if sender_user else f"User{message_data['message_sender_id']}"
+                    messages.append((
+                        message_data["message_content"],
+                        message_data["message_send_time_in_utc"],
+                        message_data["message_sender_id"],
+                        sender_name,
+                        message_data.get("seq")
+                    ))
+                message_ids = []
+                logger.info(f"STEP 2.2: Loaded {len(messages)} messages after seq {since_seq}")
+            
+            # Load messages from database by ID (using _id for O(log n) lookup)
             for message_id in message_ids:
                 try:
-                    # 使用_id字段查询，获得O(log n)的查询性能
-                    message_data = await Database.find_one("messages", {"_id": message_id})
+                    # 优先从消息日志读取尚未落库的消息，否则使用_id字段查询，获得O(log n)的查询性能
+                    message_data = journal.get_pending(message_id) or await Database.find_one("messages", {"_id": message_id})
                     
                     if message_data:
                         # Get sender user instance for sender name
@@ -222,12 +413,13 @@ class ChatroomManager:
                         sender_user = user_manager.get_user_instance(message_data["message_sender_id"])
                         sender_name = sender_user.telegram_user_name if sender_user else f"User{message_data['message_sender_id']}"
                         
-                        # Create message tuple: (message_content, datetime_utc, sender_id, sender_name)
+                        # Create message tuple: (message_content, datetime_utc, sender_id, sender_name, seq)
                         message_tuple = (
                             message_data["message_content"],
                             message_data["message_send_time_in_utc"],
                             message_data["message_sender_id"],
-                            sender_name
+                            sender_name,
+                            message_data.get("seq")
                         )
                         messages.append(message_tuple)
                         
@@ -244,7 +436,7 @@ class ChatroomManager:
             logger.info(f"STEP 2.3: Transforming messages for user {user_id}")
             # Transform messages for the requesting user
             chat_history = []
-            for message_content, datetime_utc, sender_id, sender_name in messages:
+            for message_content, datetime_utc, sender_id, sender_name, seq in messages:
                 # Replace sender name with "I" if it's the requesting user
                 display_name = "I" if sender_id == user_id else sender_name
                 
@@ -252,7 +444,8 @@ class ChatroomManager:
                     message_content,
                     datetime_utc.isoformat() if hasattr(datetime_utc, 'isoformat') else str(datetime_utc),
                     sender_id,
-                    display_name
+                    display_name,
+                    seq
                 ))
             
             logger.info(f"STEP 2.3 SUCCESS: Retrieved {len(chat_history)} messages for chatroom {chatroom_id}, user {user_id}")
@@ -262,12 +455,46 @@ class ChatroomManager:
             logger.error(f"STEP 2 FAILED: Error getting chat history for chatroom {chatroom_id}: {e}")
             return []
 
-    async def send_message(self, chatroom_id, sender_user_id, message_content) -> dict:
+    async def send_message(self, chatroom_id, sender_user_id, message_content, client_message_id: Optional[str] = None) -> dict:
         """
         Send a message in the specified chatroom
-        Creates Message instance, stores in chatroom, and saves to database
+        提供client_message_id时，同一发送者在窗口内的重发直接返回原消息的确认（duplicate=True），不再存储
         Returns dict with success status and match_id
         """
+        if client_message_id is None:
+            return await self._send_new_message(chatroom_id, sender_user_id, message_content)
+        
+        chatroom = self.chatrooms.get(int(chatroom_id))
+        if not chatroom:
+            return await self._send_new_message(chatroom_id, sender_user_id, message_content)
+        
+        key = (int(sender_user_id), str(client_message_id))
+        original = chatroom.recent_client_messages.get(key)
+        if original is not None:
+            # 原消息可能仍在发送中，等待它的结果
+            result = dict(await asyncio.shield(original))
+            result["duplicate"] = True
+            logger.info(f"SEND MSG DEDUPED: client_message_id {client_message_id} from user {sender_user_id} already sent in chatroom {chatroom.chatroom_id}")
+            return result
+        
+        send_result = asyncio.get_running_loop().create_future()
+        chatroom.remember_client_message(key, send_result)
+        result = {"success": False, "match_id": chatroom.match_id}
+        try:
+            result = await self._send_new_message(chatroom_id, sender_user_id, message_content, client_message_id)
+            return result
+        finally:
+            # 异常或任务被取消时也要给等待中的重发请求一个结果，避免它们一直挂起
+            if not send_result.done():
+                send_result.set_result(result)
+            if not result["success"]:
+                # 发送失败允许客户端用同一ID重试
+                chatroom.recent_client_messages.pop(key, None)
+
+    async def _send_new_message(self, chatroom_id, sender_user_id, message_content, client_message_id: Optional[str] = None) -> dict:
+        """
+        Creates Message instance, stores in chatroom, and saves to database
+        """
         try:
             # 统一转换为int类型
             chatroom_id = int(chatroom_id)
@@ -307,31 +534,47 @@ class ChatroomManager:
             
             logger.info(f"SEND MSG STEP 3: Creating message from {sender_user_id} to {receiver_user_id}")
             
-            # Create Message instance
-            message = Message(sender_user, receiver_user, message_content, chatroom_id)
-            
-            logger.info(f"SEND MSG STEP 4: Saving message {message.message_id} to database")
-            
-            # Save message to database first
-            save_success = await message.save_to_database()
-            if not save_success:
-                logger.error(f"SEND MSG STEP 4 FAILED: Could not save message {message.message_id} to database")
+            # 启动时回填序号失败的旧聊天室，先完成回填再分配序号
+            if chatroom.last_seq is None and not await self._backfill_chatroom_seqs(chatroom):
                 return {"success": False, "match_id": chatroom.match_id}
             
+            # Create Message instance，序号在创建时同步分配
+            message = Message(
+                sender_user, receiver_user, message_content, chatroom_id,
+                seq=chatroom.next_seq(), client_message_id=client_message_id
+            )
+            
+            ack_level = settings.MESSAGE_ACK_LEVEL
+            if ack_level == "accepted":
+                logger.info(f"SEND MSG STEP 4: Appending message {message.message_id} to journal")
+                # 写入内存日志即确认，由MessageJournal后台批量落库并更新聊天室
+                MessageJournal().append(message)
+            else:
+                logger.info(f"SEND MSG STEP 4: Saving message {message.message_id} to database")
+                # 投递前只等待一次插入
+                save_success = await message.save_to_database()
+                if not save_success:
+                    logger.error(f"SEND MSG STEP 4 FAILED: Could not save message {message.message_id} to database")
+                    return {"success": False, "match_id": chatroom.match_id}
+            
             logger.info(f"SEND MSG STEP 5: Adding message {message.message_id} to chatroom {chatroom_id}")
             
             # Add message ID to chatroom (don't store message instance in memory)
             chatroom.message_ids.append(message.message_id)
-            
-            logger.info(f"SEND MSG STEP 6: Updating chatroom {chatroom_id} in database")
-            
-            # Save updated chatroom to database (to update message_ids)
-            chatroom_save_success = await chatroom.save_to_database()
-            if not chatroom_save_success:
-                logger.warning(f"SEND MSG STEP 6 WARNING: Could not update chatroom {chatroom_id} in database, but message was saved")
-            
-            logger.info(f"SEND MSG SUCCESS: Message {message.message_id} sent successfully in chatroom {chatroom_id} with match_id {chatroom.match_id}")
-            return {"success": True, "match_id": chatroom.match_id}
+            chatroom.record_message(sender_user_id, message_content, message.message_send_time_in_utc)
+            
+            # 聊天室更新和匹配活动时间刷新不阻塞投递
+            if ack_level != "accepted":
+                logger.info(f"SEND MSG STEP 6: Updating chatroom {chatroom_id} in database (background)")
+                self._run_in_background(
+                    chatroom.append_messages_to_database([message.message_id]),
+                    f"update chatroom {chatroom_id}"
+                )
+            # 聊天活动刷新匹配的最近活动时间（已归档的匹配会被恢复）
+            self._run_in_background(MatchManager().touch_match(chatroom.match_id), f"touch match {chatroom.match_id}")
+            
+            logger.info(f"SEND MSG SUCCESS: Message {message.message_id} accepted ({ack_level}) in chatroom {chatroom_id} with match_id {chatroom.match_id}")
+            return {"success": True, "match_id": chatroom.match_id, "seq": message.seq, "ack": ack_level, "duplicate": False}
             
         except Exception as e:
             logger.error(f"SEND MSG FAILED: Error sending message in chatroom {chatroom_id}: {e}")
@@ -4,6 +4,8 @@ from app.utils.my_logger import MyLogger
 from app.services.https.MatchManager import MatchManager
 from app.services.https.UserManagement import UserManagement
 from app.services.https.ChatroomManager import ChatroomManager
+from app.services.https.MessageJournal import MessageJournal
+from app.objects.Message import Message
 
 logger = MyLogger("DataIntegrity")
 
@@ -127,8 +129,8 @@ class DataIntegrity:
         try:
             logger.info("开始检查User的match_ids数据完备性...")
             
-            # 获取所有存在的match_ids
-            existing_match_ids = set(self.match_manager.match_list.keys())
+            # 获取所有存在的match_ids（包括已归档的匹配）
+            existing_match_ids = set(self.match_manager.match_list.keys()) | self.match_manager.archived_match_ids
             
             # 轮询UserManagement里的user实例
             for user_id, user in self.user_manager.user_list.items():
@@ -172,7 +174,7 @@ class DataIntegrity:
             
             # 获取所有存在的user_ids和match_ids
             existing_user_ids = set(self.user_manager.user_list.keys())
-            existing_match_ids = set(self.match_manager.match_list.keys())
+            existing_match_ids = set(self.match_manager.match_list.keys()) | self.match_manager.archived_match_ids
             
             # 轮询ChatroomManager内存中的所有chatroom
             for chatroom_id, chatroom in self.chatroom_manager.chatrooms.items():
@@ -258,6 +260,9 @@ class DataIntegrity:
         try:
             logger.info("开始检查Chatroom的message_ids完备性...")
             
+            # 查询之后才创建的消息不在查询结果中，不能当作无效ID
+            max_checked_message_id = Message._message_counter
+            
             # 获取所有存在的message_ids
             messages_data = await Database.find("messages")
             existing_message_ids = set()
@@ -275,6 +280,8 @@ class DataIntegrity:
                     
                     # 检查每个message_id是否存在
                     for message_id in chatroom.message_ids:
+                        if message_id > max_checked_message_id or MessageJournal().get_pending(message_id):
+                            continue  # 新发送或尚在消息日志中等待落库
                         if message_id not in existing_message_ids:
                             logger.warning(f"Chatroom {chatroom_id} 的message_ids中发现不存在的message_id: {message_id}")
                             invalid_message_ids.append(message_id)
@@ -575,9 +582,10 @@ class DataIntegrity:
         try:
             logger.info("开始检查数据库users表的match_ids...")
             
-            # 获取所有match_ids
+            # 获取所有match_ids（包括已归档的匹配）
             matches_data = await Database.find("matches")
-            existing_match_ids = set(match["_id"] for match in matches_data)
+            archived_data = await Database.find("matches_archive", {}, {"_id": 1})
+            existing_match_ids = set(match["_id"] for match in matches_data + archived_data)
             
             # 获取所有用户
             users_data = await Database.find("users")
@@ -624,7 +632,8 @@ class DataIntegrity:
             existing_user_ids = set(user["_id"] for user in users_data)
             
             matches_data = await Database.find("matches")
-            existing_match_ids = set(match["_id"] for match in matches_data)
+            archived_data = await Database.find("matches_archive", {}, {"_id": 1})
+            existing_match_ids = set(match["_id"] for match in matches_data + archived_data)
             
             # 获取所有chatrooms
             chatrooms_data = await Database.find("chatrooms")
@@ -3,14 +3,19 @@
 提供重试机制、对话结束检测、总结分割等功能
 """
 
-import os
 import asyncio
-import requests
+from contextlib import aclosing
+import httpx
 from typing import List, Dict, Optional
 from datetime import datetime
 from app.config import settings
 from app.utils.my_logger import MyLogger
-from app.utils.prompt_manager import prompt_manager
+from app.utils.prompt_manager import CompiledPrompt, prompt_manager
+from app.utils.summary_detector import is_final_summary, split_final_summary
+from app.utils.context_builder import MESSAGE_OVERHEAD_TOKENS, context_builder, estimate_tokens
+from app.services.https.AIAdmissionController import AIAdmissionController, AIOverloadedError
+from app.services.https.AIProviderRouter import AIProviderRouter
+from app.services.https.AIProviders import backoff_delay
 import json
 
 logger = MyLogger("KimiInteractionAPI")
@@ -19,72 +24,128 @@ class KimiInteractionAPI:
     """
     与Kimi AI模型进行交互的API封装
     提供完整的AI对话功能，包括重试机制、对话结束检测、总结分割等
+    所有请求共用一个httpx.AsyncClient连接池（keep-alive），等待期间不阻塞事件循环
     """
     _instance = None
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
+            if not settings.KIMI_API_KEY:
+                logger.error("KIMI_API_KEY 未设置")
+                raise ValueError("KIMI_API_KEY 未设置")
             cls._instance = super(KimiInteractionAPI, cls).__new__(cls, *args, **kwargs)
+            cls._instance.api_key = settings.KIMI_API_KEY
+            cls._instance.api_url = settings.KIMI_API_URL
+            cls._instance.model_name = settings.KIMI_MODEL_NAME
+            cls._instance.max_retries = settings.AI_MAX_RETRIES  # 最大尝试次数
+            cls._instance.timeout = settings.AI_REQUEST_TIMEOUT_SECONDS  # 每次尝试的超时时间（秒）
+            cls._instance.client = None  # 第一次请求时创建
+            cls._instance.transport = None  # 可替换的httpx传输层（测试时使用httpx.MockTransport）
         return cls._instance
 
-    def __init__(self, *args, **kwargs):
-        # 从环境变量获取Kimi API配置
-        self.api_key = os.getenv("KIMI_API_KEY", "sk-k6FqWbmEJJa9TKxK39fjCEflSG7JraFGlK2BnhAYcaHi89PJ")
-        self.api_url = "https://api.moonshot.cn/v1/chat/completions"
-        self.model_name = "moonshot-v1-8k"
-        self.max_retries = 3  # 最大重试次数
-        self.timeout = 60  # 请求超时时间（秒）
-        
-        if not self.api_key:
-            logger.error("KIMI_API_KEY 未设置")
-            raise ValueError("KIMI_API_KEY 未设置")
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        获取共享的异步HTTP客户端
+        """
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                timeout=httpx.Timeout(self.timeout, connect=settings.AI_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(
+                    max_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.AI_HTTP_MAX_CONNECTIONS
+                ),
+                transport=self.transport
+            )
+        return self.client
+
+    async def close(self):
+        """
+        关闭连接池（服务关闭时调用）
+        """
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
 
-    def _get_system_prompt(self, gender: str = "neutral") -> str:
+    def _get_system_prompt(self, gender: str = "neutral") -> CompiledPrompt:
         """
-        获取系统提示词
+        获取预先组合好的系统提示词（prompt文件修改后自动重新组合）
         
         Args:
             gender: 用户性别 ('male', 'female', 'neutral')
             
         Returns:
-            str: 系统提示词内容
+            CompiledPrompt: 系统提示词内容、token数和版本
         """
-        return prompt_manager.get_complete_prompt(gender)
+        return prompt_manager.get_compiled_prompt(gender)
     
-    def _format_history_for_api(self, history: List[tuple], gender: str = "neutral") -> List[Dict[str, str]]:
+    def _format_history_for_api(self, history: List[tuple], prompt: CompiledPrompt, user_id: Optional[int] = None, message: Optional[str] = None) -> List[Dict[str, str]]:
         """
         将历史记录格式化为Kimi API需要的格式
+        总token数控制在AI_CONTEXT_TOKEN_BUDGET以内，较早的轮次压缩为按用户缓存的滚动摘要
         
         Args:
             history: List[Tuple[str, str, int, str]] 历史记录
                     格式: (消息内容, ISO时间字符串, 发送者ID, 显示名称)
-            gender: 用户性别 ('male', 'female', 'neutral')
+            prompt: 系统提示词（使用预先计算的token数）
+            user_id: 用户ID（用于摘要缓存）
+            message: 当前用户消息（提供时追加在最后并计入预算）
         
         Returns:
             List[Dict[str, str]]: 格式化后的历史记录
         """
-        messages = []
-        
-        # 添加系统提示词
-        messages.append({
-            "role": "system",
-            "content": self._get_system_prompt(gender)
-        })
-        
-        # 添加历史对话
-        for message_content, timestamp, sender_id, display_name in history:
-            if display_name == "I":  # 用户消息
-                messages.append({
-                    "role": "user",
-                    "content": message_content
-                })
-            else:  # AI消息 (display_name == "AI Assistant")
-                messages.append({
-                    "role": "assistant",
-                    "content": message_content
-                })
-        
-        return messages
+        return context_builder.build_messages(user_id, prompt.text, history, message, system_prompt_tokens=prompt.token_count)
+    
+    def _build_request_data(self, user_id: int, message: str, history: list, prompt: CompiledPrompt, stream: bool) -> dict:
+        """
+        构建API请求数据（使用OpenAI兼容格式）
+        """
+        # 格式化历史记录并添加当前用户消息
+        messages = self._format_history_for_api(history, prompt, user_id, message)
+        return {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": stream,
+            "temperature": 0.95,
+            "top_p": 0.7,
+            "max_tokens": 1024
+        }
+    
+    @staticmethod
+    def _estimate_request_tokens(request_data: dict) -> int:
+        """
+        估算一次请求消耗的token数（所有消息 + 最大回复长度），用于准入控制的token预算
+        """
+        prompt_tokens = sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in request_data["messages"])
+        return prompt_tokens + request_data.get("max_tokens", 0)
+    
+    def _build_result(self, ai_response: str, prompt_version: str) -> dict:
+        """
+        根据完整的AI响应文本构建结果，检查是否是最终总结并分割
+        prompt_version记录生成该回复时使用的系统提示词版本
+        """
+        ai_response = ai_response.strip()
+        if self._is_final_summary(ai_response):
+            summary_parts = self._split_final_summary(ai_response)
+            return {
+                "success": True,
+                "message": summary_parts[0] if summary_parts else ai_response,
+                "summary": summary_parts[1] if len(summary_parts) > 1 else "",
+                "is_final": True,
+                "prompt_version": prompt_version,
+                "timestamp": datetime.now().isoformat()
+            }
+        return {
+            "success": True,
+            "message": ai_response,
+            "summary": "",
+            "is_final": False,
+            "prompt_version": prompt_version,
+            "timestamp": datetime.now().isoformat()
+        }
     
     async def send_message_to_ai(self, user_id: int, message: str, history: list, gender: str = "neutral") -> dict:
         """
@@ -102,128 +163,158 @@ class KimiInteractionAPI:
                 - message: str - AI响应消息
                 - summary: str - 总结内容（如果有）
                 - is_final: bool - 是否是最终总结
+                - prompt_version: str - 使用的系统提示词版本
                 - timestamp: str - 时间戳
+        
+        Raises:
+            AIOverloadedError: 准入控制拒绝（排队已满、等待超时或超出token预算）
         """
         try:
             logger.info(f"[{user_id}] 开始处理用户消息: {message[:50]}...")
             
-            # 格式化历史记录
-            messages = self._format_history_for_api(history, gender)
-            
-            # 添加当前用户消息
-            messages.append({
-                "role": "user",
-                "content": message
-            })
-            
-            # 构建API请求数据（使用OpenAI兼容格式）
-            request_data = {
-                "model": self.model_name,
-                "messages": messages,
-                "stream": False,
-                "temperature": 0.95,
-                "top_p": 0.7,
-                "max_tokens": 1024
-            }
-            
-            # 发送API请求（包含重试机制）
-            response_json = self._make_api_request(request_data, user_id)
+            # 构建API请求数据并发送（包含重试机制）
+            prompt = self._get_system_prompt(gender)
+            request_data = self._build_request_data(user_id, message, history, prompt, stream=False)
+            # 通过服务商路由发送（按延迟和错误率选择服务商，失败时切换）
+            async with AIAdmissionController().admit(self._estimate_request_tokens(request_data)):
+                response_json = await AIProviderRouter().complete(request_data, user_id)
             
             # 解析响应（OpenAI兼容格式）
             if 'choices' in response_json and len(response_json['choices']) > 0:
                 choice = response_json['choices'][0]
                 if 'message' in choice and 'content' in choice['message']:
-                    # 提取AI响应文本
-                    ai_response = choice['message']['content'].strip()
-                    
-                    # 检查是否是最终总结
-                    if self._is_final_summary(ai_response):
-                        summary_parts = self._split_final_summary(ai_response)
-                        return {
-                            "success": True,
-                            "message": summary_parts[0] if summary_parts else ai_response,
-                            "summary": summary_parts[1] if len(summary_parts) > 1 else "",
-                            "is_final": True,
-                            "timestamp": datetime.now().isoformat()
-                        }
-                    else:
-                        return {
-                            "success": True,
-                            "message": ai_response,
-                            "summary": "",
-                            "is_final": False,
-                            "timestamp": datetime.now().isoformat()
-                        }
+                    return self._build_result(choice['message']['content'], prompt.version)
                 else:
                     raise Exception("API响应格式错误：缺少message或content")
             else:
                 raise Exception("API响应格式错误：缺少choices")
-                
+        
+        except AIOverloadedError:
+            # 准入被拒绝时不返回备用响应（备用响应会被当作正常回复保存），由调用方提示用户稍后重试
+            raise
         except Exception as e:
             logger.error(f"[{user_id}] 处理用户消息失败: {str(e)}", exc_info=True)
             return await self.get_fallback_response()
     
-    def _make_api_request(self, request_data: dict, user_id: int) -> dict:
+    async def stream_message_to_ai(self, user_id: int, message: str, history: list, gender: str = "neutral"):
+        """
+        以流式方式向Kimi API发送消息，逐段产出AI生成的内容
+        
+        Yields:
+            dict: {"type": "delta", "content": str} 每收到一段内容产出一次
+                  {"type": "done", **send_message_to_ai的结果} 流结束后产出一次（基于完整文本检测最终总结）
+                  {"type": "error", "error": str} 已开始输出后连接中断，或准入被拒绝（带retry_after）时产出，之后不再有done
         """
-        向Kimi API发送请求（包含重试机制）
+        logger.info(f"[{user_id}] 开始流式处理用户消息: {message[:50]}...")
+        prompt = self._get_system_prompt(gender)
+        request_data = self._build_request_data(user_id, message, history, prompt, stream=True)
+        
+        # 许可一直持有到流结束
+        try:
+            async with AIAdmissionController().admit(self._estimate_request_tokens(request_data)):
+                async with aclosing(self._stream_response(request_data, user_id, prompt)) as events:
+                    async for event in events:
+                        yield event
+        except AIOverloadedError as e:
+            yield {"type": "error", "error": str(e), "retry_after": e.retry_after}
+    
+    async def _stream_response(self, request_data: dict, user_id: int, prompt: CompiledPrompt):
+        """
+        发送流式请求并解析SSE响应，产出的事件见stream_message_to_ai
+        """
+        # 在收到第一个字节之前失败可以安全重试，失败时与非流式接口一样返回备用响应
+        try:
+            response = await self._send_with_retries(request_data, user_id, stream=True)
+        except Exception as e:
+            logger.error(f"[{user_id}] 流式请求失败: {str(e)}")
+            yield {"type": "done", **await self.get_fallback_response()}
+            return
+        
+        parts = []
+        try:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                content = choices[0].get("delta", {}).get("content") if choices else None
+                if content:
+                    parts.append(content)
+                    yield {"type": "delta", "content": content}
+        except Exception as e:
+            logger.error(f"[{user_id}] 流式响应中断, 已收到 {len(parts)} 段: {str(e)}")
+            yield {"type": "error", "error": f"AI响应流中断: {str(e)}"}
+            return
+        finally:
+            await response.aclose()
+        
+        logger.info(f"[{user_id}] 流式响应完成, 共 {len(parts)} 段")
+        yield {"type": "done", **self._build_result("".join(parts), prompt.version)}
+    
+    async def _send_with_retries(self, request_data: dict, user_id: int, stream: bool) -> httpx.Response:
+        """
+        发送请求直到收到200响应（包含重试机制）
+        网络错误、超时、429和5xx会重试，等待时间为带随机抖动的指数退避（优先使用Retry-After）
+        stream为True时只等待响应头，响应体由调用方读取并负责aclose
         
         Args:
             request_data: 请求数据
             user_id: 用户ID
+            stream: 是否以流式读取响应体
             
         Returns:
-            dict: API响应
+            httpx.Response: 状态码为200的响应
             
         Raises:
-            Exception: 当所有重试都失败时抛出异常
+            Exception: 当所有重试都失败或遇到不可重试的错误时抛出异常
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-
         logger.info(f"[{user_id}] 发送请求到Kimi API")
+        client = self._get_client()
         
-        # 重试机制
-        retry_count = 0
-        while retry_count < self.max_retries:
+        for attempt in range(1, self.max_retries + 1):
+            retry_after = None
             try:
-                logger.info(f"[{user_id}] 尝试第 {retry_count + 1}/{self.max_retries} 次请求Kimi API...")
-                
-                response = requests.post(
-                    self.api_url, 
-                    json=request_data, 
-                    headers=headers, 
-                    timeout=self.timeout
-                )
-                
-                logger.info(f"[{user_id}] 请求成功, 状态码: {response.status_code}")
+                logger.info(f"[{user_id}] 尝试第 {attempt}/{self.max_retries} 次请求Kimi API...")
+                # 非流式时整个尝试（包括读取响应体）的总时间不超过timeout；流式时限制等待响应头的时间
+                request = client.build_request("POST", self.api_url, json=request_data)
+                response = await asyncio.wait_for(client.send(request, stream=stream), timeout=self.timeout)
+                logger.info(f"[{user_id}] 请求完成, 状态码: {response.status_code}")
                 
-                # 检查响应状态码
                 if response.status_code == 200:
-                    response_json = response.json()
-                    logger.info(f"[{user_id}] AI响应成功")
-                    logger.debug(f"[{user_id}] 完整响应: {json.dumps(response_json, indent=2, ensure_ascii=False)}")
-                    return response_json
-                else:
-                    # 其他错误
-                    response.raise_for_status()
-                    
-            except Exception as e:
-                retry_count += 1
-                logger.error(f"[{user_id}] Kimi API调用失败 (尝试 {retry_count}/{self.max_retries}), 错误: {str(e)}", exc_info=True)
-                
-                if retry_count >= self.max_retries:
-                    logger.error(f"[{user_id}] Kimi API调用最终失败, 已达到最大重试次数 {self.max_retries}")
-                    raise Exception(f"Kimi API调用最终失败, 已达到最大重试次数 {self.max_retries}")
+                    return response
+                if stream:
+                    await response.aread()
+                    await response.aclose()
                 
-                # 指数退避策略：2^retry_count秒
-                sleep_time = 2 ** retry_count
-                logger.info(f"[{user_id}] 等待 {sleep_time}秒后重试...")
-                import time
-                time.sleep(sleep_time)
+                if response.status_code != 429 and response.status_code < 500:
+                    # 请求本身有问题，重试没有意义
+                    raise Exception(f"Kimi API请求被拒绝, 状态码: {response.status_code}, 响应: {response.text[:200]}")
+                retry_after = response.headers.get("Retry-After")
+                error = f"状态码 {response.status_code}"
                 
-        raise Exception("Kimi API调用最终失败, 已达到最大重试次数")
+            except (httpx.TransportError, asyncio.TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+            
+            logger.error(f"[{user_id}] Kimi API调用失败 (尝试 {attempt}/{self.max_retries}), 错误: {error}")
+            if attempt >= self.max_retries:
+                break
+            
+            sleep_time = self._backoff_delay(attempt, retry_after)
+            logger.info(f"[{user_id}] 等待 {sleep_time:.2f}秒后重试...")
+            await asyncio.sleep(sleep_time)
+        
+        logger.error(f"[{user_id}] Kimi API调用最终失败, 已达到最大重试次数 {self.max_retries}")
+        raise Exception(f"Kimi API调用最终失败, 已达到最大重试次数 {self.max_retries}")
+    
+    @staticmethod
+    def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        第attempt次失败后的等待时间：服务端给出Retry-After时遵循它，
+        否则在[0, min(上限, 基数 * 2^(attempt-1))]中随机取值（full jitter），避免大量请求同时重试
+        """
+        return backoff_delay(attempt, retry_after)
     
     def _is_final_summary(self, response_text: str) -> bool:
         """
@@ -235,87 +326,7 @@ class KimiInteractionAPI:
         Returns:
             bool: 是否是最终总结
         """
-        # 检查是否包含新的总结关键词和结构标识
-        summary_keywords = [
-            # 标准格式标识
-            "## 🌿 关键词提取",
-            "### 关键词提取", 
-            "关键词提取",
-            "## 💖 你看重的关系特质",
-            "### 你看重的关系特质",
-            "你看重的关系特质",
-            "## 🎯 提问问题包",
-            "### 提问问题包",
-            "提问问题包",
-            
-            # 相似表达
-            "关键词总结",
-            "关键词汇总",
-            "关键词整理",
-            "核心关键词",
-            "重要关键词",
-            "关键信息提取",
-            "信息提取",
-            "特质总结",
-            "关系特质",
-            "你的特质",
-            "个人特质",
-            "性格特质",
-            "关系价值观",
-            "你重视的",
-            "你在意的",
-            "你关注的",
-            "你偏好的",
-            
-            # 问题包相关
-            "现场问题",
-            "约会问题",
-            "交流问题",
-            "聊天问题",
-            "提问工具",
-            "问题工具",
-            "沟通工具",
-            "对话工具",
-            "你可以问",
-            "你可以现场问",
-            "可以问TA",
-            "问对方",
-            "询问对方",
-            "了解对方",
-            "探索对方",
-            
-            # Emoji标识
-            "🌿 关键词",
-            "💖 你看重",
-            "💖 你重视",
-            "💖 关系特质",
-            "🎯 提问",
-            "🎯 问题",
-            "🎯 你可以",
-            "🎯 现场问",
-            "🎯 交流问题",
-            
-            # 生成语句
-            "根据你分享的信息",
-            "基于我们的对话",
-            "通过刚才的交流",
-            "从你的回答中",
-            "我为你生成",
-            "我为你整理",
-            "我为你总结",
-            "帮你整理了",
-            "帮你生成了",
-            "为你准备了",
-            
-            # 结束标识
-            "对话总结",
-            "探索完成",
-            "分析完成",
-            "整理完毕"
-        ]
-        
-        response_lower = response_text.lower()
-        return any(keyword.lower() in response_lower for keyword in summary_keywords)
+        return is_final_summary(response_text)
     
     def _split_final_summary(self, response_text: str) -> list[str]:
         """
@@ -327,76 +338,7 @@ class KimiInteractionAPI:
         Returns:
             list[str]: [关键词摘要部分, 问题包部分]
         """
-        # 寻找问题包的分割点
-        lines = response_text.split('\n')
-        keywords_summary_lines = []
-        questions_lines = []
-        in_questions = False
-        
-        for line in lines:
-            # 检查是否到了问题包部分
-            if any(keyword in line.lower() for keyword in [
-                # 标准格式标识
-                "## 🎯 提问问题包", "### 提问问题包", "提问问题包",
-                "## 🎯 现场问题", "### 现场问题", "现场问题",
-                
-                # 相似表达
-                "约会问题", "交流问题", "聊天问题", "提问工具", "问题工具",
-                "沟通工具", "对话工具", "你可以问", "你可以现场问", "可以问ta",
-                "问对方", "询问对方", "了解对方", "探索对方",
-                
-                # Emoji标识
-                "🎯 提问", "🎯 问题", "🎯 你可以", "🎯 现场问", "🎯 交流问题",
-                
-                # 生成语句
-                "现在，我将根据你分享的信息", "根据你分享的信息，我为你生成",
-                "基于我们的对话，我为你", "通过刚才的交流，我为你",
-                "从你的回答中，我为你", "我为你生成以下", "我为你整理了以下",
-                "我为你总结了以下", "帮你整理了以下", "帮你生成了以下",
-                "为你准备了以下", "以下是为你准备的", "以下是根据你的",
-                
-                # 问题引导语
-                "以下三个问题", "三个问题", "这些问题", "问题列表",
-                "建议问题", "推荐问题", "适合的问题"
-            ]):
-                in_questions = True
-                questions_lines.append(line)
-                continue
-            
-            if in_questions:
-                questions_lines.append(line)
-            else:
-                keywords_summary_lines.append(line)
-        
-        # 构建两个部分
-        keywords_summary = '\n'.join(keywords_summary_lines).strip()
-        questions_part = '\n'.join(questions_lines).strip()
-        
-        # 如果没有找到问题包部分，尝试其他分割方式
-        if not questions_part:
-            # 方法1：寻找数字列表（1. 2. 3.）作为问题包的标识
-            for i, line in enumerate(lines):
-                if line.strip().startswith(('1.', '2.', '3.')) and '?' in line:
-                    keywords_summary = '\n'.join(lines[:i]).strip()
-                    questions_part = '\n'.join(lines[i:]).strip()
-                    break
-            
-            # 方法2：如果仍然没有找到，寻找包含问题引导词的行
-            if not questions_part:
-                for i, line in enumerate(lines):
-                    if any(keyword in line.lower() for keyword in [
-                        "问题：", "问题:", "以下问题", "这些问题", "三个问题",
-                        "适合的问题", "建议问题", "推荐问题", "现场问题"
-                    ]):
-                        keywords_summary = '\n'.join(lines[:i+1]).strip()
-                        questions_part = '\n'.join(lines[i+1:]).strip()
-                        break
-        
-        # 如果仍然没有找到分割点，返回原始消息
-        if not questions_part:
-            return [response_text]
-        
-        return [keywords_summary, questions_part]
+        return split_final_summary(response_text)
     
     async def get_fallback_response(self) -> dict:
         """
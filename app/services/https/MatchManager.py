@@ -1,3 +1,5 @@
+import gc
+import time
 from typing import Optional, Dict, Any
 from app.config import settings
 from app.objects.Match import Match
@@ -19,6 +21,7 @@ class MatchManager:
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance.match_list = {}  # Dictionary to store matches by match_id
+            cls._instance.archived_match_ids = set()  # 已归档到matches_archive的match_id
             logger.info("MatchManager singleton instance created")
         return cls._instance
 
@@ -36,48 +39,12 @@ class MatchManager:
             matches_data = await Database.find("matches")
             logger.info(f"MatchManager construct: Found {len(matches_data)} matches in database")
             
-            loaded_count = 0
-            for match_data in matches_data:
-                try:
-                    match_id = match_data["_id"]  # match_id现在存储在_id字段中
-                    user_id_1 = match_data["user_id_1"]
-                    user_id_2 = match_data["user_id_2"]
-                    
-                    logger.info(f"MatchManager construct: Processing match {match_id} (users: {user_id_1}, {user_id_2})")
-                    
-                    # 创建Match实例但使用现有ID
-                    # 先临时禁用初始化检查
-                    Match._initialized = True
-                    original_counter = Match._match_counter
-                    
-                    # 创建Match实例
-                    match = Match(
-                        telegram_user_session_id_1=user_id_1,
-                        telegram_user_session_id_2=user_id_2,
-                        reason_to_id_1=match_data.get("description_to_user_1", ""),
-                        reason_to_id_2=match_data.get("description_to_user_2", ""),
-                        match_score=match_data.get("match_score", 0),
-                        match_time=match_data.get("match_time", "Unknown")
-                    )
-                    
-                    # 恢复原始计数器并设置正确的match_id
-                    Match._match_counter = original_counter
-                    match.match_id = match_id
-                    
-                    # 设置其他属性
-                    match.is_liked = match_data.get("is_liked", False)
-                    match.mutual_game_scores = match_data.get("mutual_game_scores", {})
-                    match.chatroom_id = match_data.get("chatroom_id")
-                    
-                    # 存储到内存
-                    self.match_list[match_id] = match
-                    loaded_count += 1
-                    
-                    logger.info(f"MatchManager construct: Successfully loaded match {match_id}")
-                    
-                except Exception as e:
-                    logger.error(f"MatchManager construct: Error loading match from database: {e}")
-                    continue
+            loaded_count = self.load_match_documents(matches_data)
+            
+            # 只加载归档匹配的ID，匹配本身在被访问时再从归档集合中恢复
+            archived_data = await Database.find("matches_archive", {}, {"_id": 1})
+            self.archived_match_ids = {archived["_id"] for archived in archived_data}
+            logger.info(f"MatchManager construct: Found {len(self.archived_match_ids)} archived matches")
             
             logger.info(f"MatchManager construct: Loaded {loaded_count} matches from database")
             logger.info(f"MatchManager construct completed successfully")
@@ -87,6 +54,47 @@ class MatchManager:
             logger.error(f"MatchManager construct: Error constructing MatchManager: {e}")
             return False
 
+    def load_match_documents(self, matches_data) -> int:
+        """
+        批量将数据库文档水合为Match实例并放入内存
+        用户实例通过一次取得的user_list批量解析，不逐条输出日志
+        返回成功加载的匹配数量
+        """
+        from app.services.https.UserManagement import UserManagement
+        users = UserManagement().user_list
+        from_document = Match.from_document
+        match_list = self.match_list
+        
+        loaded_count = 0
+        failed_count = 0
+        missing_user_count = 0
+        # 大量创建长期存活的对象时暂停循环垃圾回收，避免反复的全代扫描
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for match_data in matches_data:
+                try:
+                    user_1 = users.get(match_data["user_id_1"])
+                    user_2 = users.get(match_data["user_id_2"])
+                    if user_1 is None or user_2 is None:
+                        missing_user_count += 1
+                
+                    match = from_document(match_data, user_1, user_2)
+                    match_list[match.match_id] = match
+                    loaded_count += 1
+                except Exception as e:
+                    failed_count += 1
+                    logger.error(f"MatchManager construct: Error loading match {match_data.get('_id')} from database: {e}")
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        
+        if missing_user_count:
+            logger.warning(f"MatchManager construct: {missing_user_count} matches reference users not found in UserManagement")
+        if failed_count:
+            logger.warning(f"MatchManager construct: Failed to load {failed_count} matches")
+        return loaded_count
+
     async def create_match(self, user_id_1: int, user_id_2: int, reason_1: str, reason_2: str, match_score: int) -> Match:
         """
         创建新的匹配
@@ -133,9 +141,10 @@ class MatchManager:
             logger.error(f"Error creating match between users {user_id_1} and {user_id_2}: {e}")
             raise
 
-    def get_match(self, match_id) -> Optional[Match]:
+    async def get_match(self, match_id) -> Optional[Match]:
         """
         根据match_id获取匹配
+        如果匹配已被归档，则从matches_archive中恢复到内存和matches集合
         """
         try:
             # 统一转换为int类型
@@ -145,19 +154,107 @@ class MatchManager:
             if match:
                 logger.info(f"Retrieved match {match_id}")
                 return match
-            else:
-                logger.warning(f"Match {match_id} not found in memory")
-                return None
+            
+            if match_id in self.archived_match_ids:
+                return await self._rehydrate_match(match_id)
+            
+            logger.warning(f"Match {match_id} not found in memory")
+            return None
         except Exception as e:
             logger.error(f"Error retrieving match {match_id}: {e}")
             return None
 
-    def toggle_like(self, match_id: int) -> bool:
+    async def _rehydrate_match(self, match_id: int) -> Optional[Match]:
+        """
+        从matches_archive恢复一个归档匹配，放回内存和matches集合
+        """
+        archived_data = await Database.find_one("matches_archive", {"_id": match_id})
+        
+        # 等待数据库期间可能已被其他请求恢复
+        match = self.match_list.get(match_id)
+        if match:
+            return match
+        
+        if not archived_data:
+            logger.warning(f"Archived match {match_id} not found in matches_archive")
+            self.archived_match_ids.discard(match_id)
+            return None
+        
+        from app.services.https.UserManagement import UserManagement
+        user_manager = UserManagement()
+        match = Match.from_document(
+            archived_data,
+            user_manager.get_user_instance(archived_data["user_id_1"]),
+            user_manager.get_user_instance(archived_data["user_id_2"])
+        )
+        match.touch()
+        self.match_list[match_id] = match
+        self.archived_match_ids.discard(match_id)
+        
+        # 移回matches集合
+        if await match.save_to_database():
+            await Database.delete_one("matches_archive", {"_id": match_id})
+        
+        logger.info(f"Rehydrated archived match {match_id}")
+        return match
+
+    async def touch_match(self, match_id) -> None:
+        """
+        记录匹配上的一次活动（例如聊天室消息），归档的匹配会被恢复
+        """
+        if match_id is None:
+            return
+        match = await self.get_match(match_id)
+        if match:
+            match.touch()
+
+    async def archive_inactive_matches(self, inactive_days: Optional[int] = None) -> int:
+        """
+        将超过inactive_days天没有活动的匹配移入matches_archive并从内存中移除
+        返回归档的匹配数量
+        """
+        if inactive_days is None:
+            inactive_days = settings.MATCH_ARCHIVE_AFTER_DAYS
+        if inactive_days <= 0:
+            return 0
+        
+        cutoff = time.time() - inactive_days * 86400
+        stale_matches = [m for m in self.match_list.values() if m.last_activity_time < cutoff]
+        archived_count = 0
+        
+        for match in stale_matches:
+            match_id = match.match_id
+            try:
+                archive_doc = match.to_dict()
+                archive_doc["_id"] = archive_doc.pop("match_id")
+                
+                # 先写归档集合，保证匹配在任何时刻都至少有一份持久化数据
+                await Database.delete_one("matches_archive", {"_id": match_id})
+                await Database.insert_one("matches_archive", archive_doc)
+                
+                # 写入期间匹配可能被访问或已被删除，此时放弃归档
+                if self.match_list.get(match_id) is not match or match.last_activity_time >= cutoff:
+                    await Database.delete_one("matches_archive", {"_id": match_id})
+                    continue
+                
+                self.match_list.pop(match_id, None)
+                self.archived_match_ids.add(match_id)
+                await Database.delete_one("matches", {"_id": match_id})
+                archived_count += 1
+                
+            except Exception as e:
+                logger.error(f"Error archiving match {match_id}: {e}")
+                continue
+        
+        logger.info(f"Archived {archived_count} matches inactive for more than {inactive_days} days")
+        return archived_count
+
+    async def toggle_like(self, match_id: int) -> bool:
         """
         切换匹配的喜欢状态
         """
         try:
-            match = self.get_match(match_id)
+            match = await self.get_match(match_id)
             if match:
                 success = match.toggle_like()
                 if success:
@@ -178,7 +275,7 @@ class MatchManager:
         try:
             if match_id is not None:
                 # Save specific match
-                match = self.get_match(match_id)
+                match = await self.get_match(match_id)
                 if match:
                     success = await match.save_to_database()
                     if success:
@@ -192,10 +289,21 @@ class MatchManager:
                 success_count = 0
                 total_matches = len(self.match_list)
                 
-                for match in self.match_list.values():
-                    if await match.save_to_database():
-                        success_count += 1
-                
+                # 复制一份列表，保存过程中匹配可能被归档或删除
+                for match in list(self.match_list.values()):
+                    if self.match_list.get(match.match_id) is not match:
+                        # 已被归档或删除，不能再写回matches集合
+                        total_matches -= 1
+                        continue
+                    if not await match.save_to_database():
+                        continue
+                    if match.match_id not in self.match_list:
+                        # 保存期间被归档或删除：撤销刚写回的matches文档（已被恢复的匹配由新实例保存，不删除）
+                        await Database.delete_one("matches", {"_id": match.match_id})
+                        total_matches -= 1
+                        continue
+                    success_count += 1
+
                 logger.info(f"Saved {success_count}/{total_matches} matches to database")
                 return success_count == total_matches
                 
@@ -203,12 +311,12 @@ class MatchManager:
             logger.error(f"Error saving matches to database: {e}")
             return False
 
-    def get_match_info(self, user_id: int, match_id: int) -> Optional[Dict[str, Any]]:
+    async def get_match_info(self, user_id: int, match_id: int) -> Optional[Dict[str, Any]]:
         """
         获取匹配信息，返回对特定用户的视图
         """
         try:
-            match = self.get_match(match_id)
+            match = await self.get_match(match_id)
             if not match:
                 logger.error(f"Match {match_id} not found")
                 return None
@@ -238,9 +346,34 @@ class MatchManager:
             logger.error(f"Error getting match info for user {user_id} in match {match_id}: {e}")
             return None
     
+    async def find_match_between(self, user_id_a: int, user_id_b: int) -> Optional[Match]:
+        """
+        查找两个用户之间已有的匹配（不区分顺序），包括已归档的匹配（找到时恢复到内存）
+        """
+        for match in self.match_list.values():
+            if {match.user_id_1, match.user_id_2} == {user_id_a, user_id_b}:
+                return match
+        
+        if not self.archived_match_ids:
+            return None
+        try:
+            archived = await Database.find(
+                "matches_archive",
+                {"$or": [
+                    {"user_id_1": user_id_a, "user_id_2": user_id_b},
+                    {"user_id_1": user_id_b, "user_id_2": user_id_a}
+                ]},
+                {"_id": 1},
+                limit=1
+            )
+        except Exception as e:
+            logger.error(f"Error looking up archived match between users {user_id_a} and {user_id_b}: {e}")
+            return None
+        return await self.get_match(archived[0]["_id"]) if archived else None
+
     def get_user_matches(self, user_id: int) -> list[Match]:
         """
-        获取用户的所有匹配
+        获取用户在内存中的所有匹配（不包括已归档的匹配，查重请使用find_match_between）
         """
         try:
             user_matches = []
@@ -261,35 +394,7 @@ class MatchManager:
         """
         try:
             matches_data = await Database.find("matches")
-            loaded_count = 0
-            
-            for match_data in matches_data:
-                try:
-                    # Reconstruct Match object from database data
-                    match = Match(
-                        telegram_user_session_id_1=match_data["user_id_1"],
-                        telegram_user_session_id_2=match_data["user_id_2"],
-                        reason_to_id_1=match_data["description_to_user_1"],
-                        reason_to_id_2=match_data["description_to_user_2"],
-                        match_score=match_data["match_score"],
-                        match_time=match_data.get("match_time", "Unknown")
-                    )
-                    
-                    # Restore additional properties
-                    match.match_id = match_data["match_id"]
-                    match.is_liked = match_data.get("is_liked", False)
-                    match.mutual_game_scores = match_data.get("mutual_game_scores", {})
-                    match.chatroom_id = match_data.get("chatroom_id")
-                    
-                    # User instances are automatically populated in Match.__init__()
-                    
-                    # Store in memory
-                    self.match_list[match.match_id] = match
-                    loaded_count += 1
-                    
-                except Exception as e:
-                    logger.error(f"Error reconstructing match from database data: {e}")
-                    continue
+            loaded_count = self.load_match_documents(matches_data)
             
             logger.info(f"Loaded {loaded_count} matches from database")
             return True
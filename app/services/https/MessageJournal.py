@@ -0,0 +1,154 @@
+import asyncio
+from pymongo.errors import BulkWriteError
+from app.config import settings
+from app.core.database import Database
+from app.utils.my_logger import MyLogger
+
+logger = MyLogger("MessageJournal")
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+
+class MessageJournal:
+    """
+    内存消息日志，全局唯一
+    MESSAGE_ACK_LEVEL为"accepted"时，消息写入日志后立即投递给接收方，
+    由后台任务按批次insert_many写入数据库，并批量更新对应聊天室
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.pending = {}  # {message_id: message_document} 尚未落库的消息（按写入顺序）
+            cls._instance.flush_lock = asyncio.Lock()
+            cls._instance.attempts = {}  # {message_id: 失败次数} 因非重复键错误写入失败的消息
+            logger.info("MessageJournal singleton instance created")
+        return cls._instance
+
+    def append(self, message):
+        """
+        写入日志（同步方法，不访问数据库）
+        """
+        self.pending[message.message_id] = message.to_document()
+
+    def get_pending(self, message_id):
+        """
+        获取尚未落库的消息文档，不存在返回None
+        """
+        return self.pending.get(message_id)
+
+    def get_pending_for_chatroom(self, chatroom_id, since_seq: int = 0) -> list:
+        """
+        获取某个聊天室中序号大于since_seq且尚未落库的消息文档
+        """
+        return [
+            document for document in self.pending.values()
+            if document["chatroom_id"] == chatroom_id and (document.get("seq") or 0) > since_seq
+        ]
+
+    async def flush(self) -> int:
+        """
+        将一批日志消息写入数据库，返回本批次移出日志的消息数
+        重复_id视为已写入；因其他错误写入失败的消息保留在日志中下次重试，
+        超过MESSAGE_JOURNAL_MAX_ATTEMPTS次后转入死信集合，避免一直阻塞后续消息
+        """
+        async with self.flush_lock:
+            if not self.pending:
+                return 0
+
+            batch_ids = list(self.pending.keys())[:settings.MESSAGE_JOURNAL_MAX_BATCH]
+            documents = [self.pending[message_id] for message_id in batch_ids]
+            failed_ids = set()
+
+            try:
+                await Database.insert_many("messages", documents, ordered=False)
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                failed_ids = {
+                    batch_ids[error["index"]] for error in write_errors
+                    if error.get("code") != DUPLICATE_KEY_ERROR_CODE
+                }
+                if failed_ids:
+                    logger.error(f"Failed to flush {len(failed_ids)}/{len(documents)} journaled messages: {write_errors[:3]}")
+            except Exception as e:
+                # 连接类错误，整批保留等待重试
+                logger.error(f"Failed to flush {len(documents)} journaled messages, will retry: {e}")
+                return 0
+
+            dead_ids = []
+            for message_id in failed_ids:
+                self.attempts[message_id] = self.attempts.get(message_id, 0) + 1
+                if self.attempts[message_id] >= settings.MESSAGE_JOURNAL_MAX_ATTEMPTS:
+                    dead_ids.append(message_id)
+            if dead_ids:
+                await self._dead_letter(dead_ids)
+
+            # 按聊天室分组，每个聊天室只更新一次
+            chatroom_message_ids = {}
+            for message_id in batch_ids:
+                if message_id in failed_ids:
+                    continue
+                document = self.pending.pop(message_id)
+                self.attempts.pop(message_id, None)
+                chatroom_message_ids.setdefault(document["chatroom_id"], []).append(message_id)
+
+            # 导入放在方法内部避免循环导入
+            from app.services.https.ChatroomManager import ChatroomManager
+            chatroom_manager = ChatroomManager()
+            for chatroom_id, message_ids in chatroom_message_ids.items():
+                chatroom = chatroom_manager.chatrooms.get(chatroom_id)
+                if chatroom:
+                    await chatroom.append_messages_to_database(message_ids)
+
+            written = sum(len(message_ids) for message_ids in chatroom_message_ids.values())
+            if written:
+                logger.info(f"Flushed {written} journaled messages in {len(chatroom_message_ids)} chatrooms")
+            return written + len(dead_ids)
+
+    async def _dead_letter(self, message_ids: list):
+        """
+        将多次写入失败的消息移出日志并写入死信集合（尽力而为，失败时把消息内容记入日志）
+        """
+        documents = []
+        for message_id in message_ids:
+            documents.append(self.pending.pop(message_id))
+            self.attempts.pop(message_id, None)
+
+        logger.error(f"Dropping {len(documents)} journaled messages after {settings.MESSAGE_JOURNAL_MAX_ATTEMPTS} failed attempts: {message_ids}")
+        try:
+            await Database.insert_many("messages_dead_letter", documents, ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to write dead-letter messages: {e}; documents: {documents}")
+
+    async def drain(self) -> bool:
+        """
+        写入全部日志消息（关闭服务时调用），返回日志是否已清空
+        """
+        while self.pending:
+            if await self.flush() == 0:
+                break
+        if self.pending:
+            logger.error(f"MessageJournal drain: {len(self.pending)} messages could not be written to database")
+            return False
+        return True
+
+    async def run(self):
+        """
+        后台批量落库循环
+        """
+        interval = settings.MESSAGE_JOURNAL_FLUSH_INTERVAL_MS / 1000
+        logger.info(f"启动消息日志落库任务，每{settings.MESSAGE_JOURNAL_FLUSH_INTERVAL_MS}毫秒批量写入一次")
+
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                while self.pending:
+                    if await self.flush() == 0:
+                        break
+            except asyncio.CancelledError:
+                logger.info("消息日志落库任务被取消")
+                break
+            except Exception as e:
+                logger.error(f"消息日志落库任务发生错误: {e}")
+                await asyncio.sleep(1)
@@ -0,0 +1,103 @@
+import asyncio
+import time
+import uuid
+from app.config import settings
+from app.core.database import Database
+from app.utils.my_logger import MyLogger
+
+logger = MyLogger("PendingEventQueue")
+
+
+class PendingEventQueue:
+    """
+    离线事件队列，全局唯一
+    用户不在线时，发给他的私信、新匹配和点赞事件暂存在这里（每个用户最多OFFLINE_QUEUE_MAX_EVENTS条），
+    用户下次认证成功后作为一个批次发出，发送成功后再确认删除
+    pending_events集合为准：每个用户一个文档，事件用$push/$pull原子增删，多个worker之间不会互相覆盖
+    """
+    _instance = None
+    COLLECTION = "pending_events"
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.background_tasks = set()  # 进行中的确认任务，保持引用防止被回收
+            logger.info("PendingEventQueue singleton instance created")
+        return cls._instance
+
+    async def push(self, user_id, event: dict, coalesce_key: str = None) -> bool:
+        """
+        为离线用户暂存一个事件，返回是否写入成功
+        带coalesce_key的事件替换队列中相同key的旧事件（例如同一匹配的点赞状态只保留最新的）
+        """
+        user_id = str(user_id)
+        max_events = settings.OFFLINE_QUEUE_MAX_EVENTS
+        event = dict(event, event_id=uuid.uuid4().hex, queued_at=time.time())
+        try:
+            if coalesce_key is not None:
+                event["coalesce_key"] = coalesce_key
+                await Database.update_one(self.COLLECTION, {"_id": user_id}, {"$pull": {"events": {"coalesce_key": coalesce_key}}})
+
+            # 队列已满时这次写入会挤掉最早的事件，客户端需要按since_seq补齐
+            await Database.update_one(
+                self.COLLECTION,
+                {"_id": user_id, f"events.{max_events - 1}": {"$exists": True}},
+                {"$set": {"truncated": True}}
+            )
+            await Database.update_one(
+                self.COLLECTION,
+                {"_id": user_id},
+                {"$push": {"events": {"$each": [event], "$slice": -max_events}}},
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Failed to queue pending event for user {user_id}: {e}")
+            return False
+
+    async def peek(self, user_id) -> dict:
+        """
+        读取用户的全部事件但不删除，发送成功后调用ack确认
+        没有事件时返回None
+        """
+        user_id = str(user_id)
+        document = await Database.find_one(self.COLLECTION, {"_id": user_id})
+        events = document.get("events") if document else None
+        if not events:
+            return None
+        return {"events": events, "truncated": bool(document.get("truncated"))}
+
+    async def ack(self, user_id, events: list) -> bool:
+        """
+        确认事件已送达：只删除这一批事件，peek之后新加入的事件保留到下次
+        """
+        user_id = str(user_id)
+        event_ids = [event["event_id"] for event in events if "event_id" in event]
+        # 旧版本写入的事件没有event_id，按queued_at匹配
+        legacy_times = [event["queued_at"] for event in events if "event_id" not in event]
+        try:
+            await Database.update_one(
+                self.COLLECTION,
+                {"_id": user_id},
+                {"$pull": {"events": {"$or": [
+                    {"event_id": {"$in": event_ids}},
+                    {"event_id": {"$exists": False}, "queued_at": {"$in": legacy_times}}
+                ]}}, "$set": {"truncated": False}}
+            )
+            await Database.delete_one(self.COLLECTION, {"_id": user_id, "events": {"$size": 0}})
+            return True
+        except Exception as e:
+            logger.error(f"Failed to acknowledge {len(events)} pending events for user {user_id}: {e}")
+            return False
+
+    def ack_later(self, user_id, events: list):
+        """
+        在后台确认事件（同步方法，供发送队列的发送成功回调使用）
+        """
+        task = asyncio.ensure_future(self.ack(user_id, events))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def pending_count(self, user_id) -> int:
+        document = await Database.find_one(self.COLLECTION, {"_id": str(user_id)})
+        return len(document.get("events") or []) if document else 0
@@ -282,7 +282,7 @@ class UserManagement:
             messages_to_delete = []   # 需要删除的消息
             
             for match_id in user_match_ids:
-                match_instance = match_manager.get_match(match_id)
+                match_instance = await match_manager.get_match(match_id)
                 if match_instance:
                     matches_to_delete.append(match_instance)
                     
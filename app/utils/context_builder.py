@@ -0,0 +1,158 @@
+import math
+from collections import deque
+from typing import Dict, List, Optional
+from app.config import settings
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_HEADER = "以下是你和用户较早对话的摘要（按时间顺序，已截断）：\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数（不依赖分词器）：
+    中文等非ASCII字符按每字1个token（对moonshot偏保守），ASCII按每4个字符1个token
+    """
+    if not text:
+        return 0
+    ascii_count = len(text.encode("ascii", "ignore"))
+    return (len(text) - ascii_count) + math.ceil(ascii_count / 4)
+
+
+class ContextBuilder:
+    """
+    AI对话上下文构建器，把请求控制在AI_CONTEXT_TOKEN_BUDGET以内：
+    - 系统提示词和当前用户消息总是保留
+    - 从最新的轮次往前尽量多地保留原文
+    - 更早的轮次压缩为滚动摘要（每轮截取开头一段），按用户缓存，
+      只处理新滑出窗口的轮次；摘要超出AI_SUMMARY_TOKEN_BUDGET时丢弃最早的摘要行
+    - 历史来自有界缓冲区，最早的消息可能已被丢弃：按最后一条已压缩的消息重新定位已压缩的位置
+    """
+
+    def __init__(self):
+        # {user_id: {"covered": 已压缩的历史条数, "anchor": 最后一条已压缩的消息, "lines": deque, "tokens": int}}
+        self._summaries = {}
+
+    def build_messages(self, user_id: Optional[int], system_prompt: str, history: List[tuple], message: Optional[str] = None,
+                       system_prompt_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        构建发送给AI的消息列表
+
+        Args:
+            user_id: 用户ID（None时不使用摘要缓存）
+            system_prompt: 系统提示词
+            history: List[Tuple[str, str, int, str]] (消息内容, ISO时间字符串, 发送者ID, 显示名称)，按时间顺序
+            message: 当前用户消息（None时由调用方追加）
+            system_prompt_tokens: 预先计算的系统提示词token数（None时现场估算）
+        """
+        budget = settings.AI_CONTEXT_TOKEN_BUDGET
+        if system_prompt_tokens is None:
+            system_prompt_tokens = estimate_tokens(system_prompt)
+        used = system_prompt_tokens + MESSAGE_OVERHEAD_TOKENS
+        if message is not None:
+            used += estimate_tokens(message) + MESSAGE_OVERHEAD_TOKENS
+
+        # 先尝试不留摘要空间；放不下全部历史（或已有摘要）时再预留摘要的空间
+        split = self._fit_recent(history, budget - used)
+        cached = self._summaries.get(user_id) if user_id is not None else None
+        if split > 0 or (cached is not None and cached["covered"] > 0):
+            split = self._fit_recent(history, budget - used - settings.AI_SUMMARY_TOKEN_BUDGET - MESSAGE_OVERHEAD_TOKENS)
+
+        summary = self._update_summary(user_id, history, split)
+        # 已压缩进摘要的轮次不再以原文出现
+        if summary is not None and summary["covered"] > split:
+            split = summary["covered"]
+
+        messages = [{"role": "system", "content": system_prompt}]
+        if summary is not None and summary["lines"]:
+            messages.append({"role": "system", "content": SUMMARY_HEADER + "\n".join(summary["lines"])})
+        for message_content, _, _, display_name in history[split:]:
+            messages.append({
+                "role": "user" if display_name == "I" else "assistant",
+                "content": message_content
+            })
+        if message is not None:
+            messages.append({"role": "user", "content": message})
+        return messages
+
+    @staticmethod
+    def _fit_recent(history: List[tuple], available: int) -> int:
+        """
+        从最新的轮次往前累加，返回能放进available个token的最早下标（只遍历放得下的轮次）
+        """
+        split = len(history)
+        for index in range(len(history) - 1, -1, -1):
+            available -= estimate_tokens(history[index][0]) + MESSAGE_OVERHEAD_TOKENS
+            if available < 0:
+                break
+            split = index
+        return split
+
+    def _update_summary(self, user_id: Optional[int], history: List[tuple], split: int) -> Optional[dict]:
+        """
+        把history[:split]中尚未压缩的轮次追加到该用户的摘要
+        对话被重置时重新开始
+        """
+        if user_id is None:
+            if split == 0:
+                return None
+            summary = {"covered": 0, "anchor": None, "lines": deque(), "tokens": 0}
+        else:
+            summary = self._summaries.get(user_id)
+            covered = self._locate_covered(summary, history) if summary is not None else None
+            if covered is None:
+                summary = self._summaries[user_id] = {"covered": 0, "anchor": None, "lines": deque(), "tokens": 0}
+            else:
+                summary["covered"] = covered
+
+        for message_content, _, _, display_name in history[summary["covered"]:split]:
+            line = self._compact_turn(message_content, display_name)
+            summary["lines"].append(line)
+            summary["tokens"] += estimate_tokens(line) + 1
+        summary["covered"] = max(summary["covered"], split)
+        summary["anchor"] = history[summary["covered"] - 1] if summary["covered"] else None
+
+        while summary["tokens"] > settings.AI_SUMMARY_TOKEN_BUDGET and summary["lines"]:
+            summary["tokens"] -= estimate_tokens(summary["lines"].popleft()) + 1
+        return summary
+
+    @staticmethod
+    def _locate_covered(summary: dict, history: List[tuple]) -> Optional[int]:
+        """
+        已压缩部分在当前history中的结束下标：最早的消息被丢弃后向前移动；
+        最后一条已压缩的消息也已被丢弃时为0，对话被重置时返回None
+        """
+        covered, anchor = summary["covered"], summary["anchor"]
+        if covered == 0:
+            return 0
+        for index in range(min(covered, len(history)) - 1, -1, -1):
+            if history[index] == anchor:
+                return index + 1
+        # 当前历史全部晚于最后一条已压缩的消息（时间为ISO字符串，可以直接比较）
+        if history and history[0][1] > anchor[1]:
+            return 0
+        return None
+
+    @staticmethod
+    def _compact_turn(message_content: str, display_name: str) -> str:
+        """
+        把一轮对话压缩为一行：用户的话保留得多一些（总结依赖用户提供的信息），AI的话只保留开头
+        """
+        if display_name == "I":
+            speaker, limit = "用户", settings.AI_SUMMARY_LINE_CHARS
+        else:
+            speaker, limit = "AI", settings.AI_SUMMARY_LINE_CHARS // 2
+        text = " ".join(message_content.split())
+        if len(text) > limit:
+            text = text[:limit] + "…"
+        return f"{speaker}: {text}"
+
+    def forget(self, user_id: int):
+        """
+        清除用户的摘要缓存
+        """
+        self._summaries.pop(user_id, None)
+
+
+# 创建全局实例
+context_builder = ContextBuilder()
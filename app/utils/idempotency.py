@@ -0,0 +1,93 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+from app.config import settings
+
+
+class IdempotencyCache:
+    """
+    幂等请求缓存（用于客户端带Idempotency-Key重试的AI聊天请求）：
+    - 相同(user_id, key)的请求正在处理时，后到的请求等待同一个任务（single-flight），不重复调用AI
+    - 完成的结果按(user_id, key, 历史版本)缓存AI_IDEMPOTENCY_TTL_SECONDS秒，重试时直接重放；
+      历史版本在结果保存之后读取，对话继续或被重置后旧结果不再匹配
+    - 执行失败（抛出异常，或cacheable判定为不可缓存）时不缓存，等待同一任务的请求收到同一个结果/异常
+    """
+
+    def __init__(self):
+        self._in_flight = {}  # {(user_id, key): asyncio.Task}
+        self._results: "OrderedDict[tuple, tuple]" = OrderedDict()  # {(user_id, key, version): (过期时间, 结果)}
+
+    def _lookup(self, user_id: Hashable, key: str, version: Hashable) -> Optional[Any]:
+        """
+        查找未过期的缓存结果
+        """
+        cache_key = (user_id, key, version)
+        cached = self._results.get(cache_key)
+        if cached is None:
+            return None
+        expire_at, result = cached
+        if expire_at <= time.monotonic():
+            del self._results[cache_key]
+            return None
+        self._results.move_to_end(cache_key)
+        return result
+
+    def _store(self, user_id: Hashable, key: str, version: Hashable, result: Any):
+        """
+        缓存结果，超出AI_IDEMPOTENCY_MAX_ENTRIES时丢弃最久未使用的结果
+        """
+        self._results[(user_id, key, version)] = (time.monotonic() + settings.AI_IDEMPOTENCY_TTL_SECONDS, result)
+        self._results.move_to_end((user_id, key, version))
+        while len(self._results) > settings.AI_IDEMPOTENCY_MAX_ENTRIES:
+            self._results.popitem(last=False)
+
+    async def run(self, user_id: Hashable, key: str, get_version: Callable[[], Awaitable[Hashable]],
+                  factory: Callable[[], Awaitable[Any]],
+                  cacheable: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """
+        执行或重放一次幂等请求
+
+        Args:
+            user_id: 用户ID
+            key: 客户端提供的幂等键
+            get_version: 返回该用户当前历史版本的协程函数
+            factory: 真正执行请求的协程函数（只会被调用一次）
+            cacheable: 判断结果是否可以缓存的函数（None时总是缓存）
+
+        Returns:
+            (结果, 是否为重放/合并的结果)
+        """
+        cached = self._lookup(user_id, key, await get_version())
+        if cached is not None:
+            return cached, True
+
+        flight_key = (user_id, key)
+        task = self._in_flight.get(flight_key)
+        replayed = task is not None
+        if task is None:
+            task = asyncio.ensure_future(self._execute(flight_key, get_version, factory, cacheable))
+            self._in_flight[flight_key] = task
+        # 发起请求的客户端断开时任务继续执行，保证对话被保存、重试能拿到结果
+        return await asyncio.shield(task), replayed
+
+    async def _execute(self, flight_key: tuple, get_version: Callable[[], Awaitable[Hashable]],
+                       factory: Callable[[], Awaitable[Any]],
+                       cacheable: Optional[Callable[[Any], bool]]) -> Any:
+        try:
+            result = await factory()
+            if cacheable is None or cacheable(result):
+                self._store(*flight_key, await get_version(), result)
+            return result
+        finally:
+            self._in_flight.pop(flight_key, None)
+
+    def clear(self):
+        """
+        清空缓存结果（不影响正在处理的请求）
+        """
+        self._results.clear()
+
+
+# 创建全局实例
+chat_idempotency = IdempotencyCache()
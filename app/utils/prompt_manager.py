@@ -1,10 +1,33 @@
+import hashlib
 import os
+import time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, NamedTuple, Optional
+from app.config import settings
+from app.utils.context_builder import estimate_tokens
+from app.utils.my_logger import MyLogger
+
+logger = MyLogger("PromptManager")
+
+CORE_PROMPT_FILES = ['role.md', 'object.md', 'skill.md', 'constraint.md', 'workflow.md']
+GENDER_PROMPT_FILES = {
+    "male": "male.md",
+    "female": "female.md",
+    "neutral": "neutral.md"
+}
+
+
+class CompiledPrompt(NamedTuple):
+    """预先组合好的完整系统提示词（不可变）"""
+    text: str
+    token_count: int  # estimate_tokens估算的token数
+    version: str  # 所有prompt文件内容的哈希前缀，用于追踪每次回复使用的提示词
+
 
 class PromptManager:
     """
     提示词管理器，负责读取和组合prompt文件
+    每种性别的完整提示词预先组合好；prompt文件的修改时间变化时重新组合并整体替换
     """
     
     def __init__(self):
@@ -12,6 +35,9 @@ class PromptManager:
         # 获取prompts文件夹路径
         self.prompts_dir = Path(__file__).parent.parent / "prompts"
         self._cache = {}  # 缓存读取的文件内容
+        self._compiled = {}  # {gender: CompiledPrompt}，重新加载时整体替换
+        self._file_stamps = None  # 上次组合时各文件的(mtime_ns, size)
+        self._next_check_at = 0.0
     
     def _read_prompt_file(self, filename: str) -> str:
         """
@@ -36,9 +62,66 @@ class PromptManager:
                 self._cache[filename] = content
                 return content
         except Exception as e:
-            print(f"读取prompt文件 {filename} 失败: {e}")
+            logger.error(f"读取prompt文件 {filename} 失败: {e}")
             return ""
     
+    def _stat_prompt_files(self) -> tuple:
+        """
+        各prompt文件的(文件名, mtime_ns, size)，文件不存在时为None
+        """
+        stamps = []
+        for filename in CORE_PROMPT_FILES + list(GENDER_PROMPT_FILES.values()):
+            try:
+                stat = os.stat(self.prompts_dir / filename)
+                stamps.append((filename, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamps.append((filename, None, None))
+        return tuple(stamps)
+
+    def reload_if_changed(self, force: bool = False) -> bool:
+        """
+        检查prompt文件是否被修改（最多每PROMPT_RELOAD_CHECK_SECONDS秒stat一次），
+        有变化时重新组合所有性别的提示词并整体替换，返回是否重新加载
+        """
+        now = time.monotonic()
+        if not force and self._compiled and now < self._next_check_at:
+            return False
+        self._next_check_at = now + settings.PROMPT_RELOAD_CHECK_SECONDS
+
+        stamps = self._stat_prompt_files()
+        if not force and stamps == self._file_stamps:
+            return False
+
+        self._cache = {}
+        texts = {gender: self._assemble_prompt(gender) for gender in GENDER_PROMPT_FILES}
+        digest = hashlib.sha256()
+        for filename in CORE_PROMPT_FILES + list(GENDER_PROMPT_FILES.values()):
+            digest.update(filename.encode("utf-8") + b"\0" + self._read_prompt_file(filename).encode("utf-8") + b"\0")
+        version = digest.hexdigest()[:12]
+
+        # 一次赋值完成替换，读取方不会看到组合到一半的结果
+        self._compiled = {
+            gender: CompiledPrompt(text, estimate_tokens(text), version)
+            for gender, text in texts.items()
+        }
+        self._file_stamps = stamps
+        logger.info(f"系统提示词已重新组合，版本 {version}")
+        return True
+
+    def get_compiled_prompt(self, gender: str = "neutral") -> CompiledPrompt:
+        """
+        获取预先组合好的完整系统提示词
+        
+        Args:
+            gender: 性别 ('male', 'female', 'neutral')
+            
+        Returns:
+            CompiledPrompt: 提示词文本、token数和版本
+        """
+        self.reload_if_changed()
+        compiled = self._compiled
+        return compiled.get(gender.lower()) or compiled["neutral"]
+
     def get_core_prompts(self) -> str:
         """
         获取核心提示词内容
@@ -46,10 +129,9 @@ class PromptManager:
         Returns:
             str: 组合后的核心提示词
         """
-        core_files = ['role.md', 'object.md', 'skill.md', 'constraint.md', 'workflow.md']
         prompts = []
         
-        for filename in core_files:
+        for filename in CORE_PROMPT_FILES:
             content = self._read_prompt_file(filename)
             if content:
                 prompts.append(content)
@@ -66,18 +148,12 @@ class PromptManager:
         Returns:
             str: 性别特定的提示词内容
         """
-        gender_map = {
-            "male": "male.md",
-            "female": "female.md",
-            "neutral": "neutral.md"
-        }
-        
-        filename = gender_map.get(gender.lower(), "neutral.md")
+        filename = GENDER_PROMPT_FILES.get(gender.lower(), "neutral.md")
         return self._read_prompt_file(filename)
     
     def get_complete_prompt(self, gender: str = "neutral") -> str:
         """
-        获取完整的系统提示词
+        获取完整的系统提示词（预先组合好的结果）
         
         Args:
             gender: 性别 ('male', 'female', 'neutral')
@@ -85,6 +161,12 @@ class PromptManager:
         Returns:
             str: 完整的系统提示词
         """
+        return self.get_compiled_prompt(gender).text
+    
+    def _assemble_prompt(self, gender: str) -> str:
+        """
+        组合核心提示词和性别特定的提示词
+        """
         core_prompts = self.get_core_prompts()
         gender_prompt = self.get_gender_specific_prompt(gender)
         
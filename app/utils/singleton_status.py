@@ -49,6 +49,9 @@ class SingletonStatusReporter:
                 "match_list": {
                     "size": len(match_mgr.match_list),
                     "items": match_mgr.match_list if len(match_mgr.match_list) <= 5 else f"Too many items ({len(match_mgr.match_list)}), showing first 5: {match_mgr.match_list[:5]}"
+                },
+                "archived_match_ids": {
+                    "size": len(match_mgr.archived_match_ids)
                 }
             }
         except Exception as e:
@@ -67,6 +70,31 @@ class SingletonStatusReporter:
         except Exception as e:
             status["ChatroomManager"] = {"error": str(e)}
         
+        # AIResponseProcessor 状态
+        try:
+            from app.services.https.AIResponseProcessor import AIResponseProcessor
+            ai_processor = AIResponseProcessor()
+            status["AIResponseProcessor"] = {
+                "ai_histories": {"size": len(ai_processor.ai_histories)},
+                "history_loads": {"size": len(ai_processor.history_loads)},
+                "unsaved_messages": {"size": len(ai_processor.unsaved_messages)}
+            }
+        except Exception as e:
+            status["AIResponseProcessor"] = {"error": str(e)}
+        
+        # AIAdmissionController 状态
+        try:
+            from app.services.https.AIAdmissionController import AIAdmissionController
+            admission = AIAdmissionController()
+            status["AIAdmissionController"] = {
+                "in_flight": {"size": admission.in_flight},
+                "waiters": {"size": len(admission.waiters)},
+                "user_locks": {"size": len(admission.user_locks)},
+                "stats": admission.get_stats()
+            }
+        except Exception as e:
+            status["AIAdmissionController"] = {"error": str(e)}
+        
         return status
     
     @staticmethod
@@ -0,0 +1,182 @@
+"""
+最终总结的检测和分割（KimiInteractionAPI和AIResponseProcessor共用）
+每组关键词预先编译为一个前缀树形式的正则（共享前缀的分支合并），由C实现的正则引擎单遍扫描文本，
+而不是对每个关键词分别查找子串
+"""
+
+import re
+from typing import Iterable, List, Optional
+
+
+class KeywordMatcher:
+    """
+    多关键词匹配器：search返回最左边的匹配，contains判断是否包含任意关键词
+    """
+
+    def __init__(self, keywords: Iterable[str], ignore_case: bool = True):
+        self.keywords = tuple(dict.fromkeys(keyword.lower() if ignore_case else keyword for keyword in keywords))
+        flags = re.IGNORECASE if ignore_case else 0
+        self.pattern = re.compile(self._trie_pattern(self.keywords), flags)
+
+    @staticmethod
+    def _trie_pattern(keywords: Iterable[str]) -> str:
+        """
+        把关键词构建为前缀树，再转换为正则：每个节点只对下一个字符分支一次
+        """
+        trie = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[""] = {}  # 关键词在此结束
+
+        def build(node: dict) -> str:
+            branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ""
+            body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+            return f"(?:{body})?" if "" in node else body
+
+        return build(trie) if trie else "(?!)"
+
+    def search(self, text: str) -> Optional[re.Match]:
+        return self.pattern.search(text)
+
+    def contains(self, text: str) -> bool:
+        return self.pattern.search(text) is not None
+
+
+# 最终总结的标识（任意一个出现即认为是最终总结，不区分大小写）
+FINAL_SUMMARY_KEYWORDS = (
+    # 标准格式标识
+    "## 🌿 关键词提取", "### 关键词提取", "关键词提取",
+    "## 💖 你看重的关系特质", "### 你看重的关系特质", "你看重的关系特质",
+    "## 🎯 提问问题包", "### 提问问题包", "提问问题包",
+    # 相似表达
+    "关键词总结", "关键词汇总", "关键词整理", "核心关键词", "重要关键词", "关键信息提取", "信息提取",
+    "特质总结", "关系特质", "你的特质", "个人特质", "性格特质", "关系价值观",
+    "你重视的", "你在意的", "你关注的", "你偏好的",
+    # 问题包相关
+    "现场问题", "约会问题", "交流问题", "聊天问题", "提问工具", "问题工具", "沟通工具", "对话工具",
+    "你可以问", "你可以现场问", "可以问TA", "问对方", "询问对方", "了解对方", "探索对方",
+    # Emoji标识
+    "🌿 关键词", "💖 你看重", "💖 你重视", "💖 关系特质",
+    "🎯 提问", "🎯 问题", "🎯 你可以", "🎯 现场问", "🎯 交流问题",
+    # 生成语句
+    "根据你分享的信息", "基于我们的对话", "通过刚才的交流", "从你的回答中",
+    "我为你生成", "我为你整理", "我为你总结", "帮你整理了", "帮你生成了", "为你准备了",
+    # 结束标识
+    "对话总结", "探索完成", "分析完成", "整理完毕",
+)
+
+# 问题包部分的开头（所在行及之后的内容属于问题包）
+QUESTION_SECTION_KEYWORDS = (
+    # 标准格式标识
+    "## 🎯 提问问题包", "### 提问问题包", "提问问题包",
+    "## 🎯 现场问题", "### 现场问题", "现场问题",
+    # 相似表达
+    "约会问题", "交流问题", "聊天问题", "提问工具", "问题工具",
+    "沟通工具", "对话工具", "你可以问", "你可以现场问", "可以问ta",
+    "问对方", "询问对方", "了解对方", "探索对方",
+    # Emoji标识
+    "🎯 提问", "🎯 问题", "🎯 你可以", "🎯 现场问", "🎯 交流问题",
+    # 生成语句
+    "现在，我将根据你分享的信息", "根据你分享的信息，我为你生成",
+    "基于我们的对话，我为你", "通过刚才的交流，我为你",
+    "从你的回答中，我为你", "我为你生成以下", "我为你整理了以下",
+    "我为你总结了以下", "帮你整理了以下", "帮你生成了以下",
+    "为你准备了以下", "以下是为你准备的", "以下是根据你的",
+    # 问题引导语
+    "以下三个问题", "三个问题", "这些问题", "问题列表",
+    "建议问题", "推荐问题", "适合的问题",
+)
+
+# 没有问题包标识时，问题引导语所在行之后的内容属于问题包
+QUESTION_INTRO_KEYWORDS = (
+    "问题：", "问题:", "以下问题", "这些问题", "三个问题",
+    "适合的问题", "建议问题", "推荐问题", "现场问题",
+)
+
+# 伴侣画像和筛选问题之间的分割词（分割词保留在第二部分开头）
+PROFILE_SPLIT_KEYWORDS = (
+    "filter questions", "筛选问题", "问题工具包", "提问建议", "约会提问",
+    "推荐提问", "建议提问", "实用提问", "情景提问", "初期提问",
+)
+
+# 对话结束的标识（区分大小写）
+CONVERSATION_END_KEYWORDS = (
+    "总结", "总结报告", "建议总结", "对话总结", "最终建议", "结束语",
+    "#end", "Your Ideal Partner Profile", "理想伴侣画像",
+)
+
+PROFILE_SEPARATOR = "***"
+NUMBERED_QUESTION_PREFIXES = ("1.", "2.", "3.")
+
+_final_summary_matcher = KeywordMatcher(FINAL_SUMMARY_KEYWORDS)
+_question_section_matcher = KeywordMatcher(QUESTION_SECTION_KEYWORDS)
+_question_intro_matcher = KeywordMatcher(QUESTION_INTRO_KEYWORDS)
+_profile_split_matcher = KeywordMatcher(PROFILE_SPLIT_KEYWORDS)
+_conversation_end_matcher = KeywordMatcher(CONVERSATION_END_KEYWORDS, ignore_case=False)
+
+
+def is_final_summary(response_text: str) -> bool:
+    """
+    检查AI响应是否是最终总结
+    """
+    return _final_summary_matcher.contains(response_text)
+
+
+def is_conversation_end(response_text: str) -> bool:
+    """
+    检查AI响应是否表示对话结束
+    """
+    return _conversation_end_matcher.contains(response_text)
+
+
+def split_final_summary(response_text: str) -> List[str]:
+    """
+    分割最终总结为关键词摘要和问题包两部分
+
+    Returns:
+        list[str]: [关键词摘要部分, 问题包部分]，找不到分割点时为[原文]
+    """
+    lines = response_text.split('\n')
+
+    # 第一个包含问题包标识的行及之后的内容属于问题包（关键词不含换行，最左边的匹配就在第一个这样的行）
+    match = _question_section_matcher.search(response_text)
+    if match:
+        index = response_text.count('\n', 0, match.start())
+        return ['\n'.join(lines[:index]).strip(), '\n'.join(lines[index:]).strip()]
+
+    # 方法1：寻找带问号的数字列表（1. 2. 3.）作为问题包的开头
+    for index, line in enumerate(lines):
+        if line.strip().startswith(NUMBERED_QUESTION_PREFIXES) and '?' in line:
+            return ['\n'.join(lines[:index]).strip(), '\n'.join(lines[index:]).strip()]
+
+    # 方法2：问题引导语所在行之后的内容属于问题包
+    match = _question_intro_matcher.search(response_text)
+    if match:
+        index = response_text.count('\n', 0, match.start())
+        questions_part = '\n'.join(lines[index + 1:]).strip()
+        if questions_part:
+            return ['\n'.join(lines[:index + 1]).strip(), questions_part]
+
+    return [response_text]
+
+
+def split_profile_summary(response_text: str) -> List[str]:
+    """
+    分割伴侣画像总结为两部分：优先用***分割，其次用Filter Questions/筛选问题等关键词分割（不区分大小写，分割词保留在第二部分开头）
+
+    Returns:
+        list[str]: [画像部分, 筛选问题部分]，找不到分割点时为[原文]
+    """
+    position = response_text.find(PROFILE_SEPARATOR)
+    if position != -1:
+        return [response_text[:position].strip(), response_text[position + len(PROFILE_SEPARATOR):].strip()]
+
+    match = _profile_split_matcher.search(response_text)
+    if match:
+        return [response_text[:match.start()].strip(), response_text[match.start():].strip()]
+
+    return [response_text]
@@ -58,6 +58,7 @@ class APIConfig:
     
     # Backend API Configuration
     API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")  # 本地服务器API地址
+    AUTH_ISSUER_KEY = os.getenv("AUTH_ISSUER_KEY", "")  # 与后端相同的签发密钥，以可信后端身份调用接口（X-Issuer-Key）
     
     # Telegram Bot Configuration
     # yukio原来的 token（已注释）
@@ -28,6 +28,7 @@ users_collection = db[Config.Database.USER_COLLECTION]  # 新增：用户表集
 
 # API配置
 API_BASE_URL = Config.API.API_BASE_URL  # 从配置文件获取API地址
+API_HEADERS = {"X-Issuer-Key": Config.API.AUTH_ISSUER_KEY}  # 后端接口需要token或签发密钥
 
 logging.basicConfig(
     format=Config.Logging.LOG_FORMAT,
@@ -51,7 +52,7 @@ user_target_gender = {}  # 记录用户目标性别
 async def create_new_user_api(telegram_user_id: int, telegram_user_name: str, gender: int):
     """调用后端API创建新用户，使用schema定义"""
     try:
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(headers=API_HEADERS) as client:
             url = f"{API_BASE_URL}/api/v1/UserManagement/create_new_user"
             
             # 使用schema构造请求
@@ -84,7 +85,7 @@ async def create_new_user_api(telegram_user_id: int, telegram_user_name: str, ge
 async def edit_user_age_api(user_id: int, age: int):
     """调用后端API编辑用户年龄，使用schema定义"""
     try:
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(headers=API_HEADERS) as client:
             url = f"{API_BASE_URL}/api/v1/UserManagement/edit_user_age"
             
             # 使用schema构造请求
@@ -113,7 +114,7 @@ async def edit_user_age_api(user_id: int, age: int):
 async def edit_target_gender_api(user_id: int, target_gender: int):
     """调用后端API编辑用户目标性别，使用schema定义"""
     try:
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(headers=API_HEADERS) as client:
             url = f"{API_BASE_URL}/api/v1/UserManagement/edit_target_gender"
             
             # 使用schema构造请求
@@ -142,7 +143,7 @@ async def edit_target_gender_api(user_id: int, target_gender: int):
 async def edit_summary_api(user_id: int, summary: str):
     """调用后端API编辑用户总结，使用schema定义"""
     try:
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(headers=API_HEADERS) as client:
             url = f"{API_BASE_URL}/api/v1/UserManagement/edit_summary"
             
             # 使用schema构造请求
@@ -614,7 +615,7 @@ async def check_user_exists_api(user_id: int) -> bool:
     """
     api_url = get_api_base_url() + "/api/v1/UserManagement/get_user_info_with_user_id"
     try:
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(headers=API_HEADERS) as client:
             # 使用schema构造请求
             request = GetUserInfoWithUserIdRequest(user_id=user_id)
             req_body = request.dict()
@@ -689,7 +690,7 @@ async def deactivate_user_api(user_id: int) -> bool:
     """
     api_url = get_api_base_url() + "/api/v1/UserManagement/deactivate_user"
     try:
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(headers=API_HEADERS) as client:
             # 使用schema构造请求
             request = DeactivateUserRequest(user_id=user_id)
             req_body = request.dict()
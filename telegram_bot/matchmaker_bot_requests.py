@@ -6,6 +6,7 @@ import requests
 from typing import List, Dict, Optional, Any
 from datetime import datetime
 from dotenv import load_dotenv
+from profile_splitter import split_profile_summary
 
 # Load environment variables from .env file
 load_dotenv()
@@ -404,34 +405,9 @@ class MatchmakerBot:
     
     def _split_final_summary(self, response_text: str) -> list[str]:
         """
-        分割最终总结为两部分：只保留 Ideal Partner Profile 及其后内容为第一条，第二条为筛选问题部分。
-        优先用 *** 分割，其次用 Filter Questions/筛选问题等关键词分割，分割点保留在第二部分开头。
-        增强健壮性：分割关键词不区分大小写，支持:号。
+        分割最终总结为画像和筛选问题两部分（实现见profile_splitter.py）
         """
-        import re
-        # 1. 优先用 *** 分割（不区分大小写，允许前后有空格/换行）
-        split_match = re.search(r"\n?\s*\*\*\*\s*\n?", response_text, re.IGNORECASE)
-        if split_match:
-            split_pos = split_match.start()
-            profile_part = response_text[:split_pos].strip()
-            questions_part = response_text[split_match.end():].strip()
-            return [profile_part, questions_part]
-
-        # 2. 用"Filter Questions"等关键词分割，保留分割词在第二部分
-        pattern = re.compile(
-            r"(filter questions:?|筛选问题:?|问题工具包:?|提问建议:?|约会提问:?|推荐提问:?|建议提问:?|实用提问:?|情景提问:?|初期提问:?)",
-            re.IGNORECASE
-        )
-        match = pattern.search(response_text)
-        if match:
-            split_pos = match.start()
-            profile_part = response_text[:split_pos].strip()
-            questions_part = response_text[split_pos:].strip()
-            return [profile_part, questions_part]
-
-        # 3. 兜底：返回原文，并打印调试信息
-        print("[SPLIT_DEBUG] 分割失败，原文如下：\n", response_text)
-        return [response_text]
+        return split_profile_summary(response_text)
     
     def clear_history(self):
         """Clear the conversation history and start a new session."""
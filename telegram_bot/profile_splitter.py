@@ -0,0 +1,40 @@
+"""
+伴侣画像总结的分割（两个bot共用）
+bot单独部署，不依赖后端的app包；与app/utils/summary_detector.py的split_profile_summary结果一致，
+由tests/test_summary_detector.py的golden测试保证
+"""
+
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# 分割模式（模块加载时编译一次，不在每次分割时重新编译）
+# 1. *** 分割线（允许前后有空格/换行）
+PROFILE_SEPARATOR_PATTERN = re.compile(r"\n?\s*\*\*\*\s*\n?")
+# 2. "Filter Questions"等关键词（不区分大小写，支持:号）
+PROFILE_SPLIT_PATTERN = re.compile(
+    r"(filter questions:?|筛选问题:?|问题工具包:?|提问建议:?|约会提问:?|推荐提问:?|建议提问:?|实用提问:?|情景提问:?|初期提问:?)",
+    re.IGNORECASE
+)
+
+
+def split_profile_summary(response_text: str) -> list[str]:
+    """
+    分割最终总结为两部分：只保留 Ideal Partner Profile 及其后内容为第一条，第二条为筛选问题部分。
+    优先用 *** 分割，其次用 Filter Questions/筛选问题等关键词分割，分割点保留在第二部分开头。
+    增强健壮性：分割关键词不区分大小写，支持:号。
+    """
+    # 1. 优先用 *** 分割
+    split_match = PROFILE_SEPARATOR_PATTERN.search(response_text)
+    if split_match:
+        return [response_text[:split_match.start()].strip(), response_text[split_match.end():].strip()]
+
+    # 2. 用“Filter Questions”等关键词分割，保留分割词在第二部分
+    match = PROFILE_SPLIT_PATTERN.search(response_text)
+    if match:
+        return [response_text[:match.start()].strip(), response_text[match.start():].strip()]
+
+    # 3. 兜底：返回原文
+    logger.debug("伴侣画像总结分割失败，原文如下：\n%s", response_text)
+    return [response_text]
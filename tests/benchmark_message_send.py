@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+私信发送延迟基准测试：对比旧的发送路径与两种写入确认级别
+
+测量从调用发送到可以投递给接收方之间的耗时：
+    legacy    旧路径：find_one + insert 消息，find_one + update 聊天室，共4次往返
+    durable   MESSAGE_ACK_LEVEL=durable：单次insert后投递，聊天室更新在后台
+    accepted  MESSAGE_ACK_LEVEL=accepted：写入内存日志后投递，批量落库
+
+默认使用模拟往返延迟的内存集合（--rtt-ms），加 --mongodb 则连接配置中的真实数据库
+（会向messages/chatrooms集合写入测试数据）。
+
+用法:
+    python tests/benchmark_message_send.py
+    python tests/benchmark_message_send.py --messages 2000 --rtt-ms 2
+    python tests/benchmark_message_send.py --mongodb
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.core.database import Database
+from app.objects.User import User
+from app.objects.Chatroom import Chatroom
+from app.objects.Message import Message
+from app.services.https.UserManagement import UserManagement
+from app.services.https.ChatroomManager import ChatroomManager
+from app.services.https.MessageJournal import MessageJournal
+
+BASE_USER_ID = 9_031_000
+
+
+class SimulatedCollection:
+    """每次操作等待一次固定往返延迟的内存集合"""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.documents = {}
+
+    async def find_one(self, query):
+        await asyncio.sleep(self.rtt)
+        return self.documents.get(query.get("_id"))
+
+    async def insert_one(self, document):
+        await asyncio.sleep(self.rtt)
+        self.documents[document["_id"]] = document
+        return type("InsertOneResult", (), {"inserted_id": document["_id"]})()
+
+    async def insert_many(self, documents, ordered=True):
+        await asyncio.sleep(self.rtt)
+        for document in documents:
+            self.documents[document["_id"]] = document
+        return type("InsertManyResult", (), {"inserted_ids": [d["_id"] for d in documents]})()
+
+    async def update_one(self, query, update):
+        await asyncio.sleep(self.rtt)
+        return type("UpdateResult", (), {"modified_count": 1})()
+
+
+def use_simulated_database(rtt_ms: float):
+    collections = {}
+
+    def get_collection(collection_name):
+        return collections.setdefault(collection_name, SimulatedCollection(rtt_ms / 1000))
+
+    Database.get_collection = classmethod(lambda cls, name: get_collection(name))
+
+
+async def legacy_send(chatroom, sender, receiver, content):
+    """旧发送路径：消息和聊天室各一次find_one + 写入，全部完成后才投递"""
+    message = Message(sender, receiver, content, chatroom.chatroom_id, seq=chatroom.next_seq())
+    if not await Database.find_one("messages", {"_id": message.message_id}):
+        await Database.insert_one("messages", message.to_document())
+    chatroom.message_ids.append(message.message_id)
+    chatroom.record_message(sender.user_id, content, message.message_send_time_in_utc)
+    await chatroom.save_to_database()
+
+
+async def setup_chatroom():
+    Message._initialized = True
+    Chatroom._initialized = True
+    user_manager = UserManagement()
+    chatroom_manager = ChatroomManager()
+    sender = User("bench_sender", 1, BASE_USER_ID + 1)
+    receiver = User("bench_receiver", 2, BASE_USER_ID + 2)
+    user_manager.user_list[sender.user_id] = sender
+    user_manager.user_list[receiver.user_id] = receiver
+    chatroom = Chatroom(sender, receiver, match_id=None)
+    chatroom_manager.chatrooms[chatroom.chatroom_id] = chatroom
+    await chatroom.save_to_database()
+    return chatroom, sender, receiver
+
+
+async def measure(label: str, send, count: int):
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        await send(f"benchmark message {i}")
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:<10} p50 {p50:8.3f}ms   p99 {p99:8.3f}ms   mean {statistics.mean(latencies):8.3f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Private message send latency benchmark")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="模拟的数据库往返延迟（毫秒）")
+    parser.add_argument("--mongodb", action="store_true", help="使用配置中的真实MongoDB")
+    args = parser.parse_args()
+
+    # 发送路径逐条输出INFO日志，这里关闭日志输出，只比较数据库往返的影响
+    logging.disable(logging.CRITICAL)
+    if args.mongodb:
+        await Database.connect()
+        await Message.initialize_counter()
+        await Chatroom.initialize_counter()
+        print("使用真实MongoDB")
+    else:
+        use_simulated_database(args.rtt_ms)
+        print(f"使用模拟数据库，往返延迟 {args.rtt_ms}ms")
+
+    chatroom, sender, receiver = await setup_chatroom()
+    chatroom_manager = ChatroomManager()
+    print("=" * 60)
+
+    await measure("legacy", lambda content: legacy_send(chatroom, sender, receiver, content), args.messages)
+
+    for ack_level in ("durable", "accepted"):
+        settings.MESSAGE_ACK_LEVEL = ack_level
+        await measure(
+            ack_level,
+            lambda content: chatroom_manager.send_message(chatroom.chatroom_id, sender.user_id, content),
+            args.messages
+        )
+        # 后台写入不计入发送延迟，但在下一轮之前完成
+        await asyncio.gather(*chatroom_manager.background_tasks)
+        await MessageJournal().drain()
+
+    if args.mongodb:
+        await Database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
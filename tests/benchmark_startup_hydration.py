@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+启动水合基准测试：MatchManager / ChatroomManager 从数据库文档批量构建内存对象
+
+只测量文档 -> 内存对象的水合耗时（不包含MongoDB读取），
+对比 from_document 批量路径与旧的逐条构造路径。
+
+用法:
+    python tests/benchmark_startup_hydration.py
+    python tests/benchmark_startup_hydration.py --matches 1000000 --chatrooms 500000 --legacy-sample 20000
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.objects.User import User
+from app.objects.Match import Match
+from app.objects.Chatroom import Chatroom
+from app.services.https.UserManagement import UserManagement
+from app.services.https.MatchManager import MatchManager
+from app.services.https.ChatroomManager import ChatroomManager
+
+
+def generate_documents(num_users: int, num_matches: int, num_chatrooms: int):
+    """生成与数据库中结构一致的用户、匹配和聊天室文档"""
+    user_manager = UserManagement()
+    for user_id in range(1, num_users + 1):
+        user_manager.user_list[user_id] = User(f"user_{user_id}", 1 + user_id % 2, user_id)
+
+    match_docs = []
+    for match_id in range(1, num_matches + 1):
+        match_docs.append({
+            "_id": match_id,
+            "user_id_1": 1 + match_id % num_users,
+            "user_id_2": 1 + (match_id * 7) % num_users,
+            "description_to_user_1": "reason for user 1",
+            "description_to_user_2": "reason for user 2",
+            "is_liked": False,
+            "match_score": 80,
+            "mutual_game_scores": {},
+            "chatroom_id": match_id if match_id <= num_chatrooms else None,
+            "match_time": "2025-01-01 00:00:00 UTC",
+            "last_activity_time": time.time()
+        })
+
+    chatroom_docs = []
+    for chatroom_id in range(1, num_chatrooms + 1):
+        match_doc = match_docs[chatroom_id - 1]
+        chatroom_docs.append({
+            "_id": chatroom_id,
+            "user1_id": match_doc["user_id_1"],
+            "user2_id": match_doc["user_id_2"],
+            "message_ids": [],
+            "match_id": chatroom_id
+        })
+
+    return match_docs, chatroom_docs
+
+
+def legacy_load_matches(match_docs):
+    """旧的逐条构造路径（Match构造函数 + 计数器临时修改）"""
+    match_list = {}
+    for match_data in match_docs:
+        Match._initialized = True
+        original_counter = Match._match_counter
+        match = Match(
+            telegram_user_session_id_1=match_data["user_id_1"],
+            telegram_user_session_id_2=match_data["user_id_2"],
+            reason_to_id_1=match_data.get("description_to_user_1", ""),
+            reason_to_id_2=match_data.get("description_to_user_2", ""),
+            match_score=match_data.get("match_score", 0),
+            match_time=match_data.get("match_time", "Unknown")
+        )
+        Match._match_counter = original_counter
+        match.match_id = match_data["_id"]
+        match_list[match.match_id] = match
+    return match_list
+
+
+def legacy_load_chatrooms(chatroom_docs):
+    """旧的逐条构造路径（Chatroom构造函数 + 逐条查找用户）"""
+    Chatroom._initialized = True
+    user_manager = UserManagement()
+    chatrooms = {}
+    for chatroom_data in chatroom_docs:
+        user1 = user_manager.get_user_instance(int(chatroom_data["user1_id"]))
+        user2 = user_manager.get_user_instance(int(chatroom_data["user2_id"]))
+        chatroom = Chatroom(user1, user2, chatroom_data.get("match_id"))
+        chatroom.chatroom_id = int(chatroom_data["_id"])
+        chatroom.message_ids = chatroom_data.get("message_ids", [])
+        chatrooms[chatroom.chatroom_id] = chatroom
+    return chatrooms
+
+
+def timed(label: str, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<45} {elapsed:8.3f}s")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup hydration benchmark")
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--matches", type=int, default=1000000)
+    parser.add_argument("--chatrooms", type=int, default=500000)
+    parser.add_argument("--legacy-sample", type=int, default=20000,
+                        help="旧路径只测量这么多条记录并线性外推（旧路径逐条写日志，全量过慢）")
+    args = parser.parse_args()
+
+    print(f"生成文档: {args.users} 用户, {args.matches} 匹配, {args.chatrooms} 聊天室")
+    match_docs, chatroom_docs = generate_documents(args.users, args.matches, args.chatrooms)
+
+    print("=" * 60)
+    match_manager = MatchManager()
+    chatroom_manager = ChatroomManager()
+    loaded_matches, match_time = timed("MatchManager.load_match_documents", match_manager.load_match_documents, match_docs)
+    loaded_chatrooms, chatroom_time = timed("ChatroomManager.load_chatroom_documents", chatroom_manager.load_chatroom_documents, chatroom_docs)
+    print(f"已加载: {loaded_matches} 匹配, {loaded_chatrooms} 聊天室, 合计 {match_time + chatroom_time:.3f}s")
+
+    if args.legacy_sample > 0:
+        print("=" * 60)
+        # 旧路径逐条输出INFO日志，这里关闭日志输出，只比较构造本身的开销
+        logging.disable(logging.CRITICAL)
+        sample = args.legacy_sample
+        _, legacy_match_time = timed(f"legacy Match() x {sample}", legacy_load_matches, match_docs[:sample])
+        _, legacy_chatroom_time = timed(f"legacy Chatroom() x {sample}", legacy_load_chatrooms, chatroom_docs[:sample])
+        logging.disable(logging.NOTSET)
+        projected = legacy_match_time * args.matches / sample + legacy_chatroom_time * args.chatrooms / sample
+        print(f"旧路径外推全量耗时（不含日志I/O）: {projected:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
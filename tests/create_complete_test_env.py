@@ -156,7 +156,7 @@ async def create_complete_test_environment():
         print("\n💬 步骤3: 创建测试聊天室...")
         test_chatrooms = []
         for match_id in test_matches:
-            match = match_manager.get_match(match_id)
+            match = await match_manager.get_match(match_id)
             if match:
                 try:
                     chatroom_id = await chatroom_manager.get_or_create_chatroom(
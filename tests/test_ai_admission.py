@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+测试AI服务准入控制：全局并发上限、按用户串行、有界排队、token预算和统计数据
+使用httpx.MockTransport模拟Kimi API，不访问网络
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import httpx
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.services.https.AIAdmissionController import AIAdmissionController, AIOverloadedError
+from app.services.https.KimiInteractionAPI import KimiInteractionAPI
+
+USER_ID = 9_046_000
+
+
+class override_settings:
+    def __init__(self, **values):
+        self.values = values
+        self.saved = {}
+
+    def __enter__(self):
+        for name, value in self.values.items():
+            self.saved[name] = getattr(settings, name)
+            setattr(settings, name, value)
+
+    def __exit__(self, *exc):
+        for name, value in self.saved.items():
+            setattr(settings, name, value)
+
+
+def fresh_controller() -> AIAdmissionController:
+    controller = AIAdmissionController()
+    controller.tokens = float(settings.AI_TOKENS_PER_MINUTE)
+    controller.tokens_updated_at = None
+    controller.reset_stats()
+    return controller
+
+
+async def burst_of_users():
+    controller = fresh_controller()
+    active = []
+    peak = []
+
+    async def handler(request: httpx.Request):
+        active.append(1)
+        peak.append(len(active))
+        await asyncio.sleep(0.05)
+        active.pop()
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": "ok"}}]})
+
+    kimi = KimiInteractionAPI()
+    kimi.client = None
+    kimi.transport = httpx.MockTransport(handler)
+    results = await asyncio.gather(*(kimi.send_message_to_ai(USER_ID + i, "hi", []) for i in range(12)))
+    await kimi.close()
+
+    stats = controller.get_stats()
+    print(f"Peak provider concurrency {max(peak)}, stats {stats}")
+    assert all(result["message"] == "ok" for result in results)
+    assert max(peak) <= settings.AI_MAX_CONCURRENT_REQUESTS
+    assert stats["admitted"] == 12 and stats["in_flight"] == 0 and stats["queue_depth"] == 0
+    assert stats["max_wait_seconds"] > 0
+
+
+def test_global_concurrency_cap():
+    print("Testing global concurrency cap...")
+    with override_settings(AI_MAX_CONCURRENT_REQUESTS=3):
+        asyncio.run(burst_of_users())
+    print("✓ Global concurrency cap passed")
+
+
+async def same_user_turns():
+    controller = fresh_controller()
+    order = []
+
+    async def turn(name: str):
+        async with controller.user_turn(USER_ID):
+            order.append(f"{name} start")
+            await asyncio.sleep(0.02)
+            order.append(f"{name} end")
+
+    await asyncio.gather(turn("a"), turn("b"), turn("c"))
+    assert order == ["a start", "a end", "b start", "b end", "c start", "c end"]
+    assert not controller.user_locks
+
+    # 等待超时的轮次被拒绝
+    async def slow_turn():
+        async with controller.user_turn(USER_ID):
+            await asyncio.sleep(0.2)
+
+    results = await asyncio.gather(slow_turn(), turn("late"), return_exceptions=True)
+    assert isinstance(results[1], AIOverloadedError) and results[1].reason == "user_busy"
+    assert controller.get_stats()["rejected"]["user_busy"] == 1
+
+
+def test_per_user_serialization():
+    print("Testing per-user serialization...")
+    with override_settings(AI_QUEUE_TIMEOUT_SECONDS=0.1):
+        asyncio.run(same_user_turns())
+    print("✓ Per-user serialization passed")
+
+
+async def bounded_queue_and_budget():
+    controller = fresh_controller()
+
+    async def call(tokens: int = 10, hold: float = 0.2):
+        async with controller.admit(tokens):
+            await asyncio.sleep(hold)
+
+    # 1个并发名额、最多2个排队：第4个请求立即被拒绝，排队超时的请求也被拒绝
+    results = await asyncio.gather(*(call() for _ in range(4)), return_exceptions=True)
+    reasons = sorted(result.reason for result in results if isinstance(result, AIOverloadedError))
+    assert reasons == ["queue_full", "timeout", "timeout"]
+    assert controller.in_flight == 0 and not controller.waiters
+
+    # 超出每分钟token预算的请求在等待补充也来不及时直接拒绝
+    controller.tokens = 0
+    try:
+        await call(tokens=settings.AI_TOKENS_PER_MINUTE, hold=0)
+        assert False, "expected token budget rejection"
+    except AIOverloadedError as e:
+        assert e.reason == "token_budget" and e.retry_after > 1
+
+    stats = controller.get_stats()
+    assert stats["rejected"] == {"queue_full": 1, "timeout": 2, "token_budget": 1, "user_busy": 0}
+    assert stats["admitted"] == 1
+
+
+def test_bounded_queue_and_token_budget():
+    print("Testing bounded queue and token budget...")
+    with override_settings(AI_MAX_CONCURRENT_REQUESTS=1, AI_MAX_QUEUE_DEPTH=2, AI_QUEUE_TIMEOUT_SECONDS=0.1):
+        try:
+            asyncio.run(bounded_queue_and_budget())
+        finally:
+            fresh_controller()  # 恢复token预算，不影响其他测试
+    print("✓ Bounded queue and token budget passed")
+
+
+if __name__ == "__main__":
+    test_global_concurrency_cap()
+    test_per_user_serialization()
+    test_bounded_queue_and_token_budget()
+    print("All AI admission tests passed!")
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+测试AI对话历史的有界缓冲区和分桶存储：按需从数据库加载最近的桶、按时间顺序追加、
+换出最久未使用的用户、补写写入失败的消息以及旧格式数据的迁移
+使用内存中的模拟集合代替MongoDB，不需要服务器和数据库
+"""
+
+import asyncio
+import copy
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.core.database import Database
+from app.services.https.AIResponseProcessor import AIResponseProcessor
+from app.utils.context_builder import context_builder
+from app.utils.idempotency import IdempotencyCache
+
+USER_IDS = [9_049_000 + i for i in range(5)]
+
+
+class FakeDatabase:
+    """
+    只实现AIResponseProcessor用到的查询和更新
+    """
+
+    def __init__(self):
+        self.collections = {"AI_chatroom": [], "AI_message": [], "AI_message_bucket": []}
+        self.reads = 0
+        self.fail_writes = False
+
+    @staticmethod
+    def _matches(document: dict, query: dict) -> bool:
+        for key, condition in query.items():
+            value = document.get(key)
+            if isinstance(condition, dict):
+                if "$in" in condition and value not in condition["$in"]:
+                    return False
+                if "$nin" in condition and value in condition["$nin"]:
+                    return False
+                if "$ne" in condition and value == condition["$ne"]:
+                    return False
+            elif value != condition:
+                return False
+        return True
+
+    async def find_one(self, collection_name: str, query: dict):
+        self.reads += 1
+        return next((copy.deepcopy(d) for d in self.collections[collection_name] if self._matches(d, query)), None)
+
+    async def find(self, collection_name: str, query: dict = {}, projection: dict = {}, limit: int = 0, sort: list = []):
+        self.reads += 1
+        documents = [copy.deepcopy(d) for d in self.collections[collection_name] if self._matches(d, query)]
+        for key, direction in reversed(sort):
+            documents.sort(key=lambda d: d[key], reverse=direction < 0)
+        return documents[:limit] if limit > 0 else documents
+
+    async def insert_one(self, collection_name: str, document: dict):
+        if self.fail_writes:
+            raise ConnectionError("database unavailable")
+        self.collections[collection_name].append(copy.deepcopy(document))
+
+    async def update_one(self, collection_name: str, query: dict, update: dict, upsert: bool = False):
+        await asyncio.sleep(0)  # 像真实数据库一样在写入前让出控制权，暴露并发追加的交错
+        if self.fail_writes:
+            raise ConnectionError("database unavailable")
+        document = next((d for d in self.collections[collection_name] if self._matches(d, query)), None)
+        if document is None:
+            if not upsert:
+                return 0
+            document = dict(query)
+            self.collections[collection_name].append(document)
+            document.update(copy.deepcopy(update.get("$setOnInsert", {})))
+        for key, value in update.get("$set", {}).items():
+            document[key] = value
+        for key, value in update.get("$push", {}).items():
+            document.setdefault(key, []).extend(copy.deepcopy(value["$each"]))
+        for key, value in update.get("$max", {}).items():
+            document[key] = max(document.get(key, value), value)
+        return 1
+
+
+def message_document(message_id: int, index: int) -> dict:
+    return {
+        "ai_message_id": message_id,
+        "ai_message_content": f"消息{index}",
+        "ai_message_send_time_in_utc": f"2025-06-01T00:{index // 60:02d}:{index % 60:02d}",
+        "role": index % 2
+    }
+
+
+def seed_legacy_history(db: FakeDatabase, user_id: int, count: int, first_id: int):
+    """
+    旧格式：AI_chatroom的消息ID列表 + 每条消息一个AI_message文档
+    """
+    message_ids = list(range(first_id, first_id + count))
+    for index, message_id in enumerate(message_ids):
+        db.collections["AI_message"].append({"_id": message_id, **message_document(message_id, index)})
+    db.collections["AI_chatroom"].append({"user_id": user_id, "ai_message_ids": message_ids})
+
+
+def seed_bucketed_history(db: FakeDatabase, user_id: int, count: int, first_id: int, with_count: bool = True):
+    """
+    with_count为False时模拟没有message_count的旧桶文档
+    """
+    messages = [message_document(first_id + index, index) for index in range(count)]
+    size = settings.AI_HISTORY_BUCKET_SIZE
+    for bucket, start in enumerate(range(0, count, size)):
+        chunk = messages[start:start + size]
+        document = {
+            "_id": f"{user_id}:{bucket}", "user_id": user_id, "bucket": bucket,
+            "messages": chunk, "last_message_id": chunk[-1]["ai_message_id"]
+        }
+        if with_count:
+            document["message_count"] = start + len(chunk)
+        db.collections["AI_message_bucket"].append(document)
+
+
+def bucket_contents(db: FakeDatabase, user_id: int) -> list:
+    buckets = sorted((d for d in db.collections["AI_message_bucket"] if d["user_id"] == user_id), key=lambda d: d["bucket"])
+    return [[message["ai_message_content"] for message in bucket["messages"]] for bucket in buckets]
+
+
+async def with_fake_database(scenario):
+    db = FakeDatabase()
+    originals = {name: getattr(Database, name) for name in ("find_one", "find", "insert_one", "update_one")}
+    for name in originals:
+        setattr(Database, name, getattr(db, name))
+    limits = (settings.AI_HISTORY_MAX_MESSAGES, settings.AI_HISTORY_MAX_ACTIVE_USERS, settings.AI_HISTORY_BUCKET_SIZE)
+    processor = AIResponseProcessor()
+    for user_id in USER_IDS:
+        processor.ai_histories.pop(user_id, None)
+        processor.history_counts.pop(user_id, None)
+    try:
+        await scenario(db, processor)
+    finally:
+        for name, method in originals.items():
+            setattr(Database, name, method)
+        settings.AI_HISTORY_MAX_MESSAGES, settings.AI_HISTORY_MAX_ACTIVE_USERS, settings.AI_HISTORY_BUCKET_SIZE = limits
+        for user_id in USER_IDS:
+            processor.ai_histories.pop(user_id, None)
+            processor.history_counts.pop(user_id, None)
+            processor.unsaved_messages.pop(user_id, None)
+
+
+async def lazy_load_and_append(db: FakeDatabase, processor: AIResponseProcessor):
+    settings.AI_HISTORY_MAX_MESSAGES = settings.AI_HISTORY_BUCKET_SIZE = 50
+    user_id = USER_IDS[0]
+    seed_bucketed_history(db, user_id, 300, first_id=1)
+
+    # 并发的第一次读取只加载一次：一次查询读取最后两个桶，只取最近的50条
+    histories = await asyncio.gather(*(processor.get_conversation_history(user_id) for _ in range(5)))
+    assert db.reads == 1
+    assert all(history == histories[0] for history in histories)
+    assert [entry[0] for entry in histories[0]] == [f"消息{i}" for i in range(250, 300)]
+    assert await processor.get_history_version(user_id) == 300
+
+    # 新消息追加在末尾，最早的消息被丢弃，顺序不变；数据库中写入新的桶
+    processor.message_counter = max(processor.message_counter, 1000)
+    await processor.save_conversation_history(user_id, "新的问题", "新的回答")
+    history = await processor.get_conversation_history(user_id)
+    assert len(history) == 50
+    assert [entry[0] for entry in history[-3:]] == ["消息299", "新的问题", "新的回答"]
+    assert await processor.get_history_version(user_id) == processor.message_counter
+    assert db.reads == 1
+    assert bucket_contents(db, user_id)[-1] == ["新的问题", "新的回答"] and len(bucket_contents(db, user_id)) == 7
+
+    # 换出后重新加载得到同样的历史
+    processor.ai_histories.pop(user_id)
+    processor.history_counts.pop(user_id)
+    assert await processor.get_conversation_history(user_id) == history
+    assert db.reads == 2
+
+
+def test_lazy_load_and_append():
+    print("Testing lazy loading and bounded append...")
+    asyncio.run(with_fake_database(lazy_load_and_append))
+    print("✓ Lazy loading and bounded append passed")
+
+
+async def append_across_buckets(db: FakeDatabase, processor: AIResponseProcessor):
+    settings.AI_HISTORY_BUCKET_SIZE = 5
+    user_id = USER_IDS[0]
+    processor.message_counter = max(processor.message_counter, 3000)
+    seed_bucketed_history(db, user_id, 4, first_id=2000)
+
+    # 写满当前桶后写入下一个桶
+    await processor.save_conversation_history(user_id, "问1", "答1")
+    assert bucket_contents(db, user_id) == [["消息0", "消息1", "消息2", "消息3", "问1"], ["答1"]]
+
+    # 写入失败的消息保留在未保存列表中，下一次写入时按顺序补写
+    db.fail_writes = True
+    await processor.save_conversation_history(user_id, "问2", "答2")
+    db.fail_writes = False
+    assert [message["ai_message_content"] for message in processor.unsaved_messages[user_id]] == ["问2", "答2"]
+    await processor.save_conversation_history(user_id, "问3", "答3")
+    assert bucket_contents(db, user_id)[1] == ["答1", "问2", "答2", "问3", "答3"]
+    assert user_id not in processor.unsaved_messages
+
+    # 关闭时只补写未保存的消息
+    db.fail_writes = True
+    await processor.save_conversation_history(user_id, "问4", "答4")
+    db.fail_writes = False
+    assert await processor.save_to_database()
+    assert bucket_contents(db, user_id)[2] == ["问4", "答4"]
+    assert not processor.unsaved_messages
+    buckets = sorted(db.collections["AI_message_bucket"], key=lambda d: d["bucket"])
+    assert [bucket["last_message_id"] for bucket in buckets] == [
+        bucket["messages"][-1]["ai_message_id"] for bucket in buckets
+    ]
+
+
+def test_append_across_buckets():
+    print("Testing bucketed appends...")
+    asyncio.run(with_fake_database(append_across_buckets))
+    print("✓ Bucketed appends passed")
+
+
+async def concurrent_appends(db: FakeDatabase, processor: AIResponseProcessor):
+    settings.AI_HISTORY_BUCKET_SIZE = 3
+    user_id = USER_IDS[0]
+    processor.message_counter = max(processor.message_counter, 4000)
+    seed_bucketed_history(db, user_id, 2, first_id=3500)
+    await processor.get_conversation_history(user_id)
+
+    # 同一用户的多次保存同时写入数据库：按保存顺序写入，桶不超出大小，也不会跳过桶
+    await asyncio.gather(*(processor.save_conversation_history(user_id, f"问{i}", f"答{i}") for i in range(4)))
+    contents = bucket_contents(db, user_id)
+    assert all(len(bucket) == 3 for bucket in contents[:-1]) and len(contents[-1]) <= 3
+    assert sum(contents, []) == ["消息0", "消息1"] + [text for i in range(4) for text in (f"问{i}", f"答{i}")]
+    assert processor.history_counts[user_id]["total"] == 10
+    assert user_id not in processor.unsaved_messages
+
+
+def test_concurrent_appends_are_serialized():
+    print("Testing concurrent bucket appends...")
+    asyncio.run(with_fake_database(concurrent_appends))
+    print("✓ Concurrent bucket appends passed")
+
+
+async def stored_message_count(db: FakeDatabase, processor: AIResponseProcessor):
+    settings.AI_HISTORY_BUCKET_SIZE = 5
+    first, second = USER_IDS[:2]
+    processor.message_counter = max(processor.message_counter, 5000)
+    seed_bucketed_history(db, first, 7, first_id=4500)
+    seed_bucketed_history(db, second, 7, first_id=4600, with_count=False)
+
+    # 桶大小设置改变后，已保存的条数仍从桶中的message_count读取，新消息写在最后一个桶之后
+    settings.AI_HISTORY_BUCKET_SIZE = 3
+    await processor.get_conversation_history(first)
+    assert processor.history_counts[first] == {"bucket": 1, "filled": 2, "total": 7}
+    await processor.save_conversation_history(first, "问", "答")
+    assert bucket_contents(db, first)[1:] == [["消息5", "消息6", "问"], ["答"]]
+    buckets = sorted((d for d in db.collections["AI_message_bucket"] if d["user_id"] == first), key=lambda d: d["bucket"])
+    assert [bucket["message_count"] for bucket in buckets] == [5, 8, 9]
+    assert processor.history_counts[first]["total"] == 9
+
+    # 没有message_count的旧桶按之前的桶都已写满估算，写入后补上message_count
+    settings.AI_HISTORY_BUCKET_SIZE = 5
+    await processor.save_conversation_history(second, "问", "答")
+    assert bucket_contents(db, second)[1] == ["消息5", "消息6", "问", "答"]
+    assert processor.history_counts[second]["total"] == 9
+    assert next(d for d in db.collections["AI_message_bucket"] if d["_id"] == f"{second}:1")["message_count"] == 9
+
+
+def test_message_count_is_stored_in_buckets():
+    print("Testing stored bucket message counts...")
+    asyncio.run(with_fake_database(stored_message_count))
+    print("✓ Stored bucket message counts passed")
+
+
+async def idempotent_retry_after_eviction(db: FakeDatabase, processor: AIResponseProcessor):
+    user_id = USER_IDS[0]
+    processor.message_counter = max(processor.message_counter, 6000)
+    seed_bucketed_history(db, user_id, 4, first_id=5500)
+    cache = IdempotencyCache()
+    calls = []
+
+    async def chat():
+        calls.append(1)
+        await processor.save_conversation_history(user_id, "问", "答")
+        return {"success": True, "message": "答"}
+
+    def version():
+        return processor.get_history_version(user_id)
+
+    first, replayed = await cache.run(user_id, "k1", version, chat)
+    assert not replayed
+    # 在重试之前用户被换出内存
+    processor.ai_histories.pop(user_id)
+    processor.history_counts.pop(user_id)
+
+    retry, replayed = await cache.run(user_id, "k1", version, chat)
+    assert replayed and retry == first
+    assert len(calls) == 1
+    assert sum(bucket_contents(db, user_id), []) == ["消息0", "消息1", "消息2", "消息3", "问", "答"]
+
+
+def test_idempotent_retry_after_eviction():
+    print("Testing idempotent retry after eviction...")
+    asyncio.run(with_fake_database(idempotent_retry_after_eviction))
+    print("✓ Idempotent retry after eviction passed")
+
+
+async def eviction(db: FakeDatabase, processor: AIResponseProcessor):
+    processor.message_counter = max(processor.message_counter, 10_000)
+    for index, user_id in enumerate(USER_IDS[:3]):
+        seed_bucketed_history(db, user_id, 4, first_id=2000 + index * 10)
+    resident = len([user_id for user_id in processor.ai_histories if user_id not in USER_IDS])
+    settings.AI_HISTORY_MAX_ACTIVE_USERS = resident + 2
+
+    first, second, third = USER_IDS[:3]
+    await processor.get_conversation_history(first)
+    await processor.save_conversation_history(second, "你好", "你好呀")
+    context_builder._summaries[second] = {"covered": 0, "anchor": None, "lines": [], "tokens": 0}
+    await processor.get_conversation_history(first)  # first最近使用过，换出的是second
+    await processor.get_conversation_history(third)
+    assert first in processor.ai_histories and third in processor.ai_histories
+    assert second not in processor.ai_histories and second not in processor.history_counts
+    # 换出的用户的滚动摘要一起清除
+    assert second not in context_builder._summaries
+
+    # 换出后再次使用时从数据库重新加载，包括刚保存的消息
+    history = await processor.get_conversation_history(second)
+    assert [entry[0] for entry in history[-2:]] == ["你好", "你好呀"] and len(history) == 6
+    assert first not in processor.ai_histories
+
+    # 写入数据库失败的用户不会被换出，补写成功后才可以换出
+    db.fail_writes = True
+    await processor.save_conversation_history(second, "还在吗", "在的")
+    db.fail_writes = False
+    assert second in processor.unsaved_messages
+    await processor.get_conversation_history(first)
+    await processor.get_conversation_history(third)  # second最久未使用，但有未保存的消息，换出的是first
+    assert second in processor.ai_histories and first not in processor.ai_histories
+
+    assert await processor.save_to_database(second)
+    assert second not in processor.unsaved_messages
+    await processor.get_conversation_history(first)
+    assert second not in processor.ai_histories
+    history = await processor.get_conversation_history(second)
+    assert [entry[0] for entry in history[-2:]] == ["还在吗", "在的"]
+
+
+def test_evicts_least_recently_used_users():
+    print("Testing eviction of inactive users...")
+    asyncio.run(with_fake_database(eviction))
+    print("✓ Eviction of inactive users passed")
+
+
+async def legacy_migration(db: FakeDatabase, processor: AIResponseProcessor):
+    settings.AI_HISTORY_BUCKET_SIZE = 100
+    first, second, third, fourth = USER_IDS[:4]
+    seed_legacy_history(db, first, 350, first_id=1)
+    seed_legacy_history(db, second, 5, first_id=1000)
+    seed_legacy_history(db, third, 0, first_id=2000)
+
+    # 每批2个聊天室，分桶后的消息顺序与ai_message_ids一致
+    assert await processor.migrate_legacy_history(batch_size=2) == 3
+    assert [len(bucket) for bucket in bucket_contents(db, first)] == [100, 100, 100, 50]
+    assert sum(bucket_contents(db, first), []) == [f"消息{i}" for i in range(350)]
+    assert bucket_contents(db, second) == [[f"消息{i}" for i in range(5)]] and bucket_contents(db, third) == []
+    assert all("_id" not in message for bucket in db.collections["AI_message_bucket"] for message in bucket["messages"])
+    assert all(chatroom["bucketed"] for chatroom in db.collections["AI_chatroom"])
+    assert await processor.migrate_legacy_history() == 0
+
+    # 迁移中断后重新执行：补写缺少的桶，已写入的桶不重复
+    db.collections["AI_chatroom"][0]["bucketed"] = False
+    db.collections["AI_message_bucket"] = [d for d in db.collections["AI_message_bucket"] if d["_id"] != f"{first}:3"]
+    assert await processor.migrate_legacy_history() == 1
+    assert sum(bucket_contents(db, first), []) == [f"消息{i}" for i in range(350)]
+
+    # 启动后才出现的旧格式对话在第一次读取时迁移
+    seed_legacy_history(db, fourth, 6, first_id=3000)
+    history = await processor.get_conversation_history(fourth)
+    assert [entry[0] for entry in history] == [f"消息{i}" for i in range(6)]
+    assert processor.history_counts[fourth]["total"] == 6
+    assert db.collections["AI_message_bucket"][-1]["message_count"] == 6
+
+    # 消息计数器从分桶和旧格式中最大的消息ID开始
+    initialized, counter = AIResponseProcessor._initialized, processor.message_counter
+    AIResponseProcessor._initialized = False
+    try:
+        await processor.initialize_counter()
+        assert processor.message_counter == 3005
+    finally:
+        AIResponseProcessor._initialized, processor.message_counter = initialized, max(counter, processor.message_counter)
+
+
+def test_legacy_migration():
+    print("Testing migration of legacy AI conversations...")
+    asyncio.run(with_fake_database(legacy_migration))
+    print("✓ Migration of legacy AI conversations passed")
+
+
+if __name__ == "__main__":
+    test_lazy_load_and_append()
+    test_append_across_buckets()
+    test_concurrent_appends_are_serialized()
+    test_message_count_is_stored_in_buckets()
+    test_idempotent_retry_after_eviction()
+    test_evicts_least_recently_used_users()
+    test_legacy_migration()
+    print("All AI history buffer tests passed!")
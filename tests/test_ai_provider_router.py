@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+测试AI服务商路由：失败切换、按延迟排序、对冲请求降低尾延迟，以及Gemini格式转换
+使用本地模拟服务商和httpx.MockTransport，不访问网络
+"""
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.services.https.AIProviderRouter import AIProviderRouter
+from app.services.https.KimiInteractionAPI import KimiInteractionAPI
+from app.services.https.AIProviders import AIProvider, AIProviderError, GeminiProvider, KimiProvider, StubProvider
+
+USER_ID = 9_047_000
+REQUEST = {
+    "model": "moonshot-v1-8k",
+    "messages": [
+        {"role": "system", "content": "系统提示词"},
+        {"role": "user", "content": "你好"},
+        {"role": "assistant", "content": "你好呀"},
+        {"role": "user", "content": "介绍一下自己"}
+    ],
+    "temperature": 0.95,
+    "top_p": 0.7,
+    "max_tokens": 1024
+}
+
+
+DEFAULT_PROVIDERS = list(AIProviderRouter().providers)
+
+
+def use_providers(*providers) -> AIProviderRouter:
+    router = AIProviderRouter()
+    router.set_providers(providers)
+    return router
+
+
+def restore_providers():
+    AIProviderRouter().set_providers(DEFAULT_PROVIDERS)
+
+
+def reply_of(response: dict) -> str:
+    return response["choices"][0]["message"]["content"]
+
+
+async def failover_and_ranking():
+    broken = StubProvider("broken", failure_rate=1.0)
+    backup = StubProvider("backup", reply="backup")
+    router = use_providers(broken, backup)
+    assert reply_of(await router.complete(REQUEST, USER_ID)) == "backup"
+
+    # 错误率超过阈值后不再首先尝试故障服务商
+    for _ in range(settings.AI_PROVIDER_MIN_SAMPLES):
+        await router.complete(REQUEST, USER_ID)
+    assert [provider.name for provider in router.ranked_providers()] == ["backup", "broken"]
+    calls = broken.calls
+    await router.complete(REQUEST, USER_ID)
+    assert broken.calls == calls
+    assert router.get_stats()["broken"]["error_rate"] == 1.0
+
+    # 有足够样本后优先使用更快的服务商
+    slow = StubProvider("slow", reply="slow", latency=0.02)
+    fast = StubProvider("fast", reply="fast", latency=0.001)
+    router = use_providers(slow, fast)
+    for _ in range(settings.AI_PROVIDER_MIN_SAMPLES):
+        await router._timed_call(slow, REQUEST, USER_ID)
+        await router._timed_call(fast, REQUEST, USER_ID)
+    assert reply_of(await router.complete(REQUEST, USER_ID)) == "fast"
+
+    # 所有服务商都失败时抛出异常
+    router = use_providers(StubProvider("a", failure_rate=1.0), StubProvider("b", failure_rate=1.0))
+    try:
+        await router.complete(REQUEST, USER_ID)
+        assert False, "expected AIProviderError"
+    except AIProviderError:
+        pass
+
+
+def test_failover_and_ranking():
+    print("Testing failover and latency-aware ranking...")
+    try:
+        asyncio.run(failover_and_ranking())
+    finally:
+        restore_providers()
+    print("✓ Failover and latency-aware ranking passed")
+
+
+def tail_latency(index: int) -> float:
+    # 每20次调用中有一次慢请求
+    return 0.3 if index % 20 == 19 else 0.01
+
+
+async def measure_tail(hedging: bool) -> tuple:
+    counter = iter(range(10_000))
+    primary = StubProvider("primary", reply="primary", latency=lambda: tail_latency(next(counter)))
+    secondary = StubProvider("secondary", reply="secondary", latency=0.02)
+    router = use_providers(primary, secondary)
+    settings.AI_HEDGE_ENABLED = hedging
+    latencies = []
+    for _ in range(60):
+        start = time.perf_counter()
+        await router.complete(REQUEST, USER_ID)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[-1], router.get_stats()
+
+
+def test_hedging_cuts_tail_latency():
+    print("Testing hedged requests...")
+    hedge_enabled, hedge_percentile = settings.AI_HEDGE_ENABLED, settings.AI_HEDGE_PERCENTILE
+    settings.AI_HEDGE_PERCENTILE = 90
+    try:
+        p50_plain, max_plain, _ = asyncio.run(measure_tail(False))
+        p50_hedged, max_hedged, stats = asyncio.run(measure_tail(True))
+    finally:
+        settings.AI_HEDGE_ENABLED, settings.AI_HEDGE_PERCENTILE = hedge_enabled, hedge_percentile
+        restore_providers()
+    print(f"Without hedging p50 {p50_plain * 1000:.0f}ms max {max_plain * 1000:.0f}ms; "
+          f"with hedging p50 {p50_hedged * 1000:.0f}ms max {max_hedged * 1000:.0f}ms; stats {stats}")
+    assert max_plain >= 0.3 and max_hedged < 0.2
+    # 开始对冲后（样本足够）慢请求由第二个服务商接手
+    assert stats["secondary"]["hedges"] >= 1 and stats["secondary"]["hedge_wins"] >= 1
+    assert stats["secondary"]["hedges"] <= 10  # 只在超过分位延迟时对冲，而不是每次都发两份
+    print("✓ Hedged requests passed")
+
+
+async def gemini_round_trip():
+    seen = []
+
+    async def handler(request: httpx.Request):
+        seen.append(request)
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "我是"}, {"text": "Gemini"}]}}]})
+
+    provider = GeminiProvider("https://gemini.test/v1beta/models/gemini-2.5-flash:generateContent", "key", "gemini-2.5-flash")
+    provider.transport = httpx.MockTransport(handler)
+    response = await provider.complete(REQUEST, USER_ID)
+    await provider.close()
+
+    payload = json.loads(seen[0].content)
+    assert seen[0].headers["x-goog-api-key"] == "key"
+    assert payload["systemInstruction"] == {"parts": [{"text": "系统提示词"}]}
+    assert [content["role"] for content in payload["contents"]] == ["user", "model", "user"]
+    assert payload["generationConfig"] == {"temperature": 0.95, "topP": 0.7, "maxOutputTokens": 1024}
+    assert reply_of(response) == "我是Gemini"
+
+
+def test_gemini_format_conversion():
+    print("Testing Gemini request/response conversion...")
+    asyncio.run(gemini_round_trip())
+    print("✓ Gemini request/response conversion passed")
+
+
+async def kimi_single_attempt():
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append(request)
+        return httpx.Response(503, text="overloaded")
+
+    kimi = KimiInteractionAPI()
+    kimi.client = None
+    kimi.transport = httpx.MockTransport(handler)
+    try:
+        await KimiProvider().complete(REQUEST, USER_ID)
+    except AIProviderError:
+        pass
+    else:
+        raise AssertionError("KimiProvider should raise AIProviderError on 503")
+    finally:
+        await kimi.close()
+        kimi.transport = None
+    # 失败后由路由器切换服务商，不在同一个服务商上重试
+    assert len(calls) == 1
+
+
+def test_kimi_provider_single_attempt():
+    print("Testing Kimi provider single attempt...")
+    asyncio.run(kimi_single_attempt())
+    # 基类是抽象类，子类必须实现complete
+    try:
+        AIProvider()
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("AIProvider should be abstract")
+    print("✓ Kimi provider single attempt passed")
+
+
+if __name__ == "__main__":
+    test_failover_and_ranking()
+    test_hedging_cuts_tail_latency()
+    test_gemini_format_conversion()
+    test_kimi_provider_single_attempt()
+    print("All AI provider router tests passed!")
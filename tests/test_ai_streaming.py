@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+测试流式AI聊天：Kimi流式响应解析、SSE接口和WebSocket增量帧
+使用httpx.MockTransport模拟Kimi的流式响应，不访问网络和数据库
+"""
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.api.v1.AIResponseProcessor import router as ai_router
+from app.services.https.AIResponseProcessor import AIResponseProcessor
+from app.services.https.KimiInteractionAPI import KimiInteractionAPI
+from app.WebSocketsService.MessageConnectionHandler import MessageConnectionHandler
+from app.WebSocketsService.OutboundQueue import OutboundQueue
+
+USER_ID = 9_042_000
+CHUNKS = ["你好", "，我是", "Lushia", "。"]
+CHUNK_DELAY = 0.05
+
+
+async def sse_body():
+    for chunk in CHUNKS:
+        await asyncio.sleep(CHUNK_DELAY)
+        payload = {"choices": [{"delta": {"content": chunk}}]}
+        yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+    yield b"data: [DONE]\n\n"
+
+
+def use_streaming_transport() -> KimiInteractionAPI:
+    async def handler(request: httpx.Request):
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=sse_body())
+
+    kimi = KimiInteractionAPI()
+    kimi.client = None
+    kimi.transport = httpx.MockTransport(handler)
+    return kimi
+
+
+async def stream_tokens():
+    kimi = use_streaming_transport()
+    start = time.perf_counter()
+    first_token_at = None
+    events = []
+    async for event in kimi.stream_message_to_ai(USER_ID, "hi", []):
+        if first_token_at is None:
+            first_token_at = time.perf_counter() - start
+        events.append(event)
+    total = time.perf_counter() - start
+    await kimi.close()
+
+    print(f"Time to first token {first_token_at * 1000:.0f}ms, full reply {total * 1000:.0f}ms")
+    assert [event["content"] for event in events if event["type"] == "delta"] == CHUNKS
+    assert events[-1]["type"] == "done" and events[-1]["message"] == "".join(CHUNKS)
+    assert first_token_at < total / 2
+
+
+def test_stream_message_to_ai():
+    print("Testing Kimi token streaming...")
+    asyncio.run(stream_tokens())
+    print("✓ Kimi token streaming passed")
+
+
+def test_sse_endpoint_saves_history():
+    print("Testing SSE endpoint...")
+    use_streaming_transport()
+    processor = AIResponseProcessor()
+    processor.ai_histories.pop(USER_ID, None)
+
+    app = FastAPI()
+    app.include_router(ai_router)
+    with TestClient(app) as client:
+        response = client.post("/ai/chat/stream", json={"user_id": USER_ID, "message": "hi"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = [
+        json.loads(block.split("data: ", 1)[1])
+        for block in response.text.strip().split("\n\n")
+    ]
+    assert [event["type"] for event in events] == ["delta"] * len(CHUNKS) + ["done"]
+    assert events[-1]["message"] == "".join(CHUNKS)
+    # 流结束后保存了用户消息和AI回复
+    assert len(processor.ai_histories.get(USER_ID, [])) == 2
+    print("✓ SSE endpoint passed")
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, message: str):
+        self.sent.append(json.loads(message))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def websocket_frames():
+    use_streaming_transport()
+    websocket = FakeWebSocket()
+    handler = MessageConnectionHandler(websocket)
+    handler.user_id = str(USER_ID + 1)
+    handler.outbound = OutboundQueue(websocket, maxsize=32)
+    handler.outbound.start()
+
+    await handler.on_message({"type": "ai_chat", "message": "hi", "request_id": "r1"})
+    # 生成期间的第二个请求被拒绝，而不是阻塞接收循环
+    await handler.on_message({"type": "ai_chat", "message": "again", "request_id": "r2"})
+    await handler.ai_chat_task
+    await asyncio.sleep(0.01)
+    await handler.outbound.close()
+    await KimiInteractionAPI().close()
+
+    types = [frame["type"] for frame in websocket.sent]
+    assert types[0] == "ai_chat_error" and websocket.sent[0]["request_id"] == "r2"
+    assert types[1:] == ["ai_chat_delta"] * len(CHUNKS) + ["ai_chat_complete"]
+    assert websocket.sent[-1]["response"] == "".join(CHUNKS) and websocket.sent[-1]["request_id"] == "r1"
+
+
+def test_websocket_streaming_frames():
+    print("Testing WebSocket streaming frames...")
+    asyncio.run(websocket_frames())
+    print("✓ WebSocket streaming frames passed")
+
+
+if __name__ == "__main__":
+    test_stream_message_to_ai()
+    test_sse_endpoint_saves_history()
+    test_websocket_streaming_frames()
+    print("All AI streaming tests passed!")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试/ai/chat的幂等键：重复请求合并到同一次AI调用（single-flight）、完成后重放结果、不重复保存对话
+使用httpx.MockTransport模拟Kimi API，不访问网络
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.api.v1.AIResponseProcessor import router as ai_router
+from app.services.https.AIResponseProcessor import AIResponseProcessor
+from app.services.https.KimiInteractionAPI import KimiInteractionAPI
+from app.utils.idempotency import IdempotencyCache, chat_idempotency
+
+USER_ID = 9_045_000
+
+
+def use_counting_transport(calls: list, delay: float = 0.2) -> KimiInteractionAPI:
+    async def handler(request: httpx.Request):
+        calls.append(request)
+        await asyncio.sleep(delay)  # 模拟LLM延迟
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": f"回复{len(calls)}"}}]})
+
+    kimi = KimiInteractionAPI()
+    kimi.client = None
+    kimi.transport = httpx.MockTransport(handler)
+    return kimi
+
+
+async def retried_chat_requests():
+    calls = []
+    kimi = use_counting_transport(calls)
+    processor = AIResponseProcessor()
+    processor.ai_histories.pop(USER_ID, None)
+    chat_idempotency.clear()
+
+    app = FastAPI()
+    app.include_router(ai_router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        body = {"user_id": USER_ID, "message": "hi", "idempotency_key": "k1"}
+        # 处理中的重复请求合并到同一次AI调用
+        first, second = await asyncio.gather(
+            client.post("/ai/chat", json=body),
+            client.post("/ai/chat", json=body)
+        )
+        assert len(calls) == 1
+        assert first.json()["response"] == second.json()["response"] == "回复1"
+        assert ("Idempotent-Replayed" in first.headers) != ("Idempotent-Replayed" in second.headers)
+
+        # 完成后的重试直接重放，不再调用AI
+        retry = await client.post("/ai/chat", json={"user_id": USER_ID, "message": "hi"}, headers={"Idempotency-Key": "k1"})
+        assert retry.json()["response"] == "回复1"
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert len(calls) == 1
+        assert len(processor.ai_histories[USER_ID]) == 2  # 只保存了一次用户消息和AI回复
+
+        # 新的幂等键和不带幂等键的请求正常调用AI
+        await client.post("/ai/chat", json={"user_id": USER_ID, "message": "next", "idempotency_key": "k2"})
+        await client.post("/ai/chat", json={"user_id": USER_ID, "message": "again"})
+        assert len(calls) == 3
+        assert len(processor.ai_histories[USER_ID]) == 6
+
+        # 对话继续后旧幂等键的结果不再匹配当前历史版本
+        stale = await client.post("/ai/chat", json=body)
+        assert len(calls) == 4 and stale.json()["response"] == "回复4"
+    await kimi.close()
+
+
+def test_chat_idempotency():
+    print("Testing /ai/chat idempotency...")
+    asyncio.run(retried_chat_requests())
+    print("✓ /ai/chat idempotency passed")
+
+
+async def no_history() -> int:
+    return 0
+
+
+async def failed_calls_are_not_cached():
+    cache = IdempotencyCache()
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("provider down")
+
+    results = await asyncio.gather(
+        cache.run(1, "k", no_history, failing),
+        cache.run(1, "k", no_history, failing),
+        return_exceptions=True
+    )
+    assert len(attempts) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    async def succeeding():
+        attempts.append(1)
+        return {"success": False}
+
+    await cache.run(1, "k", no_history, succeeding, cacheable=lambda result: result["success"])
+    result, replayed = await cache.run(1, "k", no_history, succeeding, cacheable=lambda result: result["success"])
+    assert len(attempts) == 3 and replayed is False
+    assert not cache._in_flight and not cache._results
+
+
+def test_failed_calls_are_not_cached():
+    print("Testing failed calls are not cached...")
+    asyncio.run(failed_calls_are_not_cached())
+    print("✓ Failed calls are not cached passed")
+
+
+if __name__ == "__main__":
+    test_chat_idempotency()
+    test_failed_calls_are_not_cached()
+    print("All chat idempotency tests passed!")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+测试聊天室创建的single-flight：同一匹配的并发请求只创建一个聊天室、只写入一次数据库
+使用内存中的模拟集合代替MongoDB，不需要服务器和数据库
+"""
+
+import asyncio
+import copy
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.core.database import Database
+from app.objects.Chatroom import Chatroom
+from app.objects.Match import Match
+from app.objects.User import User
+from app.services.https.ChatroomManager import ChatroomManager
+from app.services.https.MatchManager import MatchManager
+from app.services.https.UserManagement import UserManagement
+
+USER_ID = 9_028_000
+
+
+class FakeDatabase:
+    """
+    只实现聊天室和匹配保存用到的查询和更新，写入前让出控制权以暴露并发
+    """
+
+    def __init__(self):
+        self.collections = {"chatrooms": {}, "matches": {}}
+        self.inserts = {"chatrooms": 0, "matches": 0}
+
+    async def find_one(self, collection_name: str, query: dict):
+        await asyncio.sleep(0)
+        document = self.collections[collection_name].get(query["_id"])
+        return copy.deepcopy(document) if document else None
+
+    async def insert_one(self, collection_name: str, document: dict):
+        await asyncio.sleep(0)
+        self.inserts[collection_name] += 1
+        self.collections[collection_name][document["_id"]] = copy.deepcopy(document)
+
+    async def update_one(self, collection_name: str, query: dict, update: dict, upsert: bool = False):
+        await asyncio.sleep(0)
+        document = self.collections[collection_name].setdefault(query["_id"], {"_id": query["_id"]})
+        document.update(copy.deepcopy(update.get("$set", {})))
+        return 1
+
+
+async def concurrent_creation():
+    db = FakeDatabase()
+    originals = {name: getattr(Database, name) for name in ("find_one", "insert_one", "update_one")}
+    for name in originals:
+        setattr(Database, name, getattr(db, name))
+
+    Chatroom._initialized = Match._initialized = True
+    user_manager = UserManagement()
+    chatroom_manager = ChatroomManager()
+    match_manager = MatchManager()
+    user1, user2 = User("creation_1", 1, USER_ID), User("creation_2", 2, USER_ID + 1)
+    user_manager.user_list[user1.user_id] = user1
+    user_manager.user_list[user2.user_id] = user2
+    match = Match(user1.user_id, user2.user_id, "reason 1", "reason 2", 80, "2025-06-01T00:00:00")
+    match_manager.match_list[match.match_id] = match
+    before = set(chatroom_manager.chatrooms)
+    try:
+        results = await asyncio.gather(*(
+            chatroom_manager.get_or_create_chatroom(user1.user_id, user2.user_id, match.match_id) for _ in range(10)
+        ))
+        created = set(chatroom_manager.chatrooms) - before
+        print(f"10 concurrent calls created chatrooms {sorted(created)}")
+        assert len(created) == 1
+        chatroom_id = created.pop()
+        assert results == [chatroom_id] * 10
+        assert match.chatroom_id == chatroom_id
+        assert db.inserts["chatrooms"] == 1
+        assert not chatroom_manager.pending_chatroom_creations
+
+        # 创建完成后直接返回已有的聊天室
+        assert await chatroom_manager.get_or_create_chatroom(user1.user_id, user2.user_id, match.match_id) == chatroom_id
+        assert db.inserts["chatrooms"] == 1
+    finally:
+        for name, method in originals.items():
+            setattr(Database, name, method)
+        for chatroom_id in set(chatroom_manager.chatrooms) - before:
+            chatroom_manager.chatrooms.pop(chatroom_id)
+        for user in (user1, user2):
+            chatroom_manager.user_chatrooms.pop(user.user_id, None)
+            user_manager.user_list.pop(user.user_id, None)
+        match_manager.match_list.pop(match.match_id, None)
+
+
+def test_concurrent_creation_is_single_flight():
+    print("Testing single-flight chatroom creation...")
+    asyncio.run(concurrent_creation())
+    print("✓ Single-flight chatroom creation passed")
+
+
+if __name__ == "__main__":
+    test_concurrent_creation_is_single_flight()
+    print("All chatroom creation tests passed!")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+测试收件箱（会话列表）：最后一条消息预览、未读数、按最近活动排序和分页
+纯内存测试，不需要数据库
+"""
+
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.objects.User import User
+from app.objects.Chatroom import Chatroom
+from app.services.https.UserManagement import UserManagement
+from app.services.https.ChatroomManager import ChatroomManager
+
+BASE_USER_ID = 9_029_000
+
+
+def setup_chatrooms():
+    """创建1个主用户和3个对方用户，每对用户一个聊天室"""
+    Chatroom._initialized = True
+    user_manager = UserManagement()
+    chatroom_manager = ChatroomManager()
+
+    me = User("inbox_me", 1, BASE_USER_ID)
+    user_manager.user_list[me.user_id] = me
+
+    chatrooms = []
+    for i in range(1, 4):
+        other = User(f"inbox_other_{i}", 2, BASE_USER_ID + i)
+        user_manager.user_list[other.user_id] = other
+        chatroom = Chatroom(me, other, match_id=None)
+        chatroom_manager.chatrooms[chatroom.chatroom_id] = chatroom
+        chatroom_manager._index_chatroom(chatroom)
+        chatrooms.append(chatroom)
+    return me, chatrooms
+
+
+def test_inbox_order_and_unread():
+    print("Testing inbox ordering and unread counts...")
+    chatroom_manager = ChatroomManager()
+    me, chatrooms = setup_chatrooms()
+    base_time = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    # 聊天室0最早活动，聊天室2最近活动
+    chatrooms[0].record_message(chatrooms[0].user2_id, "hi from 1", base_time)
+    chatrooms[1].record_message(me.user_id, "hello 2", base_time + timedelta(minutes=1))
+    chatrooms[2].record_message(chatrooms[2].user2_id, "first", base_time + timedelta(minutes=2))
+    chatrooms[2].record_message(chatrooms[2].user2_id, "second", base_time + timedelta(minutes=3))
+
+    inbox = chatroom_manager.get_inbox(me.user_id)
+    ids = [c["chatroom_id"] for c in inbox["conversations"]]
+    print(f"Inbox order: {ids}")
+    assert inbox["total"] == 3
+    assert ids == [chatrooms[2].chatroom_id, chatrooms[1].chatroom_id, chatrooms[0].chatroom_id]
+
+    latest = inbox["conversations"][0]
+    assert latest["last_message"] == "second"
+    assert latest["unread_count"] == 2
+    assert latest["target_user_name"] == "inbox_other_3"
+    # 自己发送的消息不计入自己的未读数
+    assert inbox["conversations"][1]["unread_count"] == 0
+
+    chatrooms[2].mark_read(me.user_id)
+    assert chatroom_manager.get_inbox(me.user_id)["conversations"][0]["unread_count"] == 0
+    print("✓ Inbox ordering and unread counts passed")
+
+
+def test_inbox_pagination_and_preview():
+    print("Testing inbox pagination and preview truncation...")
+    chatroom_manager = ChatroomManager()
+    me, chatrooms = setup_chatrooms()
+
+    long_message = "x" * (settings.INBOX_PREVIEW_LENGTH + 50)
+    chatrooms[0].record_message(me.user_id, long_message, datetime.now(timezone.utc))
+    assert len(chatrooms[0].last_message) == settings.INBOX_PREVIEW_LENGTH + 1
+
+    page = chatroom_manager.get_inbox(me.user_id, offset=1, limit=1)
+    assert len(page["conversations"]) == 1
+
+    # 已删除的聊天室从索引中被跳过
+    del chatroom_manager.chatrooms[chatrooms[1].chatroom_id]
+    inbox = chatroom_manager.get_inbox(me.user_id)
+    assert chatrooms[1].chatroom_id not in [c["chatroom_id"] for c in inbox["conversations"]]
+    print("✓ Inbox pagination and preview truncation passed")
+
+
+if __name__ == "__main__":
+    test_inbox_order_and_unread()
+    test_inbox_pagination_and_preview()
+    print("All inbox tests passed!")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+测试聊天室消息序号和增量同步
+纯内存测试，不需要数据库
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.core.database import Database
+from app.objects.User import User
+from app.objects.Chatroom import Chatroom
+from app.services.https.UserManagement import UserManagement
+from app.services.https.ChatroomManager import ChatroomManager
+
+BASE_USER_ID = 9_030_000
+
+
+def test_next_seq_is_monotonic():
+    print("Testing per-chatroom sequence numbers...")
+    Chatroom._initialized = True
+    user1 = User("seq_user_1", 1, BASE_USER_ID + 1)
+    user2 = User("seq_user_2", 2, BASE_USER_ID + 2)
+
+    room_a = Chatroom(user1, user2, match_id=None)
+    room_b = Chatroom(user1, user2, match_id=None)
+    assert [room_a.next_seq() for _ in range(3)] == [1, 2, 3]
+    # 序号按聊天室独立计数
+    assert room_b.next_seq() == 1
+    assert room_a.last_seq == 3
+    print("✓ Sequence numbers passed")
+
+
+def test_legacy_document_has_no_seq():
+    print("Testing legacy chatroom documents...")
+    user1 = User("seq_user_1", 1, BASE_USER_ID + 1)
+    user2 = User("seq_user_2", 2, BASE_USER_ID + 2)
+    legacy = Chatroom.from_document({"_id": BASE_USER_ID, "user1_id": user1.user_id, "user2_id": user2.user_id,
+                                     "message_ids": [1, 2]}, user1, user2)
+    # 旧文档的last_seq由ChatroomManager启动时回填
+    assert legacy.last_seq is None
+
+    current = Chatroom.from_document({"_id": BASE_USER_ID + 1, "user1_id": user1.user_id, "user2_id": user2.user_id,
+                                      "message_ids": [3], "last_seq": 7}, user1, user2)
+    assert current.next_seq() == 8
+    print("✓ Legacy chatroom documents passed")
+
+
+def test_up_to_date_client_gets_empty_delta():
+    print("Testing delta sync for an up-to-date client...")
+    Chatroom._initialized = True
+    user_manager = UserManagement()
+    chatroom_manager = ChatroomManager()
+    user1 = User("seq_user_1", 1, BASE_USER_ID + 1)
+    user2 = User("seq_user_2", 2, BASE_USER_ID + 2)
+    user_manager.user_list[user1.user_id] = user1
+    user_manager.user_list[user2.user_id] = user2
+
+    chatroom = Chatroom(user1, user2, match_id=None)
+    chatroom.message_ids = [101, 102]
+    chatroom.next_seq()
+    chatroom.next_seq()
+    chatroom_manager.chatrooms[chatroom.chatroom_id] = chatroom
+
+    # 客户端已经拥有最新序号时不访问数据库
+    history = asyncio.run(chatroom_manager.get_chatroom_history(chatroom.chatroom_id, user1.user_id, since_seq=2))
+    assert history == []
+    print("✓ Delta sync for an up-to-date client passed")
+
+
+def test_backfill_uses_one_bulk_write_and_keeps_seq_on_failure():
+    print("Testing seq backfill for legacy chatrooms...")
+    Chatroom._initialized = True
+    user1 = User("seq_user_1", 1, BASE_USER_ID + 1)
+    user2 = User("seq_user_2", 2, BASE_USER_ID + 2)
+    chatroom_manager = ChatroomManager()
+    chatroom = Chatroom.from_document({"_id": BASE_USER_ID, "user1_id": user1.user_id, "user2_id": user2.user_id,
+                                       "message_ids": [11, 12, 13]}, user1, user2)
+    calls = []
+
+    async def failing_bulk_write(collection_name, operations, ordered=True):
+        raise ConnectionError("database unavailable")
+
+    async def recording_bulk_write(collection_name, operations, ordered=True):
+        calls.append((collection_name, [(op._filter["_id"], op._doc["$set"]["seq"]) for op in operations]))
+        return len(operations)
+
+    async def save_to_database():
+        return True
+
+    original = Database.bulk_write
+    chatroom.save_to_database = save_to_database
+    try:
+        # 回填失败时不设置last_seq，旧消息不会在没有序号的情况下被当作已同步
+        Database.bulk_write = failing_bulk_write
+        assert not asyncio.run(chatroom_manager._backfill_chatroom_seqs(chatroom))
+        assert chatroom.last_seq is None
+
+        Database.bulk_write = recording_bulk_write
+        assert asyncio.run(chatroom_manager._backfill_chatroom_seqs(chatroom))
+    finally:
+        Database.bulk_write = original
+    assert calls == [("messages", [(11, 1), (12, 2), (13, 3)])]
+    assert chatroom.last_seq == 3 and chatroom.next_seq() == 4
+    print("✓ Seq backfill for legacy chatrooms passed")
+
+
+if __name__ == "__main__":
+    test_next_seq_is_monotonic()
+    test_legacy_document_has_no_seq()
+    test_up_to_date_client_gets_empty_delta()
+    test_backfill_uses_one_bulk_write_and_keeps_seq_on_failure()
+    print("All chatroom seq tests passed!")
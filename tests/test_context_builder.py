@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+测试AI对话上下文构建：token预算、最近轮次原文保留和按用户缓存的滚动摘要
+不需要服务器和数据库
+"""
+
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.utils.context_builder import ContextBuilder, estimate_tokens
+
+USER_ID = 9_043_000
+SYSTEM_PROMPT = "你是Lushia，一个帮助用户了解自己恋爱偏好的助手。" * 20
+
+
+def make_history(turns: int) -> list:
+    history = []
+    for i in range(turns):
+        if i % 2 == 0:
+            history.append((f"第{i}轮：我平时喜欢爬山和看电影，周末经常和朋友一起做饭。" * 2, "2025-06-01T00:00:00", USER_ID, "I"))
+        else:
+            history.append((f"第{i}轮：听起来很棒！能再说说你理想中的周末是什么样子的吗？", "2025-06-01T00:00:00", 999, "AI Assistant"))
+    return history
+
+
+def total_tokens(messages: list) -> int:
+    return sum(estimate_tokens(message["content"]) + 4 for message in messages)
+
+
+def test_estimate_tokens():
+    print("Testing token estimation...")
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("你好") == 2
+    assert estimate_tokens("hello world!") == 3
+    print("✓ Token estimation passed")
+
+
+def test_short_history_is_kept_verbatim():
+    print("Testing short history...")
+    builder = ContextBuilder()
+    history = make_history(6)
+    messages = builder.build_messages(USER_ID, SYSTEM_PROMPT, history, "新消息")
+    assert len(messages) == 1 + len(history) + 1
+    assert messages[-1] == {"role": "user", "content": "新消息"}
+    assert messages[1]["role"] == "user" and messages[2]["role"] == "assistant"
+    print("✓ Short history passed")
+
+
+def test_long_history_stays_within_budget():
+    print("Testing long history budget and rolling summary...")
+    builder = ContextBuilder()
+    sizes = []
+    for turns in (200, 400, 800):
+        history = make_history(turns)
+        messages = builder.build_messages(USER_ID, SYSTEM_PROMPT, history, "新消息")
+        sizes.append(total_tokens(messages))
+        assert sizes[-1] <= settings.AI_CONTEXT_TOKEN_BUDGET
+        # 最近的轮次原文保留，摘要在系统提示词之后
+        assert messages[-2]["content"] == history[-1][0]
+        assert messages[1]["role"] == "system" and messages[1]["content"].startswith("以下是")
+    print(f"Request tokens for 200/400/800 turns: {sizes}")
+
+    # 增量：新增两轮只压缩新滑出窗口的轮次
+    summary = builder._summaries[USER_ID]
+    covered = summary["covered"]
+    history = make_history(802)
+    builder.build_messages(USER_ID, SYSTEM_PROMPT, history, "新消息")
+    assert builder._summaries[USER_ID] is summary
+    assert summary["covered"] - covered == 2
+    assert summary["tokens"] <= settings.AI_SUMMARY_TOKEN_BUDGET
+
+    # 对话被重置（历史变短）时重新开始
+    builder.build_messages(USER_ID, SYSTEM_PROMPT, make_history(4), "新消息")
+    assert builder._summaries[USER_ID]["covered"] == 0
+    print("✓ Long history budget and rolling summary passed")
+
+
+def test_summary_follows_bounded_history():
+    print("Testing rolling summary over a bounded history buffer...")
+    full, bounded = ContextBuilder(), ContextBuilder()
+    for turns in range(300, 340, 2):
+        history = make_history(turns)
+        full.build_messages(USER_ID, SYSTEM_PROMPT, history, "新消息")
+        # 只保留最近250条时（最早的消息被丢弃），摘要与使用完整历史时相同，新滑出窗口的轮次没有遗漏
+        window = history[-250:]
+        messages = bounded.build_messages(USER_ID, SYSTEM_PROMPT, window, "新消息")
+        assert list(bounded._summaries[USER_ID]["lines"]) == list(full._summaries[USER_ID]["lines"])
+        assert messages[-2]["content"] == history[-1][0]
+    assert bounded._summaries[USER_ID]["covered"] < 250
+    print("✓ Rolling summary over a bounded history buffer passed")
+
+
+if __name__ == "__main__":
+    test_estimate_tokens()
+    test_short_history_is_kept_verbatim()
+    test_long_history_stays_within_budget()
+    test_summary_follows_bounded_history()
+    print("All context builder tests passed!")
@@ -97,8 +97,8 @@ async def test_deactivate_user():
         print(f"注销后 - 用户3 match_ids: {user3_after.match_ids}")
         
         # 检查匹配是否被删除
-        match1_after = match_manager.get_match(match1.match_id)
-        match2_after = match_manager.get_match(match2.match_id)
+        match1_after = await match_manager.get_match(match1.match_id)
+        match2_after = await match_manager.get_match(match2.match_id)
         
         if match1_after is None:
             print(f"✓ 匹配{match1.match_id}已成功删除")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+测试基于Unix域套接字的跨进程WebSocket扇出broker
+在同一进程中启动两个不同worker_id的broker模拟两个uvicorn worker
+"""
+
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.WebSocketsService.FanoutBroker import UnixSocketBroker, create_fanout_broker, InProcessBroker
+
+
+async def wait_for(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+async def two_workers(socket_dir: str):
+    received_a, received_b = [], []
+
+    async def deliver_a(payload):
+        received_a.append(payload)
+
+    async def deliver_b(payload):
+        received_b.append(payload)
+
+    worker_a = UnixSocketBroker(socket_dir, worker_id="a")
+    worker_b = UnixSocketBroker(socket_dir, worker_id="b")
+    await worker_a.start(deliver_a)
+    await worker_b.start(deliver_b)  # b连接a，a反向连接b
+    await wait_for(lambda: "b" in worker_a.peers and "a" in worker_b.peers)
+
+    # 用户42连接在worker b上，worker a可以把消息路由过去
+    worker_b.user_online("default", "42")
+    await wait_for(lambda: ("default", "42") in worker_a.remote_users)
+    assert await worker_a.send_to_user("default", "42", "hello") is True
+    await wait_for(lambda: received_b)
+    assert received_b[0]["op"] == "send_to_user" and received_b[0]["message"] == "hello"
+    # 不在任何worker上的用户
+    assert await worker_a.send_to_user("default", "99", "nobody") is False
+
+    # 广播转发给所有其他worker
+    await worker_b.forward({"op": "broadcast", "namespace": "default", "message": "all"})
+    await wait_for(lambda: received_a)
+    assert received_a[0]["message"] == "all"
+
+    # worker b退出后，a清理它的在线用户
+    worker_b.user_offline("default", "42")
+    await worker_b.close()
+    await wait_for(lambda: "b" not in worker_a.peers)
+    assert ("default", "42") not in worker_a.remote_users
+    await worker_a.close()
+
+
+def test_unix_socket_broker_routes_between_workers():
+    print("Testing Unix socket fan-out broker...")
+    with tempfile.TemporaryDirectory() as socket_dir:
+        asyncio.run(two_workers(socket_dir))
+    print("✓ Unix socket fan-out broker passed")
+
+
+def test_create_fanout_broker():
+    assert isinstance(create_fanout_broker("inprocess"), InProcessBroker)
+    assert isinstance(create_fanout_broker("unix", "/tmp"), UnixSocketBroker)
+
+
+if __name__ == "__main__":
+    test_unix_socket_broker_routes_between_workers()
+    test_create_fanout_broker()
+    print("All fan-out broker tests passed!")
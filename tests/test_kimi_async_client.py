@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+测试KimiInteractionAPI的异步客户端：重试/退避，以及AI请求不阻塞事件循环
+使用httpx.MockTransport模拟Kimi API，不访问网络
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.services.https.AIProviderRouter import AIProviderRouter
+from app.services.https.AIProviders import KimiProvider
+from app.services.https.KimiInteractionAPI import KimiInteractionAPI
+
+USER_ID = 9_041_000
+
+
+def completion(content: str) -> dict:
+    return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+def use_transport(handler) -> KimiInteractionAPI:
+    kimi = KimiInteractionAPI()
+    kimi.client = None
+    kimi.transport = httpx.MockTransport(handler)
+    return kimi
+
+
+async def retry_then_succeed():
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(503)
+        if len(calls) == 2:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        return httpx.Response(200, json=completion("你好"))
+
+    # 直接发往Kimi的请求（流式）
+    kimi = use_transport(handler)
+    response = await kimi._send_with_retries({"model": kimi.model_name, "messages": []}, USER_ID, stream=False)
+    await kimi.close()
+    assert response.json()["choices"][0]["message"]["content"] == "你好"
+    assert len(calls) == 3
+    assert calls[0].headers["Authorization"].startswith("Bearer ")
+
+    # 经过服务商路由的非流式请求（/ai/chat）：只配置了Kimi一个服务商时同样退避重试
+    calls.clear()
+    router = AIProviderRouter()
+    providers = list(router.providers)
+    router.set_providers([KimiProvider()])
+    try:
+        kimi = use_transport(handler)
+        result = await kimi.send_message_to_ai(USER_ID, "hi", [])
+        await kimi.close()
+    finally:
+        router.set_providers(providers)
+    assert result["message"] == "你好"
+    assert len(calls) == 3
+
+    # 4xx不重试，直接返回备用响应
+    calls.clear()
+
+    async def rejecting_handler(request: httpx.Request):
+        calls.append(request)
+        return httpx.Response(400, json={"error": "bad request"})
+
+    kimi = use_transport(rejecting_handler)
+    result = await kimi.send_message_to_ai(USER_ID, "hi", [])
+    await kimi.close()
+    assert len(calls) == 1
+    assert result == {**await kimi.get_fallback_response(), "timestamp": result["timestamp"]}
+
+
+def test_retry_and_backoff():
+    print("Testing retries and backoff...")
+    base_delay = settings.AI_RETRY_BASE_DELAY_SECONDS
+    settings.AI_RETRY_BASE_DELAY_SECONDS = 0.01
+    try:
+        asyncio.run(retry_then_succeed())
+    finally:
+        settings.AI_RETRY_BASE_DELAY_SECONDS = base_delay
+
+    delays = [KimiInteractionAPI._backoff_delay(attempt) for attempt in range(1, 10) for _ in range(20)]
+    assert all(0 <= delay <= settings.AI_RETRY_MAX_DELAY_SECONDS for delay in delays)
+    assert len(set(delays)) > 1  # 带随机抖动
+    assert KimiInteractionAPI._backoff_delay(1, "2") == 2.0
+    print("✓ Retries and backoff passed")
+
+
+async def chat_survives_one_503():
+    from fastapi import FastAPI
+    from app.api.v1.AIResponseProcessor import router as ai_router
+
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, json=completion("恢复了"))
+
+    router = AIProviderRouter()
+    providers = list(router.providers)
+    router.set_providers([KimiProvider()])
+    kimi = use_transport(handler)
+    app = FastAPI()
+    app.include_router(ai_router)
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/ai/chat", json={"user_id": USER_ID, "message": "hi"})
+    finally:
+        router.set_providers(providers)
+        await kimi.close()
+    assert response.status_code == 200
+    assert response.json()["response"] == "恢复了"
+    assert len(calls) == 2
+
+
+def test_chat_survives_transient_503():
+    print("Testing /ai/chat retries a transient 503...")
+    base_delay = settings.AI_RETRY_BASE_DELAY_SECONDS
+    settings.AI_RETRY_BASE_DELAY_SECONDS = 0.01
+    try:
+        asyncio.run(chat_survives_one_503())
+    finally:
+        settings.AI_RETRY_BASE_DELAY_SECONDS = base_delay
+    print("✓ /ai/chat retries a transient 503 passed")
+
+
+async def concurrent_load():
+    async def slow_handler(request: httpx.Request):
+        await asyncio.sleep(0.3)  # 模拟LLM延迟
+        return httpx.Response(200, json=completion("ok"))
+
+    kimi = use_transport(slow_handler)
+
+    # AI请求进行期间，测量其他协程的调度延迟
+    lags = []
+
+    async def unrelated_request():
+        for _ in range(20):
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - start - 0.01)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(kimi.send_message_to_ai(USER_ID + i, "hi", []) for i in range(10)),
+        unrelated_request()
+    )
+    elapsed = time.perf_counter() - start
+    await kimi.close()
+
+    print(f"10 concurrent AI requests took {elapsed:.2f}s, max unrelated lag {max(lags) * 1000:.1f}ms")
+    assert all(result["message"] == "ok" for result in results[:10])
+    assert elapsed < 1.0  # 并发执行，而不是10 * 0.3秒
+    assert max(lags) < 0.05
+
+
+def test_ai_requests_do_not_block_event_loop():
+    print("Testing AI requests under concurrent load...")
+    asyncio.run(concurrent_load())
+    print("✓ AI requests under concurrent load passed")
+
+
+if __name__ == "__main__":
+    test_retry_and_backoff()
+    test_chat_survives_transient_503()
+    test_ai_requests_do_not_block_event_loop()
+    print("All Kimi async client tests passed!")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+测试匹配归档：长期没有活动的匹配移入matches_archive、访问时恢复、
+查重时包括已归档的匹配，以及全量保存不会把保存期间归档的匹配写回matches
+使用内存中的模拟集合代替MongoDB，不需要服务器和数据库
+"""
+
+import asyncio
+import copy
+import sys
+import time
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.core.database import Database
+from app.objects.Match import Match
+from app.services.https.MatchManager import MatchManager
+
+USER_ID = 9_026_000
+
+
+class FakeDatabase:
+    """
+    只实现MatchManager和Match.save_to_database用到的查询和更新，每次调用都让出控制权以暴露并发
+    """
+
+    def __init__(self):
+        self.collections = {"matches": {}, "matches_archive": {}}
+
+    @staticmethod
+    def _matches(document: dict, query: dict) -> bool:
+        if "$or" in query:
+            return any(FakeDatabase._matches(document, branch) for branch in query["$or"])
+        return all(document.get(key) == value for key, value in query.items())
+
+    async def find_one(self, collection_name: str, query: dict):
+        await asyncio.sleep(0)
+        document = self.collections[collection_name].get(query["_id"])
+        return copy.deepcopy(document) if document else None
+
+    async def find(self, collection_name: str, query: dict = {}, projection: dict = {}, limit: int = 0, sort: list = []):
+        await asyncio.sleep(0)
+        documents = [copy.deepcopy(d) for d in self.collections[collection_name].values() if self._matches(d, query)]
+        return documents[:limit] if limit > 0 else documents
+
+    async def insert_one(self, collection_name: str, document: dict):
+        await asyncio.sleep(0)
+        self.collections[collection_name][document["_id"]] = copy.deepcopy(document)
+
+    async def update_one(self, collection_name: str, query: dict, update: dict, upsert: bool = False):
+        await asyncio.sleep(0)
+        document = self.collections[collection_name].get(query["_id"])
+        if document is None:
+            if not upsert:
+                return 0
+            document = self.collections[collection_name][query["_id"]] = {"_id": query["_id"]}
+        document.update(copy.deepcopy(update.get("$set", {})))
+        return 1
+
+    async def delete_one(self, collection_name: str, query: dict):
+        await asyncio.sleep(0)
+        return 1 if self.collections[collection_name].pop(query["_id"], None) is not None else 0
+
+
+async def with_fake_database(scenario):
+    db = FakeDatabase()
+    originals = {name: getattr(Database, name) for name in ("find_one", "find", "insert_one", "update_one", "delete_one")}
+    for name in originals:
+        setattr(Database, name, getattr(db, name))
+    Match._initialized = True
+    manager = MatchManager()
+    existing = set(manager.match_list)
+    archived = set(manager.archived_match_ids)
+    try:
+        await scenario(db, manager)
+    finally:
+        for name, method in originals.items():
+            setattr(Database, name, method)
+        for match_id in set(manager.match_list) - existing:
+            manager.match_list.pop(match_id)
+        manager.archived_match_ids = archived
+
+
+async def create_stale_match(manager: MatchManager, user_id_1: int, user_id_2: int) -> Match:
+    match = await manager.create_match(user_id_1, user_id_2, "reason 1", "reason 2", 80)
+    await match.save_to_database()
+    match.last_activity_time = time.time() - 40 * 86400
+    return match
+
+
+async def archive_and_rehydrate(db: FakeDatabase, manager: MatchManager):
+    stale = await create_stale_match(manager, USER_ID, USER_ID + 1)
+    active = await manager.create_match(USER_ID, USER_ID + 2, "reason 1", "reason 2", 70)
+    await active.save_to_database()
+
+    # 只归档超过期限没有活动的匹配：移出内存和matches，写入matches_archive
+    assert await manager.archive_inactive_matches(inactive_days=30) == 1
+    assert stale.match_id not in manager.match_list and active.match_id in manager.match_list
+    assert stale.match_id in manager.archived_match_ids
+    assert stale.match_id in db.collections["matches_archive"] and stale.match_id not in db.collections["matches"]
+    assert db.collections["matches_archive"][stale.match_id]["user_id_1"] == USER_ID
+
+    # 访问时恢复到内存和matches，归档记录删除
+    restored = await manager.get_match(stale.match_id)
+    assert restored is not None and restored.match_id == stale.match_id
+    assert manager.match_list[stale.match_id] is restored
+    assert stale.match_id not in manager.archived_match_ids
+    assert stale.match_id in db.collections["matches"] and stale.match_id not in db.collections["matches_archive"]
+    # 恢复时刷新活动时间，不会马上再次被归档
+    assert await manager.archive_inactive_matches(inactive_days=30) == 0
+
+
+async def uniqueness_through_archive(db: FakeDatabase, manager: MatchManager):
+    stale = await create_stale_match(manager, USER_ID + 3, USER_ID + 4)
+    assert await manager.archive_inactive_matches(inactive_days=30) == 1
+
+    # 两个用户已有的匹配被归档后，查重仍能找到（顺序无关）并恢复
+    found = await manager.find_match_between(USER_ID + 4, USER_ID + 3)
+    assert found is not None and found.match_id == stale.match_id
+    assert stale.match_id in manager.match_list
+    assert await manager.find_match_between(USER_ID + 3, USER_ID + 5) is None
+
+
+async def save_all_skips_archived(db: FakeDatabase, manager: MatchManager):
+    # 排在前面的匹配保存期间，后面的匹配已经被归档
+    for index in range(5):
+        active = await manager.create_match(USER_ID + 10 + index, USER_ID + 20 + index, "reason 1", "reason 2", 70)
+        await active.save_to_database()
+    stale = await create_stale_match(manager, USER_ID + 6, USER_ID + 7)
+
+    # 全量保存与归档同时进行：归档完成后matches中不能留下被归档的匹配
+    await asyncio.gather(manager.save_to_database(), manager.archive_inactive_matches(inactive_days=30))
+    assert stale.match_id in manager.archived_match_ids
+    assert stale.match_id not in db.collections["matches"]
+    assert stale.match_id in db.collections["matches_archive"]
+
+    # 已归档的匹配不再被全量保存写回
+    await manager.save_to_database()
+    assert stale.match_id not in db.collections["matches"]
+
+
+def test_archive_and_rehydrate():
+    print("Testing match archive and rehydration...")
+    asyncio.run(with_fake_database(archive_and_rehydrate))
+    print("✓ Match archive and rehydration passed")
+
+
+def test_uniqueness_through_archive():
+    print("Testing duplicate-pair lookup through the archive...")
+    asyncio.run(with_fake_database(uniqueness_through_archive))
+    print("✓ Duplicate-pair lookup through the archive passed")
+
+
+def test_save_all_skips_archived_matches():
+    print("Testing full save skips archived matches...")
+    asyncio.run(with_fake_database(save_all_skips_archived))
+    print("✓ Full save skips archived matches passed")
+
+
+if __name__ == "__main__":
+    test_archive_and_rehydrate()
+    test_uniqueness_through_archive()
+    test_save_all_skips_archived_matches()
+    print("All match archive tests passed!")
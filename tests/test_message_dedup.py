@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+测试基于client_message_id的消息去重
+使用accepted确认级别（消息只写入内存日志），不需要数据库
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.objects.User import User
+from app.objects.Chatroom import Chatroom
+from app.objects.Message import Message
+from app.services.https.UserManagement import UserManagement
+from app.services.https.ChatroomManager import ChatroomManager
+from app.services.https.MessageJournal import MessageJournal
+
+BASE_USER_ID = 9_032_000
+
+
+def setup_chatroom():
+    Message._initialized = True
+    Chatroom._initialized = True
+    user_manager = UserManagement()
+    sender = User("dedup_sender", 1, BASE_USER_ID + 1)
+    receiver = User("dedup_receiver", 2, BASE_USER_ID + 2)
+    user_manager.user_list[sender.user_id] = sender
+    user_manager.user_list[receiver.user_id] = receiver
+    chatroom = Chatroom(sender, receiver, match_id=None)
+    ChatroomManager().chatrooms[chatroom.chatroom_id] = chatroom
+    return chatroom, sender, receiver
+
+
+async def send_with_retries():
+    chatroom_manager = ChatroomManager()
+    chatroom, sender, receiver = setup_chatroom()
+
+    first = await chatroom_manager.send_message(chatroom.chatroom_id, sender.user_id, "hello", "client-1")
+    retry = await chatroom_manager.send_message(chatroom.chatroom_id, sender.user_id, "hello", "client-1")
+    print(f"First send: {first}")
+    print(f"Retry: {retry}")
+    assert first["success"] and not first["duplicate"]
+    assert retry["success"] and retry["duplicate"]
+    assert retry["seq"] == first["seq"]
+    assert len(chatroom.message_ids) == 1
+    assert chatroom.unread_counts[receiver.user_id] == 1
+
+    # 另一个发送者使用相同的client_message_id不会被当作重发
+    other = await chatroom_manager.send_message(chatroom.chatroom_id, receiver.user_id, "hi", "client-1")
+    assert not other["duplicate"]
+
+    # 并发重发只存储一次
+    results = await asyncio.gather(*[
+        chatroom_manager.send_message(chatroom.chatroom_id, sender.user_id, "again", "client-2")
+        for _ in range(5)
+    ])
+    assert len({result["seq"] for result in results}) == 1
+    assert sum(not result["duplicate"] for result in results) == 1
+    assert len(chatroom.message_ids) == 3
+
+    # 不提供client_message_id时不去重
+    await chatroom_manager.send_message(chatroom.chatroom_id, sender.user_id, "plain")
+    await chatroom_manager.send_message(chatroom.chatroom_id, sender.user_id, "plain")
+    assert len(chatroom.message_ids) == 5
+
+    await asyncio.gather(*chatroom_manager.background_tasks)
+
+
+def test_client_message_id_dedup():
+    print("Testing client_message_id dedup...")
+    original_ack_level = settings.MESSAGE_ACK_LEVEL
+    settings.MESSAGE_ACK_LEVEL = "accepted"
+    try:
+        asyncio.run(send_with_retries())
+    finally:
+        settings.MESSAGE_ACK_LEVEL = original_ack_level
+        MessageJournal().pending.clear()
+    print("✓ client_message_id dedup passed")
+
+
+async def retry_after_cancelled_send():
+    chatroom_manager = ChatroomManager()
+    chatroom, sender, _ = setup_chatroom()
+    started = asyncio.Event()
+
+    async def slow_send(*args, **kwargs):
+        started.set()
+        await asyncio.sleep(10)
+
+    chatroom_manager._send_new_message = slow_send
+    try:
+        original = asyncio.create_task(
+            chatroom_manager.send_message(chatroom.chatroom_id, sender.user_id, "hello", "client-cancel")
+        )
+        await started.wait()
+        waiting_retry = asyncio.create_task(
+            chatroom_manager.send_message(chatroom.chatroom_id, sender.user_id, "hello", "client-cancel")
+        )
+        await asyncio.sleep(0)
+        original.cancel()
+
+        # 等待中的重发拿到失败结果，而不是一直挂起
+        result = await asyncio.wait_for(waiting_retry, timeout=1)
+        assert not result["success"] and result["duplicate"]
+        # 失败的client_message_id被遗忘，之后可以重试
+        assert (sender.user_id, "client-cancel") not in chatroom.recent_client_messages
+    finally:
+        del chatroom_manager._send_new_message
+
+
+def test_cancelled_send_releases_retries():
+    print("Testing cancelled send releases retries...")
+    asyncio.run(retry_after_cancelled_send())
+    print("✓ Cancelled send releases retries passed")
+
+
+def test_dedup_window_is_bounded():
+    print("Testing dedup window bound...")
+    chatroom, sender, _ = setup_chatroom()
+    for i in range(settings.CLIENT_MESSAGE_ID_WINDOW + 10):
+        chatroom.remember_client_message((sender.user_id, f"client-{i}"), None)
+    assert len(chatroom.recent_client_messages) == settings.CLIENT_MESSAGE_ID_WINDOW
+    # 最早的记录被淘汰
+    assert (sender.user_id, "client-0") not in chatroom.recent_client_messages
+    print("✓ Dedup window bound passed")
+
+
+if __name__ == "__main__":
+    test_client_message_id_dedup()
+    test_cancelled_send_releases_retries()
+    test_dedup_window_is_bounded()
+    print("All message dedup tests passed!")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+测试消息日志落库时对持续写入失败消息的处理
+通过替换Database.insert_many模拟BulkWriteError，不需要数据库
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from pymongo.errors import BulkWriteError
+
+from app.config import settings
+from app.core.database import Database
+from app.services.https.MessageJournal import MessageJournal
+
+
+async def flush_with_poison_message():
+    journal = MessageJournal()
+    journal.pending.clear()
+    journal.attempts.clear()
+    for i in range(3):
+        journal.pending[f"journal-msg-{i}"] = {"_id": f"journal-msg-{i}", "chatroom_id": "journal-room", "seq": i + 1}
+
+    dead_letters = []
+
+    async def fake_insert_many(collection_name, documents, ordered=True):
+        if collection_name == "messages_dead_letter":
+            dead_letters.extend(documents)
+            return
+        # 第二条消息持续失败（非重复键错误），第三条已存在（重复键）
+        errors = []
+        for index, document in enumerate(documents):
+            if document["_id"] == "journal-msg-1":
+                errors.append({"index": index, "code": 121, "errmsg": "Document failed validation"})
+            elif document["_id"] == "journal-msg-2":
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    original_insert_many = Database.insert_many
+    Database.insert_many = fake_insert_many
+    try:
+        # 第一次：正常消息和重复消息移出日志，失败消息留待重试
+        assert await journal.flush() == 2
+        assert list(journal.pending) == ["journal-msg-1"]
+        assert journal.attempts["journal-msg-1"] == 1
+
+        for _ in range(settings.MESSAGE_JOURNAL_MAX_ATTEMPTS - 2):
+            assert await journal.flush() == 0
+            assert "journal-msg-1" in journal.pending
+
+        # 达到最大尝试次数后转入死信集合，日志清空
+        assert await journal.flush() == 1
+        assert not journal.pending
+        assert not journal.attempts
+        assert [document["_id"] for document in dead_letters] == ["journal-msg-1"]
+    finally:
+        Database.insert_many = original_insert_many
+        journal.pending.clear()
+        journal.attempts.clear()
+
+
+def test_poison_message_is_dead_lettered():
+    print("Testing journal poison message handling...")
+    asyncio.run(flush_with_poison_message())
+    print("✓ Journal poison message handling passed")
+
+
+if __name__ == "__main__":
+    test_poison_message_is_dead_lettered()
+    print("All message journal tests passed!")
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+测试离线事件队列：用户不在线时暂存事件，重新连接时作为一个批次补发，发送成功后才确认删除
+使用内存中的假WebSocket和模拟的pending_events集合，不需要服务器和数据库
+"""
+
+import asyncio
+import copy
+import json
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.core.database import Database
+from app.services.https.ChatroomManager import ChatroomManager
+from app.services.https.PendingEventQueue import PendingEventQueue
+from app.WebSocketsService.MessageConnectionHandler import MessageConnectionHandler
+from app.WebSocketsService.OutboundQueue import OutboundQueue
+
+
+class FakePendingEvents:
+    """
+    只实现PendingEventQueue用到的查询和更新（$push/$slice、$pull、$set、events.N/$size过滤）
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+    @staticmethod
+    def _event_matches(event: dict, condition: dict) -> bool:
+        if "$or" in condition:
+            return any(FakePendingEvents._event_matches(event, branch) for branch in condition["$or"])
+        for key, expected in condition.items():
+            if isinstance(expected, dict):
+                if "$in" in expected and event.get(key) not in expected["$in"]:
+                    return False
+                if "$exists" in expected and (key in event) != expected["$exists"]:
+                    return False
+            elif event.get(key) != expected:
+                return False
+        return True
+
+    def _matches(self, document: dict, query: dict) -> bool:
+        for key, condition in query.items():
+            if key == "_id":
+                if document["_id"] != condition:
+                    return False
+            elif key.startswith("events."):
+                if (len(document.get("events", [])) > int(key.split(".")[1])) != condition["$exists"]:
+                    return False
+            elif key == "events":
+                if len(document.get("events", [])) != condition["$size"]:
+                    return False
+        return True
+
+    async def find_one(self, collection_name: str, query: dict):
+        document = self.documents.get(query["_id"])
+        return copy.deepcopy(document) if document else None
+
+    async def update_one(self, collection_name: str, query: dict, update: dict, upsert: bool = False):
+        document = self.documents.get(query["_id"])
+        if document is None or not self._matches(document, query):
+            if document is not None or not upsert:
+                return 0
+            document = self.documents[query["_id"]] = {"_id": query["_id"]}
+        for key, value in update.get("$set", {}).items():
+            document[key] = value
+        for key, condition in update.get("$pull", {}).items():
+            document[key] = [event for event in document.get(key, []) if not self._event_matches(event, condition)]
+        for key, value in update.get("$push", {}).items():
+            events = document.get(key, []) + copy.deepcopy(value["$each"])
+            document[key] = events[value["$slice"]:]
+        return 1
+
+    async def delete_one(self, collection_name: str, query: dict):
+        document = self.documents.get(query["_id"])
+        if document is not None and self._matches(document, query):
+            del self.documents[query["_id"]]
+            return 1
+        return 0
+
+
+async def with_fake_database(scenario):
+    db = FakePendingEvents()
+    originals = {name: getattr(Database, name) for name in ("find_one", "update_one", "delete_one")}
+    for name in originals:
+        setattr(Database, name, getattr(db, name))
+    try:
+        await scenario(db)
+    finally:
+        for name, method in originals.items():
+            setattr(Database, name, method)
+
+
+class FakeWebSocket:
+    def __init__(self, fail: bool = False):
+        self.sent = []
+        self.fail = fail
+
+    async def send_text(self, message: str):
+        if self.fail:
+            raise ConnectionError("socket closed")
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def connect(user_id: str, websocket: FakeWebSocket) -> MessageConnectionHandler:
+    handler = MessageConnectionHandler(websocket)
+    handler.user_id = user_id
+    handler.outbound = OutboundQueue(websocket, maxsize=8)
+    handler.outbound.start()
+    return handler
+
+
+async def offline_then_reconnect(db: FakePendingEvents):
+    user_id = "9038000"
+    MessageConnectionHandler.sessions.pop(user_id, None)
+    pending = PendingEventQueue()
+
+    # 不在线：事件进入离线队列
+    for seq in (1, 2, 3):
+        delivered = await MessageConnectionHandler.deliver_event(user_id, {"type": "private_message", "chatroom_id": 1, "seq": seq})
+        assert delivered is False
+    # 同一匹配的点赞状态只保留最新的
+    await MessageConnectionHandler.deliver_event(user_id, {"type": "match_like_update", "match_id": 5, "is_liked": True}, coalesce_key="like:5")
+    await MessageConnectionHandler.deliver_event(user_id, {"type": "match_like_update", "match_id": 5, "is_liked": False}, coalesce_key="like:5")
+    assert await pending.pending_count(user_id) == 4
+
+    # 发送前连接就断开：事件不会被确认删除
+    broken = connect(user_id, FakeWebSocket(fail=True))
+    await broken._flush_pending_events()
+    await asyncio.sleep(0)
+    await asyncio.gather(*pending.background_tasks)
+    assert await pending.pending_count(user_id) == 4
+    await broken.outbound.close()
+
+    # 重新连接：认证后一次性补发，写入socket后才确认删除
+    websocket = FakeWebSocket()
+    handler = connect(user_id, websocket)
+    await handler._flush_pending_events()
+    await asyncio.sleep(0)
+    await asyncio.gather(*pending.background_tasks)
+
+    assert len(websocket.sent) == 1
+    batch = json.loads(websocket.sent[0])
+    print(f"Offline batch: {batch['count']} events, truncated={batch['truncated']}")
+    assert batch["type"] == "offline_events" and batch["count"] == 4 and not batch["truncated"]
+    assert [event.get("seq") for event in batch["events"][:3]] == [1, 2, 3]
+    assert batch["events"][3]["is_liked"] is False
+    assert await pending.pending_count(user_id) == 0
+    assert user_id not in db.documents
+
+    # 队列已清空，再次连接不会重复补发
+    await handler._flush_pending_events()
+    await asyncio.sleep(0)
+    assert len(websocket.sent) == 1
+    await handler.outbound.close()
+
+    # 在线：直接投递，不进入离线队列
+    MessageConnectionHandler.sessions[user_id] = {handler}
+    handler.outbound = OutboundQueue(websocket, maxsize=8)
+    handler.outbound.start()
+    assert await MessageConnectionHandler.deliver_event(user_id, {"type": "new_match", "match_id": 6})
+    assert await pending.pending_count(user_id) == 0
+    await handler.outbound.close()
+    MessageConnectionHandler.sessions.pop(user_id, None)
+
+
+async def ack_keeps_new_events(db: FakePendingEvents):
+    user_id = "9038002"
+    pending = PendingEventQueue()
+    await pending.push(user_id, {"type": "private_message", "seq": 1})
+    batch = await pending.peek(user_id)
+    # 批次发送期间（例如另一个worker）又加入了新事件
+    await pending.push(user_id, {"type": "private_message", "seq": 2})
+    await pending.ack(user_id, batch["events"])
+
+    remaining = await pending.peek(user_id)
+    assert [event["seq"] for event in remaining["events"]] == [2]
+
+
+def test_offline_events_flushed_on_reconnect():
+    print("Testing offline events flushed on reconnect...")
+    asyncio.run(with_fake_database(offline_then_reconnect))
+    print("✓ Offline events flushed on reconnect passed")
+
+
+def test_ack_only_removes_delivered_events():
+    print("Testing ack only removes delivered events...")
+    asyncio.run(with_fake_database(ack_keeps_new_events))
+    print("✓ Ack only removes delivered events passed")
+
+
+async def overflow_queue(db: FakePendingEvents):
+    user_id = "9038001"
+    pending = PendingEventQueue()
+    limit = settings.OFFLINE_QUEUE_MAX_EVENTS
+    for seq in range(limit + 10):
+        await pending.push(user_id, {"type": "private_message", "seq": seq})
+
+    batch = await pending.peek(user_id)
+    assert len(batch["events"]) == limit
+    assert batch["events"][0]["seq"] == 10  # 丢弃最早的
+    assert batch["truncated"]
+    await pending.ack(user_id, batch["events"])
+    assert await pending.peek(user_id) is None
+
+
+def test_queue_is_bounded():
+    print("Testing offline queue bound...")
+    asyncio.run(with_fake_database(overflow_queue))
+    print("✓ Offline queue bound passed")
+
+
+class FakeChatroom:
+    def __init__(self, user1_id: int, user2_id: int):
+        self.user1_id = user1_id
+        self.user2_id = user2_id
+
+    def get_other_user_id(self, user_id: int):
+        return {self.user1_id: self.user2_id, self.user2_id: self.user1_id}.get(user_id)
+
+
+async def recipient_must_be_chatroom_member(db: FakePendingEvents):
+    sender, recipient, outsider, chatroom_id = 9038010, 9038011, 9038012, 9_038_500
+    for user_id in (recipient, outsider):
+        MessageConnectionHandler.sessions.pop(str(user_id), None)
+    manager = ChatroomManager()
+    manager.chatrooms[chatroom_id] = FakeChatroom(sender, recipient)
+    sent = []
+
+    async def fake_send_message(chatroom_id, sender_user_id, message_content, client_message_id=None):
+        sent.append(message_content)
+        return {"success": True, "match_id": 1, "seq": len(sent), "ack": "durable"}
+
+    original_send_message = manager.send_message
+    manager.send_message = fake_send_message
+    websocket = FakeWebSocket()
+    handler = connect(str(sender), websocket)
+    try:
+        # 聊天室之外的用户（包括不存在的用户ID）收不到事件，也不会保存消息
+        for target in (outsider, 123456789):
+            await handler.handle_private_message({"target_user_id": target, "chatroom_id": chatroom_id, "content": "hi"})
+            await asyncio.sleep(0)
+            assert "error" in json.loads(websocket.sent[-1])
+            assert await PendingEventQueue().pending_count(target) == 0
+        assert sent == []
+
+        # 聊天室中的另一方正常投递（不在线时进入离线队列）
+        await handler.handle_private_message({"target_user_id": recipient, "chatroom_id": chatroom_id, "content": "hi"})
+        assert sent == ["hi"]
+        assert await PendingEventQueue().pending_count(recipient) == 1
+    finally:
+        manager.send_message = original_send_message
+        manager.chatrooms.pop(chatroom_id, None)
+        await handler.outbound.close()
+
+
+def test_private_message_recipient_is_chatroom_member():
+    print("Testing private message recipient validation...")
+    asyncio.run(with_fake_database(recipient_must_be_chatroom_member))
+    print("✓ Private message recipient validation passed")
+
+
+if __name__ == "__main__":
+    test_offline_events_flushed_on_reconnect()
+    test_ack_only_removes_delivered_events()
+    test_queue_is_bounded()
+    test_private_message_recipient_is_chatroom_member()
+    print("All offline queue tests passed!")
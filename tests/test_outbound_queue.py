@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+测试WebSocket连接的有界发送队列和三种溢出策略
+使用内存中的假WebSocket，不需要服务器
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.WebSocketsService.ConnectionHandler import ConnectionHandler
+from app.WebSocketsService.OutboundQueue import OutboundQueue, SLOW_CONSUMER_CLOSE_CODE
+
+
+class FakeWebSocket:
+    """记录发送内容的WebSocket，可设置每次发送的延迟"""
+
+    def __init__(self, send_delay: float = 0):
+        self.send_delay = send_delay
+        self.sent = []
+        self.close_code = None
+
+    async def send_text(self, message: str):
+        await asyncio.sleep(self.send_delay)
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+def register(user_id: str, websocket: FakeWebSocket, maxsize: int = 16, policy: str = "drop_oldest"):
+    handler = ConnectionHandler(websocket)
+    handler.user_id = user_id
+    handler.outbound = OutboundQueue(websocket, maxsize=maxsize, overflow_policy=policy)
+    handler.outbound.start()
+    ConnectionHandler.sessions.setdefault(user_id, set()).add(handler)
+    return handler
+
+
+async def broadcast_with_slow_peer():
+    ConnectionHandler.sessions.clear()
+    slow = FakeWebSocket(send_delay=0.5)
+    fast = FakeWebSocket()
+    slow_handler = register("slow", slow)
+    fast_handler = register("fast", fast)
+
+    start = time.perf_counter()
+    for i in range(5):
+        await ConnectionHandler.broadcast(f"message {i}")
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.05)
+
+    print(f"Broadcast took {elapsed * 1000:.2f}ms, fast peer received {len(fast.sent)}")
+    # 广播只是入队，不等待慢连接
+    assert elapsed < 0.1
+    assert fast.sent == [f"message {i}" for i in range(5)]
+    assert len(slow.sent) == 0
+
+    await slow_handler.outbound.close()
+    await fast_handler.outbound.close()
+    ConnectionHandler.sessions.clear()
+
+
+def test_broadcast_does_not_wait_for_slow_peer():
+    print("Testing broadcast with a slow peer...")
+    asyncio.run(broadcast_with_slow_peer())
+    print("✓ Broadcast with a slow peer passed")
+
+
+async def overflow_policies():
+    # drop_oldest：只保留最新的maxsize条
+    queue = OutboundQueue(FakeWebSocket(), maxsize=3, overflow_policy="drop_oldest")
+    for i in range(5):
+        assert queue.enqueue(f"m{i}")
+    assert [entry[1] for entry in queue.entries] == ["m2", "m3", "m4"]
+    assert queue.dropped_count == 2
+
+    # coalesce：相同key只保留最新状态，溢出时先丢弃可合并的消息
+    queue = OutboundQueue(FakeWebSocket(), maxsize=3, overflow_policy="coalesce")
+    queue.enqueue("chat 1")
+    queue.enqueue("presence v1", coalesce_key="presence:7")
+    queue.enqueue("presence v2", coalesce_key="presence:7")
+    queue.enqueue("chat 2")
+    assert [entry[1] for entry in queue.entries] == ["chat 1", "presence v2", "chat 2"]
+    queue.enqueue("chat 3")
+    assert [entry[1] for entry in queue.entries] == ["chat 1", "chat 2", "chat 3"]
+
+    # disconnect：队列满时断开慢连接
+    websocket = FakeWebSocket(send_delay=1)
+    queue = OutboundQueue(websocket, maxsize=2, overflow_policy="disconnect")
+    queue.start()
+    await asyncio.sleep(0)
+    results = [queue.enqueue(f"m{i}") for i in range(4)]
+    await asyncio.sleep(0)
+    await queue.close()
+    print(f"Disconnect policy enqueue results: {results}")
+    assert results[-1] is False
+    assert queue.overflowed
+
+
+def test_overflow_policies():
+    print("Testing overflow policies...")
+    asyncio.run(overflow_policies())
+    print("✓ Overflow policies passed")
+
+
+async def slow_consumer_is_closed():
+    websocket = FakeWebSocket()
+    queue = OutboundQueue(websocket, maxsize=1, overflow_policy="disconnect")
+    queue.enqueue("m0")
+    queue.enqueue("m1")
+    queue.start()
+    await asyncio.sleep(0.01)
+    assert websocket.close_code == SLOW_CONSUMER_CLOSE_CODE
+    assert websocket.sent == []
+
+
+def test_slow_consumer_is_closed():
+    print("Testing slow consumer disconnect...")
+    asyncio.run(slow_consumer_is_closed())
+    print("✓ Slow consumer disconnect passed")
+
+
+if __name__ == "__main__":
+    test_broadcast_does_not_wait_for_slow_peer()
+    test_overflow_policies()
+    test_slow_consumer_is_closed()
+    print("All outbound queue tests passed!")
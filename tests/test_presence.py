@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+测试在线状态服务：心跳、空闲连接回收和多设备在线
+使用内存中的假连接和手动推进的时间，不需要服务器
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.WebSocketsService.ConnectionHandler import ConnectionHandler
+from app.WebSocketsService.OutboundQueue import OutboundQueue
+from app.WebSocketsService.PresenceService import PresenceService
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def send_text(self, message: str):
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+class FakeConnection:
+    """只实现PresenceService需要的接口"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.outbound = OutboundQueue(FakeWebSocket(), maxsize=8)
+        self.reaped = False
+
+    async def reap(self):
+        self.reaped = True
+
+
+async def heartbeat_and_reap():
+    presence = PresenceService(ping_interval=2, idle_timeout=5, tick_seconds=1)
+    active, idle = FakeConnection("1"), FakeConnection("2")
+    presence.track(active, now=100.0)
+    presence.track(idle, now=100.0)
+
+    # 活跃连接持续有消息，空闲连接没有
+    for second in range(101, 108):
+        presence.touch(active, now=float(second))
+        await presence.tick(now=float(second) + 0.5)
+
+    pings = [json.loads(entry[1]) for entry in idle.outbound.entries]
+    print(f"Idle connection pings: {len(pings)}, reaped: {idle.reaped}")
+    assert pings and pings[0]["type"] == "ping"
+    assert idle.reaped
+    assert not active.reaped
+    assert not active.outbound.entries  # 活跃连接不需要ping
+    assert idle not in presence.last_seen
+    assert presence.get_last_seen("2") is not None
+
+
+def test_heartbeat_and_idle_reaping():
+    print("Testing heartbeats and idle reaping...")
+    asyncio.run(heartbeat_and_reap())
+    print("✓ Heartbeats and idle reaping passed")
+
+
+async def multiple_devices():
+    ConnectionHandler.sessions.clear()
+    phone = ConnectionHandler(FakeWebSocket())
+    laptop = ConnectionHandler(FakeWebSocket())
+    for handler in (phone, laptop):
+        handler.user_id = "7"
+        handler.outbound = OutboundQueue(handler.websocket, maxsize=8)
+        handler.outbound.start()
+        ConnectionHandler.sessions.setdefault("7", set()).add(handler)
+        ConnectionHandler.presence.track(handler)
+
+    assert ConnectionHandler.is_online("7")
+    assert await ConnectionHandler.send_to_user("7", "hello")
+    await asyncio.sleep(0)
+    # 两个设备都收到
+    assert phone.websocket.sent == ["hello"] and laptop.websocket.sent == ["hello"]
+
+    # 回收一个设备后用户仍在线
+    await phone.reap()
+    assert phone.websocket.close_code is not None
+    assert ConnectionHandler.is_online("7")
+    await laptop.reap()
+    assert not ConnectionHandler.is_online("7")
+    assert "7" not in ConnectionHandler.sessions
+
+
+def test_multiple_devices_per_user():
+    print("Testing multiple devices per user...")
+    asyncio.run(multiple_devices())
+    print("✓ Multiple devices per user passed")
+
+
+if __name__ == "__main__":
+    test_heartbeat_and_idle_reaping()
+    test_multiple_devices_per_user()
+    print("All presence tests passed!")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+测试预先组合的系统提示词：按性别组合、预计算token数、文件修改后自动重新加载和版本号
+使用临时prompts目录，不修改app/prompts
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.utils.context_builder import estimate_tokens
+from app.utils.prompt_manager import PromptManager
+
+
+def make_manager(prompts_dir: Path) -> PromptManager:
+    manager = PromptManager()
+    manager.prompts_dir = prompts_dir
+    return manager
+
+
+def test_compiled_prompts_are_reused():
+    print("Testing compiled prompts...")
+    manager = PromptManager()
+    compiled = manager.get_compiled_prompt("female")
+    assert compiled.text == f"{manager.get_core_prompts()}\n\n{manager.get_gender_specific_prompt('female')}"
+    assert compiled.token_count == estimate_tokens(compiled.text)
+    # 文件未修改时直接复用同一个对象，不重新组合
+    assert manager.get_compiled_prompt("female") is compiled
+    assert manager.get_complete_prompt("female") is compiled.text
+    # 未知性别使用neutral，所有性别共用一个版本号
+    assert manager.get_compiled_prompt("unknown") is manager.get_compiled_prompt("neutral")
+    assert manager.get_compiled_prompt("male").version == compiled.version
+    print("✓ Compiled prompts passed")
+
+
+def test_reload_on_file_change():
+    print("Testing reload on prompt file change...")
+    check_seconds = settings.PROMPT_RELOAD_CHECK_SECONDS
+    settings.PROMPT_RELOAD_CHECK_SECONDS = 0
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        for path in (ROOT_PATH / "app" / "prompts").glob("*.md"):
+            shutil.copy(path, temp_dir / path.name)
+        manager = make_manager(temp_dir)
+        before = manager.get_compiled_prompt("male")
+        assert manager.reload_if_changed() is False
+
+        workflow = temp_dir / "workflow.md"
+        workflow.write_text(workflow.read_text(encoding="utf-8") + "\n新增的测试规则。", encoding="utf-8")
+        stat = workflow.stat()
+        os.utime(workflow, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        after = manager.get_compiled_prompt("male")
+        assert after is not before
+        assert after.text.endswith(manager.get_gender_specific_prompt("male"))
+        assert "新增的测试规则。" in after.text and "新增的测试规则。" not in before.text
+        assert after.version != before.version
+        assert after.token_count > before.token_count
+    finally:
+        settings.PROMPT_RELOAD_CHECK_SECONDS = check_seconds
+        shutil.rmtree(temp_dir)
+    print("✓ Reload on prompt file change passed")
+
+
+def test_stat_is_throttled():
+    print("Testing reload check throttling...")
+    manager = PromptManager()
+    manager.get_compiled_prompt("neutral")
+    calls = []
+    original_stat = manager._stat_prompt_files
+    manager._stat_prompt_files = lambda: calls.append(1) or original_stat()
+
+    start = time.perf_counter()
+    for _ in range(10_000):
+        manager.get_compiled_prompt("neutral")
+    elapsed = time.perf_counter() - start
+    print(f"10000 prompt lookups took {elapsed * 1000:.1f}ms, {len(calls)} stat checks")
+    assert len(calls) <= 1
+    print("✓ Reload check throttling passed")
+
+
+if __name__ == "__main__":
+    test_compiled_prompts_are_reused()
+    test_reload_on_file_change()
+    test_stat_is_throttled()
+    print("All prompt manager tests passed!")
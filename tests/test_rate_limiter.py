@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+测试WebSocket连接的令牌桶限流和洪泛断开
+使用内存中的假WebSocket，不需要服务器
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.WebSocketsService.ConnectionHandler import ConnectionHandler, FLOOD_CLOSE_CODE
+from app.WebSocketsService.RateLimiter import ConnectionRateLimiter, parse_rate_limits
+
+
+def test_token_bucket():
+    print("Testing token buckets...")
+    limits = parse_rate_limits("*=10/20, private=1/2")
+    assert limits == {"*": (10.0, 20.0), "private": (1.0, 2.0)}
+
+    limiter = ConnectionRateLimiter(limits)
+    # 突发容量内允许，之后按速率补充
+    assert limiter.check("private", now=0.0) == 0
+    assert limiter.check("private", now=0.0) == 0
+    retry_after = limiter.check("private", now=0.0)
+    assert 0.9 < retry_after <= 1.0
+    assert limiter.check("private", now=1.0) == 0
+    # 没有配置的类型不限流
+    assert all(limiter.check("private_chat_init", now=0.0) == 0 for _ in range(100))
+
+    for bad in ("private=0/1", "private=abc"):
+        try:
+            parse_rate_limits(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"parse_rate_limits should reject {bad!r}")
+    print("✓ Token buckets passed")
+
+
+class FakeWebSocket:
+    """按顺序返回预设帧的WebSocket"""
+
+    def __init__(self, frames: list):
+        self.frames = [{"type": "websocket.receive", "text": frame} for frame in frames]
+        self.frames.append({"type": "websocket.disconnect", "code": 1000})
+        self.sent = []
+        self.close_code = None
+
+    async def receive_text(self):
+        return json.dumps({"user_id": "9040000"})
+
+    async def receive(self):
+        await asyncio.sleep(0)
+        return self.frames.pop(0)
+
+    async def send_text(self, message: str):
+        self.sent.append(json.loads(message))
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+class RecordingHandler(ConnectionHandler):
+    async def _authenticate(self, auth_data: dict) -> bool:
+        self.user_id = auth_data["user_id"]
+        return True
+
+    async def on_connect(self):
+        self.handled = []
+
+    async def on_message(self, message):
+        self.handled.append(message)
+
+
+async def run_handler(frames: list, limits: str) -> RecordingHandler:
+    handler = RecordingHandler(FakeWebSocket(frames))
+    handler.rate_limiter = ConnectionRateLimiter(parse_rate_limits(limits))
+    await handler.handle_connection()
+    return handler
+
+
+async def throttled_flood():
+    # 5条私聊只处理前2条（突发容量），其余收到rate_limited
+    frames = [json.dumps({"type": "private", "content": str(i)}) for i in range(5)]
+    handler = await run_handler(frames, "private=0.001/2")
+    throttled = [message for message in handler.websocket.sent if message.get("type") == "rate_limited"]
+    print(f"Handled {len(handler.handled)} frames, throttle responses: {len(throttled)}")
+    assert [message["content"] for message in handler.handled] == ["0", "1"]
+    assert throttled and throttled[0]["message_type"] == "private" and throttled[0]["retry_after"] > 0
+    assert handler.websocket.close_code is None
+
+    # 持续洪泛达到WS_RATE_LIMIT_MAX_STRIKES时断开
+    frames = [json.dumps({"type": "broadcast"}) for _ in range(settings.WS_RATE_LIMIT_MAX_STRIKES + 10)]
+    handler = await run_handler(frames, "*=0.001/1")
+    assert len(handler.handled) == 1
+    assert handler.websocket.close_code == FLOOD_CLOSE_CODE
+    assert len(handler.websocket.frames) > 1  # 剩余的帧没有被读取
+    assert "9040000" not in ConnectionHandler.sessions
+
+
+def test_throttled_flood():
+    print("Testing throttle responses and flood disconnect...")
+    asyncio.run(throttled_flood())
+    print("✓ Throttle responses and flood disconnect passed")
+
+
+if __name__ == "__main__":
+    test_token_bucket()
+    test_throttled_flood()
+    print("All rate limiter tests passed!")
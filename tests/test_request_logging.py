@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+测试全局请求日志中间件：token和签发密钥脱敏，流式响应不被缓冲
+通过ASGI接口直接调用应用（不触发lifespan），不需要服务器和数据库
+"""
+
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from app.config import settings
+from app.server_run import app, log_requests_and_responses
+
+USER_ID = 9_039_100
+
+
+class CapturingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+
+async def call_with_secrets(handler: CapturingHandler):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.post(
+            "/api/v1/auth/token",
+            json={"user_id": USER_ID, "issuer_key": "super-secret-issuer-key"},
+            headers={"Authorization": "Bearer secret-bearer-token", "X-Issuer-Key": "super-secret-issuer-key"}
+        )
+
+
+def test_secrets_are_redacted():
+    print("Testing request log redaction...")
+    handler = CapturingHandler()
+    server_logger = logging.getLogger("server")
+    server_logger.addHandler(handler)
+    original_key = settings.AUTH_ISSUER_KEY
+    settings.AUTH_ISSUER_KEY = "super-secret-issuer-key"
+    try:
+        asyncio.run(call_with_secrets(handler))
+    finally:
+        settings.AUTH_ISSUER_KEY = original_key
+        server_logger.removeHandler(handler)
+
+    log_text = "\n".join(handler.lines)
+    assert "/auth/token" in log_text
+    assert "super-secret-issuer-key" not in log_text
+    assert "secret-bearer-token" not in log_text
+    assert "authorization: ***" in log_text
+    print("✓ Request log redaction passed")
+
+
+async def first_event_before_generator_finishes():
+    """
+    生成器发出第一个事件后一直等待，直到客户端收到这个事件才结束
+    中间件如果先读完整个响应体，第一个事件永远发不出去，请求会超时
+    """
+    first_event_received = asyncio.Event()
+    generator_finished = []
+
+    async def event_stream():
+        yield "event: delta\ndata: {}\n\n"
+        await first_event_received.wait()
+        yield "event: done\ndata: {}\n\n"
+        generator_finished.append(True)
+
+    stream_app = FastAPI()
+    stream_app.middleware("http")(log_requests_and_responses)
+
+    @stream_app.get("/stream")
+    async def stream():
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/stream", "raw_path": b"/stream", "query_string": b"",
+        "root_path": "", "headers": [], "client": ("test", 1), "server": ("test", 80)
+    }
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    chunks = []
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            if not chunks:
+                # 收到第一个事件时生成器还没有结束
+                assert not generator_finished
+                first_event_received.set()
+            chunks.append(message["body"])
+
+    await asyncio.wait_for(stream_app(scope, receive, send), timeout=2)
+    assert chunks[0].startswith(b"event: delta")
+    assert generator_finished
+
+
+def test_streaming_response_is_not_buffered():
+    print("Testing streaming response passes through logging middleware...")
+    asyncio.run(first_event_before_generator_finishes())
+    print("✓ Streaming response passes through logging middleware passed")
+
+
+if __name__ == "__main__":
+    test_secrets_are_redacted()
+    test_streaming_response_is_not_buffered()
+    print("All request logging tests passed!")
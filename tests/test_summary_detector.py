@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+测试最终总结的检测和分割：固定样例的期望输出（golden），
+以及在随机生成的文本上与旧的逐关键词实现结果完全一致；各调用方使用同一实现
+不需要服务器和数据库
+"""
+
+import random
+import re
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.services.https.AIResponseProcessor import AIResponseProcessor
+from app.services.https.KimiInteractionAPI import KimiInteractionAPI
+from app.utils.summary_detector import (
+    CONVERSATION_END_KEYWORDS,
+    FINAL_SUMMARY_KEYWORDS,
+    PROFILE_SPLIT_KEYWORDS,
+    QUESTION_INTRO_KEYWORDS,
+    QUESTION_SECTION_KEYWORDS,
+    KeywordMatcher,
+    is_conversation_end,
+    is_final_summary,
+    split_final_summary,
+    split_profile_summary,
+)
+from telegram_bot.profile_splitter import split_profile_summary as bot_split_profile_summary
+
+KIMI_SUMMARY = """根据你分享的信息，我为你整理了你的关键词：
+## 🌿 关键词提取
+真诚、幽默、爱运动
+## 💖 你看重的关系特质
+彼此尊重，愿意沟通
+## 🎯 提问问题包
+1. 你周末一般怎么过？
+2. 你最近读了什么书？"""
+
+PROFILE_SUMMARY = """Your Ideal Partner Profile
+- Kind and curious
+- Loves the outdoors
+***
+Filter Questions:
+1. What does a perfect weekend look like to you?"""
+
+GOLDEN = [
+    # (文本, is_final_summary, split_final_summary, split_profile_summary, is_conversation_end)
+    ("你好！今天想聊点什么？", False, ["你好！今天想聊点什么？"], ["你好！今天想聊点什么？"], False),
+    (KIMI_SUMMARY, True,
+     ["根据你分享的信息，我为你整理了你的关键词：\n## 🌿 关键词提取\n真诚、幽默、爱运动\n## 💖 你看重的关系特质\n彼此尊重，愿意沟通",
+      "## 🎯 提问问题包\n1. 你周末一般怎么过？\n2. 你最近读了什么书？"],
+     [KIMI_SUMMARY], False),
+    (PROFILE_SUMMARY, False,
+     ["Your Ideal Partner Profile\n- Kind and curious\n- Loves the outdoors\n***\nFilter Questions:",
+      "1. What does a perfect weekend look like to you?"],
+     ["Your Ideal Partner Profile\n- Kind and curious\n- Loves the outdoors",
+      "Filter Questions:\n1. What does a perfect weekend look like to you?"], True),
+    ("画像：温柔体贴\nFILTER QUESTIONS: 你喜欢旅行吗", False, ["画像：温柔体贴\nFILTER QUESTIONS: 你喜欢旅行吗"],
+     ["画像：温柔体贴", "FILTER QUESTIONS: 你喜欢旅行吗"], False),
+    ("关系特质：独立\n下面是一些想法\n1. Do you like dogs?\n2. Cats?", True,
+     ["关系特质：独立\n下面是一些想法", "1. Do you like dogs?\n2. Cats?"],
+     ["关系特质：独立\n下面是一些想法\n1. Do you like dogs?\n2. Cats?"], False),
+    ("信息提取完成\n问题：\n你喜欢什么音乐", True, ["信息提取完成\n问题：", "你喜欢什么音乐"],
+     ["信息提取完成\n问题：\n你喜欢什么音乐"], False),
+    ("信息提取完成\n问题：", True, ["信息提取完成\n问题："], ["信息提取完成\n问题："], False),
+    ("你可以问TA：最喜欢的电影", True, ["", "你可以问TA：最喜欢的电影"], ["你可以问TA：最喜欢的电影"], False),
+]
+
+
+# 旧实现（逐关键词、逐行查找），用来验证新实现的结果完全一致
+def legacy_is_final_summary(text):
+    lower = text.lower()
+    return any(keyword.lower() in lower for keyword in FINAL_SUMMARY_KEYWORDS)
+
+
+def legacy_split_final_summary(text):
+    lines = text.split('\n')
+    summary_lines, question_lines, in_questions = [], [], False
+    for line in lines:
+        if any(keyword in line.lower() for keyword in QUESTION_SECTION_KEYWORDS):
+            in_questions = True
+            question_lines.append(line)
+            continue
+        (question_lines if in_questions else summary_lines).append(line)
+    summary, questions = '\n'.join(summary_lines).strip(), '\n'.join(question_lines).strip()
+    if not questions:
+        for i, line in enumerate(lines):
+            if line.strip().startswith(('1.', '2.', '3.')) and '?' in line:
+                summary, questions = '\n'.join(lines[:i]).strip(), '\n'.join(lines[i:]).strip()
+                break
+        if not questions:
+            for i, line in enumerate(lines):
+                if any(keyword in line.lower() for keyword in QUESTION_INTRO_KEYWORDS):
+                    summary, questions = '\n'.join(lines[:i + 1]).strip(), '\n'.join(lines[i + 1:]).strip()
+                    break
+    if not questions:
+        return [text]
+    return [summary, questions]
+
+
+def legacy_split_profile_summary(text):
+    split_match = re.search(r"\n?\s*\*\*\*\s*\n?", text, re.IGNORECASE)
+    if split_match:
+        return [text[:split_match.start()].strip(), text[split_match.end():].strip()]
+    match = re.search(
+        r"(filter questions:?|筛选问题:?|问题工具包:?|提问建议:?|约会提问:?|推荐提问:?|建议提问:?|实用提问:?|情景提问:?|初期提问:?)",
+        text, re.IGNORECASE
+    )
+    if match:
+        return [text[:match.start()].strip(), text[match.start():].strip()]
+    return [text]
+
+
+def legacy_is_conversation_end(text):
+    return any(keyword in text for keyword in CONVERSATION_END_KEYWORDS)
+
+
+def random_text(rng: random.Random) -> str:
+    fragments = list(FINAL_SUMMARY_KEYWORDS + QUESTION_SECTION_KEYWORDS + QUESTION_INTRO_KEYWORDS
+                     + PROFILE_SPLIT_KEYWORDS + CONVERSATION_END_KEYWORDS)
+    filler = ["我喜欢爬山", "周末看电影", "Hello", " ", "  ", "\n", "\n\n", "***", "**", "1. 你好吗?", "2.", "?", "：", ":",
+              "关键", "问题", "对方", "🎯", "💖", "##", "Filter", "questions", "TA", "ta", "\t", "問題"]
+    parts = []
+    for _ in range(rng.randint(0, 12)):
+        piece = rng.choice(fragments) if rng.random() < 0.3 else rng.choice(filler)
+        if rng.random() < 0.2:
+            piece = piece.upper() if rng.random() < 0.5 else piece.swapcase()
+        if rng.random() < 0.2 and len(piece) > 1:
+            cut = rng.randrange(1, len(piece))
+            piece = piece[:cut]  # 关键词的前缀，不应匹配
+        parts.append(piece)
+    return "".join(parts)
+
+
+def test_golden_outputs():
+    print("Testing golden outputs...")
+    for text, final, split, profile, end in GOLDEN:
+        assert is_final_summary(text) is final, text
+        assert split_final_summary(text) == split, text
+        assert split_profile_summary(text) == profile, text
+        assert is_conversation_end(text) is end, text
+        # 旧实现给出相同结果
+        assert legacy_is_final_summary(text) is final
+        assert legacy_split_final_summary(text) == split
+        assert legacy_split_profile_summary(text) == profile
+    print("✓ Golden outputs passed")
+
+
+def test_matches_legacy_on_random_text():
+    print("Testing equivalence with legacy implementation...")
+    rng = random.Random(48)
+    for _ in range(5000):
+        text = random_text(rng)
+        assert is_final_summary(text) == legacy_is_final_summary(text), repr(text)
+        assert split_final_summary(text) == legacy_split_final_summary(text), repr(text)
+        assert split_profile_summary(text) == legacy_split_profile_summary(text), repr(text)
+        assert is_conversation_end(text) == legacy_is_conversation_end(text), repr(text)
+    print("✓ Equivalence with legacy implementation passed")
+
+
+def test_keyword_matcher():
+    print("Testing keyword matcher...")
+    matcher = KeywordMatcher(["he", "she", "hers", "his"])
+    assert matcher.search("ushers").start() == 1
+    assert matcher.contains("HIS") and not matcher.contains("hi s")
+    assert not KeywordMatcher(["Abc"], ignore_case=False).contains("abc")
+    assert not KeywordMatcher([]).contains("anything")
+    print("✓ Keyword matcher passed")
+
+
+def test_callers_share_implementation():
+    print("Testing callers share the implementation...")
+    kimi = KimiInteractionAPI()
+    processor = AIResponseProcessor()
+    for text, *_ in GOLDEN:
+        assert kimi._is_final_summary(text) == is_final_summary(text)
+        assert kimi._split_final_summary(text) == split_final_summary(text)
+        assert processor._split_final_summary(text) == split_profile_summary(text)
+    result = kimi._build_result(KIMI_SUMMARY, "v1")
+    assert result["is_final"] and result["summary"].startswith("## 🎯 提问问题包")
+    print("✓ Callers share the implementation passed")
+
+
+def test_bot_splitter_matches():
+    print("Testing Telegram bot profile splitter...")
+    # bot单独部署，保留自己的实现，结果必须与后端一致
+    for text, _, _, profile, _ in GOLDEN:
+        assert bot_split_profile_summary(text) == profile, text
+    rng = random.Random(48)
+    for _ in range(2000):
+        text = random_text(rng)
+        assert bot_split_profile_summary(text) == split_profile_summary(text), repr(text)
+    print("✓ Telegram bot profile splitter passed")
+
+
+if __name__ == "__main__":
+    test_golden_outputs()
+    test_matches_legacy_on_random_text()
+    test_keyword_matcher()
+    test_callers_share_implementation()
+    test_bot_splitter_matches()
+    print("All summary detector tests passed!")
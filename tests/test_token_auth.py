@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+测试签名token认证：token验证缓存、过期/篡改的token，以及WebSocket认证
+不需要服务器和数据库
+"""
+
+import asyncio
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+import httpx
+from fastapi import HTTPException
+
+from app.config import settings
+from app.api.v1.Auth import issue_token
+from app.core import security
+from app.core.security import create_access_token, verify_access_token
+from app.objects.User import User
+from app.schemas.Auth import IssueTokenRequest
+from app.services.https.ChatroomManager import ChatroomManager
+from app.services.https.MatchManager import MatchManager
+from app.services.https.UserManagement import UserManagement
+from app.WebSocketsService.ConnectionHandler import ConnectionHandler
+
+USER_ID = 9_039_000
+
+
+def test_verify_access_token():
+    print("Testing token verification and cache...")
+    token = create_access_token({"sub": str(USER_ID)})
+    assert verify_access_token(token) == str(USER_ID)
+    assert token in security._verified_tokens
+    # 缓存命中
+    assert verify_access_token(token) == str(USER_ID)
+
+    # 篡改签名
+    tampered = token[:-2] + ("AA" if not token.endswith("AA") else "BB")
+    assert verify_access_token(tampered) is None
+
+    # 过期的token（包括缓存中已过期的）
+    expired = create_access_token({"sub": str(USER_ID)}, timedelta(seconds=-1))
+    assert verify_access_token(expired) is None
+    security._verified_tokens[token] = (str(USER_ID), time.time() - 1)
+    assert verify_access_token(token) is None
+    assert token not in security._verified_tokens
+
+    # 缓存有上限
+    security._verified_tokens.clear()
+    for i in range(settings.TOKEN_VERIFY_CACHE_SIZE):
+        security._verified_tokens[f"token-{i}"] = (str(i), time.time() + 60)
+    verify_access_token(create_access_token({"sub": str(USER_ID)}, timedelta(minutes=5)))
+    assert len(security._verified_tokens) == settings.TOKEN_VERIFY_CACHE_SIZE
+    assert "token-0" not in security._verified_tokens  # 淘汰最久未使用的
+    security._verified_tokens.clear()
+    print("✓ Token verification and cache passed")
+
+
+class FakeWebSocket:
+    pass
+
+
+async def websocket_authentication():
+    UserManagement().user_list[USER_ID] = User("token_auth_user", 1, USER_ID)
+    token = create_access_token({"sub": str(USER_ID)})
+
+    handler = ConnectionHandler(FakeWebSocket())
+    assert await handler._authenticate({"token": token})
+    assert handler.user_id == str(USER_ID)
+
+    assert not await ConnectionHandler(FakeWebSocket())._authenticate({"token": "not-a-token"})
+    unknown_user_token = create_access_token({"sub": str(USER_ID + 1)})
+    assert not await ConnectionHandler(FakeWebSocket())._authenticate({"token": unknown_user_token})
+
+    # 只带user_id的旧客户端由AUTH_ALLOW_LEGACY_USER_ID控制
+    legacy_setting = settings.AUTH_ALLOW_LEGACY_USER_ID
+    try:
+        settings.AUTH_ALLOW_LEGACY_USER_ID = True
+        assert await ConnectionHandler(FakeWebSocket())._authenticate({"user_id": str(USER_ID)})
+        settings.AUTH_ALLOW_LEGACY_USER_ID = False
+        assert not await ConnectionHandler(FakeWebSocket())._authenticate({"user_id": str(USER_ID)})
+    finally:
+        settings.AUTH_ALLOW_LEGACY_USER_ID = legacy_setting
+        UserManagement().user_list.pop(USER_ID, None)
+
+
+def test_websocket_authentication():
+    print("Testing WebSocket token authentication...")
+    asyncio.run(websocket_authentication())
+    print("✓ WebSocket token authentication passed")
+
+
+async def non_ascii_issuer_key():
+    original_key = settings.AUTH_ISSUER_KEY
+    settings.AUTH_ISSUER_KEY = "issuer-secret"
+    try:
+        # 非ASCII的密钥返回401/403，而不是compare_digest抛出TypeError
+        try:
+            await security.get_current_user(token=None, issuer_key="密钥")
+        except HTTPException as e:
+            assert e.status_code == 401
+        else:
+            assert settings.AUTH_ALLOW_LEGACY_USER_ID
+        try:
+            await issue_token(IssueTokenRequest(issuer_key="密钥", user_id=USER_ID))
+        except HTTPException as e:
+            assert e.status_code == 403
+        else:
+            raise AssertionError("issue_token should reject a non-ASCII issuer key")
+        assert await security.get_current_user(token=None, issuer_key="issuer-secret") == {"_id": None, "issuer": True}
+    finally:
+        settings.AUTH_ISSUER_KEY = original_key
+
+
+def test_non_ascii_issuer_key_rejected():
+    print("Testing non-ASCII issuer key...")
+    asyncio.run(non_ascii_issuer_key())
+    print("✓ Non-ASCII issuer key passed")
+
+
+class FakeMatch:
+    def __init__(self, match_id, user_id_1, user_id_2):
+        self.match_id = match_id
+        self.user_id_1 = user_id_1
+        self.user_id_2 = user_id_2
+
+
+async def token_must_match_user():
+    from app.server_run import app
+
+    original_key = settings.AUTH_ISSUER_KEY
+    settings.AUTH_ISSUER_KEY = "issuer-secret"
+    MatchManager().match_list[9_039_500] = FakeMatch(9_039_500, USER_ID + 1, USER_ID + 2)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(USER_ID)})}"}
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            inbox = "/api/v1/ChatroomManager/get_inbox"
+            # 自己的数据
+            response = await client.post(inbox, json={"user_id": USER_ID}, headers=headers)
+            assert response.status_code == 200
+            # 冒充其他用户
+            response = await client.post(inbox, json={"user_id": USER_ID + 1}, headers=headers)
+            assert response.status_code == 403
+            # 不属于自己的匹配
+            response = await client.post("/api/v1/MatchManager/toggle_like", json={"match_id": 9_039_500}, headers=headers)
+            assert response.status_code == 403
+            # 默认不接受不带token的请求
+            if not settings.AUTH_ALLOW_LEGACY_USER_ID:
+                response = await client.post(inbox, json={"user_id": USER_ID})
+                assert response.status_code == 401
+            # 可信后端可以操作任意用户
+            response = await client.post(inbox, json={"user_id": USER_ID + 1}, headers={"X-Issuer-Key": "issuer-secret"})
+            assert response.status_code == 200
+    finally:
+        settings.AUTH_ISSUER_KEY = original_key
+        MatchManager().match_list.pop(9_039_500, None)
+        security._verified_tokens.clear()
+
+
+def test_token_must_match_requested_user():
+    print("Testing token user must match requested user...")
+    asyncio.run(token_must_match_user())
+    print("✓ Token user must match requested user passed")
+
+
+class FakeChatroom:
+    def __init__(self, chatroom_id, user1_id, user2_id):
+        self.chatroom_id = chatroom_id
+        self.user1_id = user1_id
+        self.user2_id = user2_id
+        self.message_ids = []
+        self.last_seq = 0
+        self.read_by = []
+
+    def get_other_user_id(self, user_id):
+        return {self.user1_id: self.user2_id, self.user2_id: self.user1_id}.get(user_id)
+
+    def mark_read(self, user_id):
+        self.read_by.append(user_id)
+
+
+async def chatroom_must_include_token_user():
+    from app.server_run import app
+
+    chatroom_id = 9_039_600
+    others = FakeChatroom(chatroom_id, USER_ID + 1, USER_ID + 2)
+    ChatroomManager().chatrooms[chatroom_id] = others
+    ChatroomManager().chatrooms[chatroom_id + 1] = FakeChatroom(chatroom_id + 1, USER_ID, USER_ID + 1)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(USER_ID)})}"}
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            history = "/api/v1/ChatroomManager/get_chat_history"
+            # 自己的user_id + 别人的聊天室
+            response = await client.post(history, json={"chatroom_id": chatroom_id, "user_id": USER_ID}, headers=headers)
+            assert response.status_code == 403
+            # 自己的聊天室
+            response = await client.post(history, json={"chatroom_id": chatroom_id + 1, "user_id": USER_ID}, headers=headers)
+            assert response.status_code == 200
+
+        # 不经过路由直接调用：非成员拿不到消息，也不会标记已读
+        assert await ChatroomManager().get_chatroom_history(chatroom_id, USER_ID) == []
+        assert others.read_by == []
+    finally:
+        ChatroomManager().chatrooms.pop(chatroom_id, None)
+        ChatroomManager().chatrooms.pop(chatroom_id + 1, None)
+        security._verified_tokens.clear()
+
+
+def test_chatroom_must_include_token_user():
+    print("Testing token user must be a chatroom member...")
+    asyncio.run(chatroom_must_include_token_user())
+    print("✓ Token user must be a chatroom member passed")
+
+
+if __name__ == "__main__":
+    test_verify_access_token()
+    test_websocket_authentication()
+    test_non_ascii_issuer_key_rejected()
+    test_token_must_match_requested_user()
+    test_chatroom_must_include_token_user()
+    print("All token auth tests passed!")
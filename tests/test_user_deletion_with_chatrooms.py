@@ -106,7 +106,7 @@ class UserDeletionChatroomTest:
         
         # 为每个匹配创建聊天室
         for match_id in self.test_matches:
-            match = match_manager.get_match(match_id)
+            match = await match_manager.get_match(match_id)
             if match:
                 chatroom_id = await chatroom_manager.get_or_create_chatroom(
                     match.user_id_1, match.user_id_2, match.match_id
@@ -200,7 +200,7 @@ class UserDeletionChatroomTest:
         match_manager = MatchManager()
         related_chatrooms = []
         for match_id in user_matches:
-            match = match_manager.get_match(match_id)
+            match = await match_manager.get_match(match_id)
             if match and match.chatroom_id:
                 related_chatrooms.append(match.chatroom_id)
         
@@ -282,7 +282,7 @@ class UserDeletionChatroomTest:
                 match_manager = MatchManager()
                 valid_matches = []
                 for match_id in user.match_ids:
-                    match = match_manager.get_match(match_id)
+                    match = await match_manager.get_match(match_id)
                     if match:
                         valid_matches.append(match_id)
                 print(f"  有效匹配: {valid_matches}")
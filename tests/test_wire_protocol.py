@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+测试WebSocket帧编码协商：JSON文本帧、MessagePack二进制帧和应用层deflate压缩
+使用内存中的假WebSocket，不需要服务器
+"""
+
+import asyncio
+import json
+import sys
+import zlib
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.config import settings
+from app.WebSocketsService.OutboundQueue import OutboundQueue
+from app.WebSocketsService.WireCodec import WireCodec, FRAME_DEFLATE, msgpack
+
+
+def build_history_frame(count: int = 200) -> str:
+    """模拟private_chat_init_complete中的聊天记录"""
+    chat_history = [
+        [f"今天晚上一起去吃饭吗？第{i}条消息", "2025-06-01T20:00:00", str(9_037_000 + i % 2), "Alice" if i % 2 else "Bob", i + 1]
+        for i in range(count)
+    ]
+    return json.dumps({
+        "type": "private_chat_init_complete",
+        "chatroom_id": 1,
+        "chat_history": chat_history,
+        "last_seq": count
+    })
+
+
+def test_negotiation():
+    print("Testing protocol negotiation...")
+    assert WireCodec.negotiate({"user_id": "1"}).is_text
+    assert WireCodec.negotiate({"user_id": "1", "protocol": "xml"}).describe() == {"protocol": "json", "compression": None}
+    codec = WireCodec.negotiate({"user_id": "1", "protocol": "msgpack", "compression": "deflate"})
+    expected_protocol = "msgpack" if msgpack is not None else "json"
+    assert codec.describe() == {"protocol": expected_protocol, "compression": "deflate"}
+    print("✓ Protocol negotiation passed")
+
+
+def test_roundtrip_and_size():
+    print("Testing encode/decode roundtrip and frame size...")
+    message = build_history_frame()
+    plain_size = len(message.encode("utf-8"))
+    sizes = {}
+    for protocol in ("json", "msgpack"):
+        if protocol == "msgpack" and msgpack is None:
+            continue
+        for compression in (None, "deflate"):
+            codec = WireCodec(protocol, compression, min_compress_bytes=1024)
+            frame = codec.encode(message)
+            assert codec.decode(frame) == json.loads(message)
+            sizes[(protocol, compression)] = len(frame if isinstance(frame, bytes) else frame.encode("utf-8"))
+
+    for key, size in sizes.items():
+        print(f"  {key}: {size} bytes ({size / plain_size:.0%} of JSON text)")
+    assert sizes[("json", None)] == plain_size
+    assert sizes[("json", "deflate")] < plain_size / 3
+    if msgpack is not None:
+        assert sizes[("msgpack", None)] < plain_size
+
+    # 小帧不压缩
+    codec = WireCodec("json", "deflate", min_compress_bytes=1024)
+    small = codec.encode(json.dumps({"type": "pong"}))
+    assert small[0] != FRAME_DEFLATE
+    assert codec.decode(small) == {"type": "pong"}
+
+    # 格式错误的帧
+    for bad in (b"", b"\x07abc", bytes([FRAME_DEFLATE]) + b"not deflate"):
+        try:
+            codec.decode(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"decode should reject {bad!r}")
+    print("✓ Encode/decode roundtrip and frame size passed")
+
+
+def test_decompression_is_bounded():
+    print("Testing bounded deflate decompression...")
+    codec = WireCodec("json", "deflate")
+    # 高压缩比的超大帧（解压后超过上限）被拒绝
+    bomb = json.dumps({"type": "broadcast", "message": "a" * (settings.WS_MAX_DECOMPRESSED_BYTES * 4)}).encode("utf-8")
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    frame = bytes([FRAME_DEFLATE]) + compressor.compress(bomb) + compressor.flush()
+    assert len(frame) < settings.WS_MAX_DECOMPRESSED_BYTES // 100
+    try:
+        codec.decode(frame)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("decode should reject frames that decompress beyond the limit")
+
+    # 截断的deflate流同样被拒绝
+    try:
+        codec.decode(frame[:len(frame) // 2])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("decode should reject truncated deflate frames")
+
+    # 上限以内正常解码
+    message = {"type": "broadcast", "message": "b" * 4096}
+    assert codec.decode(WireCodec("json", "deflate", min_compress_bytes=16).encode(json.dumps(message))) == message
+    print("✓ Bounded deflate decompression passed")
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.text_frames = []
+        self.binary_frames = []
+
+    async def send_text(self, message: str):
+        self.text_frames.append(message)
+
+    async def send_bytes(self, data: bytes):
+        self.binary_frames.append(data)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def queue_uses_codec():
+    text_socket, binary_socket = FakeWebSocket(), FakeWebSocket()
+    codec = WireCodec("json", "deflate", min_compress_bytes=16)
+    text_queue = OutboundQueue(text_socket, maxsize=8)
+    binary_queue = OutboundQueue(binary_socket, maxsize=8, codec=codec)
+    message = build_history_frame(20)
+    for queue in (text_queue, binary_queue):
+        queue.start()
+        queue.enqueue(message)
+    await asyncio.sleep(0.01)
+    await text_queue.close()
+    await binary_queue.close()
+
+    assert text_socket.text_frames == [message] and not text_socket.binary_frames
+    assert not binary_socket.text_frames and len(binary_socket.binary_frames) == 1
+    assert codec.decode(binary_socket.binary_frames[0]) == json.loads(message)
+
+
+def test_outbound_queue_encodes_frames():
+    print("Testing outbound queue with negotiated codec...")
+    asyncio.run(queue_uses_codec())
+    print("✓ Outbound queue with negotiated codec passed")
+
+
+if __name__ == "__main__":
+    test_negotiation()
+    test_roundtrip_and_size()
+    test_decompression_is_bounded()
+    test_outbound_queue_encodes_frames()
+    print("All wire protocol tests passed!")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试WebSocket主题订阅：事件只发布给订阅者
+使用内存中的假WebSocket，不需要服务器
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_PATH))
+
+from app.WebSocketsService.ConnectionHandler import ConnectionHandler
+from app.WebSocketsService.MessageConnectionHandler import MessageConnectionHandler
+from app.services.https.MatchManager import MatchManager
+from app.WebSocketsService.OutboundQueue import OutboundQueue
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, message: str):
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def connect(user_id: str):
+    websocket = FakeWebSocket()
+    handler = ConnectionHandler(websocket)
+    handler.user_id = user_id
+    handler.outbound = OutboundQueue(websocket, maxsize=16)
+    handler.outbound.start()
+    handler.subscribe(handler.topic("user", user_id))
+    return handler
+
+
+async def publish_to_subscribers():
+    ConnectionHandler.subscriptions.clear()
+    alice, bob, carol = connect("1"), connect("2"), connect("3")
+    chatroom_topic = ConnectionHandler.topic("chatroom", 10)
+    alice.subscribe(chatroom_topic)
+    bob.subscribe(chatroom_topic)
+
+    delivered = await ConnectionHandler.publish(chatroom_topic, "chat event")
+    await ConnectionHandler.publish(ConnectionHandler.topic("match", 5), "nobody listens")
+    await asyncio.sleep(0)
+    assert delivered == 2
+    assert alice.websocket.sent == ["chat event"]
+    assert bob.websocket.sent == ["chat event"]
+    # 未订阅的用户收不到事件
+    assert carol.websocket.sent == []
+
+    # exclude_id排除发布者自己
+    assert await ConnectionHandler.publish(chatroom_topic, "from alice", exclude_id="1") == 1
+
+    # 断开连接后清理订阅，空主题被删除
+    bob.unsubscribe_all()
+    alice.unsubscribe_all()
+    assert chatroom_topic not in ConnectionHandler.subscriptions
+    assert await ConnectionHandler.publish(chatroom_topic, "after disconnect") == 0
+
+    for handler in (alice, bob, carol):
+        await handler.outbound.close()
+    ConnectionHandler.subscriptions.clear()
+
+
+def test_publish_only_reaches_subscribers():
+    print("Testing topic publish...")
+    asyncio.run(publish_to_subscribers())
+    print("✓ Topic publish passed")
+
+
+class FakeMatch:
+    def __init__(self, match_id, user_id_1, user_id_2):
+        self.match_id = match_id
+        self.user_id_1 = user_id_1
+        self.user_id_2 = user_id_2
+
+
+async def reject_non_participant_subscription():
+    ConnectionHandler.subscriptions.clear()
+    match_manager = MatchManager()
+    match_manager.match_list[9_034_001] = FakeMatch(9_034_001, 9_034_101, 9_034_102)
+
+    websocket = FakeWebSocket()
+    intruder = MessageConnectionHandler(websocket)
+    intruder.user_id = "9034103"
+    try:
+        await intruder.handle_private_chat_init({"target_user_id": 9_034_101, "match_id": 9_034_001})
+        # 非匹配双方的用户收到错误，不会订阅聊天室或匹配主题
+        assert json.loads(websocket.sent[-1])["type"] == "private_chat_error"
+        assert ConnectionHandler.topic("match", 9_034_001) not in ConnectionHandler.subscriptions
+        assert not intruder.topics
+    finally:
+        match_manager.match_list.pop(9_034_001, None)
+        ConnectionHandler.subscriptions.clear()
+
+
+def test_non_participant_cannot_subscribe():
+    print("Testing non-participant subscription rejected...")
+    asyncio.run(reject_non_participant_subscription())
+    print("✓ Non-participant subscription rejected passed")
+
+
+if __name__ == "__main__":
+    test_publish_only_reaches_subscribers()
+    test_non_participant_cannot_subscribe()
+    print("All topic tests passed!")